@@ -0,0 +1,63 @@
+"""
+Blog management export specs (see apps/core/exports.py)
+"""
+
+from django.db.models import Count, Q
+
+from apps.core.exports import Column, ExportSpec, register_export
+
+from .models import Category, Tag
+
+SORTS = {
+    'name': ('name',),
+    '-name': ('-name',),
+    'posts': ('-posts_count', 'name'),
+    '-posts': ('posts_count', 'name'),
+}
+
+
+class TaxonomyExport(ExportSpec):
+    """Categories and tags share the management list filters and sorting"""
+    model = None
+    search_fields = ('name', 'slug')
+
+    def get_queryset(self, params, user=None):
+        queryset = self.model.objects.annotate(posts_count=Count('post'))
+
+        # Apply same filters as list view
+        search = params.get('search')
+        if search:
+            query = Q()
+            for field in self.search_fields:
+                query |= Q(**{f'{field}__icontains': search})
+            queryset = queryset.filter(query)
+
+        return queryset.order_by(*SORTS.get(params.get('sort'), ('pk',)))
+
+
+@register_export
+class CategoryExport(TaxonomyExport):
+    name = 'blog.categories'
+    filename = 'blog_categories'
+    sheet_title = 'Categories'
+    model = Category
+    search_fields = ('name', 'slug', 'description')
+    columns = [
+        Column('Name', 'name'),
+        Column('Slug', 'slug'),
+        Column('Description', 'description'),
+        Column('Posts Count', 'posts_count'),
+    ]
+
+
+@register_export
+class TagExport(TaxonomyExport):
+    name = 'blog.tags'
+    filename = 'blog_tags'
+    sheet_title = 'Tags'
+    model = Tag
+    columns = [
+        Column('Name', 'name'),
+        Column('Slug', 'slug'),
+        Column('Posts Count', 'posts_count'),
+    ]
@@ -0,0 +1,36 @@
+"""
+Management command to move buffered blog post view counts into the database
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.blog.view_counts import flush_view_counts
+
+
+class Command(BaseCommand):
+    help = 'Add view counts buffered in the cache to Post.views'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep running and flush periodically (default: flush once and exit, for cron)'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=60,
+            help='Seconds between flushes in --loop mode (default: 60)'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                flushed = flush_view_counts()
+                self.stdout.write(f"Flushed {flushed} post views")
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping view count flusher")
@@ -0,0 +1,98 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.http import HttpResponse
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from apps.blog.models import Category, Post
+from apps.blog.view_counts import _buffered, flush_view_counts, pending_views, record_view
+
+User = get_user_model()
+
+LOCMEM_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'default'},
+    'pages': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+}
+
+
+@override_settings(BLOG_VIEW_COUNT_BUFFER=True, CACHES=LOCMEM_CACHES)
+class ViewCountBufferTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        author = User.objects.create_user(username='writer', password='test123')
+        category = Category.objects.create(name='Solar Tips')
+        self.post = Post.objects.create(
+            title='Sizing an inverter', author=author, category=category,
+            excerpt='excerpt', content='content', status='published', views=10,
+        )
+        self.other = Post.objects.create(
+            title='Battery care', author=author, category=category,
+            excerpt='excerpt', content='content', status='published',
+        )
+
+    def test_views_are_buffered_until_flushed(self):
+        with self.assertNumQueries(0):
+            for _ in range(3):
+                record_view(self.post)
+            record_view(self.other)
+        self.assertEqual(pending_views(self.post.pk), 3)
+
+        updated_at = Post.objects.get(pk=self.post.pk).updated_at
+        self.assertEqual(flush_view_counts(), 4)
+
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual(post.views, 13)
+        self.assertEqual(post.updated_at, updated_at)
+        self.assertEqual(Post.objects.get(pk=self.other.pk).views, 1)
+        self.assertEqual(pending_views(self.post.pk), 0)
+        self.assertEqual(flush_view_counts(), 0)
+
+    def test_views_recorded_after_flush_are_kept(self):
+        record_view(self.post)
+        flush_view_counts()
+        record_view(self.post)
+        record_view(self.post)
+        flush_view_counts()
+        self.assertEqual(Post.objects.get(pk=self.post.pk).views, 13)
+
+    @override_settings(BLOG_VIEW_COUNT_BUFFER=None, CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'default'},
+    })
+    def test_without_a_shared_atomic_cache_views_are_written_through(self):
+        # A per-process cache would hide the counters from the flush command
+        with self.assertNumQueries(1):
+            record_view(self.post)
+        self.assertEqual(Post.objects.get(pk=self.post.pk).views, 11)
+        self.assertEqual(flush_view_counts(), 0)
+
+    @override_settings(BLOG_VIEW_COUNT_BUFFER=None, CACHES={
+        'default': {'BACKEND': 'apps.core.tiered_cache.TieredCache', 'OPTIONS': {'L2': 'shared'}},
+        'shared': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://127.0.0.1:6379'},
+    })
+    def test_redis_behind_the_tiered_cache_buffers_views(self):
+        self.assertTrue(_buffered())
+
+    def test_post_detail_does_not_save_the_post(self):
+        updated_at = self.post.updated_at
+        # The page template itself is not under test here
+        with mock.patch('apps.blog.views.render', return_value=HttpResponse()):
+            response = self.client.get(reverse('blog:post_detail', args=[self.post.slug]))
+        self.assertEqual(response.status_code, 200)
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual((post.views, post.updated_at), (10, updated_at))
+        self.assertEqual(pending_views(self.post.pk), 1)
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'default'},
+        'pages': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'pages'},
+    })
+    def test_views_served_from_the_page_cache_are_counted(self):
+        caches['pages'].clear()
+        url = reverse('blog:post_detail', args=[self.post.slug])
+        with mock.patch('apps.blog.views.render', side_effect=lambda *args, **kwargs: HttpResponse()) as render:
+            self.assertEqual(self.client.get(url)['X-Page-Cache'], 'miss')
+            self.assertEqual(self.client.get(url)['X-Page-Cache'], 'hit')
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(pending_views(self.post.pk), 2)
@@ -1,15 +1,18 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.core.paginator import Paginator
 from django.db.models import Q, Count
-from django.http import HttpResponse, JsonResponse
+from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required
 import json
 
 from .models import Post, Category, Tag, Comment, BlogBanner, PostLike, CommentLike
 from .forms import CommentForm, PostForm, CategoryForm, TagForm, BlogBannerForm
+from .view_counts import record_view
+from apps.core.page_cache import cache_public_page
 from django.contrib import messages
 from django.contrib.auth.decorators import user_passes_test
+from apps.core.exports import export_response
 def staff_check(user):
     """Check if user has blog management permissions"""
     return user.is_staff or user.role in ['super_admin', 'manager', 'director', 'sales_manager', 'content_manager']
@@ -294,46 +297,8 @@ def category_delete(request, pk):
 @user_passes_test(staff_check)
 def category_export(request):
     """Export categories to CSV"""
-    categories = Category.objects.all()
-
-    # Apply same filters as list view
-    search = request.GET.get('search')
-    if search:
-        categories = categories.filter(
-            Q(name__icontains=search) |
-            Q(slug__icontains=search) |
-            Q(description__icontains=search)
-        )
-
-    # Apply sorting
-    sort_by = request.GET.get('sort')
-    if sort_by == 'name':
-        categories = categories.order_by('name')
-    elif sort_by == '-name':
-        categories = categories.order_by('-name')
-    elif sort_by == 'posts':
-        categories = categories.annotate(posts_count=Count('post')).order_by('-posts_count')
-    elif sort_by == '-posts':
-        categories = categories.annotate(posts_count=Count('post')).order_by('posts_count')
-
-    # Create CSV response
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="blog_categories.csv"'
-
-    import csv
-    writer = csv.writer(response)
-    writer.writerow(['Name', 'Slug', 'Description', 'Posts Count', 'Created At'])
-
-    for category in categories:
-        writer.writerow([
-            category.name,
-            category.slug,
-            category.description or '',
-            category.post_set.count(),
-            category.created_at.date() if hasattr(category, 'created_at') else ''
-        ])
-
-    return response
+    params = {key: request.GET[key] for key in ('search', 'sort') if request.GET.get(key)}
+    return export_response(request, 'blog.categories', 'csv', params)
 
 @login_required
 @user_passes_test(staff_check)
@@ -436,44 +401,8 @@ def tag_delete(request, pk):
 @user_passes_test(staff_check)
 def tag_export(request):
     """Export tags to CSV"""
-    tags = Tag.objects.all()
-
-    # Apply same filters as list view
-    search = request.GET.get('search')
-    if search:
-        tags = tags.filter(
-            Q(name__icontains=search) |
-            Q(slug__icontains=search)
-        )
-
-    # Apply sorting
-    sort_by = request.GET.get('sort')
-    if sort_by == 'name':
-        tags = tags.order_by('name')
-    elif sort_by == '-name':
-        tags = tags.order_by('-name')
-    elif sort_by == 'posts':
-        tags = tags.annotate(posts_count=Count('post')).order_by('-posts_count')
-    elif sort_by == '-posts':
-        tags = tags.annotate(posts_count=Count('post')).order_by('posts_count')
-
-    # Create CSV response
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="blog_tags.csv"'
-
-    import csv
-    writer = csv.writer(response)
-    writer.writerow(['Name', 'Slug', 'Posts Count', 'Created At'])
-
-    for tag in tags:
-        writer.writerow([
-            tag.name,
-            tag.slug,
-            tag.post_set.count(),
-            tag.created_at.date() if hasattr(tag, 'created_at') else ''
-        ])
-
-    return response
+    params = {key: request.GET[key] for key in ('search', 'sort') if request.GET.get(key)}
+    return export_response(request, 'blog.tags', 'csv', params)
 
 @login_required
 @user_passes_test(staff_check)
@@ -622,6 +551,7 @@ def toggle_post_featured(request, pk):
         base_url += '?' + query_string
     return redirect(base_url)
 
+@cache_public_page('blog')
 def blog_list(request):
     posts = Post.objects.filter(status='published')
     categories = Category.objects.all()
@@ -684,6 +614,11 @@ def post_preview(request, pk):
     }
     return render(request, 'blog/post_detail.html', context)
 
+def _count_cached_view(request, meta):
+    # Cached pages skip the view, so their views are counted here
+    record_view(Post(pk=meta['post_id']))
+
+@cache_public_page('blog', on_hit=_count_cached_view)
 def post_detail(request, slug):
     post = get_object_or_404(Post, slug=slug, status='published')
     # Get top-level comments only for the original display
@@ -699,9 +634,8 @@ def post_detail(request, slug):
     if not related_posts.exists():
         related_posts = Post.objects.filter(category=post.category).exclude(id=post.id).order_by('-created_at')[:3]
 
-    # Increment view count
-    post.views += 1
-    post.save()
+    # Buffered in the cache and flushed by flush_blog_views (see view_counts.py)
+    record_view(post)
 
     if request.method == 'POST':
         comment_form = CommentForm(request.POST)
@@ -721,7 +655,9 @@ def post_detail(request, slug):
         'related_posts': related_posts,
         'is_preview': False,  # For published posts
     }
-    return render(request, 'blog/post_detail.html', context)
+    response = render(request, 'blog/post_detail.html', context)
+    response.page_cache_meta = {'post_id': post.pk}
+    return response
 
 def like_post(request, slug):
     """Handle post likes via AJAX"""
@@ -0,0 +1,104 @@
+"""
+Which chat rooms a user may open.
+
+Every chat view and the WebSocket consumer used to work this out room by room
+with a participants or groups query each. accessible_room_ids() resolves all
+active rooms for a user with two queries (the user's group names, and the
+active rooms including the private ones they belong to) and caches the result
+per user. The cached sets are dropped by the signal handlers in
+apps/chat/signals.py when group or room membership changes; a room being
+created, renamed or deactivated rotates a version token that invalidates every
+user's entry at once.
+
+Access rules (unchanged from the views):
+- general rooms: every user
+- private rooms: participants only
+- department rooms: staff, or a group whose name contains the room name
+- project rooms: staff, or membership of 'management', 'staff' or a group named after the room
+"""
+
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+from .models import ChatRoom
+
+VERSION_CACHE_KEY = 'chat:accessible_rooms:version'
+USER_CACHE_KEY = 'chat:accessible_rooms:{version}:{user_id}'
+CACHE_TIMEOUT = getattr(settings, 'CHAT_ACCESS_CACHE_TIMEOUT', 60 * 15)
+
+PROJECT_GROUPS = ('management', 'staff')
+
+
+def _version():
+    version = cache.get(VERSION_CACHE_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(VERSION_CACHE_KEY, version, None):
+            version = cache.get(VERSION_CACHE_KEY) or version
+    return version
+
+
+def _room_is_accessible(room_type, name, group_names, is_staff):
+    room_name = name.lower()
+    if room_type == 'department':
+        return is_staff or any(room_name in group.lower() for group in group_names)
+    if room_type == 'project':
+        return is_staff or any(group in PROJECT_GROUPS or group == room_name for group in group_names)
+    # General rooms, private rooms the user belongs to (already filtered) and unknown types
+    return True
+
+
+def resolve_accessible_room_ids(user):
+    """Uncached resolution; two queries regardless of the number of rooms"""
+    if not user or not user.is_authenticated:
+        return frozenset()
+
+    group_names = list(user.groups.values_list('name', flat=True))
+    rooms = (
+        ChatRoom.objects.filter(is_active=True)
+        .filter(~Q(room_type='private') | Q(participants=user))
+        .values_list('id', 'room_type', 'name')
+        .distinct()
+    )
+    return frozenset(
+        room_id for room_id, room_type, name in rooms
+        if _room_is_accessible(room_type, name, group_names, user.is_staff)
+    )
+
+
+def accessible_room_ids(user):
+    """IDs of the active rooms ``user`` may open, cached per user"""
+    if not user or not user.is_authenticated:
+        return frozenset()
+
+    key = USER_CACHE_KEY.format(version=_version(), user_id=user.pk)
+    room_ids = cache.get(key)
+    if room_ids is None:
+        room_ids = resolve_accessible_room_ids(user)
+        cache.set(key, room_ids, CACHE_TIMEOUT)
+    return room_ids
+
+
+def accessible_rooms(user):
+    """Queryset of the active rooms ``user`` may open"""
+    return ChatRoom.objects.filter(pk__in=accessible_room_ids(user))
+
+
+def can_access_room(user, room):
+    """Whether ``user`` may open ``room`` (a ChatRoom or its id)"""
+    room_id = getattr(room, 'pk', room)
+    return room_id in accessible_room_ids(user)
+
+
+def invalidate_user_rooms(*user_ids):
+    """Drop the cached room sets of specific users (membership changes)"""
+    version = _version()
+    cache.delete_many([USER_CACHE_KEY.format(version=version, user_id=user_id) for user_id in user_ids])
+
+
+def invalidate_all_rooms():
+    """Invalidate every user's cached room set (rooms created, renamed or deactivated, groups renamed)"""
+    cache.set(VERSION_CACHE_KEY, uuid.uuid4().hex, None)
@@ -1,8 +1,14 @@
 import json
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
-from .models import ChatRoom, Message, MessageReadStatus
+from . import presence
+from .access import can_access_room
+from .history import history_page
+from .models import ChatRoom, Message
+from .read_receipts import PendingReads
+from .read_state import mark_read
 
 User = get_user_model()
 
@@ -13,7 +19,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         """Handle WebSocket connection"""
         self.room_name = self.scope['url_route']['kwargs']['room_name']
-        self.room_group_name = f'chat_{self.room_name}'
+        self.room_group_name = presence.room_group(self.room_name)
 
         # Check if user is authenticated
         if self.scope['user'] and self.scope['user'].is_authenticated:
@@ -30,6 +36,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
         # Get or create room
         self.room = await self.get_room(self.room_name)
+        self.pending_reads = PendingReads(self.flush_reads)
 
         # Join room group
         await self.channel_layer.group_add(
@@ -39,11 +46,18 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
         await self.accept()
 
-        # Send message history to new connection
-        await self.send_messages_history()
+        # Send message history to new connection: the newest page, or everything
+        # since ?after_id=<last seen id> for a reconnecting client (?history=0 skips it)
+        params = parse_qs(self.scope.get('query_string', b'').decode())
+        if params.get('history', ['1'])[0] != '0':
+            await self.send_history(after_id=params.get('after_id', [None])[0])
 
     async def disconnect(self, close_code):
         """Handle WebSocket disconnection"""
+        if hasattr(self, 'pending_reads'):
+            await self.pending_reads.close()
+            await self.set_typing(False)
+
         # Leave room group
         if hasattr(self, 'room_group_name'):
             await self.channel_layer.group_discard(
@@ -82,22 +96,22 @@ class ChatConsumer(AsyncWebsocketConsumer):
                             'sender': self.user.id
                         }
                     )
+            elif message_type == 'history':
+                await self.send_history(
+                    before_id=text_data_json.get('before_id'),
+                    after_id=text_data_json.get('after_id'),
+                    limit=text_data_json.get('limit'),
+                )
+            elif message_type == 'typing':
+                await self.set_typing(bool(text_data_json.get('is_typing', True)))
             elif message_type == 'mark_read':
-                # Handle read status updates
-                message_id = text_data_json.get('message_id')
+                # Read status updates are coalesced and flushed periodically
+                try:
+                    message_id = int(text_data_json.get('message_id'))
+                except (TypeError, ValueError):
+                    message_id = None
                 if message_id:
-                    await self.mark_message_as_read(message_id)
-
-                # Notify online users about read status
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'user_read_message',
-                        'message_id': message_id,
-                        'user_id': self.user.id,
-                        'username': self.user.username,
-                    }
-                )
+                    self.pending_reads.add(message_id)
 
         except json.JSONDecodeError:
             # Handle invalid JSON
@@ -105,6 +119,40 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 'error': 'Invalid message format'
             }))
 
+    async def flush_reads(self, message_id):
+        """Apply the newest coalesced mark_read and notify online users about it"""
+        if not await self.mark_message_as_read(message_id):
+            return
+
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'user_read_message',
+                'message_id': message_id,
+                'user_id': self.user.id,
+                'username': self.user.username,
+            }
+        )
+
+    async def set_typing(self, is_typing):
+        """Update the presence registry and broadcast when the room's typists change"""
+        if is_typing:
+            changed = await database_sync_to_async(presence.start_typing)(self.user, self.room)
+        else:
+            changed = await database_sync_to_async(presence.stop_typing)(self.user, self.room.pk)
+        if changed:
+            await self.channel_layer.group_send(
+                self.room_group_name,
+                await database_sync_to_async(presence.typing_event)(self.room.pk)
+            )
+
+    async def typing_update(self, event):
+        """Send the room's typing users (other than this user) to WebSocket"""
+        await self.send(text_data=json.dumps({
+            'type': 'typing',
+            'typing_users': [typist for typist in event['typing_users'] if typist['id'] != self.user.id],
+        }))
+
     async def chat_message(self, event):
         """Send chat message to WebSocket"""
         message = event['message']
@@ -129,24 +177,9 @@ class ChatConsumer(AsyncWebsocketConsumer):
         """Check if user can access the room"""
         try:
             room = ChatRoom.objects.get(name=room_name, is_active=True)
-            user = self.scope['user']
-
-            if room.room_type == 'private':
-                return room.participants.filter(id=user.id).exists()
-            elif room.room_type == 'department':
-                # Check if user belongs to appropriate groups
-                return user.groups.filter(name__icontains=room.name.lower()).exists() or user.is_staff
-            elif room.room_type == 'general':
-                # General rooms are accessible to all authenticated users
-                return True
-            elif room.room_type == 'project':
-                # Check project access
-                return user.groups.filter(
-                    name__in=['management', 'staff', room.name.lower()]
-                ).exists() or user.is_staff
-            return True
         except ChatRoom.DoesNotExist:
             return False
+        return can_access_room(self.scope['user'], room)
 
     @database_sync_to_async
     def get_room(self, room_name):
@@ -166,43 +199,20 @@ class ChatConsumer(AsyncWebsocketConsumer):
             content=content
         )
 
-    async def send_messages_history(self):
-        """Send recent messages to newly connected user"""
-        messages = await database_sync_to_async(self._get_messages)()
-
-        # Send messages in chronological order
-        for message in messages:
-            await self.send(text_data=json.dumps({
-                'type': 'message',
-                'id': message.id,
-                'content': message.content,
-                'author': message.author.username,
-                'author_full_name': f"{message.author.first_name} {message.author.last_name}".strip() or message.author.username,
-                'author_id': message.author.id,
-                'author_role': message.author.get_role_display(),
-                'timestamp': message.timestamp.isoformat(),
-                'room_id': message.room.id,
-                'is_edited': message.is_edited,
-            }))
-
-    def _get_messages(self):
-        """Get recent messages from database"""
-        return list(Message.objects.filter(
-            room=self.room
-        ).select_related('author').order_by('timestamp')[:50])
+    async def send_history(self, before_id=None, after_id=None, limit=None):
+        """Send one page of room history as a single frame"""
+        page = await database_sync_to_async(history_page)(
+            self.room, before_id=before_id, after_id=after_id, limit=limit
+        )
+        await self.send(text_data=json.dumps(page))
 
     @database_sync_to_async
     def mark_message_as_read(self, message_id):
         """Mark a message as read by the current user"""
-        try:
-            message = Message.objects.get(id=message_id, room=self.room)
-            MessageReadStatus.objects.get_or_create(
-                message=message,
-                user=self.user,
-                defaults={'read_at': message.timestamp}
-            )
-        except Message.DoesNotExist:
-            pass
+        if not Message.objects.filter(id=message_id, room=self.room).exists():
+            return False
+        mark_read(self.user, self.room, message_id)
+        return True
 
 
 class OnlineStatusConsumer(AsyncWebsocketConsumer):
@@ -210,15 +220,14 @@ class OnlineStatusConsumer(AsyncWebsocketConsumer):
 
     @database_sync_to_async
     def mark_user_online(self):
-        """Mark user as online in database"""
-        from .models import UserActivity
-        return UserActivity.mark_user_online(self.scope['user'])
+        """Refresh the user's presence; UserActivity is only written periodically"""
+        presence.touch(self.scope['user'])
 
     async def connect(self):
         if self.scope['user'] and self.scope['user'].is_authenticated:
             self.user = self.scope['user']
 
-            # Update user activity in database
+            # Refresh presence (UserActivity is persisted periodically)
             await self.mark_user_online()
 
             await self.channel_layer.group_add(
@@ -239,6 +248,7 @@ class OnlineStatusConsumer(AsyncWebsocketConsumer):
 
     async def disconnect(self, close_code):
         if hasattr(self, 'user'):
+            await database_sync_to_async(presence.go_offline)(self.user)
             await self.channel_layer.group_discard(
                 'online_users',
                 self.channel_name
@@ -254,6 +264,15 @@ class OnlineStatusConsumer(AsyncWebsocketConsumer):
                 }
             )
 
+    async def receive(self, text_data):
+        """Clients send periodic heartbeats to stay online"""
+        try:
+            data = json.loads(text_data)
+        except json.JSONDecodeError:
+            return
+        if data.get('type') == 'heartbeat':
+            await self.mark_user_online()
+
     async def user_online(self, event):
         """Handle user coming online"""
         if event['user_id'] != self.user.id:
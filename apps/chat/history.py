@@ -0,0 +1,84 @@
+"""
+Cursor-paginated chat history for the room WebSocket.
+
+A page is one query (limit + 1 rows with their authors, the extra row telling
+whether more messages follow) and is sent as a single frame:
+
+    {"type": "history", "messages": [...], "authors": {"<id>": {...}},
+     "direction": "before" | "after", "has_more": bool}
+
+Messages are in chronological order and only carry author_id; the author
+fields are sent once per page in ``authors``. Cursors are message ids:
+
+- no cursor: the newest page
+- before_id: the page of messages older than before_id (scrolling up)
+- after_id: messages newer than after_id, oldest first (a reconnecting client
+  asks for everything since the last id it has seen)
+"""
+
+from django.conf import settings
+
+from .models import Message
+
+PAGE_SIZE = getattr(settings, 'CHAT_HISTORY_PAGE_SIZE', 50)
+MAX_PAGE_SIZE = 100
+
+
+def _cursor(value):
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return None
+    return value if value >= 0 else None
+
+
+def history_page(room, before_id=None, after_id=None, limit=None):
+    """One page of ``room``'s history as a ready-to-send frame"""
+    try:
+        limit = min(max(int(limit or PAGE_SIZE), 1), MAX_PAGE_SIZE)
+    except (TypeError, ValueError):
+        limit = PAGE_SIZE
+    before_id, after_id = _cursor(before_id), _cursor(after_id)
+
+    messages_qs = Message.objects.filter(room=room).select_related('author')
+    if after_id is not None:
+        direction = 'after'
+        rows = list(messages_qs.filter(id__gt=after_id).order_by('id')[:limit + 1])
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+    else:
+        direction = 'before'
+        if before_id is not None:
+            messages_qs = messages_qs.filter(id__lt=before_id)
+        rows = list(messages_qs.order_by('-id')[:limit + 1])
+        has_more = len(rows) > limit
+        rows = rows[:limit][::-1]
+
+    authors = {}
+    for message in rows:
+        author = message.author
+        if author.id not in authors:
+            authors[author.id] = {
+                'username': author.username,
+                'full_name': f"{author.first_name} {author.last_name}".strip() or author.username,
+                'role': author.get_role_display(),
+            }
+
+    return {
+        'type': 'history',
+        'room_id': room.id,
+        'direction': direction,
+        'has_more': has_more,
+        'authors': {str(author_id): fields for author_id, fields in authors.items()},
+        'messages': [
+            {
+                'id': message.id,
+                'content': message.content,
+                'author_id': message.author_id,
+                'timestamp': message.timestamp.isoformat(),
+                'is_edited': message.is_edited,
+                'reply_to': message.reply_to_id,
+            }
+            for message in rows
+        ],
+    }
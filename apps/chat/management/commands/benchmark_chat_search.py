@@ -0,0 +1,145 @@
+"""
+Management command to benchmark chat search on a synthetic message corpus
+
+The corpus is generated inside a transaction that is rolled back at the end,
+so the command can be pointed at a development database without leaving data
+behind. Each query is timed against the old content__icontains scan and the
+search index (search.search_messages).
+"""
+import itertools
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from apps.chat import search
+from apps.chat.models import ChatRoom, Message
+
+User = get_user_model()
+
+DOMAIN_WORDS = (
+    'solar panel inverter battery quotation install roof site survey invoice payment '
+    'delivery warranty meter grid kilowatt lithium charge controller cable mounting '
+    'customer nairobi mombasa kisumu eldoret nakuru schedule technician approve '
+    'order stock supplier discount holiday offer project deadline report monday friday'
+).split()
+VOCABULARY_SIZE = 20000
+
+
+def _vocabulary(rng):
+    """Domain words first (the most frequent), then random filler words"""
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    filler = {''.join(rng.choices(letters, k=rng.randint(3, 10))) for _ in range(VOCABULARY_SIZE)}
+    return DOMAIN_WORDS + sorted(filler - set(DOMAIN_WORDS))
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Benchmark chat search (icontains scan vs search index) on a synthetic corpus, rolled back afterwards'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--messages',
+            type=int,
+            default=1_000_000,
+            help='Synthetic messages to generate (default: 1000000)'
+        )
+        parser.add_argument(
+            '--rooms',
+            type=int,
+            default=50,
+            help='Rooms to spread the messages over (default: 50)'
+        )
+        parser.add_argument(
+            '--queries',
+            type=int,
+            default=20,
+            help='Random queries to time (default: 20)'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=42,
+            help='Random seed for the corpus and queries (default: 42)'
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        try:
+            with transaction.atomic():
+                self._run(rng, options)
+                raise _Rollback
+        except _Rollback:
+            self.stdout.write("Synthetic corpus rolled back")
+
+    def _run(self, rng, options):
+        author = User.objects.create_user(username=f'chat-search-benchmark-{rng.randrange(10 ** 9)}')
+        ChatRoom.objects.bulk_create([
+            ChatRoom(name=f'benchmark-{author.pk}-{n}', room_type='general') for n in range(options['rooms'])
+        ])
+        # Re-read for the ids (MySQL bulk_create does not return them)
+        rooms = list(ChatRoom.objects.filter(name__startswith=f'benchmark-{author.pk}-'))
+        # Search as a user who can see a fifth of the rooms
+        room_ids = [room.id for room in rooms[:max(1, len(rooms) // 5)]]
+
+        # Zipf-like word frequencies, like real chat text
+        vocabulary = _vocabulary(rng)
+        weights = list(itertools.accumulate(1 / rank for rank in range(1, len(vocabulary) + 1)))
+        started = time.perf_counter()
+        remaining = options['messages']
+        while remaining:
+            size = min(remaining, 5000)
+            # bulk_create skips the post_save indexing; the index is built below in batches
+            Message.objects.bulk_create([
+                Message(
+                    room=rng.choice(rooms), author=author,
+                    content=' '.join(rng.choices(vocabulary, cum_weights=weights, k=rng.randint(4, 24))),
+                )
+                for _ in range(size)
+            ])
+            remaining -= size
+        self.stdout.write(f"Generated {options['messages']} messages in {time.perf_counter() - started:.1f}s")
+
+        if search.backend() == 'index':
+            started = time.perf_counter()
+            search.rebuild_index(Message.objects.filter(author=author), batch_size=5000)
+            self.stdout.write(f"Built the search index in {time.perf_counter() - started:.1f}s")
+
+        queries = [
+            ' '.join(rng.sample(vocabulary, rng.randint(1, 3)))
+            for _ in range(options['queries'])
+        ]
+        scan_total = index_total = 0.0
+        for query in queries:
+            scan_filter = Q()
+            for term in query.split():
+                scan_filter |= Q(content__icontains=term)
+
+            # A results page plus the total, as api_search_messages does
+            started = time.perf_counter()
+            scan_qs = Message.objects.filter(scan_filter, room_id__in=room_ids)
+            list(scan_qs.order_by('-timestamp')[:20])
+            scan_qs.count()
+            scan = time.perf_counter() - started
+
+            started = time.perf_counter()
+            index_qs = search.search_messages(query, room_ids)
+            list(index_qs.order_by('-search_rank', '-timestamp')[:20])
+            index_qs.count()
+            indexed = time.perf_counter() - started
+
+            scan_total += scan
+            index_total += indexed
+            self.stdout.write(f"{query!r:40} icontains {scan * 1000:8.1f}ms  index {indexed * 1000:8.1f}ms")
+
+        count = len(queries) or 1
+        self.stdout.write(self.style.SUCCESS(
+            f"Mean over {len(queries)} queries ({search.backend()} backend): "
+            f"icontains {scan_total / count * 1000:.1f}ms, index {index_total / count * 1000:.1f}ms"
+        ))
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.5 on 2026-10-17 04:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def add_fulltext_index(apps, schema_editor):
+    # MySQL searches chat_message.content through a FULLTEXT index instead of MessageSearchTerm
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute('ALTER TABLE chat_message ADD FULLTEXT INDEX chat_message_content_ft (content)')
+
+
+def drop_fulltext_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute('ALTER TABLE chat_message DROP INDEX chat_message_content_ft')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_chatroom_show_read_receipts_roomreadcursor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageSearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('frequency', models.PositiveSmallIntegerField(default=1)),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='chat.message')),
+                ('room', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='chat.chatroom')),
+            ],
+            options={
+                'verbose_name': 'Message Search Term',
+                'verbose_name_plural': 'Message Search Terms',
+                'indexes': [models.Index(fields=['term', 'room'], name='chat_search_term_room_idx')],
+                'unique_together': {('term', 'message')},
+            },
+        ),
+        migrations.RunPython(add_fulltext_index, drop_fulltext_index),
+    ]
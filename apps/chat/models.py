@@ -30,6 +30,8 @@ class ChatRoom(models.Model):
     participants = models.ManyToManyField(User, related_name='chat_rooms', blank=True)
     # Whether new users should be auto-added to this room (used by signals)
     is_auto_join = models.BooleanField(default=True, help_text='If true, users will be auto-added based on group or general auto-join rules')
+    # Per-message read receipts are only stored for rooms that display them
+    show_read_receipts = models.BooleanField(default=False, help_text='If true, record which users have read each message')
 
     class Meta:
         ordering = ['-created_at']
@@ -119,6 +121,26 @@ class Message(models.Model):
             self.mentioned_users.clear()
 
 
+class MessageSearchTerm(models.Model):
+    """Inverted index entry: a normalised word and the message it occurs in (see apps/chat/search.py)"""
+
+    term = models.CharField(max_length=64)
+    message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='search_terms')
+    # Copied from the message so the index query can filter by accessible rooms; no index of its
+    # own, which would tempt the planner into scanning whole rooms instead of the (term, room) index
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='+', db_index=False)
+    frequency = models.PositiveSmallIntegerField(default=1)
+
+    class Meta:
+        unique_together = ['term', 'message']
+        indexes = [models.Index(fields=['term', 'room'], name='chat_search_term_room_idx')]
+        verbose_name = 'Message Search Term'
+        verbose_name_plural = 'Message Search Terms'
+
+    def __str__(self):
+        return f"{self.term} in message {self.message_id}"
+
+
 class MessageReadStatus(models.Model):
     """Tracks which users have read which messages"""
 
@@ -135,6 +157,24 @@ class MessageReadStatus(models.Model):
         return f"{self.user.username} read message {self.message.id}"
 
 
+class RoomReadCursor(models.Model):
+    """A user's read position in a room, with the number of unread messages after it"""
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_read_cursors')
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='read_cursors')
+    last_read_message_id = models.PositiveBigIntegerField(default=0)
+    unread_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['user', 'room']
+        verbose_name = 'Room Read Cursor'
+        verbose_name_plural = 'Room Read Cursors'
+
+    def __str__(self):
+        return f"{self.user.username} in {self.room.name}: {self.unread_count} unread"
+
+
 class NotificationPreference(models.Model):
     """User preferences for chat notifications"""
 
@@ -0,0 +1,151 @@
+"""
+Online presence and typing indicators for chat, kept in the cache.
+
+Typing state used to live in UserActivity rows: every keystroke burst wrote the
+row and every open room polled it with a three-second window query, and each
+page view or socket connect wrote mark_user_online. This registry keeps that
+ephemeral state in the shared cache with TTLs instead:
+
+- typing: a per-room roster {user_id: {expires, username, full_name}} that
+  expires on its own after CHAT_TYPING_TTL seconds without a refresh; changes
+  are broadcast to the room's channel layer group (chat_<room name>) as
+  typing_update events, so rooms with a socket no longer need to poll
+- presence: touch() refreshes an online key with CHAT_PRESENCE_TTL and
+  persists UserActivity.last_activity at most once per
+  CHAT_PRESENCE_PERSIST_INTERVAL seconds, which is what "last seen" and the
+  online user lists are read from
+
+With a per-process cache (LocMem) the registry is only shared between the
+requests one process serves; configure a shared cache backend in production.
+"""
+
+import logging
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+TYPING_TTL = getattr(settings, 'CHAT_TYPING_TTL', 5)  # seconds
+PRESENCE_TTL = getattr(settings, 'CHAT_PRESENCE_TTL', 120)  # seconds
+PERSIST_INTERVAL = getattr(settings, 'CHAT_PRESENCE_PERSIST_INTERVAL', 60)  # seconds
+
+ONLINE_KEY = 'chat:presence:online:{user_id}'
+PERSISTED_KEY = 'chat:presence:persisted:{user_id}'
+TYPING_ROOM_KEY = 'chat:typing:room:{room_id}'
+TYPING_USER_KEY = 'chat:typing:user:{user_id}'
+
+
+def room_group(room_name):
+    """Channel layer group of a chat room (shared with ChatConsumer)"""
+    return f'chat_{room_name}'
+
+
+def display_name(user):
+    return f"{user.first_name} {user.last_name}".strip() or user.username
+
+
+# Presence
+
+def touch(user):
+    """Record activity for ``user``; writes UserActivity at most once per PERSIST_INTERVAL"""
+    if not user or not user.is_authenticated:
+        return
+    now = time.time()
+    cache.set(ONLINE_KEY.format(user_id=user.pk), now, PRESENCE_TTL)
+
+    if cache.add(PERSISTED_KEY.format(user_id=user.pk), now, PERSIST_INTERVAL):
+        from .models import UserActivity
+
+        updated = UserActivity.objects.filter(user=user).update(last_activity=timezone.now(), is_online=True)
+        if not updated:
+            UserActivity.objects.get_or_create(user=user, defaults={'last_activity': timezone.now(), 'is_online': True})
+
+
+def go_offline(user):
+    """Drop the online key (socket closed); "last seen" keeps the last persisted activity"""
+    cache.delete(ONLINE_KEY.format(user_id=user.pk))
+
+
+def is_online(user_id):
+    return cache.get(ONLINE_KEY.format(user_id=user_id)) is not None
+
+
+# Typing
+
+def _live_roster(room_id, now=None):
+    now = now or time.time()
+    roster = cache.get(TYPING_ROOM_KEY.format(room_id=room_id)) or {}
+    return {user_id: entry for user_id, entry in roster.items() if entry['expires'] > now}
+
+
+def _save_roster(room_id, roster):
+    key = TYPING_ROOM_KEY.format(room_id=room_id)
+    if roster:
+        cache.set(key, roster, TYPING_TTL)
+    else:
+        cache.delete(key)
+
+
+def typing_users(room_id, exclude_user_id=None):
+    """Users currently typing in a room, as {id, username, full_name} dicts"""
+    return [
+        {'id': user_id, 'username': entry['username'], 'full_name': entry['full_name']}
+        for user_id, entry in sorted(_live_roster(room_id).items())
+        if user_id != exclude_user_id
+    ]
+
+
+def start_typing(user, room):
+    """Mark ``user`` as typing in ``room`` for TYPING_TTL seconds; returns whether they just started"""
+    now = time.time()
+    roster = _live_roster(room.pk, now)
+    started = user.pk not in roster
+    roster[user.pk] = {'expires': now + TYPING_TTL, 'username': user.username, 'full_name': display_name(user)}
+    _save_roster(room.pk, roster)
+
+    # A user types in one room at a time
+    previous_room_id = cache.get(TYPING_USER_KEY.format(user_id=user.pk))
+    if previous_room_id and previous_room_id != room.pk:
+        _remove_typist(previous_room_id, user.pk)
+    cache.set(TYPING_USER_KEY.format(user_id=user.pk), room.pk, TYPING_TTL)
+    return started
+
+
+def stop_typing(user, room_id=None):
+    """Clear ``user``'s typing state; returns the room id they were typing in, if any"""
+    user_key = TYPING_USER_KEY.format(user_id=user.pk)
+    room_id = room_id or cache.get(user_key)
+    cache.delete(user_key)
+    if room_id and _remove_typist(room_id, user.pk):
+        return room_id
+    return None
+
+
+def _remove_typist(room_id, user_id):
+    roster = _live_roster(room_id)
+    if roster.pop(user_id, None) is None:
+        return False
+    _save_roster(room_id, roster)
+    return True
+
+
+def typing_event(room_id):
+    """Channel layer event carrying a room's typing users"""
+    return {'type': 'typing_update', 'typing_users': typing_users(room_id)}
+
+
+def broadcast_typing(room):
+    """Push the room's typing users to its sockets (from synchronous code)"""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        async_to_sync(channel_layer.group_send)(room_group(room.name), typing_event(room.pk))
+    except Exception as e:
+        # Rooms without a socket keep polling api_get_typing_users
+        logger.warning(f"Could not broadcast typing status for room {room.name}: {str(e)}")
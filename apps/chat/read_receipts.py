@@ -0,0 +1,76 @@
+"""
+Read receipts (MessageReadStatus rows) for rooms with show_read_receipts on.
+
+Receipts used to be written with one get_or_create per message, so a poll or
+an initial room load could cost up to 100 SELECT+INSERT pairs, and every
+WebSocket mark_read event did the same. record_read_receipts() now finds the
+messages in a read range that still lack a receipt with a single query and
+inserts them with bulk_create(ignore_conflicts=True), so a concurrent reader
+inserting the same rows is harmless.
+
+A socket sends mark_read for every message that scrolls into view.
+PendingReads keeps only the newest message id and flushes it after
+CHAT_READ_FLUSH_INTERVAL seconds (and on disconnect), so a burst of events
+becomes one cursor update, one receipt write and one broadcast.
+"""
+
+import asyncio
+
+from django.conf import settings
+
+from .models import Message, MessageReadStatus
+
+BATCH_SIZE = getattr(settings, 'CHAT_READ_RECEIPT_BATCH_SIZE', 500)
+FLUSH_INTERVAL = getattr(settings, 'CHAT_READ_FLUSH_INTERVAL', 2.0)  # seconds
+
+
+def record_read_receipts(user, room, after_id, up_to_id):
+    """Write receipts for messages in (after_id, up_to_id] of ``room``; returns the number written"""
+    missing_ids = list(
+        Message.objects.filter(room=room, id__gt=after_id, id__lte=up_to_id)
+        .exclude(author=user)
+        .exclude(read_status__user=user)
+        .values_list('id', flat=True)
+    )
+    if not missing_ids:
+        return 0
+
+    MessageReadStatus.objects.bulk_create(
+        [MessageReadStatus(message_id=message_id, user=user) for message_id in missing_ids],
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    return len(missing_ids)
+
+
+class PendingReads:
+    """Coalesces a socket's mark_read events until the next flush"""
+
+    def __init__(self, flush, interval=FLUSH_INTERVAL):
+        self.flush = flush  # async callable taking the newest message id
+        self.interval = interval
+        self.message_id = None
+        self._task = None
+
+    def add(self, message_id):
+        if self.message_id is None or message_id > self.message_id:
+            self.message_id = message_id
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.interval)
+        self._task = None
+        await self.drain()
+
+    async def drain(self):
+        """Flush the pending message id now, if any"""
+        message_id, self.message_id = self.message_id, None
+        if message_id is not None:
+            await self.flush(message_id)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.drain()
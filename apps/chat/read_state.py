@@ -0,0 +1,134 @@
+"""
+Per-user read cursors and unread counters for chat rooms.
+
+Unread counts used to be computed by excluding every MessageReadStatus row of
+the user from the room's messages, which slowed down as history grew while the
+unread badge is polled from every open page. Each (user, room) pair now has a
+RoomReadCursor holding the id of the last message the user has read and the
+number of messages from other users after it:
+
+- a new message bumps the counter of every other cursor in its room with one
+  UPDATE and moves the author's own cursor past it (record_new_message)
+- reading a room moves the cursor forward and recounts what is left after it
+  (mark_read), which only touches the unread tail
+- unread counts are read straight from the cursor rows (unread_counts)
+
+Cursors are created lazily the first time a user's counts are needed, seeded
+from the existing MessageReadStatus rows. Per-message receipts are only written
+for rooms with show_read_receipts enabled (see read_receipts.py).
+"""
+
+from django.db import transaction
+from django.db.models import Count, F, Max
+
+from .models import ChatRoom, Message, MessageReadStatus, RoomReadCursor
+from .read_receipts import record_read_receipts
+
+
+def _legacy_unread(user, room_ids):
+    """Unread messages by MessageReadStatus, used once to seed new cursors"""
+    return Message.objects.filter(room_id__in=room_ids).exclude(author=user).exclude(
+        id__in=MessageReadStatus.objects.filter(user=user).values_list('message_id', flat=True)
+    )
+
+
+def _create_cursors(user, room_ids):
+    """Create the missing cursors for ``room_ids``; returns {room_id: unread_count}"""
+    unread = dict(
+        _legacy_unread(user, room_ids).order_by().values('room').annotate(count=Count('id'))
+        .values_list('room', 'count')
+    )
+    last_read = dict(
+        MessageReadStatus.objects.filter(user=user, message__room_id__in=room_ids)
+        .order_by().values('message__room').annotate(last=Max('message_id'))
+        .values_list('message__room', 'last')
+    )
+    RoomReadCursor.objects.bulk_create(
+        [
+            RoomReadCursor(
+                user=user, room_id=room_id,
+                last_read_message_id=last_read.get(room_id) or 0,
+                unread_count=unread.get(room_id, 0),
+            )
+            for room_id in room_ids
+        ],
+        ignore_conflicts=True,
+    )
+    return {room_id: unread.get(room_id, 0) for room_id in room_ids}
+
+
+def unread_counts(user, room_ids):
+    """Unread message count per room id for ``user``"""
+    room_ids = list(room_ids)
+    if not room_ids:
+        return {}
+
+    counts = dict(
+        RoomReadCursor.objects.filter(user=user, room_id__in=room_ids).values_list('room_id', 'unread_count')
+    )
+    missing = [room_id for room_id in room_ids if room_id not in counts]
+    if missing:
+        counts.update(_create_cursors(user, missing))
+    return counts
+
+
+def total_unread(user, room_ids):
+    """Unread messages across ``room_ids`` (the global chat badge)"""
+    return sum(unread_counts(user, room_ids).values())
+
+
+def get_cursor(user, room):
+    """The user's cursor for ``room``, created if needed"""
+    room_id = getattr(room, 'pk', room)
+    cursor = RoomReadCursor.objects.filter(user=user, room_id=room_id).first()
+    if cursor is None:
+        _create_cursors(user, [room_id])
+        cursor = RoomReadCursor.objects.get(user=user, room_id=room_id)
+    return cursor
+
+
+def record_new_message(message):
+    """Count a newly saved message as unread for everyone in the room except its author"""
+    cursors = RoomReadCursor.objects.filter(room_id=message.room_id)
+    cursors.exclude(user_id=message.author_id).update(unread_count=F('unread_count') + 1)
+    cursors.filter(user_id=message.author_id, last_read_message_id__lt=message.id).update(
+        last_read_message_id=message.id
+    )
+
+
+def record_deleted_message(message):
+    """Stop counting a deleted message for users who had not read it yet"""
+    RoomReadCursor.objects.filter(
+        room_id=message.room_id, last_read_message_id__lt=message.id, unread_count__gt=0,
+    ).exclude(user_id=message.author_id).update(unread_count=F('unread_count') - 1)
+
+
+def mark_read(user, room, up_to_message_id=None):
+    """Move the user's cursor in ``room`` up to ``up_to_message_id`` (default: latest message).
+
+    Returns the remaining unread count. The cursor never moves backwards.
+    """
+    if not isinstance(room, ChatRoom):
+        room = ChatRoom.objects.get(pk=room)
+
+    messages_qs = Message.objects.filter(room=room)
+    if up_to_message_id is None:
+        up_to_message_id = messages_qs.aggregate(last=Max('id'))['last'] or 0
+    else:
+        up_to_message_id = int(up_to_message_id)
+
+    with transaction.atomic():
+        cursor = get_cursor(user, room)
+        cursor = RoomReadCursor.objects.select_for_update().get(pk=cursor.pk)
+        previous = cursor.last_read_message_id
+        if up_to_message_id <= previous:
+            return cursor.unread_count
+
+        cursor.last_read_message_id = up_to_message_id
+        # Only the messages after the new position are counted
+        cursor.unread_count = messages_qs.filter(id__gt=up_to_message_id).exclude(author=user).count()
+        cursor.save(update_fields=['last_read_message_id', 'unread_count', 'updated_at'])
+
+    if room.show_read_receipts:
+        record_read_receipts(user, room, previous, up_to_message_id)
+    return cursor.unread_count
@@ -0,0 +1,171 @@
+"""
+Full-text search over chat messages.
+
+api_search_messages used to OR together content__icontains filters, a full
+table scan per search. Searches now go through an index:
+
+- on MySQL, the FULLTEXT index on chat_message.content added by migration
+  0010, queried with MATCH ... AGAINST in boolean mode (every word is a prefix
+  match) and ranked by MySQL's relevance score
+- elsewhere (SQLite in development), the MessageSearchTerm inverted index: one
+  row per (word, message) with the word's frequency and the message's room.
+  Each word is matched as a prefix with an index range scan on (term, room),
+  restricted to the user's accessible rooms inside the same query, and
+  results are ranked by how many query words matched, then by how often
+
+The inverted index is kept up to date from the Message post_save signal
+(index_message), so new and edited messages are searchable immediately;
+rebuild_chat_search_index backfills existing history. CHAT_SEARCH_BACKEND
+('auto', 'fulltext' or 'index') forces a backend.
+
+highlight() builds an HTML-escaped snippet around the first match with the
+matched words wrapped in <mark>.
+"""
+
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+
+from .models import Message, MessageSearchTerm
+
+MAX_TERM_LENGTH = 64
+MIN_TERM_LENGTH = 2
+MAX_QUERY_TERMS = 8
+SNIPPET_LENGTH = getattr(settings, 'CHAT_SEARCH_SNIPPET_LENGTH', 160)
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def backend():
+    """'fulltext' (MySQL FULLTEXT) or 'index' (MessageSearchTerm)"""
+    configured = getattr(settings, 'CHAT_SEARCH_BACKEND', 'auto')
+    if configured in ('fulltext', 'index'):
+        return configured
+    return 'fulltext' if connection.vendor == 'mysql' else 'index'
+
+
+def tokenize(text):
+    """Normalised words of ``text`` (lowercase, at least MIN_TERM_LENGTH characters)"""
+    return [
+        word[:MAX_TERM_LENGTH]
+        for word in WORD_RE.findall((text or '').lower())
+        if len(word) >= MIN_TERM_LENGTH
+    ]
+
+
+def query_terms(query):
+    """Distinct query words in order, capped at MAX_QUERY_TERMS"""
+    return list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+
+
+# Index maintenance
+
+def _terms_for(message):
+    return Counter(tokenize(message.content))
+
+
+def index_message(message, created=False):
+    """(Re)index one message; called when a message is created or edited"""
+    if backend() != 'index':
+        return
+    entries = [
+        MessageSearchTerm(term=term, message_id=message.pk, room_id=message.room_id, frequency=min(count, 32767))
+        for term, count in _terms_for(message).items()
+    ]
+    if created:
+        # A new message has no entries yet: a single INSERT
+        MessageSearchTerm.objects.bulk_create(entries)
+        return
+    with transaction.atomic():
+        MessageSearchTerm.objects.filter(message_id=message.pk).delete()
+        MessageSearchTerm.objects.bulk_create(entries)
+
+
+def rebuild_index(messages=None, batch_size=1000):
+    """Index ``messages`` (default: all) from scratch; returns the number of messages indexed"""
+    messages = (messages if messages is not None else Message.objects.all()).order_by('id')
+    indexed = 0
+    last_id = 0
+    while True:
+        batch = list(messages.filter(id__gt=last_id).only('id', 'room_id', 'content')[:batch_size])
+        if not batch:
+            return indexed
+        with transaction.atomic():
+            MessageSearchTerm.objects.filter(message_id__in=[message.id for message in batch]).delete()
+            MessageSearchTerm.objects.bulk_create(
+                [
+                    MessageSearchTerm(term=term, message_id=message.id, room_id=message.room_id,
+                                      frequency=min(count, 32767))
+                    for message in batch
+                    for term, count in _terms_for(message).items()
+                ],
+                batch_size=batch_size,
+            )
+        indexed += len(batch)
+        last_id = batch[-1].id
+
+
+# Querying
+
+def _prefix_range(field, term):
+    # A range instead of LIKE so both SQLite and MySQL can use the (term, room) index
+    return Q(**{f'{field}__gte': term, f'{field}__lt': term + '\uffff'})
+
+
+def search_messages(query, room_ids):
+    """Messages in ``room_ids`` matching ``query``, annotated with search_rank (higher is better)"""
+    terms = query_terms(query)
+    room_ids = list(room_ids)
+    if not terms or not room_ids:
+        return Message.objects.none()
+
+    if backend() == 'fulltext':
+        boolean_query = ' '.join(f'{term}*' for term in terms)
+        match = "MATCH (chat_message.content) AGAINST (%s IN BOOLEAN MODE)"
+        return (
+            Message.objects.filter(room_id__in=room_ids)
+            .annotate(search_rank=RawSQL(match, [boolean_query]))
+            .filter(search_rank__gt=0)
+        )
+
+    term_filter = Q()
+    for term in terms:
+        term_filter |= _prefix_range('search_terms__term', term)
+
+    # One filter() call so the rank aggregates count the matching index rows only
+    return (
+        Message.objects.filter(term_filter & Q(search_terms__room_id__in=room_ids))
+        # Messages matching more query words first, then more occurrences
+        .annotate(search_rank=Count('search_terms__term', distinct=True) * 1000 + Sum('search_terms__frequency'))
+    )
+
+
+def highlight(text, query, length=SNIPPET_LENGTH):
+    """HTML-escaped snippet of ``text`` around the first match, matched words wrapped in <mark>"""
+    text = text or ''
+    terms = query_terms(query)
+    if not terms:
+        return escape(text[:length])
+
+    pattern = re.compile(r'\b(?:' + '|'.join(re.escape(term) for term in terms) + r')\w*', re.IGNORECASE)
+    first = pattern.search(text)
+    start = 0
+    if first and len(text) > length:
+        start = max(0, min(first.start() - length // 4, len(text) - length))
+    end = min(len(text), start + length)
+
+    window = text[start:end]
+    parts = []
+    position = 0
+    for match in pattern.finditer(window):
+        parts.append(escape(window[position:match.start()]))
+        parts.append(f'<mark>{escape(match.group(0))}</mark>')
+        position = match.end()
+    parts.append(escape(window[position:]))
+
+    return ('…' if start else '') + ''.join(parts) + ('…' if end < len(text) else '')
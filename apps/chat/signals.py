@@ -1,10 +1,13 @@
-from django.db.models.signals import m2m_changed, post_save
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
 from django.conf import settings
 
-from .models import ChatRoom
+from .access import invalidate_all_rooms, invalidate_user_rooms
+from .models import ChatRoom, Message
+from .read_state import record_deleted_message, record_new_message
+from .search import index_message
 
 User = get_user_model()
 
@@ -25,10 +28,16 @@ def user_groups_changed(sender, instance, action, pk_set, **kwargs):
     if action not in ('post_add', 'post_remove'):
         return
 
-    try:
-        groups = Group.objects.filter(pk__in=pk_set)
-    except Exception:
-        groups = []
+    # group.user_set.add(user) sends the group as instance and the user ids in pk_set
+    if kwargs.get('reverse'):
+        groups = [instance]
+        users = list(User.objects.filter(pk__in=pk_set))
+    else:
+        try:
+            groups = Group.objects.filter(pk__in=pk_set)
+        except Exception:
+            groups = []
+        users = [instance]
 
     dept_rooms = ChatRoom.objects.filter(room_type='department')
 
@@ -37,11 +46,9 @@ def user_groups_changed(sender, instance, action, pk_set, **kwargs):
             try:
                 if _match_room_group(room.name, group.name):
                     if action == 'post_add':
-                        room.participants.add(instance)
+                        room.participants.add(*users)
                     elif action == 'post_remove':
-                        # remove safely
-                        if room.participants.filter(id=instance.id).exists():
-                            room.participants.remove(instance)
+                        room.participants.remove(*users)
             except Exception:
                 # guard against unexpected errors
                 continue
@@ -84,3 +91,61 @@ def user_created_auto_join_rooms(sender, instance, created, **kwargs):
                         continue
     except Exception:
         pass
+
+
+def _invalidate_membership(action, instance_is_user, instance, pk_set):
+    """Drop cached accessible rooms of the users whose membership changed"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if instance_is_user:
+        invalidate_user_rooms(instance.pk)
+    elif action == 'post_clear' or pk_set is None:
+        # Cleared from the group/room side: the affected users are not known
+        invalidate_all_rooms()
+    else:
+        invalidate_user_rooms(*pk_set)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def user_groups_access_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # user.groups.add() is the forward side, group.user_set.add() the reverse
+    _invalidate_membership(action, not reverse, instance, pk_set)
+
+
+@receiver(m2m_changed, sender=ChatRoom.participants.through)
+def room_participants_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # room.participants.add() is the forward side, user.chat_rooms.add() the reverse
+    _invalidate_membership(action, reverse, instance, pk_set)
+
+
+@receiver(post_save, sender=User)
+def user_access_changed(sender, instance, created, update_fields=None, **kwargs):
+    """Staff status affects department and project rooms"""
+    if created or update_fields == frozenset({'last_login'}):
+        return
+    invalidate_user_rooms(instance.pk)
+
+
+@receiver(post_save, sender=ChatRoom)
+@receiver(post_delete, sender=ChatRoom)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def rooms_or_groups_changed(sender, **kwargs):
+    invalidate_all_rooms()
+
+
+@receiver(post_save, sender=Message)
+def message_saved_update_unread(sender, instance, created, **kwargs):
+    if created:
+        record_new_message(instance)
+
+
+@receiver(post_save, sender=Message)
+def message_saved_update_search_index(sender, instance, created, **kwargs):
+    # New and edited messages are searchable straight away
+    index_message(instance, created=created)
+
+
+@receiver(post_delete, sender=Message)
+def message_deleted_update_unread(sender, instance, **kwargs):
+    record_deleted_message(instance)
@@ -0,0 +1,123 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from apps.chat.access import accessible_room_ids, can_access_room, resolve_accessible_room_ids
+from apps.chat.models import ChatRoom, Message
+
+User = get_user_model()
+
+LOCMEM_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'chat-access-tests'},
+    'pages': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class AccessibleRoomsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='wanjiru', password='test123')
+        self.other = User.objects.create_user(username='otieno', password='test123')
+        self.general = ChatRoom.objects.create(name='general', room_type='general')
+        self.sales = ChatRoom.objects.create(name='sales', room_type='department', is_auto_join=False)
+        self.project = ChatRoom.objects.create(name='solar-farm', room_type='project')
+        self.private = ChatRoom.objects.create(name='dm', room_type='private', is_auto_join=False)
+        self.private.participants.add(self.other)
+        self.closed = ChatRoom.objects.create(name='archive', room_type='general', is_active=False)
+
+    def test_rules_match_room_types(self):
+        self.assertEqual(accessible_room_ids(self.user), {self.general.id})
+
+        self.user.groups.add(Group.objects.create(name='Sales Team'))
+        self.user.groups.add(Group.objects.create(name='solar-farm'))
+        self.private.participants.add(self.user)
+        self.assertEqual(
+            accessible_room_ids(self.user),
+            {self.general.id, self.sales.id, self.project.id, self.private.id},
+        )
+
+    def test_staff_see_department_and_project_rooms(self):
+        self.user.is_staff = True
+        self.user.save()
+        self.assertEqual(accessible_room_ids(self.user), {self.general.id, self.sales.id, self.project.id})
+
+    def test_resolution_uses_two_queries(self):
+        for i in range(10):
+            ChatRoom.objects.create(name=f'dept-{i}', room_type='department')
+        with self.assertNumQueries(2):
+            resolve_accessible_room_ids(self.user)
+
+    def test_result_is_cached(self):
+        accessible_room_ids(self.user)
+        with self.assertNumQueries(0):
+            self.assertTrue(can_access_room(self.user, self.general))
+            self.assertFalse(can_access_room(self.user, self.sales))
+
+    def test_membership_changes_invalidate_cache(self):
+        self.assertFalse(can_access_room(self.user, self.private))
+        self.private.participants.add(self.user)
+        self.assertTrue(can_access_room(self.user, self.private))
+        self.user.chat_rooms.remove(self.private)
+        self.assertFalse(can_access_room(self.user, self.private))
+
+        group = Group.objects.create(name='sales')
+        group.user_set.add(self.user)
+        self.assertTrue(can_access_room(self.user, self.sales))
+        group.user_set.clear()
+        self.assertFalse(can_access_room(self.user, self.sales))
+
+    def test_room_changes_invalidate_cache(self):
+        self.assertTrue(can_access_room(self.user, self.general))
+        self.general.is_active = False
+        self.general.save()
+        self.assertFalse(can_access_room(self.user, self.general))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ChatQueryCountTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='wanjiru', password='test123')
+        self.author = User.objects.create_user(username='otieno', password='test123')
+        self.client.force_login(self.user)
+
+    def add_rooms(self, count):
+        for _ in range(count):
+            room = ChatRoom.objects.create(name=f'room-{ChatRoom.objects.count()}', room_type='general')
+            for n in range(2):
+                Message.objects.create(room=room, author=self.author, content=f'message {n}')
+
+    def count_queries(self, url):
+        # Warm up per-user rows (online status, preferences) before counting
+        self.client.get(url)
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response
+
+    def test_dashboard_queries_do_not_grow_with_rooms(self):
+        self.add_rooms(2)
+        few, _ = self.count_queries(reverse('chat:dashboard'))
+        self.add_rooms(8)
+        many, response = self.count_queries(reverse('chat:dashboard'))
+        self.assertEqual(few, many)
+
+        rooms = response.context['rooms']
+        self.assertEqual(len(rooms), 10)
+        for room in rooms:
+            self.assertEqual(room.unread_count, 2)
+            self.assertEqual(room.last_message.content, 'message 1')
+
+    def test_unread_badge_queries_do_not_grow_with_rooms(self):
+        self.add_rooms(2)
+        few, _ = self.count_queries(reverse('chat:api_unread_count'))
+        self.add_rooms(8)
+        many, response = self.count_queries(reverse('chat:api_unread_count'))
+        self.assertEqual(few, many)
+        self.assertEqual(response.json()['unread_count'], 20)
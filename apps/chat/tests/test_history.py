@@ -0,0 +1,118 @@
+import json
+
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from channels.routing import URLRouter
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from apps.chat.history import history_page
+from apps.chat.models import ChatRoom, Message
+from apps.chat.routing import websocket_urlpatterns
+
+User = get_user_model()
+
+LOCMEM_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'chat-history-tests'},
+    'pages': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class HistoryPageTest(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='test123', first_name='Alice')
+        self.bob = User.objects.create_user(username='bob', password='test123')
+        self.room = ChatRoom.objects.create(name='general', room_type='general')
+        self.messages = [
+            Message.objects.create(room=self.room, author=(self.alice, self.bob)[n % 2], content=f'message {n}')
+            for n in range(12)
+        ]
+        self.ids = [message.id for message in self.messages]
+
+    def test_default_page_is_the_newest_messages(self):
+        with self.assertNumQueries(1):
+            page = history_page(self.room, limit=5)
+        self.assertEqual([m['id'] for m in page['messages']], self.ids[-5:])
+        self.assertTrue(page['has_more'])
+        self.assertEqual(page['authors'][str(self.alice.id)]['full_name'], 'Alice')
+        self.assertEqual(set(page['authors']), {str(self.alice.id), str(self.bob.id)})
+
+    def test_before_id_pages_backwards(self):
+        page = history_page(self.room, before_id=self.ids[5], limit=5)
+        self.assertEqual([m['id'] for m in page['messages']], self.ids[:5])
+        self.assertFalse(page['has_more'])
+
+    def test_after_id_returns_messages_since_last_seen(self):
+        page = history_page(self.room, after_id=self.ids[2], limit=5)
+        self.assertEqual(page['direction'], 'after')
+        self.assertEqual([m['id'] for m in page['messages']], self.ids[3:8])
+        self.assertTrue(page['has_more'])
+
+        page = history_page(self.room, after_id=self.ids[-1])
+        self.assertEqual(page['messages'], [])
+        self.assertFalse(page['has_more'])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class HistoryConsumerTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='alice', password='test123')
+        self.room = ChatRoom.objects.create(name='general', room_type='general')
+        self.ids = [
+            Message.objects.create(room=self.room, author=self.user, content=f'message {n}').id
+            for n in range(60)
+        ]
+        self.application = URLRouter(websocket_urlpatterns)
+
+    async def connect(self, query_string=b''):
+        path = f'/ws/chat/{self.room.name}/'
+        communicator = ApplicationCommunicator(self.application, {
+            'type': 'websocket', 'path': path, 'raw_path': path.encode(), 'query_string': query_string,
+            'headers': [], 'subprotocols': [], 'user': self.user,
+        })
+        await communicator.send_input({'type': 'websocket.connect'})
+        response = await communicator.receive_output(timeout=2)
+        self.assertEqual(response['type'], 'websocket.accept')
+        return communicator
+
+    async def receive_json(self, communicator):
+        return json.loads((await communicator.receive_output(timeout=2))['text'])
+
+    async def close(self, communicator):
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(timeout=2)
+
+    def test_connect_sends_newest_page_in_one_frame(self):
+        async def scenario():
+            communicator = await self.connect()
+            page = await self.receive_json(communicator)
+            self.assertEqual(page['type'], 'history')
+            self.assertEqual([m['id'] for m in page['messages']], self.ids[-50:])
+            self.assertTrue(page['has_more'])
+            self.assertTrue(await communicator.receive_nothing())
+
+            await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps({
+                'type': 'history', 'before_id': page['messages'][0]['id'],
+            })})
+            older = await self.receive_json(communicator)
+            self.assertEqual([m['id'] for m in older['messages']], self.ids[:10])
+            self.assertFalse(older['has_more'])
+            await self.close(communicator)
+
+        async_to_sync(scenario)()
+
+    def test_reconnect_since_last_seen_id(self):
+        async def scenario():
+            communicator = await self.connect(f'after_id={self.ids[-3]}'.encode())
+            page = await self.receive_json(communicator)
+            self.assertEqual([m['id'] for m in page['messages']], self.ids[-2:])
+            await self.close(communicator)
+
+            communicator = await self.connect(b'history=0')
+            self.assertTrue(await communicator.receive_nothing())
+            await self.close(communicator)
+
+        async_to_sync(scenario)()
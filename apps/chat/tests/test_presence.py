@@ -0,0 +1,126 @@
+import json
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from channels.routing import URLRouter
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from apps.chat import presence
+from apps.chat.models import ChatRoom, UserActivity
+from apps.chat.routing import websocket_urlpatterns
+
+User = get_user_model()
+
+LOCMEM_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'chat-presence-tests'},
+    'pages': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class PresenceRegistryTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='njeri', password='test123', first_name='Njeri', last_name='M')
+        self.other = User.objects.create_user(username='mutua', password='test123')
+        self.room = ChatRoom.objects.create(name='general', room_type='general')
+        self.sales = ChatRoom.objects.create(name='sales', room_type='general')
+
+    def test_typing_needs_no_database(self):
+        with self.assertNumQueries(0):
+            self.assertTrue(presence.start_typing(self.user, self.room))
+            self.assertFalse(presence.start_typing(self.user, self.room))
+            presence.start_typing(self.other, self.room)
+            self.assertEqual(
+                presence.typing_users(self.room.pk, exclude_user_id=self.other.pk),
+                [{'id': self.user.pk, 'username': 'njeri', 'full_name': 'Njeri M'}],
+            )
+            self.assertEqual(presence.stop_typing(self.user), self.room.pk)
+            self.assertEqual([typist['id'] for typist in presence.typing_users(self.room.pk)], [self.other.pk])
+
+    def test_typing_expires_and_follows_the_user(self):
+        now = 1000.0
+        with mock.patch('apps.chat.presence.time.time', return_value=now):
+            presence.start_typing(self.user, self.room)
+        with mock.patch('apps.chat.presence.time.time', return_value=now + presence.TYPING_TTL + 1):
+            self.assertEqual(presence.typing_users(self.room.pk), [])
+
+        presence.start_typing(self.user, self.room)
+        presence.start_typing(self.user, self.sales)
+        self.assertEqual(presence.typing_users(self.room.pk), [])
+        self.assertEqual(len(presence.typing_users(self.sales.pk)), 1)
+
+    def test_activity_persisted_once_per_interval(self):
+        presence.touch(self.user)
+        with self.assertNumQueries(0):
+            presence.touch(self.user)
+
+        cache.delete(presence.PERSISTED_KEY.format(user_id=self.user.pk))
+        with self.assertNumQueries(1):  # a single UPDATE once the row exists
+            presence.touch(self.user)
+        self.assertTrue(presence.is_online(self.user.pk))
+        self.assertTrue(UserActivity.objects.get(user=self.user).is_online)
+
+        presence.go_offline(self.user)
+        self.assertFalse(presence.is_online(self.user.pk))
+
+    def test_typing_api_does_not_write_user_activity(self):
+        self.client.force_login(self.user)
+        presence.touch(self.user)
+        UserActivity.objects.all().delete()
+
+        self.client.post(reverse('chat:api_start_typing', args=[self.room.name]))
+        self.client.force_login(self.other)
+        response = self.client.get(reverse('chat:api_get_typing_users', args=[self.room.name]))
+        self.assertEqual([typist['username'] for typist in response.json()['typing_users']], ['njeri'])
+
+        self.client.force_login(self.user)
+        self.client.post(reverse('chat:api_stop_typing'))
+        self.assertEqual(presence.typing_users(self.room.pk), [])
+        self.assertFalse(UserActivity.objects.exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TypingBroadcastTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.typist = User.objects.create_user(username='njeri', password='test123')
+        self.watcher = User.objects.create_user(username='mutua', password='test123')
+        self.room = ChatRoom.objects.create(name='general', room_type='general')
+        self.application = URLRouter(websocket_urlpatterns)
+
+    async def connect(self, user):
+        path = f'/ws/chat/{self.room.name}/'
+        communicator = ApplicationCommunicator(self.application, {
+            'type': 'websocket', 'path': path, 'raw_path': path.encode(), 'query_string': b'history=0',
+            'headers': [], 'subprotocols': [], 'user': user,
+        })
+        await communicator.send_input({'type': 'websocket.connect'})
+        response = await communicator.receive_output(timeout=2)
+        self.assertEqual(response['type'], 'websocket.accept')
+        return communicator
+
+    def test_typing_is_broadcast_to_the_room(self):
+        async def scenario():
+            typist = await self.connect(self.typist)
+            watcher = await self.connect(self.watcher)
+
+            await typist.send_input({'type': 'websocket.receive', 'text': json.dumps({'type': 'typing', 'is_typing': True})})
+            update = json.loads((await watcher.receive_output(timeout=2))['text'])
+            self.assertEqual(update, {'type': 'typing', 'typing_users': [
+                {'id': self.typist.pk, 'username': 'njeri', 'full_name': 'njeri'},
+            ]})
+
+            await typist.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await typist.wait(timeout=2)
+            update = json.loads((await watcher.receive_output(timeout=2))['text'])
+            self.assertEqual(update, {'type': 'typing', 'typing_users': []})
+
+            await watcher.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await watcher.wait(timeout=2)
+
+        async_to_sync(scenario)()
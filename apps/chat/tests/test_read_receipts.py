@@ -0,0 +1,82 @@
+import asyncio
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from apps.chat.models import ChatRoom, Message, MessageReadStatus, RoomReadCursor
+from apps.chat.read_receipts import PendingReads, record_read_receipts
+
+User = get_user_model()
+
+
+class ReadReceiptServiceTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create_user(username='akinyi', password='test123')
+        self.author = User.objects.create_user(username='kamau', password='test123')
+        self.room = ChatRoom.objects.create(name='general', room_type='general', show_read_receipts=True)
+
+    def post_messages(self, count):
+        return [
+            Message.objects.create(room=self.room, author=self.author, content=f'message {n}')
+            for n in range(count)
+        ]
+
+    def test_missing_receipts_written_in_one_insert(self):
+        messages = self.post_messages(30)
+        MessageReadStatus.objects.create(message=messages[0], user=self.reader)
+        own = Message.objects.create(room=self.room, author=self.reader, content='mine')
+
+        with self.assertNumQueries(2):
+            written = record_read_receipts(self.reader, self.room, 0, own.id)
+        self.assertEqual(written, 29)
+        self.assertEqual(MessageReadStatus.objects.filter(user=self.reader).count(), 30)
+        self.assertFalse(MessageReadStatus.objects.filter(message=own).exists())
+
+        with self.assertNumQueries(1):
+            self.assertEqual(record_read_receipts(self.reader, self.room, 0, own.id), 0)
+
+    def count_room_load_queries(self):
+        url = reverse('chat:api_room_messages', args=[self.room.name])
+        # Create the read cursor, then rewind it so the room is unread again
+        self.client.get(url)
+        MessageReadStatus.objects.all().delete()
+        RoomReadCursor.objects.filter(user=self.reader).update(last_read_message_id=0)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_opening_busy_room_costs_bounded_queries(self):
+        self.client.force_login(self.reader)
+        self.post_messages(5)
+        quiet = self.count_room_load_queries()
+        self.post_messages(95)
+        busy = self.count_room_load_queries()
+
+        self.assertEqual(quiet, busy)
+        # Everything up to the newest loaded message counts as read
+        self.assertEqual(MessageReadStatus.objects.filter(user=self.reader).count(), 100)
+
+
+class PendingReadsTest(SimpleTestCase):
+    def test_burst_of_reads_flushes_newest_id_once(self):
+        flushed = []
+
+        async def flush(message_id):
+            flushed.append(message_id)
+
+        async def scenario():
+            pending = PendingReads(flush, interval=0.01)
+            for message_id in (3, 7, 5):
+                pending.add(message_id)
+            await asyncio.sleep(0.05)
+            pending.add(9)
+            await pending.close()
+
+        asyncio.run(scenario())
+        self.assertEqual(flushed, [7, 9])
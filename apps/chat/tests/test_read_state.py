@@ -0,0 +1,86 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+
+from apps.chat.models import ChatRoom, Message, MessageReadStatus, RoomReadCursor
+from apps.chat.read_state import mark_read, total_unread, unread_counts
+
+User = get_user_model()
+
+
+class RoomReadCursorTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create_user(username='akinyi', password='test123')
+        self.author = User.objects.create_user(username='kamau', password='test123')
+        self.room = ChatRoom.objects.create(name='general', room_type='general')
+        self.other_room = ChatRoom.objects.create(name='sales', room_type='general')
+
+    def post(self, room=None, author=None, content='hello'):
+        return Message.objects.create(room=room or self.room, author=author or self.author, content=content)
+
+    def test_cursor_seeded_from_existing_read_statuses(self):
+        first = self.post()
+        self.post()
+        self.post()
+        MessageReadStatus.objects.create(message=first, user=self.reader)
+
+        self.assertEqual(unread_counts(self.reader, [self.room.id]), {self.room.id: 2})
+        cursor = RoomReadCursor.objects.get(user=self.reader, room=self.room)
+        self.assertEqual(cursor.last_read_message_id, first.id)
+
+    def test_new_messages_increment_counters_in_bulk(self):
+        unread_counts(self.reader, [self.room.id, self.other_room.id])
+        unread_counts(self.author, [self.room.id])
+
+        # Insert, clearing mentions, the two cursor updates and the search index insert
+        with self.assertNumQueries(5):
+            message = self.post()
+        self.post(room=self.other_room)
+
+        with self.assertNumQueries(1):
+            counts = unread_counts(self.reader, [self.room.id, self.other_room.id])
+        self.assertEqual(counts, {self.room.id: 1, self.other_room.id: 1})
+
+        author_cursor = RoomReadCursor.objects.get(user=self.author, room=self.room)
+        self.assertEqual(author_cursor.unread_count, 0)
+        self.assertEqual(author_cursor.last_read_message_id, message.id)
+
+    def test_mark_read_moves_cursor_forward_only(self):
+        unread_counts(self.reader, [self.room.id])
+        messages = [self.post() for _ in range(4)]
+
+        self.assertEqual(mark_read(self.reader, self.room, messages[1].id), 2)
+        self.assertEqual(mark_read(self.reader, self.room, messages[0].id), 2)
+        self.assertEqual(mark_read(self.reader, self.room), 0)
+        self.assertEqual(total_unread(self.reader, [self.room.id]), 0)
+
+    def test_read_receipts_only_for_rooms_that_show_them(self):
+        self.post()
+        mark_read(self.reader, self.room)
+        self.assertFalse(MessageReadStatus.objects.exists())
+
+        self.room.show_read_receipts = True
+        self.room.save()
+        message = self.post()
+        mark_read(self.reader, self.room)
+        self.assertEqual(list(MessageReadStatus.objects.values_list('message_id', 'user_id')),
+                         [(message.id, self.reader.id)])
+
+    def test_deleted_unread_message_is_uncounted(self):
+        unread_counts(self.reader, [self.room.id])
+        message = self.post()
+        self.post()
+        message.delete()
+        self.assertEqual(unread_counts(self.reader, [self.room.id]), {self.room.id: 1})
+
+    def test_reading_room_updates_unread_badge(self):
+        self.client.force_login(self.reader)
+        self.post()
+        self.post()
+        url = reverse('chat:api_unread_count')
+        self.assertEqual(self.client.get(url).json()['unread_count'], 2)
+
+        self.client.get(reverse('chat:api_room_messages', args=[self.room.name]))
+        self.assertEqual(self.client.get(url).json()['unread_count'], 0)
@@ -0,0 +1,104 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+
+from apps.chat import search
+from apps.chat.models import ChatRoom, Message, MessageSearchTerm
+
+User = get_user_model()
+
+
+class SearchHelpersTest(TestCase):
+    def test_tokenize_normalises_words(self):
+        self.assertEqual(search.tokenize('Solar PANELS, a 5kW inverter!'), ['solar', 'panels', '5kw', 'inverter'])
+        self.assertEqual(search.query_terms('panel Panel panels'), ['panel', 'panels'])
+
+    def test_highlight_escapes_and_marks_matches(self):
+        self.assertEqual(
+            search.highlight('<b>Inverter</b> installed & invoiced', 'inv'),
+            '&lt;b&gt;<mark>Inverter</mark>&lt;/b&gt; installed &amp; <mark>invoiced</mark>',
+        )
+
+    def test_highlight_snippet_centres_on_first_match(self):
+        text = 'x' * 300 + ' battery ' + 'y' * 300
+        snippet = search.highlight(text, 'battery', length=100)
+        self.assertIn('<mark>battery</mark>', snippet)
+        self.assertTrue(snippet.startswith('…') and snippet.endswith('…'))
+
+
+class SearchIndexTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='wanjiku', password='test123')
+        self.room = ChatRoom.objects.create(name='general', room_type='general')
+        self.other_room = ChatRoom.objects.create(name='sales', room_type='general')
+
+    def test_index_follows_message_edits(self):
+        message = Message.objects.create(room=self.room, author=self.user, content='battery battery delivery')
+        self.assertEqual(
+            dict(message.search_terms.values_list('term', 'frequency')),
+            {'battery': 2, 'delivery': 1},
+        )
+
+        message.content = 'inverter delivery'
+        message.save()
+        self.assertEqual(set(message.search_terms.values_list('term', flat=True)), {'inverter', 'delivery'})
+        self.assertEqual(list(search.search_messages('battery', [self.room.id])), [])
+
+    def test_ranks_by_matched_words_then_frequency(self):
+        one_word = Message.objects.create(room=self.room, author=self.user, content='solar quote')
+        repeated = Message.objects.create(room=self.room, author=self.user, content='solar solar solar')
+        both_words = Message.objects.create(room=self.room, author=self.user, content='solar inverter')
+        Message.objects.create(room=self.room, author=self.user, content='unrelated')
+
+        results = search.search_messages('solar inverter', [self.room.id]).order_by('-search_rank', '-timestamp')
+        self.assertEqual(list(results), [both_words, repeated, one_word])
+
+    def test_prefix_matches_and_room_filter(self):
+        visible = Message.objects.create(room=self.room, author=self.user, content='installation booked')
+        Message.objects.create(room=self.other_room, author=self.user, content='installation cancelled')
+
+        with self.assertNumQueries(1):
+            self.assertEqual(list(search.search_messages('install', [self.room.id])), [visible])
+        self.assertEqual(list(search.search_messages('install', [])), [])
+
+    def test_rebuild_index_backfills_messages(self):
+        Message.objects.create(room=self.room, author=self.user, content='meter reading')
+        Message.objects.create(room=self.other_room, author=self.user, content='meter fault')
+        MessageSearchTerm.objects.all().delete()
+
+        self.assertEqual(search.rebuild_index(batch_size=1), 2)
+        self.assertEqual(search.search_messages('meter', [self.room.id, self.other_room.id]).count(), 2)
+
+
+class SearchApiTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='otieno', password='test123')
+        self.room = ChatRoom.objects.create(name='general', room_type='general')
+        self.client.force_login(self.user)
+
+    def test_text_search_returns_ranked_highlighted_results(self):
+        Message.objects.create(room=self.room, author=self.user, content='warranty')
+        best = Message.objects.create(room=self.room, author=self.user, content='<i>warranty</i> claim')
+
+        response = self.client.get(reverse('chat:api_search_messages'), {'q': 'warranty claim'})
+        data = response.json()
+        self.assertTrue(data['success'])
+        self.assertEqual(data['total'], 2)
+        self.assertEqual(data['results'][0]['id'], best.id)
+        self.assertEqual(
+            data['results'][0]['content_highlighted'],
+            '&lt;i&gt;<mark>warranty</mark>&lt;/i&gt; <mark>claim</mark>',
+        )
+
+    def test_thread_search_includes_replies(self):
+        root = Message.objects.create(room=self.room, author=self.user, content='roof survey')
+        Message.objects.create(room=self.room, author=self.user, content='done', reply_to=root)
+        Message.objects.create(room=self.room, author=self.user, content='unrelated')
+
+        data = self.client.get(reverse('chat:api_search_messages'), {'q': 'survey', 'type': 'threads'}).json()
+        self.assertTrue(data['success'])
+        self.assertEqual(data['total'], 2)
+        reply_counts = {result['id']: result['reply_count'] for result in data['results']}
+        self.assertEqual(reply_counts[root.id], 1)
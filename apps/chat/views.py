@@ -8,12 +8,16 @@ from django.contrib.auth.models import Group
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
-from django.db.models import Q, Count, Max
+from django.db.models import Q, Count, Max, OuterRef, Subquery
 from django.utils import timezone
-from datetime import datetime, timedelta
+from django.utils.html import escape
+from datetime import datetime
 
-from .models import ChatRoom, Message, MessageReadStatus, NotificationPreference, UserActivity, MessageReaction
+from .models import ChatRoom, Message, NotificationPreference, UserActivity, MessageReaction, RoomReadCursor
 from .forms import ChatRoomForm, MessageForm, RoomInvitationForm
+from . import presence, search
+from .access import accessible_room_ids, accessible_rooms, can_access_room
+from .read_state import mark_read, total_unread, unread_counts
 
 
 @login_required
@@ -21,45 +25,32 @@ def chat_dashboard(request):
     """Main chat dashboard showing available rooms and allowing navigation"""
 
     # Mark user as online
-    UserActivity.mark_user_online(request.user)
+    presence.touch(request.user)
 
-    # Get available rooms based on user permissions
+    # Get available rooms based on user permissions, with their latest message and unread count
     user = request.user
-    rooms = ChatRoom.objects.filter(is_active=True)
-
-    # Filter rooms based on user access
-    accessible_rooms = []
-
-    for room in rooms:
-        if room.room_type == 'private':
-            if room.participants.filter(id=user.id).exists():
-                accessible_rooms.append(room)
-        elif room.room_type == 'department':
-            # Check if user belongs to appropriate department groups
-            if user.groups.filter(name__icontains=room.name.lower()).exists() or user.is_staff:
-                accessible_rooms.append(room)
-        elif room.room_type == 'general':
-            # General rooms are accessible to all authenticated users
-            accessible_rooms.append(room)
-        elif room.room_type == 'project':
-            # Check project access
-            if user.groups.filter(name__in=['management', 'staff', room.name.lower()]).exists() or user.is_staff:
-                accessible_rooms.append(room)
-        else:
-            accessible_rooms.append(room)
+    accessible = list(
+        accessible_rooms(user).annotate(
+            last_message_id=Subquery(
+                Message.objects.filter(room=OuterRef('pk')).order_by('-timestamp', '-id').values('id')[:1]
+            ),
+        )
+    )
 
-    # Get recent activity for each room
-    for room in accessible_rooms:
-        last_message = Message.objects.filter(room=room).order_by('-timestamp').first()
-        room.last_message = last_message
-        room.unread_count = get_unread_count(user, room)
+    last_messages = Message.objects.select_related('author').in_bulk(
+        [room.last_message_id for room in accessible if room.last_message_id]
+    )
+    counts = unread_counts(user, [room.id for room in accessible])
+    for room in accessible:
+        room.last_message = last_messages.get(room.last_message_id)
+        room.unread_count = counts.get(room.id, 0)
 
     # Get online users (exclude current user)
     online_users = UserActivity.get_online_users().exclude(user=user).select_related('user')
     online_users_list = [activity.user for activity in online_users]
 
     context = {
-        'rooms': accessible_rooms,
+        'rooms': accessible,
         'online_users': online_users_list,
         'websocket_url': get_websocket_url(request),
         'form': ChatRoomForm(),
@@ -73,25 +64,13 @@ def chat_room(request, room_name):
     """Display specific chat room"""
 
     # Mark user as online
-    UserActivity.mark_user_online(request.user)
+    presence.touch(request.user)
 
     room = get_object_or_404(ChatRoom, name=room_name, is_active=True)
 
     # Check access permissions
     user = request.user
-    can_access = False
-
-    if room.room_type == 'private':
-        can_access = room.participants.filter(id=user.id).exists()
-    elif room.room_type == 'department':
-        can_access = user.groups.filter(name__icontains=room.name.lower()).exists() or user.is_staff
-    elif room.room_type == 'general':
-        # General rooms are accessible to all authenticated users
-        can_access = True
-    elif room.room_type == 'project':
-        can_access = user.groups.filter(name__in=['management', 'staff', room.name.lower()]).exists() or user.is_staff
-    else:
-        can_access = True
+    can_access = can_access_room(user, room)
 
     if not can_access:
         if request.method == 'POST' or request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -155,13 +134,6 @@ def chat_room(request, room_name):
                 file_name=file_attachment.name if file_attachment else None
             )
 
-            # Mark as read for sender
-            MessageReadStatus.objects.get_or_create(
-                message=message,
-                user=user,
-                defaults={'read_at': message.timestamp}
-            )
-
             return JsonResponse({
                 'success': True,
                 'message_id': message.id
@@ -176,13 +148,6 @@ def chat_room(request, room_name):
             message.file_name = message.file_attachment.name if message.file_attachment else None
             message.save()
 
-            # Mark as read for sender
-            MessageReadStatus.objects.get_or_create(
-                message=message,
-                user=user,
-                defaults={'read_at': message.timestamp}
-            )
-
             return redirect('chat:room', room_name=room_name)
     else:
         form = MessageForm()
@@ -192,35 +157,21 @@ def chat_room(request, room_name):
         room=room
     ).select_related('author').order_by('-timestamp')
 
-    # Mark messages as read (apply filters before slicing)
-    unread_messages = messages_qs.filter(
-        ~Q(author=user),
-    ).exclude(id__in=MessageReadStatus.objects.filter(user=user).values_list('message_id', flat=True))[:50]
-
-    # Apply read status to unread messages
-    for message in unread_messages:
-        MessageReadStatus.objects.get_or_create(
-            message=message,
-            user=user,
-            defaults={'read_at': message.timestamp}
-        )
-
-    # Get the recent messages for display (slice after filtering)
+    # Get the recent messages for display
     messages_for_display = messages_qs[:50]
     messages_list = list(reversed(messages_for_display))
 
+    # Everything up to the newest displayed message has now been read
+    if messages_list:
+        mark_read(user, room, max(message.id for message in messages_list))
+
     # Get online users in this room (include all users who have access and are online, including current user)
     online_activities = UserActivity.get_online_users().select_related('user')
 
     # For private rooms, only show participants; for other rooms, show all online users who have access
     if room.room_type == 'private':
-        online_users = [activity.user for activity in online_activities if room.participants.filter(id=activity.user.id).exists()]
-    elif room.room_type == 'department':
-        online_users = [activity.user for activity in online_activities if user.groups.filter(name__icontains=room.name.lower()).exists() or user.is_staff or activity.user.id == user.id]
-    elif room.room_type == 'general':
-        online_users = [activity.user for activity in online_activities]
-    elif room.room_type == 'project':
-        online_users = [activity.user for activity in online_activities if user.groups.filter(name__in=['management', 'staff', room.name.lower()]).exists() or user.is_staff or activity.user.id == user.id]
+        participant_ids = set(room.participants.values_list('id', flat=True))
+        online_users = [activity.user for activity in online_activities if activity.user_id in participant_ids]
     else:
         online_users = [activity.user for activity in online_activities]
 
@@ -334,24 +285,14 @@ def room_members(request, room_name):
 
     # Check access
     user = request.user
-    can_access = False
-    can_manage = False
+    can_access = can_access_room(user, room)
 
     if room.room_type == 'private':
-        can_access = room.participants.filter(id=user.id).exists()
         can_manage = can_access  # Private room members can manage membership
-    elif room.room_type == 'department':
-        can_access = user.groups.filter(name__icontains=room.name.lower()).exists() or user.is_staff
-        can_manage = user.is_staff  # Only staff can manage department room membership
-    elif room.room_type == 'general':
-        # General rooms are accessible to all authenticated users
-        can_access = True
-        can_manage = user.is_staff
     elif room.room_type == 'project':
-        can_access = user.groups.filter(name__in=['management', 'staff', room.name.lower()]).exists() or user.is_staff
         can_manage = user.groups.filter(name__in=['management', 'project-manager']).exists() or user.is_staff
     else:
-        can_access = True
+        # Only staff can manage department and general room membership
         can_manage = user.is_staff
 
     if not can_access:
@@ -475,11 +416,7 @@ def user_settings(request):
 def get_unread_count(user, room):
     """Get count of unread messages in a room for a user"""
 
-    return Message.objects.filter(
-        room=room
-    ).exclude(author=user).exclude(
-        id__in=MessageReadStatus.objects.filter(user=user).values_list('message_id', flat=True)
-    ).count()
+    return unread_counts(user, [room.id]).get(room.id, 0)
 
 
 def get_websocket_url(request):
@@ -504,18 +441,7 @@ def api_send_message(request, room_name):
     user = request.user
 
     # Check access permissions
-    can_access = False
-    if room.room_type == 'private':
-        can_access = room.participants.filter(id=user.id).exists()
-    elif room.room_type == 'department':
-        can_access = user.groups.filter(name__icontains=room.name.lower()).exists() or user.is_staff
-    elif room.room_type == 'general':
-        # General rooms are accessible to all authenticated users
-        can_access = True
-    elif room.room_type == 'project':
-        can_access = user.groups.filter(name__in=['management', 'staff', room.name.lower()]).exists() or user.is_staff
-    else:
-        can_access = True
+    can_access = can_access_room(user, room)
 
     if not can_access:
         return JsonResponse({'success': False, 'error': 'Access denied'})
@@ -584,13 +510,6 @@ def api_send_message(request, room_name):
         reply_to=reply_to
     )
 
-    # Mark as read for sender
-    MessageReadStatus.objects.get_or_create(
-        message=message,
-        user=user,
-        defaults={'read_at': message.timestamp}
-    )
-
     return JsonResponse({
         'success': True,
         'message_id': message.id,
@@ -609,18 +528,7 @@ def api_room_messages(request, room_name):
         user = request.user
 
         # Check access permissions
-        can_access = False
-        if room.room_type == 'private':
-            can_access = room.participants.filter(id=user.id).exists()
-        elif room.room_type == 'department':
-            can_access = user.groups.filter(name__icontains=room.name.lower()).exists() or user.is_staff
-        elif room.room_type == 'general':
-            # General rooms are accessible to all authenticated users
-            can_access = True
-        elif room.room_type == 'project':
-            can_access = user.groups.filter(name__in=['management', 'staff', room.name.lower()]).exists() or user.is_staff
-        else:
-            can_access = True
+        can_access = can_access_room(user, room)
 
         if not can_access:
             return JsonResponse({'success': False, 'error': 'Access denied'})
@@ -648,15 +556,10 @@ def api_room_messages(request, room_name):
 
             messages_qs = messages_qs.filter(id__gt=last_id_int).order_by('-timestamp')
 
-            # Mark messages as read - only get messages that exist
-            if messages_qs.exists():
-                unread_messages = messages_qs.exclude(author=user)
-                for message in unread_messages:
-                    MessageReadStatus.objects.get_or_create(
-                        message=message,
-                        user=user,
-                        defaults={'read_at': message.timestamp}
-                    )
+            # Mark messages as read
+            newest_id = messages_qs.aggregate(newest=Max('id'))['newest']
+            if newest_id:
+                mark_read(user, room, newest_id)
 
             # Get messages in chronological order
             messages_qs = messages_qs.order_by('timestamp')
@@ -696,13 +599,7 @@ def api_room_messages(request, room_name):
                 ).order_by('timestamp')
 
                 # Mark recent messages as read
-                recent_messages = Message.objects.filter(id__in=message_ids_list).exclude(author=user)
-                for message in recent_messages:
-                    MessageReadStatus.objects.get_or_create(
-                        message=message,
-                        user=user,
-                        defaults={'read_at': message.timestamp}
-                    )
+                mark_read(user, room, max(message_ids_list))
             else:
                 messages_qs = Message.objects.none()
 
@@ -822,7 +719,7 @@ def api_online_users(request):
     """API endpoint to get online users"""
 
     # Mark current user as online
-    UserActivity.mark_user_online(request.user)
+    presence.touch(request.user)
 
     # Get all online users (including current user for this endpoint)
     online_activities = UserActivity.get_online_users().select_related('user')
@@ -848,35 +745,13 @@ def api_unread_count(request):
     user = request.user
 
     # Get accessible rooms first, then filter messages
-    accessible_room_ids = []
-    rooms = ChatRoom.objects.filter(is_active=True)
-
-    for room in rooms:
-        can_access = False
-        if room.room_type == 'private':
-            can_access = room.participants.filter(id=user.id).exists()
-        elif room.room_type == 'department':
-            can_access = user.groups.filter(name__icontains=room.name.lower()).exists() or user.is_staff
-        elif room.room_type == 'general':
-            # General rooms are accessible to all authenticated users
-            can_access = True
-        elif room.room_type == 'project':
-            can_access = user.groups.filter(name__in=['management', 'staff', room.name.lower()]).exists() or user.is_staff
-        else:
-            can_access = True
+    room_ids = accessible_room_ids(user)
 
-        if can_access:
-            accessible_room_ids.append(room.id)
-
-    if not accessible_room_ids:
+    if not room_ids:
         return JsonResponse({'unread_count': 0})
 
     # Get unread count from accessible rooms
-    count = Message.objects.filter(
-        room_id__in=accessible_room_ids
-    ).exclude(author=user).exclude(
-        id__in=MessageReadStatus.objects.filter(user=user).values_list('message_id', flat=True)
-    ).count()
+    count = total_unread(user, room_ids)
 
     return JsonResponse({'unread_count': count})
 
@@ -898,35 +773,21 @@ def api_messages_global(request):
         last_id = 0
 
     # Get accessible rooms first, then filter messages
-    accessible_room_ids = []
-    rooms = ChatRoom.objects.filter(is_active=True)
-
-    for room in rooms:
-        can_access = False
-        if room.room_type == 'private':
-            can_access = room.participants.filter(id=user.id).exists()
-        elif room.room_type == 'department':
-            can_access = user.groups.filter(name__icontains=room.name.lower()).exists() or user.is_staff
-        elif room.room_type == 'general':
-            # General rooms are accessible to all authenticated users
-            can_access = True
-        elif room.room_type == 'project':
-            can_access = user.groups.filter(name__in=['management', 'staff', room.name.lower()]).exists() or user.is_staff
-        else:
-            can_access = True
+    room_ids = accessible_room_ids(user)
 
-        if can_access:
-            accessible_room_ids.append(room.id)
-
-    if not accessible_room_ids:
+    if not room_ids:
         return JsonResponse({'messages': [], 'unread_count': 0})
 
-    # Get new messages since last_id from accessible rooms
+    # Calculate unread count from accessible rooms (also creates any missing read cursors)
+    unread_count = total_unread(user, room_ids)
+
+    # Get new, unread messages since last_id from accessible rooms
+    read_up_to = RoomReadCursor.objects.filter(user=user, room=OuterRef('room')).values('last_read_message_id')[:1]
     messages = Message.objects.filter(
         id__gt=last_id,
-        room_id__in=accessible_room_ids
-    ).exclude(author=user).exclude(
-        id__in=MessageReadStatus.objects.filter(user=user).values_list('message_id', flat=True)
+        room_id__in=room_ids
+    ).exclude(author=user).filter(
+        id__gt=Subquery(read_up_to)
     ).select_related(
         'author', 'room'
     ).order_by('-timestamp')[:20]  # Limit to prevent overload
@@ -934,13 +795,6 @@ def api_messages_global(request):
     # Convert to chronological order for processing
     messages = list(reversed(messages))
 
-    # Calculate unread count from accessible rooms
-    unread_count = Message.objects.filter(
-        room_id__in=accessible_room_ids
-    ).exclude(author=user).exclude(
-        id__in=MessageReadStatus.objects.filter(user=user).values_list('message_id', flat=True)
-    ).count()
-
     message_data = []
     for msg in messages:
         message_data.append({
@@ -984,17 +838,7 @@ def api_toggle_reaction(request, message_id):
 
     # Check if user can access this message (room permissions)
     room = message.room
-    can_access = False
-    if room.room_type == 'private':
-        can_access = room.participants.filter(id=user.id).exists()
-    elif room.room_type == 'department':
-        can_access = user.groups.filter(name__icontains=room.name.lower()).exists() or user.is_staff
-    elif room.room_type == 'general':
-        can_access = True
-    elif room.room_type == 'project':
-        can_access = user.groups.filter(name__in=['management', 'staff', room.name.lower()]).exists() or user.is_staff
-    else:
-        can_access = True
+    can_access = can_access_room(user, room)
 
     if not can_access:
         return JsonResponse({'success': False, 'error': 'Access denied'})
@@ -1052,17 +896,7 @@ def api_message_reactions(request, message_id):
 
     # Check permissions
     room = message.room
-    can_access = False
-    if room.room_type == 'private':
-        can_access = room.participants.filter(id=user.id).exists()
-    elif room.room_type == 'department':
-        can_access = user.groups.filter(name__icontains=room.name.lower()).exists() or user.is_staff
-    elif room.room_type == 'general':
-        can_access = True
-    elif room.room_type == 'project':
-        can_access = user.groups.filter(name__in=['management', 'staff', room.name.lower()]).exists() or user.is_staff
-    else:
-        can_access = True
+    can_access = can_access_room(user, room)
 
     if not can_access:
         return JsonResponse({'success': False, 'error': 'Access denied'})
@@ -1094,40 +928,15 @@ def api_start_typing(request, room_name):
     user = request.user
 
     # Check access permissions
-    can_access = False
-    if room.room_type == 'private':
-        can_access = room.participants.filter(id=user.id).exists()
-    elif room.room_type == 'department':
-        can_access = user.groups.filter(name__icontains=room.name.lower()).exists() or user.is_staff
-    elif room.room_type == 'general':
-        can_access = True
-    elif room.room_type == 'project':
-        can_access = user.groups.filter(name__in=['management', 'staff', room.name.lower()]).exists() or user.is_staff
-    else:
-        can_access = True
+    can_access = can_access_room(user, room)
 
     if not can_access:
         return JsonResponse({'success': False, 'error': 'Access denied'})
 
-    # Update typing status
-    activity, created = UserActivity.objects.get_or_create(
-        user=user,
-        defaults={
-            'last_activity': timezone.now(),
-            'is_online': True,
-            'is_typing': True,
-            'typing_in_room': room,
-            'last_typing_update': timezone.now()
-        }
-    )
-
-    if not created:
-        activity.is_typing = True
-        activity.typing_in_room = room
-        activity.last_typing_update = timezone.now()
-        activity.is_online = True  # Also mark as online
-        activity.last_activity = timezone.now()
-        activity.save()
+    # Typing state lives in the presence registry; only changes are broadcast
+    presence.touch(user)
+    if presence.start_typing(user, room):
+        presence.broadcast_typing(room)
 
     return JsonResponse({'success': True})
 
@@ -1140,19 +949,11 @@ def api_stop_typing(request):
     user = request.user
 
     # Update typing status
-    try:
-        activity = user.chat_activity
-        activity.is_typing = False
-        activity.typing_in_room = None
-        activity.last_typing_update = timezone.now()
-        activity.save()
-    except UserActivity.DoesNotExist:
-        # Create activity record if it doesn't exist
-        UserActivity.objects.create(
-            user=user,
-            is_typing=False,
-            last_typing_update=timezone.now()
-        )
+    room_id = presence.stop_typing(user)
+    if room_id:
+        room = ChatRoom.objects.filter(pk=room_id).first()
+        if room:
+            presence.broadcast_typing(room)
 
     return JsonResponse({'success': True})
 
@@ -1165,36 +966,13 @@ def api_get_typing_users(request, room_name):
     user = request.user
 
     # Check access permissions
-    can_access = False
-    if room.room_type == 'private':
-        can_access = room.participants.filter(id=user.id).exists()
-    elif room.room_type == 'department':
-        can_access = user.groups.filter(name__icontains=room.name.lower()).exists() or user.is_staff
-    elif room.room_type == 'general':
-        can_access = True
-    elif room.room_type == 'project':
-        can_access = user.groups.filter(name__in=['management', 'staff', room.name.lower()]).exists() or user.is_staff
-    else:
-        can_access = True
+    can_access = can_access_room(user, room)
 
     if not can_access:
         return JsonResponse({'success': False, 'error': 'Access denied'})
 
-    # Get users typing in this room (within last 3 seconds, exclude current user)
-    three_seconds_ago = timezone.now() - timedelta(seconds=3)
-    typing_users = UserActivity.objects.filter(
-        is_typing=True,
-        typing_in_room=room,
-        last_typing_update__gte=three_seconds_ago
-    ).exclude(user=user).select_related('user')
-
-    typing_user_data = []
-    for activity in typing_users:
-        typing_user_data.append({
-            'id': activity.user.id,
-            'username': activity.user.username,
-            'full_name': f"{activity.user.first_name} {activity.user.last_name}".strip() or activity.user.username,
-        })
+    # Get users typing in this room (exclude current user)
+    typing_user_data = presence.typing_users(room.id, exclude_user_id=user.id)
 
     return JsonResponse({
         'success': True,
@@ -1225,26 +1003,9 @@ def api_search_messages(request):
             return JsonResponse({'success': False, 'error': 'Search query must be at least 2 characters'})
 
         # Get accessible rooms for the user
-        accessible_rooms = []
-        rooms = ChatRoom.objects.filter(is_active=True)
-
-        for room in rooms:
-            can_access = False
-            if room.room_type == 'private':
-                can_access = room.participants.filter(id=user.id).exists()
-            elif room.room_type == 'department':
-                can_access = user.groups.filter(name__icontains=room.name.lower()).exists() or user.is_staff
-            elif room.room_type == 'general':
-                can_access = True
-            elif room.room_type == 'project':
-                can_access = user.groups.filter(name__in=['management', 'staff', room.name.lower()]).exists() or user.is_staff
-            else:
-                can_access = True
-
-            if can_access:
-                accessible_rooms.append(room)
+        room_ids = accessible_room_ids(user)
 
-        if not accessible_rooms:
+        if not room_ids:
             return JsonResponse({
                 'success': True,
                 'results': [],
@@ -1253,21 +1014,18 @@ def api_search_messages(request):
             })
 
         # Base queryset
-        accessible_room_ids = [room.id for room in accessible_rooms]
 
         if search_type == 'mentions':
             # Search for @mentions
             message_qs = Message.objects.filter(
-                room_id__in=accessible_room_ids,
+                room_id__in=room_ids,
                 mentioned_users__username__icontains=query if query else ''
             ).distinct()
 
         elif search_type == 'threads':
             # Search within message threads
-            thread_root_qs = Message.objects.filter(
-                room_id__in=accessible_room_ids,
+            thread_root_qs = search.search_messages(query, room_ids).filter(
                 reply_to__isnull=True,  # Thread starters
-                content__icontains=query
             )
             message_qs = Message.objects.filter(
                 Q(id__in=thread_root_qs.values('id')) |  # Thread starters
@@ -1277,7 +1035,7 @@ def api_search_messages(request):
         elif search_type == 'files':
             # Search within file names and descriptions
             message_qs = Message.objects.filter(
-                room_id__in=accessible_room_ids,
+                room_id__in=room_ids,
                 file_attachment__isnull=False
             )
 
@@ -1293,13 +1051,8 @@ def api_search_messages(request):
             message_qs = message_qs.distinct()
 
         else:  # search_type == 'text'
-            # Standard text search
-            search_query = Q()
-            query_terms = query.split()
-            for term in query_terms:
-                search_query |= Q(content__icontains=term)
-
-            message_qs = Message.objects.filter(search_query, room_id__in=accessible_room_ids)
+            # Standard text search through the search index, best matches first
+            message_qs = search.search_messages(query, room_ids)
 
         # Apply room filter
         if room_filter:
@@ -1335,45 +1088,27 @@ def api_search_messages(request):
 
         # Apply pagination
         offset = (page - 1) * limit
-        message_qs = message_qs.select_related('author', 'room').prefetch_related('mentioned_users').order_by('-timestamp')[offset:offset + limit]
+        ordering = ('-search_rank', '-timestamp') if search_type == 'text' else ('-timestamp',)
+        message_qs = list(
+            message_qs.select_related('author', 'room').prefetch_related('mentioned_users')
+            .order_by(*ordering)[offset:offset + limit]
+        )
+        reply_counts = dict(
+            Message.objects.filter(reply_to__in=message_qs).values('reply_to')
+            .annotate(count=Count('id')).values_list('reply_to', 'count')
+        )
 
         # Format results
         results = []
         for message in message_qs:
-            # Highlight search terms in content (for text search)
-            highlighted_content = message.content
-            query_terms = query.split() if query else []
-
-            if search_type == 'text':
-                for term in query_terms:
-                    highlighted_content = highlighted_content.replace(
-                        f'<mark>{term}</mark>',
-                        f'<mark>{term}</mark>',  # Don't double-mark
-                        -1
-                    )
-                    # Simple case-insensitive highlighting
-                    import re
-                    highlighted_content = re.sub(
-                        rf'({re.escape(term)})',
-                        r'<mark>\1</mark>',
-                        highlighted_content,
-                        flags=re.IGNORECASE
-                    )
-            elif search_type == 'files':
-                # Highlight file name matches
-                if message.file_name:
-                    for term in query_terms:
-                        highlighted_content = re.sub(
-                            rf'({re.escape(term)})',
-                            r'<mark>\1</mark>',
-                            highlighted_content,
-                            flags=re.IGNORECASE
-                        )
+            # Highlighted snippet around the matched words (HTML-escaped)
+            if search_type in ('text', 'threads', 'files') and query:
+                highlighted_content = search.highlight(message.content, query)
+            else:
+                highlighted_content = escape(message.content)
 
             # Get mentioned users
-            mentioned_usernames = []
-            if hasattr(message, 'mentioned_users') and message.mentioned_users.exists():
-                mentioned_usernames = [u.username for u in message.mentioned_users.all()]
+            mentioned_usernames = [u.username for u in message.mentioned_users.all()]
 
             results.append({
                 'id': message.id,
@@ -1398,7 +1133,7 @@ def api_search_messages(request):
                 'mentioned_users': mentioned_usernames,
                 'is_thread_starter': message.reply_to is None,
                 'in_thread': message.reply_to is not None,
-                'reply_count': message.replies.count()
+                'reply_count': reply_counts.get(message.id, 0)
             })
 
         return JsonResponse({
@@ -11,7 +11,7 @@ from .models import (
     ContactMessage, Currency, AuditLog, NewsletterSubscriber,
     NewsletterCampaign, NewsletterSendLog, LegalDocument, CookieConsent,
     CookieCategory, CookieDetail, Testimonial, KenyanHoliday, HolidayOffer,
-    ServiceArea, VideoTutorial
+    ServiceArea, VideoTutorial, EmailOutbox, BackgroundJob
 )
 from .forms import (
     CompanySettingsForm, NewsletterCampaignForm, LegalDocumentForm,
@@ -717,6 +717,54 @@ class NewsletterSendLogAdmin(admin.ModelAdmin):
         return False
 
 
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'recipients', 'status', 'attempts', 'next_attempt_at', 'sent_at', 'created_at')
+    list_filter = ('status', 'template_name', 'created_at')
+    search_fields = ('subject', 'to', 'last_error')
+    readonly_fields = ('subject', 'body', 'html_body', 'from_email', 'to', 'attachments', 'template_name',
+                       'status', 'attempts', 'next_attempt_at', 'claimed_by', 'claimed_at', 'last_error',
+                       'sent_at', 'created_at')
+    actions = ['retry_now']
+
+    def recipients(self, obj):
+        return ', '.join(obj.to)
+    recipients.short_description = 'To'
+
+    def retry_now(self, request, queryset):
+        updated = queryset.exclude(status='sent').update(
+            status='pending', next_attempt_at=timezone.now(), attempts=0, claimed_by='', claimed_at=None
+        )
+        self.message_user(request, f'{updated} email(s) queued for another attempt.')
+    retry_now.short_description = 'Retry selected emails now'
+
+    def has_add_permission(self, request):
+        # Outbox entries are created by EmailService
+        return False
+
+
+@admin.register(BackgroundJob)
+class BackgroundJobAdmin(admin.ModelAdmin):
+    list_display = ('job_type', 'status', 'progress', 'attempts', 'created_by', 'created_at', 'finished_at')
+    list_filter = ('status', 'job_type', 'created_at')
+    search_fields = ('job_type', 'error', 'progress_message')
+    readonly_fields = ('job_type', 'params', 'status', 'progress', 'progress_message', 'result', 'result_file',
+                       'result_filename', 'error', 'attempts', 'max_attempts', 'run_after', 'claimed_by',
+                       'heartbeat_at', 'created_by', 'created_at', 'started_at', 'finished_at')
+    actions = ['requeue_jobs']
+
+    def requeue_jobs(self, request, queryset):
+        updated = queryset.filter(status='failed').update(
+            status='queued', run_after=timezone.now(), attempts=0, error='', progress=0
+        )
+        self.message_user(request, f'{updated} job(s) queued again.')
+    requeue_jobs.short_description = 'Run selected failed jobs again'
+
+    def has_add_permission(self, request):
+        # Jobs are created by the views that need them
+        return False
+
+
 @admin.register(LegalDocument)
 class LegalDocumentAdmin(admin.ModelAdmin):
     form = LegalDocumentForm
@@ -1017,25 +1065,19 @@ class ServiceAreaAdmin(admin.ModelAdmin):
     deactivate_areas.short_description = 'Deactivate selected areas'
 
     def update_coordinates(self, request, queryset):
-        """Re-geocode selected areas"""
-        from .geographic_utils import get_geographic_service
-
-        geo_service = get_geographic_service()
-        updated_count = 0
-
-        for area in queryset:
-            location_string = f"{area.name}, Kenya"
-            if area.county and area.county != area.name:
-                location_string = f"{area.name}, {area.county}, Kenya"
+        """Re-geocode selected areas in a background job"""
+        from .job_queue import enqueue_job
 
-            geo_result = geo_service.geocode_location(location_string)
-            if geo_result:
-                area.latitude = geo_result['latitude']
-                area.longitude = geo_result['longitude']
-                area.save(update_fields=['latitude', 'longitude'])
-                updated_count += 1
-
-        self.message_user(request, f'Updated coordinates for {updated_count} service areas.')
+        job = enqueue_job(
+            'core.geocode_service_areas',
+            {'area_ids': list(queryset.values_list('pk', flat=True)), 'force': True},
+            user=request.user,
+        )
+        self.message_user(
+            request,
+            format_html('Geocoding {} service areas in the background. <a href="{}">Track progress</a>.',
+                        queryset.count(), reverse('core:job_detail', args=[job.pk]))
+        )
     update_coordinates.short_description = 'Update coordinates for selected areas'
 
     def clear_contact_info(self, request, queryset):
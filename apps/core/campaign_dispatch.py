@@ -0,0 +1,350 @@
+"""
+Newsletter campaign dispatch engine.
+
+A campaign is sent in two steps. ``prepare()`` writes one pending
+NewsletterSendLog per target subscriber with bulk_create. ``run()`` then
+renders the newsletter templates once with placeholder tokens, fills the tokens
+in per recipient, and sends batches of pending logs over a small pool of SMTP
+connections that stay open for the whole campaign, recording each batch with
+bulk updates. Campaign content that does more with a recipient value than
+print it (a filter such as ``{{ subscriber.first_name|upper }}``, or a tag
+such as ``{% if subscriber.first_name %}``) would transform or test the token
+instead of the value, so such content is rendered once per recipient. Sending runs as a background job (see job_queue). Because
+progress lives in the send logs, a dispatcher that dies part way through is
+resumed by running it again (see the send_newsletter_campaigns command); only
+logs still pending are sent.
+"""
+
+import logging
+import re
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, Q
+from django.template import Context, Template
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.html import conditional_escape
+from django.utils.safestring import mark_safe
+
+from .email_outbox import RateLimiter, SMTPConnectionPool, build_message
+from .email_utils import EmailService
+from .models import NewsletterCampaign, NewsletterSendLog, NewsletterSubscriber
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = getattr(settings, 'NEWSLETTER_DISPATCH_BATCH_SIZE', 200)
+CONNECTIONS = getattr(settings, 'NEWSLETTER_DISPATCH_CONNECTIONS', 4)
+RATE_LIMIT = getattr(settings, 'NEWSLETTER_DISPATCH_RATE_LIMIT', 0)  # messages per second, 0 = unlimited
+# A campaign whose dispatcher has not reported progress for this long is resumable
+HEARTBEAT_TIMEOUT = getattr(settings, 'NEWSLETTER_DISPATCH_HEARTBEAT_TIMEOUT', 60 * 5)
+
+TOKEN = '%%olv:{}%%'
+TOKEN_RE = re.compile(r'%%olv:([\w.]+)%%')
+
+RECIPIENT_VARIABLE_RE = re.compile(r'\b(?:subscriber|unsubscribe_url|tracking_pixel_url|click_tracking_url)\w*')
+# Recipient values that the shared render can leave as tokens
+PLAIN_RECIPIENT_VARIABLE_RE = re.compile(
+    r'{{\s*(?:subscriber(?:\.(?:first_name|last_name|email|get_full_name))?|subscriber_name'
+    r'|unsubscribe_url|tracking_pixel_url|click_tracking_url)\s*}}'
+)
+TEMPLATE_TAG_RE = re.compile(r'{{.*?}}|{%.*?%}', re.S)
+
+
+def needs_recipient_render(content):
+    """Whether campaign ``content`` uses a recipient value in anything but a plain ``{{ variable }}``"""
+    return any(
+        RECIPIENT_VARIABLE_RE.search(tag) and not PLAIN_RECIPIENT_VARIABLE_RE.fullmatch(tag)
+        for tag in TEMPLATE_TAG_RE.findall(content)
+    )
+
+
+class _SubscriberTokens:
+    """Stands in for the subscriber while the shared template is rendered"""
+
+    first_name = TOKEN.format('subscriber.first_name')
+    last_name = TOKEN.format('subscriber.last_name')
+    email = TOKEN.format('subscriber.email')
+
+    def get_full_name(self):
+        return TOKEN.format('subscriber_name')
+
+    def __str__(self):
+        return TOKEN.format('subscriber_name')
+
+
+class CampaignDispatcher:
+    """Sends one newsletter campaign to its target subscribers"""
+
+    def __init__(self, campaign, batch_size=BATCH_SIZE, connections=CONNECTIONS, rate_limit=RATE_LIMIT):
+        self.campaign = campaign
+        self.batch_size = batch_size
+        self.pool = SMTPConnectionPool(connections)
+        self.limiter = RateLimiter(rate_limit)
+        self.site_url = getattr(settings, 'SITE_URL', 'https://olivian.co.ke')
+        self.from_email = EmailService.EMAILS['info']
+        self.per_recipient = needs_recipient_render(campaign.content)
+        self._content_template = None
+
+    # Preparation
+
+    def prepare(self):
+        """Create pending send logs for every target subscriber and mark the campaign sending"""
+        campaign = self.campaign
+        logged = campaign.send_logs.values('subscriber_id')
+        subscribers = campaign.get_target_subscribers().exclude(pk__in=logged).values_list('pk', 'email')
+
+        created = 0
+        batch = []
+        for subscriber_id, email in subscribers.iterator(chunk_size=2000):
+            batch.append(NewsletterSendLog(
+                campaign=campaign, subscriber_id=subscriber_id, email_address=email,
+                delivery_status='pending', status='pending',
+            ))
+            if len(batch) >= 1000:
+                created += len(NewsletterSendLog.objects.bulk_create(batch, ignore_conflicts=True))
+                batch = []
+        if batch:
+            created += len(NewsletterSendLog.objects.bulk_create(batch, ignore_conflicts=True))
+
+        campaign.status = 'sending'
+        campaign.total_recipients = campaign.send_logs.count()
+        NewsletterCampaign.objects.filter(pk=campaign.pk).update(
+            status=campaign.status, total_recipients=campaign.total_recipients
+        )
+        return created
+
+    def claim(self):
+        """Take ownership of the campaign unless another dispatcher is active"""
+        now = timezone.now()
+        stale = now - timedelta(seconds=HEARTBEAT_TIMEOUT)
+        return bool(NewsletterCampaign.objects.filter(
+            Q(dispatch_heartbeat__isnull=True) | Q(dispatch_heartbeat__lt=stale),
+            pk=self.campaign.pk, status='sending',
+        ).update(dispatch_heartbeat=now))
+
+    # Rendering
+
+    def _context(self, subscriber, values):
+        context = {
+            'campaign': self.campaign,
+            'subscriber': subscriber,
+            'subscriber_name': values['subscriber_name'],
+            'unsubscribe_url': values['unsubscribe_url'],
+            'tracking_pixel_url': values['tracking_pixel_url'],
+            'click_tracking_url': values['click_tracking_url'],
+        }
+        context.update(self.company_context)
+        return context
+
+    def render_content(self, subscriber, values):
+        """Render the campaign content as a template to enable personalization variables"""
+        try:
+            if self._content_template is None:
+                self._content_template = Template(self.campaign.content)
+            return self._content_template.render(Context(self._context(subscriber, values)))
+        except Exception as e:
+            logger.warning(f"Failed to render campaign content as template: {str(e)}")
+            return mark_safe(self.campaign.content)
+
+    def render_shared(self):
+        """Render the newsletter once; per-recipient values are left as tokens"""
+        campaign = self.campaign
+        self.company_context = EmailService.get_company_context()
+        tokens = {name: TOKEN.format(name) for name in (
+            'subscriber_name', 'unsubscribe_url', 'tracking_pixel_url', 'click_tracking_url',
+        )}
+        context = self._context(_SubscriberTokens(), tokens)
+        if self.per_recipient:
+            context['rendered_content'] = TOKEN.format('rendered_content')
+        else:
+            context['rendered_content'] = self.render_content(_SubscriberTokens(), tokens)
+
+        try:
+            html_content = render_to_string(f'emails/newsletter_{campaign.template_type}.html', context)
+            text_content = render_to_string(f'emails/newsletter_{campaign.template_type}.txt', context)
+        except Exception as e:
+            logger.warning(f"Template newsletter_{campaign.template_type} not found, using default: {str(e)}")
+            html_content = render_to_string('emails/newsletter_default.html', context)
+            text_content = render_to_string('emails/newsletter_default.txt', context)
+        return html_content, text_content
+
+    def recipient_values(self, log):
+        """Per-recipient token values for a send log row"""
+        subscriber_name = f"{log['first_name']} {log['last_name']}".strip() or log['email']
+        token = self._unsubscribe_token(log)
+        return {
+            'subscriber_name': subscriber_name,
+            'subscriber.first_name': log['first_name'],
+            'subscriber.last_name': log['last_name'],
+            'subscriber.email': log['email'],
+            'unsubscribe_url': self.site_url + reverse(
+                'core:unsubscribe', kwargs={'token': token, 'subscriber_id': log['subscriber_id']}
+            ),
+            'tracking_pixel_url': self.site_url + reverse('core:track_open', kwargs={'log_id': log['id']}),
+            'click_tracking_url': self.site_url + reverse('core:track_click', kwargs={'log_id': log['id']}),
+        }
+
+    @staticmethod
+    def _unsubscribe_token(log):
+        # Same token as NewsletterSubscriber.get_unsubscribe_token, without loading the row
+        return NewsletterSubscriber(id=log['subscriber_id'], email=log['email']).get_unsubscribe_token()
+
+    def recipient_content(self, log, values):
+        """The campaign content rendered for one recipient (see needs_recipient_render)"""
+        subscriber = NewsletterSubscriber(
+            id=log['subscriber_id'], email=log['email'], first_name=log['first_name'], last_name=log['last_name'],
+        )
+        return self.render_content(subscriber, values)
+
+    @staticmethod
+    def personalize(content, values, html=False):
+        def substitute(match):
+            value = values.get(match.group(1), '')
+            # Rendered content is already escaped (marked safe)
+            return conditional_escape(value) if html else value
+        return TOKEN_RE.sub(substitute, content)
+
+    # Sending
+
+    def pending_logs(self):
+        return (NewsletterSendLog.objects
+                .filter(campaign=self.campaign, delivery_status='pending')
+                .order_by('pk')
+                .values('id', 'subscriber_id', 'subscriber__first_name', 'subscriber__last_name',
+                        'email_address')[:self.batch_size])
+
+    def run(self, on_progress=None):
+        """Send every pending log of the campaign; returns (sent, failed) for this run.
+
+        ``on_progress(totals)`` is called with the progress() counts after each batch.
+        """
+        html_content, text_content = self.render_shared()
+        sent_total = failed_total = 0
+        try:
+            while True:
+                logs = [{
+                    'id': row['id'], 'subscriber_id': row['subscriber_id'],
+                    'first_name': row['subscriber__first_name'] or '',
+                    'last_name': row['subscriber__last_name'] or '',
+                    'email': row['email_address'],
+                } for row in self.pending_logs()]
+                if not logs:
+                    break
+
+                messages = []
+                for log in logs:
+                    values = self.recipient_values(log)
+                    if self.per_recipient:
+                        values['rendered_content'] = self.recipient_content(log, values)
+                    messages.append((log['id'], build_message(
+                        self.campaign.subject,
+                        self.personalize(text_content, values),
+                        [log['email']],
+                        self.from_email,
+                        self.personalize(html_content, values, html=True),
+                    )))
+
+                errors = self._send_batch(messages)
+                totals = self._record_batch([log['id'] for log in logs], errors)
+                if on_progress:
+                    on_progress(totals)
+                sent_total += len(logs) - len(errors)
+                failed_total += len(errors)
+        finally:
+            self.pool.close()
+
+        self.finish()
+        return sent_total, failed_total
+
+    def _send_batch(self, messages):
+        errors = {}
+        threads = [
+            threading.Thread(target=self._send_slot, args=(slot, messages[slot::self.pool.size], errors))
+            for slot in range(min(self.pool.size, len(messages)))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors
+
+    def _send_slot(self, slot, messages, errors):
+        for log_id, message in messages:
+            self.limiter.wait()
+            try:
+                self.pool.send(slot, message)
+            except Exception as e:
+                errors[log_id] = f'Send error: {str(e) or e.__class__.__name__}'
+
+    def _record_batch(self, log_ids, errors):
+        now = timezone.now()
+        sent_ids = [pk for pk in log_ids if pk not in errors]
+        if sent_ids:
+            NewsletterSendLog.objects.filter(pk__in=sent_ids).update(
+                delivery_status='sent', status='sent', sent_at=now, error_message=None
+            )
+        if errors:
+            failed = [NewsletterSendLog(pk=pk, delivery_status='failed', status='failed', error_message=error)
+                      for pk, error in errors.items()]
+            NewsletterSendLog.objects.bulk_update(failed, ['delivery_status', 'status', 'error_message'])
+            logger.error(f"Campaign {self.campaign.pk}: {len(errors)} sends failed in batch")
+
+        totals = self.progress()
+        NewsletterCampaign.objects.filter(pk=self.campaign.pk).update(
+            total_sent=totals['sent'], total_failed=totals['failed'], dispatch_heartbeat=now
+        )
+        return totals
+
+    def progress(self):
+        """Counts of send logs by delivery status"""
+        return self.campaign.send_logs.aggregate(
+            total=Count('pk'),
+            sent=Count('pk', filter=Q(delivery_status='sent')),
+            failed=Count('pk', filter=Q(delivery_status='failed')),
+            pending=Count('pk', filter=Q(delivery_status='pending')),
+        )
+
+    def finish(self):
+        totals = self.progress()
+        if totals['pending']:
+            return
+        campaign = self.campaign
+        campaign.status = 'sent'
+        campaign.sent_at = timezone.now()
+        campaign.total_recipients = totals['total']
+        campaign.total_sent = totals['sent']
+        campaign.total_failed = totals['failed']
+        campaign.dispatch_heartbeat = None
+        campaign.save(update_fields=['status', 'sent_at', 'total_recipients', 'total_sent',
+                                     'total_failed', 'dispatch_heartbeat'])
+        logger.info(f"Campaign {campaign.pk} finished: {totals['sent']} sent, {totals['failed']} failed")
+
+
+def dispatch_campaign(campaign_id, on_progress=None):
+    """Claim and send a campaign that is in the 'sending' state"""
+    campaign = NewsletterCampaign.objects.get(pk=campaign_id)
+    dispatcher = CampaignDispatcher(campaign)
+    if not dispatcher.claim():
+        logger.info(f"Campaign {campaign_id} is already being dispatched")
+        return None
+    return dispatcher.run(on_progress=on_progress)
+
+
+def start_campaign(campaign, background=None, user=None):
+    """Prepare the send logs and start sending outside the request.
+
+    Sending runs as a 'core.send_newsletter_campaign' background job; if the
+    worker dies, the send_newsletter_campaigns command resumes the campaign.
+    """
+    dispatcher = CampaignDispatcher(campaign)
+    dispatcher.prepare()
+    if background is None:
+        background = getattr(settings, 'NEWSLETTER_DISPATCH_IN_BACKGROUND', True)
+    if background:
+        from .job_queue import enqueue_job
+        enqueue_job('core.send_newsletter_campaign', {'campaign_id': campaign.pk}, user=user, unique=True)
+        return None
+    return dispatch_campaign(campaign.pk)
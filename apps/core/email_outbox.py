@@ -0,0 +1,266 @@
+"""
+Persistent outbound email queue.
+
+EmailService writes messages to the EmailOutbox table instead of talking to the
+mail server inside the request. The process_email_outbox command drains the
+table: it claims a batch of due rows, builds the messages (rendering quotation
+and receipt PDFs at this point rather than in the request), sends them over a small pool of
+SMTP connections that stay open between batches, and records the outcome with
+bulk updates. Failed messages are retried with exponential backoff.
+"""
+
+import logging
+import smtplib
+import threading
+import time
+import uuid
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import EmailOutbox
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = getattr(settings, 'EMAIL_OUTBOX_BATCH_SIZE', 100)
+CONNECTIONS = getattr(settings, 'EMAIL_OUTBOX_CONNECTIONS', 2)
+RATE_LIMIT = getattr(settings, 'EMAIL_OUTBOX_RATE_LIMIT', 5)  # messages per second, 0 = unlimited
+MAX_ATTEMPTS = getattr(settings, 'EMAIL_OUTBOX_MAX_ATTEMPTS', 6)
+BACKOFF_BASE = getattr(settings, 'EMAIL_OUTBOX_BACKOFF_BASE', 60)  # seconds
+BACKOFF_MAX = getattr(settings, 'EMAIL_OUTBOX_BACKOFF_MAX', 60 * 60 * 6)
+# A row stuck in 'sending' longer than this belonged to a worker that died
+CLAIM_TIMEOUT = getattr(settings, 'EMAIL_OUTBOX_CLAIM_TIMEOUT', 60 * 15)
+
+
+def outbox_enabled():
+    """Whether EmailService queues mail (True) or sends it inline (False)"""
+    return getattr(settings, 'EMAIL_OUTBOX_ENABLED', True)
+
+
+def enqueue_email(subject, body, to, from_email, html_body='', attachments=None, template_name=''):
+    """Store a message in the outbox; it is delivered once the transaction commits"""
+    if isinstance(to, str):
+        to = [to]
+    return EmailOutbox.objects.create(
+        subject=subject,
+        body=body,
+        html_body=html_body or '',
+        from_email=from_email,
+        to=[address for address in to if address],
+        attachments=attachments or [],
+        template_name=template_name,
+    )
+
+
+def resolve_attachment(spec):
+    """Turn an attachment spec into (filename, content, mimetype)"""
+    if spec.get('path'):
+        path = Path(spec['path'])
+        return spec.get('filename') or path.name, path.read_bytes(), spec.get('mimetype', 'application/pdf')
+
+    if spec.get('quotation_id'):
+        from apps.quotations.models import Quotation
+        from apps.quotations.views import QuotationPDFView
+        quotation = Quotation.objects.get(pk=spec['quotation_id'])
+        content = QuotationPDFView().generate_quotation_pdf(quotation, return_response=False)
+        return f'Quotation-{quotation.quotation_number}.pdf', content, 'application/pdf'
+
+    if spec.get('receipt_id'):
+        from apps.ecommerce.models import Receipt
+        receipt = Receipt.objects.get(pk=spec['receipt_id'])
+        path = Path(receipt.generate_receipt_pdf())
+        return f'receipt_{receipt.receipt_number}.pdf', path.read_bytes(), 'application/pdf'
+
+    raise ValueError(f'Unknown attachment spec: {spec}')
+
+
+def build_message(subject, body, to, from_email, html_body='', attachments=(), connection=None):
+    """Build an EmailMultiAlternatives; attachments that cannot be resolved are skipped"""
+    email = EmailMultiAlternatives(
+        subject=subject,
+        body=body,
+        from_email=from_email,
+        to=to,
+        connection=connection,
+    )
+    if html_body:
+        email.attach_alternative(html_body, 'text/html')
+    for spec in attachments:
+        try:
+            email.attach(*resolve_attachment(spec))
+        except Exception as e:
+            # Same behaviour as the inline path: send without the attachment
+            logger.error(f"Failed to attach {spec} to email '{subject}': {str(e)}")
+    return email
+
+
+def retry_delay(attempts):
+    """Seconds to wait before the next attempt after ``attempts`` failures"""
+    return min(BACKOFF_BASE * (2 ** max(attempts - 1, 0)), BACKOFF_MAX)
+
+
+class RateLimiter:
+    """Token bucket shared by the sender threads"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def wait(self):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + 1.0 / self.rate
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class SMTPConnectionPool:
+    """A fixed set of mail backend connections kept open across batches"""
+
+    def __init__(self, size):
+        self.size = max(1, size)
+        self._connections = [None] * self.size
+
+    def get(self, slot):
+        connection = self._connections[slot]
+        if connection is None:
+            connection = get_connection(fail_silently=False)
+            connection.open()
+            self._connections[slot] = connection
+        return connection
+
+    def reset(self, slot):
+        connection = self._connections[slot]
+        self._connections[slot] = None
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def send(self, slot, message):
+        """Send one message over the connection in ``slot``"""
+        connection = self.get(slot)
+        try:
+            connection.send_messages([message])
+        except smtplib.SMTPServerDisconnected:
+            # The server dropped an idle pooled connection; reconnect once
+            self.reset(slot)
+            self.get(slot).send_messages([message])
+        except (smtplib.SMTPException, OSError):
+            self.reset(slot)
+            raise
+
+    def close(self):
+        for slot in range(self.size):
+            self.reset(slot)
+
+
+class OutboxWorker:
+    """Drains the EmailOutbox table"""
+
+    def __init__(self, batch_size=BATCH_SIZE, connections=CONNECTIONS, rate_limit=RATE_LIMIT,
+                 max_attempts=MAX_ATTEMPTS):
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.pool = SMTPConnectionPool(connections)
+        self.limiter = RateLimiter(rate_limit)
+
+    def claim(self):
+        """Mark a batch of due messages as ours and return them"""
+        now = timezone.now()
+        due = (Q(status='pending', next_attempt_at__lte=now) |
+               Q(status='sending', claimed_at__lt=now - timedelta(seconds=CLAIM_TIMEOUT)))
+        ids = list(EmailOutbox.objects.filter(due).values_list('pk', flat=True)[:self.batch_size])
+        if not ids:
+            return []
+
+        token = uuid.uuid4().hex
+        # The status filter is repeated so a row claimed by a concurrent worker
+        # between the SELECT and this UPDATE is left alone
+        EmailOutbox.objects.filter(due, pk__in=ids).update(status='sending', claimed_by=token, claimed_at=now)
+        return list(EmailOutbox.objects.filter(claimed_by=token, status='sending'))
+
+    def run_once(self):
+        """Send one batch; returns (sent, failed) counts"""
+        entries = self.claim()
+        if not entries:
+            return 0, 0
+
+        messages = [
+            (entry, build_message(entry.subject, entry.body, entry.to, entry.from_email,
+                                  entry.html_body, entry.attachments))
+            for entry in entries
+        ]
+
+        errors = {}
+        threads = [
+            threading.Thread(target=self._send_slot, args=(slot, messages[slot::self.pool.size], errors))
+            for slot in range(min(self.pool.size, len(messages)))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self._record(entries, errors)
+        return len(entries) - len(errors), len(errors)
+
+    def _send_slot(self, slot, messages, errors):
+        for entry, message in messages:
+            self.limiter.wait()
+            try:
+                self.pool.send(slot, message)
+            except Exception as e:
+                errors[entry.pk] = str(e) or e.__class__.__name__
+
+    def _record(self, entries, errors):
+        now = timezone.now()
+        sent_ids = [entry.pk for entry in entries if entry.pk not in errors]
+        if sent_ids:
+            EmailOutbox.objects.filter(pk__in=sent_ids).update(
+                status='sent', sent_at=now, attempts=F('attempts') + 1,
+                last_error='', claimed_by='', claimed_at=None,
+            )
+
+        failed = []
+        for entry in entries:
+            if entry.pk not in errors:
+                continue
+            entry.attempts += 1
+            entry.last_error = errors[entry.pk]
+            entry.claimed_by = ''
+            entry.claimed_at = None
+            if entry.attempts >= self.max_attempts:
+                entry.status = 'failed'
+                logger.error(f"Giving up on email {entry.pk} to {entry.to}: {entry.last_error}")
+            else:
+                entry.status = 'pending'
+                entry.next_attempt_at = now + timedelta(seconds=retry_delay(entry.attempts))
+                logger.warning(f"Email {entry.pk} to {entry.to} failed (attempt {entry.attempts}): {entry.last_error}")
+            failed.append(entry)
+        if failed:
+            EmailOutbox.objects.bulk_update(
+                failed, ['status', 'attempts', 'last_error', 'next_attempt_at', 'claimed_by', 'claimed_at']
+            )
+
+    def drain(self):
+        """Send batches until nothing is due; returns (sent, failed) totals"""
+        sent = failed = 0
+        while True:
+            batch_sent, batch_failed = self.run_once()
+            if not batch_sent and not batch_failed:
+                return sent, failed
+            sent += batch_sent
+            failed += batch_failed
+
+    def close(self):
+        self.pool.close()
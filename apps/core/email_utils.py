@@ -3,12 +3,13 @@ Email utilities for Olivian Group system
 Handles all email notifications for user interactions
 """
 
-from django.core.mail import send_mail, EmailMultiAlternatives
+from django.core.mail import send_mail
 from django.template.loader import render_to_string
 from django.conf import settings
 from django.utils.html import strip_tags
 from django.utils import timezone
 from apps.core.models import CompanySettings
+from apps.core.email_outbox import build_message, enqueue_email, outbox_enabled
 import logging
 
 logger = logging.getLogger(__name__)
@@ -60,14 +61,35 @@ class EmailService:
                 'logo_url': None,
             }
     
+    @classmethod
+    def queue_email(cls, subject, text_content, recipient_email, from_email=None,
+                    html_content='', attachments=None, template_name='', sync=False):
+        """Queue an email in the outbox, or send it now when ``sync`` is set.
+
+        ``attachments`` are specs resolved when the message is built, e.g.
+        ``{'path': '/path/file.pdf'}`` or ``{'quotation_id': 12}``, so PDFs
+        are rendered by the outbox worker rather than in the request.
+        """
+        if not from_email:
+            from_email = cls.EMAILS['noreply']
+        recipients = [recipient_email] if isinstance(recipient_email, str) else list(recipient_email)
+
+        if not sync and outbox_enabled():
+            enqueue_email(subject, text_content, recipients, from_email, html_content,
+                          attachments, template_name)
+            logger.info(f"Email queued for {recipient_email}: {subject}")
+            return True
+
+        email = build_message(subject, text_content, recipients, from_email, html_content, attachments or [])
+        email.send()
+        logger.info(f"Email sent successfully to {recipient_email}")
+        return True
+
     @classmethod
     def send_email_notification(cls, template_name, context, recipient_email, 
-                              subject, from_email=None):
-        """Send HTML email notification"""
+                              subject, from_email=None, sync=False):
+        """Queue (or with ``sync=True`` send) an HTML email notification"""
         try:
-            if not from_email:
-                from_email = cls.EMAILS['noreply']
-            
             # Add company context
             context.update(cls.get_company_context())
             
@@ -81,19 +103,8 @@ class EmailService:
             # Debug: log email content length
             logger.info(f"Email content length: HTML={len(html_content)}, Text={len(text_content)}")
             
-            # Create email
-            email = EmailMultiAlternatives(
-                subject=subject,
-                body=text_content,
-                from_email=from_email,
-                to=[recipient_email] if isinstance(recipient_email, str) else recipient_email
-            )
-            email.attach_alternative(html_content, "text/html")
-            
-            # Send email
-            email.send()
-            logger.info(f"Email sent successfully to {recipient_email}")
-            return True
+            return cls.queue_email(subject, text_content, recipient_email, from_email,
+                                   html_content, template_name=template_name, sync=sync)
             
         except Exception as e:
             logger.error(f"Failed to send email to {recipient_email}: {str(e)}")
@@ -103,12 +114,10 @@ class EmailService:
     
     @classmethod
     def send_email_with_pdf_attachment(cls, template_name, context, recipient_email,
-                                     subject, from_email=None, quotation=None, file_path=None):
-        """Send HTML email notification with PDF attachment"""
+                                     subject, from_email=None, quotation=None, file_path=None, sync=False,
+                                     receipt=None):
+        """Queue (or with ``sync=True`` send) an HTML email with a PDF attachment"""
         try:
-            if not from_email:
-                from_email = cls.EMAILS['noreply']
-
             # Add company context
             context.update(cls.get_company_context())
 
@@ -116,71 +125,19 @@ class EmailService:
             html_content = render_to_string(f'emails/{template_name}.html', context)
             text_content = strip_tags(html_content)
 
-            # Create email
-            email = EmailMultiAlternatives(
-                subject=subject,
-                body=text_content,
-                from_email=from_email,
-                to=[recipient_email] if isinstance(recipient_email, str) else recipient_email
-            )
-            email.attach_alternative(html_content, "text/html")
-
             # Attach PDF - check for file_path first, then quotation
-            attachment_added = False
+            attachments = []
             if file_path:
-                try:
-                    # Read the file and attach it
-                    with open(file_path, 'rb') as pdf_file:
-                        pdf_content = pdf_file.read()
-
-                    logger.info(f"PDF loaded from file {file_path}, content size: {len(pdf_content)} bytes")
-
-                    # Extract filename from path
-                    filename = file_path.split('/')[-1] if '/' in file_path else file_path.split('\\')[-1]
-
-                    # Attach PDF
-                    email.attach(
-                        filename,
-                        pdf_content,
-                        'application/pdf'
-                    )
-                    logger.info(f"PDF attached to email: {filename}")
-                    attachment_added = True
-
-                except Exception as pdf_error:
-                    logger.error(f"Failed to attach PDF from file {file_path}: {str(pdf_error)}")
-                    import traceback
-                    logger.error(f"PDF attachment traceback: {traceback.format_exc()}")
-                    # Continue sending email without PDF attachment
-
+                attachments.append({'path': str(file_path)})
             elif quotation:
-                try:
-                    logger.info(f"Starting PDF generation for quotation {quotation.quotation_number}")
-                    from apps.quotations.views import QuotationPDFView
-                    pdf_view = QuotationPDFView()
-                    pdf_content = pdf_view.generate_quotation_pdf(quotation, return_response=False)
-
-                    logger.info(f"PDF generated successfully, content size: {len(pdf_content)} bytes")
-
-                    # Attach PDF
-                    email.attach(
-                        f'Quotation-{quotation.quotation_number}.pdf',
-                        pdf_content,
-                        'application/pdf'
-                    )
-                    logger.info(f"PDF attached to email for quotation {quotation.quotation_number}")
-                    attachment_added = True
-
-                except Exception as pdf_error:
-                    logger.error(f"Failed to attach PDF for quotation {quotation.quotation_number}: {str(pdf_error)}")
-                    import traceback
-                    logger.error(f"PDF generation traceback: {traceback.format_exc()}")
-                    # Continue sending email without PDF attachment
-
-            # Send email
-            email.send()
-            logger.info(f"Email with attachment sent successfully to {recipient_email}")
-            return True
+                # The quotation PDF is rendered when the message is built
+                attachments.append({'quotation_id': quotation.pk})
+            elif receipt:
+                # Likewise the receipt PDF, if it has not been generated yet
+                attachments.append({'receipt_id': receipt.pk})
+
+            return cls.queue_email(subject, text_content, recipient_email, from_email,
+                                   html_content, attachments, template_name, sync=sync)
 
         except Exception as e:
             logger.error(f"Failed to send email with attachment to {recipient_email}: {str(e)}")
@@ -334,19 +291,14 @@ class EmailService:
             'customer_name': receipt.order.customer.name,
         }
 
-        # Ensure PDF is generated
-        if not receipt.receipt_file:
-            receipt.generate_receipt_pdf()
-
-        # Send email with PDF attachment
+        # Send email with PDF attachment (generated when the message is built)
         email = cls.send_email_with_pdf_attachment(
             'receipt',
             context,
             receipt.order.customer.email,
             f'Receipt #{receipt.receipt_number} - Olivian Group',
             cls.EMAILS['sales'],
-            None,  # No quotation, but method expects parameter
-            receipt.receipt_file.path if receipt.receipt_file else None
+            receipt=receipt
         )
 
         # Update receipt email tracking
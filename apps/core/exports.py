@@ -0,0 +1,257 @@
+"""
+Streaming CSV/XLSX export engine.
+
+An export is described once by an ExportSpec: the columns (header, the
+``values_list`` fields they read, an optional formatter) and how to build the
+filtered queryset from request params. Rows are read with a single
+``values_list(...).iterator(chunk_size=...)`` query, so related fields cost a
+join instead of a query per row and memory stays flat however many rows there
+are. CSV is streamed straight to the client. XLSX uses openpyxl's write-only
+mode, which spools rows to a temporary file instead of building the workbook in
+memory. Exports larger than EXPORT_BACKGROUND_THRESHOLD rows are written by a
+'core.export' background job (see job_queue) and downloaded from the job page.
+
+Specs live in each app's ``exports.py`` and are registered by name:
+
+    @register_export
+    class CategoryExport(ExportSpec):
+        name = 'blog.categories'
+        filename = 'blog_categories'
+        columns = [
+            Column('Name', 'name'),
+            Column('Posts Count', 'posts_count'),
+        ]
+
+        def get_queryset(self, params, user=None):
+            return Category.objects.annotate(posts_count=Count('post'))
+"""
+
+import csv
+import logging
+import tempfile
+from datetime import datetime
+
+from django.conf import settings
+from django.contrib import messages
+from django.http import FileResponse, StreamingHttpResponse
+from django.shortcuts import redirect
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+# Exports with more rows than this are handed to a background job (0 disables the handoff)
+BACKGROUND_THRESHOLD = getattr(settings, 'EXPORT_BACKGROUND_THRESHOLD', 20000)
+
+CSV_CONTENT_TYPE = 'text/csv'
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+FORMATS = {'csv': 'csv', 'excel': 'xlsx', 'xlsx': 'xlsx'}
+
+_specs = {}
+
+
+class UnknownExport(Exception):
+    """Raised when looking up an export spec that is not registered"""
+
+
+# Column formatters
+
+def choice_label(choices):
+    """Formatter showing the display label of a choices field"""
+    labels = dict(choices)
+    return lambda value: labels.get(value, value or '')
+
+
+def date_format(fmt='%Y-%m-%d'):
+    """Formatter for date/datetime fields; blank when empty"""
+    return lambda value: value.strftime(fmt) if value else ''
+
+
+def blank_if_none(value):
+    return '' if value is None else value
+
+
+class Column:
+    """One export column: a header, the values_list fields it reads and an optional formatter.
+
+    The formatter is called with one argument per field; without one the
+    column shows its single field as is.
+    """
+
+    def __init__(self, header, *fields, format=None):
+        self.header = header
+        self.fields = fields
+        self.format = format
+
+    def value(self, values):
+        if self.format:
+            return self.format(*values)
+        return values[0]
+
+
+class ExportSpec:
+    """Declarative description of a tabular export"""
+
+    name = None
+    filename = 'export'
+    sheet_title = 'Export'
+    columns = ()
+    chunk_size = CHUNK_SIZE
+
+    def get_queryset(self, params, user=None):
+        raise NotImplementedError
+
+    def get_filename(self, fmt):
+        return f'{self.filename}.{FORMATS.get(fmt, fmt)}'
+
+    def headers(self):
+        return [column.header for column in self.columns]
+
+    def fields(self):
+        fields = []
+        for column in self.columns:
+            fields.extend(field for field in column.fields if field not in fields)
+        return fields
+
+    def rows(self, queryset, header=True):
+        """Header row followed by one formatted row per record, read in chunks"""
+        fields = self.fields()
+        positions = [[fields.index(field) for field in column.fields] for column in self.columns]
+        if header:
+            yield self.headers()
+        for values in queryset.values_list(*fields).iterator(chunk_size=self.chunk_size):
+            yield [column.value([values[i] for i in position])
+                   for column, position in zip(self.columns, positions)]
+
+    def response(self, queryset, fmt):
+        if FORMATS.get(fmt) == 'xlsx':
+            return workbook_response([(self.sheet_title, self.rows(queryset))], self.get_filename(fmt))
+        return csv_response(self.rows(queryset), self.get_filename(fmt))
+
+
+def register_export(spec_class):
+    """Class decorator registering an ExportSpec under its ``name``"""
+    _specs[spec_class.name] = spec_class
+    return spec_class
+
+
+def get_export(name):
+    if name not in _specs:
+        autodiscover_modules('exports')
+    try:
+        return _specs[name]()
+    except KeyError:
+        raise UnknownExport(name)
+
+
+# CSV
+
+class Echo:
+    """File-like object that hands back what the csv writer writes"""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows, buffer_size=64 * 1024):
+    """Encode rows as CSV text, yielding blocks of about ``buffer_size`` characters"""
+    writer = csv.writer(Echo())
+    block = []
+    size = 0
+    for row in rows:
+        line = writer.writerow(row)
+        block.append(line)
+        size += len(line)
+        if size >= buffer_size:
+            yield ''.join(block)
+            block = []
+            size = 0
+    if block:
+        yield ''.join(block)
+
+
+def csv_response(rows, filename):
+    response = StreamingHttpResponse(iter_csv(rows), content_type=CSV_CONTENT_TYPE)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def write_csv(rows, path):
+    with open(path, 'w', newline='', encoding='utf-8') as output:
+        for block in iter_csv(rows):
+            output.write(block)
+
+
+# XLSX
+
+def _cell_value(value):
+    # openpyxl rejects timezone-aware datetimes
+    if isinstance(value, datetime) and timezone.is_aware(value):
+        return timezone.make_naive(value)
+    return value
+
+
+def write_workbook(sheets, target):
+    """Write ``(title, rows)`` sheets to a path or file in write-only mode.
+
+    The first row of each sheet is written in bold as its header.
+    """
+    workbook = Workbook(write_only=True)
+    bold = Font(bold=True)
+    for title, rows in sheets:
+        worksheet = workbook.create_sheet(title=title[:31])
+        for index, row in enumerate(rows):
+            if index == 0:
+                cells = []
+                for value in row:
+                    cell = WriteOnlyCell(worksheet, value=_cell_value(value))
+                    cell.font = bold
+                    cells.append(cell)
+                worksheet.append(cells)
+            else:
+                worksheet.append([_cell_value(value) for value in row])
+    workbook.save(target)
+
+
+def workbook_response(sheets, filename):
+    output = tempfile.TemporaryFile()
+    write_workbook(sheets, output)
+    output.seek(0)
+    return FileResponse(output, as_attachment=True, filename=filename, content_type=XLSX_CONTENT_TYPE)
+
+
+def write_export(spec, queryset, fmt, path, rows=None):
+    """Write an export to a file on disk; ``rows`` overrides ``spec.rows(queryset)``"""
+    rows = spec.rows(queryset) if rows is None else rows
+    if FORMATS.get(fmt) == 'xlsx':
+        write_workbook([(spec.sheet_title, rows)], path)
+    else:
+        write_csv(rows, path)
+
+
+# Views
+
+def export_response(request, name, fmt, params=None):
+    """Stream an export, or queue it as a background job when it is very large"""
+    if fmt not in FORMATS:
+        raise ValueError(f'Unsupported format: {fmt}')
+    params = params or {}
+    spec = get_export(name)
+    queryset = spec.get_queryset(params, request.user)
+
+    if BACKGROUND_THRESHOLD:
+        total = queryset.count()
+        if total > BACKGROUND_THRESHOLD:
+            from .job_queue import enqueue_job
+            job = enqueue_job('core.export', {'name': name, 'export_format': fmt, 'params': params},
+                              user=request.user, unique=True)
+            logger.info(f'Export {name} ({total} rows) queued as job {job.pk}')
+            messages.info(request, f'This export has {total} rows and is being prepared in the background. '
+                                   'You can download it here once it is ready.')
+            return redirect('core:job_detail', pk=job.pk)
+
+    return spec.response(queryset, fmt)
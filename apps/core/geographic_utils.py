@@ -199,24 +199,35 @@ def enhance_service_area_with_coordinates(service_area):
     return False
 
 
-def batch_geocode_service_areas():
+def batch_geocode_service_areas(area_ids=None, force=False, progress=None):
     """
-    Batch geocode all service areas that don't have coordinates.
-    This should be run as a management command or background task.
+    Batch geocode service areas.
+    By default geocodes active areas without coordinates; pass ``area_ids``
+    (with ``force=True`` to overwrite existing coordinates) to geocode a
+    selection. Runs as the core.geocode_service_areas background job;
+    ``progress(percent, message)`` is called after each area.
     """
     from .models import ServiceArea
 
-    areas_without_coords = ServiceArea.objects.filter(
-        latitude__isnull=True,
-        longitude__isnull=True,
-        is_active=True
-    )
+    if area_ids is not None:
+        areas = ServiceArea.objects.filter(pk__in=area_ids)
+        if not force:
+            areas = areas.filter(latitude__isnull=True, longitude__isnull=True)
+    else:
+        areas = ServiceArea.objects.filter(
+            latitude__isnull=True,
+            longitude__isnull=True,
+            is_active=True
+        )
+    areas = list(areas)
 
     geo_service = get_geographic_service()
     updated_count = 0
 
-    for area in areas_without_coords:
+    for index, area in enumerate(areas, start=1):
         location_string = f"{area.name}, Kenya"
+        if area.county and area.county != area.name:
+            location_string = f"{area.name}, {area.county}, Kenya"
         geo_result = geo_service.geocode_location(location_string)
 
         if geo_result:
@@ -226,5 +237,8 @@ def batch_geocode_service_areas():
             updated_count += 1
             logger.info(f"Geocoded {area.name}: {area.latitude}, {area.longitude}")
 
+        if progress:
+            progress(index * 100 // len(areas), f"Geocoded {index} of {len(areas)} areas")
+
     logger.info(f"Batch geocoding completed: {updated_count} areas updated")
     return updated_count
@@ -0,0 +1,192 @@
+"""
+Precomputed holiday calendar for the holiday offer banner and discounts.
+
+The active_discounts context processor (every page render) and
+HomeView.get_active_holiday_offer used to load every active KenyanHoliday,
+compute each one's period in Python (Easter arithmetic included) and then
+query HolidayOffer once per active holiday.
+
+HolidayCalendar does that work once per calendar year. It computes the
+periods of every active holiday for the previous, current and next year (so
+windows that cross New Year are covered), cuts the timeline into disjoint
+segments at every window boundary, and resolves each segment's offers up front:
+
+- discount_offer: the rule used by active_discounts. Active holidays are taken
+  in calendar order (Jamhuri Day first from 1 to 12 December); the first whose
+  best offer (lowest priority, then order) has a discount percentage wins.
+- banner_offer: the rule used by the homepage banner, the best offer across
+  all active holidays. The segment also keeps the last day of that holiday's
+  window (banner_end_date) for the banner countdown, which for a window that
+  started last year is not in the current year's period.
+
+The segments are stored as a sorted list of start dates, so finding today's
+offers is a bisect with no queries. The calendar is cached like the company
+settings (see settings_cache.py): in process memory and in the shared cache
+under a version token that is rotated when a KenyanHoliday or HolidayOffer
+changes (see apps/core/signals.py).
+"""
+
+import threading
+import time
+import uuid
+from bisect import bisect_right
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+
+VERSION_CACHE_KEY = 'core:holiday_calendar:version'
+DATA_CACHE_KEY = 'core:holiday_calendar:data:v2:{version}:{year}'
+
+LOCAL_TTL = getattr(settings, 'HOLIDAY_CALENDAR_LOCAL_TTL', 30)
+SHARED_TTL = getattr(settings, 'HOLIDAY_CALENDAR_CACHE_TIMEOUT', 60 * 60 * 24)
+
+# Jamhuri Day is preferred over Christmas from 1 to 12 December
+JAMHURI_PRIORITY = ((12, 1), (12, 13))
+
+
+def _offer_key(offer):
+    return (offer.priority, offer.order, offer.pk)
+
+
+def _holiday_date_key(holiday, day):
+    """Calendar position of ``holiday`` when several are active on ``day``"""
+    if holiday.name == 'Jamhuri Day' and day.month == 12 and day.day <= 12:
+        return (12, 1)
+    if holiday.date_type == 'fixed' and holiday.fixed_month and holiday.fixed_day:
+        return (holiday.fixed_month, holiday.fixed_day)
+    if holiday.name == 'Christmas/New Year':
+        return (12, 25)
+    return (holiday.fixed_month or 99, holiday.fixed_day or 99)
+
+
+class HolidayCalendar:
+    """Sorted, non-overlapping date segments and the offers active in each"""
+
+    __slots__ = ('version', 'year', 'starts', 'segments', 'offers')
+
+    def __init__(self, version, year, starts, segments, offers):
+        self.version = version
+        self.year = year
+        # starts[i] is the ordinal of the first day of segments[i]
+        self.starts = starts
+        # (discount_offer_id, banner_offer_id, banner_end_ordinal), any may be None
+        self.segments = segments
+        self.offers = offers
+
+    @classmethod
+    def build(cls, year, version=None):
+        """Compute the calendar for ``year`` (2 queries)"""
+        from .models import HolidayOffer, KenyanHoliday
+
+        holidays = {holiday.pk: holiday for holiday in KenyanHoliday.objects.filter(is_active=True)}
+        offers = {}
+        best_offer = {}
+        for offer in HolidayOffer.objects.filter(is_active=True, holiday__in=list(holidays)):
+            offer.holiday = holidays[offer.holiday_id]
+            offers[offer.pk] = offer
+            current = best_offer.get(offer.holiday_id)
+            if current is None or _offer_key(offer) < _offer_key(current):
+                best_offer[offer.holiday_id] = offer
+
+        windows = []
+        boundaries = set()
+        for holiday in holidays.values():
+            for period_year in (year - 1, year, year + 1):
+                start, end = holiday.get_holiday_period(period_year)
+                if start and end and start <= end:
+                    windows.append((start, end, holiday))
+                    boundaries.update((start, end + timedelta(days=1)))
+        for period_year in (year - 1, year, year + 1):
+            boundaries.update(date(period_year, month, day) for month, day in JAMHURI_PRIORITY)
+
+        starts, segments = [], []
+        for day in sorted(boundaries):
+            active = {}
+            for start, end, holiday in windows:
+                if start <= day <= end:
+                    active[holiday] = max(end, active.get(holiday, end))
+            segment = cls._resolve(active, day, best_offer)
+            if not segments or segments[-1] != segment:
+                starts.append(day.toordinal())
+                segments.append(segment)
+
+        used = {offer_id for segment in segments for offer_id in segment[:2] if offer_id}
+        return cls(version, year, starts, segments, {pk: offer for pk, offer in offers.items() if pk in used})
+
+    @staticmethod
+    def _resolve(active, day, best_offer):
+        """Segment for ``day``; ``active`` maps each active holiday to the end of its window"""
+        candidates = []
+        for holiday in sorted(active, key=lambda holiday: _holiday_date_key(holiday, day)):
+            offer = best_offer.get(holiday.pk)
+            if offer is not None and offer not in candidates:
+                candidates.append(offer)
+
+        discount = next((offer for offer in candidates if offer.discount_percentage), None)
+        banner = min(candidates, key=_offer_key, default=None)
+        if banner is None:
+            return (discount.pk if discount else None, None, None)
+        return (discount.pk if discount else None, banner.pk, active[banner.holiday].toordinal())
+
+    def _segment(self, day):
+        index = bisect_right(self.starts, day.toordinal()) - 1
+        return self.segments[index] if index >= 0 else (None, None, None)
+
+    def discount_offer(self, day=None):
+        """The HolidayOffer whose discount applies on ``day`` (default today), or None"""
+        offer_id = self._segment(day or date.today())[0]
+        return self.offers.get(offer_id)
+
+    def banner_offer(self, day=None):
+        """The HolidayOffer shown in the homepage banner on ``day`` (default today), or None"""
+        offer_id = self._segment(day or date.today())[1]
+        return self.offers.get(offer_id)
+
+    def banner_end_date(self, day=None):
+        """Last day of the banner offer's holiday window on ``day`` (default today), or None"""
+        end = self._segment(day or date.today())[2]
+        return date.fromordinal(end) if end else None
+
+
+_lock = threading.Lock()
+_local = {'calendar': None, 'checked_at': 0.0}
+
+
+def _current_version():
+    version = cache.get(VERSION_CACHE_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(VERSION_CACHE_KEY, version, SHARED_TTL):
+            version = cache.get(VERSION_CACHE_KEY) or version
+    return version
+
+
+def get_holiday_calendar(year=None):
+    """Return the cached calendar for ``year`` (default: this year), building it if needed"""
+    year = year or date.today().year
+    now = time.monotonic()
+    calendar = _local['calendar']
+    if calendar is not None and calendar.year == year and now - _local['checked_at'] < LOCAL_TTL:
+        return calendar
+
+    version = _current_version()
+    if calendar is None or calendar.version != version or calendar.year != year:
+        data_key = DATA_CACHE_KEY.format(version=version, year=year)
+        calendar = cache.get(data_key)
+        if calendar is None:
+            calendar = HolidayCalendar.build(year, version)
+            cache.set(data_key, calendar, SHARED_TTL)
+
+    with _lock:
+        _local['calendar'] = calendar
+        _local['checked_at'] = now
+    return calendar
+
+
+def invalidate_holiday_calendar():
+    """Drop the local calendar and publish a new version token to other processes"""
+    with _lock:
+        _local['calendar'] = None
+        _local['checked_at'] = 0.0
+    cache.set(VERSION_CACHE_KEY, uuid.uuid4().hex, SHARED_TTL)
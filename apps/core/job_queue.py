@@ -0,0 +1,237 @@
+"""
+Lightweight DB-backed job queue.
+
+Heavy work (backups, full data exports, campaign sends, geocoding, receipt
+PDFs) is recorded as a BackgroundJob row and executed by the run_jobs
+management command, which can run continuously (--loop) or from cron on the
+shared host. Handlers live in each app's ``jobs.py`` and are registered with
+``@register_job('app.name')``; they receive the job row and its params and can
+report progress and attach a result file:
+
+    @register_job('core.export_all_data')
+    def export_all_data(job, **params):
+        job.update_progress(50, 'Dumping data')
+        job.set_result_file(path)
+        return {'rows': 10}
+
+Views enqueue with ``enqueue_job()`` and poll ``job_status()``.
+
+While a handler runs, a heartbeat thread refreshes the job's heartbeat_at
+every HEARTBEAT_INTERVAL seconds, so long steps without progress reports are
+not mistaken for a dead worker. Every write after the claim is conditional on
+the worker's claim token: if the job was reclaimed anyway, the superseded run
+cannot overwrite the new run's progress, status or result.
+"""
+
+import logging
+import os
+import threading
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules
+
+from .models import BackgroundJob
+
+logger = logging.getLogger(__name__)
+
+# A running job without a heartbeat for this long belonged to a worker that died
+STALE_TIMEOUT = getattr(settings, 'JOBS_STALE_TIMEOUT', 60 * 30)
+RETRY_DELAY = getattr(settings, 'JOBS_RETRY_DELAY', 60)
+# Well below STALE_TIMEOUT so a slow database write does not let a live job go stale
+HEARTBEAT_INTERVAL = getattr(settings, 'JOBS_HEARTBEAT_INTERVAL', 60)
+
+_handlers = {}
+
+
+class UnknownJobType(Exception):
+    """Raised when enqueueing a job type that has no registered handler"""
+
+
+def register_job(job_type):
+    """Decorator registering ``func(job, **params)`` as the handler for ``job_type``"""
+    def decorator(func):
+        _handlers[job_type] = func
+        return func
+    return decorator
+
+
+def autodiscover_jobs():
+    """Import every installed app's jobs module so handlers are registered"""
+    autodiscover_modules('jobs')
+
+
+def get_handler(job_type):
+    if job_type not in _handlers:
+        autodiscover_jobs()
+    try:
+        return _handlers[job_type]
+    except KeyError:
+        raise UnknownJobType(job_type)
+
+
+def result_path(filename):
+    """Path for a job result file outside MEDIA_ROOT (results are served with permission checks)"""
+    jobs_root = getattr(settings, 'JOBS_ROOT', os.path.join(settings.BASE_DIR, 'job_results'))
+    os.makedirs(jobs_root, exist_ok=True)
+    return os.path.join(jobs_root, filename)
+
+
+def enqueue_job(job_type, params=None, user=None, run_after=None, max_attempts=1, unique=False):
+    """Queue a job and return it.
+
+    With ``unique=True`` an existing queued or running job of the same type and
+    params is returned instead of queueing a duplicate.
+    """
+    get_handler(job_type)
+    params = params or {}
+    if unique:
+        existing = BackgroundJob.objects.filter(
+            job_type=job_type, params=params, status__in=['queued', 'running']
+        ).first()
+        if existing:
+            return existing
+    return BackgroundJob.objects.create(
+        job_type=job_type,
+        params=params,
+        created_by=user if user is not None and user.is_authenticated else None,
+        run_after=run_after or timezone.now(),
+        max_attempts=max_attempts,
+    )
+
+
+def job_status(job):
+    """Serializable status of a job for polling clients"""
+    return {
+        'id': job.pk,
+        'job_type': job.job_type,
+        'status': job.status,
+        'progress': job.progress,
+        'message': job.progress_message,
+        'result': job.result,
+        'error': job.error if job.status == 'failed' else '',
+        'has_file': bool(job.result_file) and job.status == 'completed',
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def claim_next_job(job_types=None):
+    """Atomically take the next due job; returns None when the queue is empty"""
+    now = timezone.now()
+    stale = now - timedelta(seconds=STALE_TIMEOUT)
+    # Abandoned jobs that used up their attempts are failed rather than re-run
+    BackgroundJob.objects.filter(
+        status='running', heartbeat_at__lt=stale, attempts__gte=F('max_attempts')
+    ).update(status='failed', error='Worker stopped before the job finished', finished_at=now)
+
+    due = Q(status='queued', run_after__lte=now) | Q(status='running', heartbeat_at__lt=stale)
+    candidates = BackgroundJob.objects.filter(due)
+    if job_types:
+        candidates = candidates.filter(job_type__in=job_types)
+
+    for pk in candidates.order_by('run_after', 'pk').values_list('pk', flat=True)[:10]:
+        token = uuid.uuid4().hex
+        # Conditional UPDATE: only one worker wins each row
+        claimed = BackgroundJob.objects.filter(due, pk=pk).update(
+            status='running', claimed_by=token, heartbeat_at=now, started_at=now, error=''
+        )
+        if claimed:
+            return BackgroundJob.objects.get(pk=pk, claimed_by=token)
+    return None
+
+
+class Heartbeat:
+    """Refreshes a claimed job's heartbeat_at from a background thread while its handler runs"""
+
+    def __init__(self, job):
+        self.job = job
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'job-{job.pk}-heartbeat', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+
+    def beat(self):
+        """Refresh heartbeat_at; False once the job is no longer running under this claim"""
+        return bool(_claimed_row(self.job).filter(status='running').update(heartbeat_at=timezone.now()))
+
+    def _run(self):
+        try:
+            while not self._stopped.wait(HEARTBEAT_INTERVAL):
+                try:
+                    if not self.beat():
+                        break
+                except Exception as e:
+                    logger.warning(f"Job {self.job.pk} heartbeat failed: {str(e)}")
+        finally:
+            connection.close()
+
+
+def _claimed_row(job):
+    """The job's row, as long as it is still claimed by this worker"""
+    return BackgroundJob.objects.filter(pk=job.pk, claimed_by=job.claimed_by)
+
+
+def run_job(job):
+    """Execute a claimed job and record its outcome"""
+    job.attempts += 1
+    _claimed_row(job).update(attempts=job.attempts)
+    try:
+        with Heartbeat(job):
+            handler = get_handler(job.job_type)
+            result = handler(job, **job.params)
+    except Exception as e:
+        logger.error(f"Job {job.pk} ({job.job_type}) failed: {str(e)}", exc_info=True)
+        job.error = f"{str(e)}\n{traceback.format_exc()}"
+        if job.attempts < job.max_attempts:
+            job.status = 'queued'
+            job.run_after = timezone.now() + timedelta(seconds=RETRY_DELAY * job.attempts)
+        else:
+            job.status = 'failed'
+            job.finished_at = timezone.now()
+        if not _claimed_row(job).update(
+            status=job.status, error=job.error, run_after=job.run_after, finished_at=job.finished_at
+        ):
+            _superseded(job)
+        return False
+
+    job.status = 'completed'
+    job.progress = 100
+    job.result = result if isinstance(result, dict) else {'value': result}
+    job.finished_at = timezone.now()
+    if not _claimed_row(job).update(
+        status=job.status, progress=job.progress, result=job.result, finished_at=job.finished_at
+    ):
+        _superseded(job)
+        return False
+    logger.info(f"Job {job.pk} ({job.job_type}) completed")
+    return True
+
+
+def _superseded(job):
+    logger.warning(f"Job {job.pk} ({job.job_type}) was reclaimed by another worker; this run's outcome is discarded")
+
+
+def run_pending_jobs(max_jobs=None, job_types=None, deadline=None):
+    """Run due jobs until the queue is empty, ``max_jobs`` ran or ``deadline`` passed"""
+    ran = 0
+    while max_jobs is None or ran < max_jobs:
+        if deadline and timezone.now() >= deadline:
+            break
+        job = claim_next_job(job_types)
+        if job is None:
+            break
+        run_job(job)
+        ran += 1
+    return ran
@@ -0,0 +1,95 @@
+"""
+Background job handlers for the core app (see job_queue.py)
+"""
+
+import logging
+
+from django.core.management import call_command
+from django.utils import timezone
+
+from .job_queue import register_job, result_path
+
+logger = logging.getLogger(__name__)
+
+
+@register_job('core.system_backup')
+def system_backup(job):
+    """Database, media and configuration archive (previously streamed by SystemBackupView)"""
+    from .views import SystemBackupView
+
+    backup_name = f"olivian_backup_{timezone.now().strftime('%Y%m%d_%H%M%S')}"
+    zip_path = SystemBackupView().build_backup(backup_name, job=job)
+    job.set_result_file(zip_path, f'{backup_name}.zip')
+    return {'backup_name': backup_name}
+
+
+@register_job('core.export_all_data')
+def export_all_data(job):
+    """Full JSON dump of the database written to disk instead of held in memory"""
+    filename = f"olivian_data_export_{timezone.now().strftime('%Y%m%d_%H%M%S')}.json"
+    filepath = result_path(filename)
+
+    job.update_progress(5, 'Exporting data')
+    # Export all data excluding problematic tables
+    call_command('dumpdata',
+                 exclude=[
+                     'auth.permission',
+                     'sessions',
+                     'admin.logentry',
+                     'core.bankaccount',  # Exclude non-existent model
+                     'chat.chatsystemmodel',  # Unmanaged admin placeholder without a table
+                     'contenttypes'
+                 ],
+                 natural_foreign=True,
+                 indent=2,
+                 output=filepath)
+    job.set_result_file(filepath, filename)
+    return {'filename': filename}
+
+
+@register_job('core.send_newsletter_campaign')
+def send_newsletter_campaign(job, campaign_id):
+    """Deliver a prepared newsletter campaign"""
+    from .campaign_dispatch import dispatch_campaign
+
+    def on_progress(totals):
+        done = totals['sent'] + totals['failed']
+        percent = done * 100 // totals['total'] if totals['total'] else 100
+        job.update_progress(percent, f"{totals['sent']} sent, {totals['failed']} failed of {totals['total']}")
+
+    result = dispatch_campaign(campaign_id, on_progress=on_progress)
+    if result is None:
+        return {'skipped': 'Campaign is already being dispatched'}
+    sent, failed = result
+    return {'sent': sent, 'failed': failed}
+
+
+@register_job('core.geocode_service_areas')
+def geocode_service_areas(job, area_ids=None, force=False):
+    """Look up coordinates for service areas"""
+    from .geographic_utils import batch_geocode_service_areas
+
+    updated = batch_geocode_service_areas(area_ids=area_ids, force=force, progress=job.update_progress)
+    return {'updated': updated}
+
+
+@register_job('core.export')
+def export(job, name, export_format, params):
+    """CSV/XLSX export too large to stream within a request (see exports.py)"""
+    from .exports import get_export, write_export
+
+    spec = get_export(name)
+    queryset = spec.get_queryset(params, job.created_by)
+    total = queryset.count()
+    filename = spec.get_filename(export_format)
+
+    def rows_with_progress():
+        for index, row in enumerate(spec.rows(queryset)):
+            if index and index % spec.chunk_size == 0:
+                job.update_progress(min(99, index * 100 // max(total, 1)), f'{index} of {total} rows written')
+            yield row
+
+    filepath = result_path(f'job{job.pk}_{filename}')
+    write_export(spec, queryset, export_format, filepath, rows=rows_with_progress())
+    job.set_result_file(filepath, filename)
+    return {'rows': total, 'filename': filename}
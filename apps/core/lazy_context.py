@@ -0,0 +1,110 @@
+"""
+Lazy, per-request context processors.
+
+The site-wide context processors in settings.TEMPLATES run for every render,
+including AJAX partials, dashboard fragments and emails that use none of their
+variables. A processor decorated with @lazy_context returns one placeholder per
+variable instead of computing anything. Django's template engine calls
+callables it finds in the context, so the processor body runs the first time a
+template uses one of its variables, and the result is memoized on the request
+for every other variable and every later render in the same request.
+
+Python callers that need the values themselves (cart and checkout totals)
+use ``processor.resolve(request)``, which shares the same memo.
+
+Views opt out of site-wide processors with @skip_context_processors (all lazy
+processors, or the named ones); the variables are then simply absent.
+
+Each evaluation is timed and its queries counted. ContextProcessorTimingMiddleware
+reports which processors a page actually used, and what they cost, in a
+Server-Timing header and the log when CONTEXT_PROCESSOR_TIMING is enabled
+(default: DEBUG).
+"""
+
+import functools
+import time
+
+from django.db import connection
+
+MEMO_ATTR = '_lazy_context'
+STATS_ATTR = '_lazy_context_stats'
+SKIP_ATTR = 'skip_context_processors'
+ALL = '__all__'
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def _evaluate(request, name, func):
+    memo = request.__dict__.setdefault(MEMO_ATTR, {})
+    if name not in memo:
+        counter = _QueryCounter()
+        started = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            memo[name] = func(request)
+        request.__dict__.setdefault(STATS_ATTR, []).append(
+            (name, (time.perf_counter() - started) * 1000, counter.count)
+        )
+    return memo[name]
+
+
+class LazyContextValue:
+    """One context variable of a lazy processor; evaluated when a template calls it"""
+
+    __slots__ = ('request', 'name', 'func', 'key')
+
+    def __init__(self, request, name, func, key):
+        self.request = request
+        self.name = name
+        self.func = func
+        self.key = key
+
+    def __call__(self):
+        return _evaluate(self.request, self.name, self.func).get(self.key)
+
+    def __repr__(self):
+        return f'<LazyContextValue {self.name}.{self.key}>'
+
+
+def is_skipped(request, name):
+    skipped = getattr(request, SKIP_ATTR, ())
+    return ALL in skipped or name in skipped
+
+
+def lazy_context(*keys):
+    """Make a context processor returning ``keys`` lazy and memoized per request"""
+    def decorator(func):
+        name = func.__name__
+
+        @functools.wraps(func)
+        def processor(request):
+            if is_skipped(request, name):
+                return {}
+            return {key: LazyContextValue(request, name, func, key) for key in keys}
+
+        processor.resolve = lambda request: dict(_evaluate(request, name, func))
+        processor.keys = keys
+        return processor
+    return decorator
+
+
+def skip_context_processors(*names):
+    """View decorator: don't provide the named lazy processors' variables (all of them if none are named)"""
+    def decorator(view_func):
+        @functools.wraps(view_func)
+        def wrapped(request, *args, **kwargs):
+            setattr(request, SKIP_ATTR, set(names) or {ALL})
+            return view_func(request, *args, **kwargs)
+        return wrapped
+    return decorator
+
+
+def processor_stats(request):
+    """[(processor name, milliseconds, queries)] for the processors evaluated during ``request``"""
+    return list(request.__dict__.get(STATS_ATTR, ()))
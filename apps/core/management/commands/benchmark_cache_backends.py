@@ -0,0 +1,223 @@
+"""
+Management command to benchmark the cache backends TieredCache can use as L2
+
+For each backend (local memory, file, database table and Redis when
+available) the command times cache hits, misses and writes, on the backend
+alone and behind TieredCache's in-process L1. It then forks a second process
+sharing the backend and measures cross-process consistency:
+
+- how long the other process keeps reading a value after it is overwritten,
+  and a tagged value after its tag is invalidated (bounded by L1_TIMEOUT with
+  an L1, never for local memory)
+- how many of two processes' concurrent incr() calls are lost (incr is get +
+  set on the file and database backends)
+
+The database backend uses a temporary cache table in the default database,
+dropped at the end, and the file backend a temporary directory.
+"""
+import multiprocessing
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.management.commands.createcachetable import Command as CreateCacheTable
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+
+from apps.core.tiered_cache import TieredCache, build_backend, get_tagged, invalidate_tags, set_tagged
+
+BACKENDS = ('locmem', 'file', 'db', 'redis')
+BENCH_TABLE = 'benchmark_cache_table'
+VALUE = {'name': 'Olivian Group', 'items': list(range(100)), 'vat_rate': '16.00'}
+
+
+class Command(BaseCommand):
+    help = 'Benchmark hit latency and cross-process consistency of the cache backends, with and without an L1'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--backends',
+            default=','.join(BACKENDS),
+            help=f'Comma-separated backends to benchmark (default: {",".join(BACKENDS)})'
+        )
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=5000,
+            help='Operations timed per measurement (default: 5000)'
+        )
+        parser.add_argument(
+            '--increments',
+            type=int,
+            default=500,
+            help='incr() calls per process in the lost-increment test (default: 500)'
+        )
+        parser.add_argument(
+            '--l1-timeout',
+            type=float,
+            default=1,
+            help='L1_TIMEOUT in seconds for the tiered measurements (default: 1)'
+        )
+        parser.add_argument(
+            '--redis-url',
+            default=getattr(settings, 'REDIS_URL', '') or os.environ.get('REDIS_URL', ''),
+            help='Redis server to benchmark (default: REDIS_URL; skipped if empty)'
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.cleanup = []
+        try:
+            for name in options['backends'].split(','):
+                config = self._l2_config(name.strip())
+                if config is None:
+                    continue
+                self.stdout.write(f"\n{name}")
+                for label, tiered in (('backend', False), ('with L1', True)):
+                    self._run(name, label, config, tiered)
+        finally:
+            for cleanup in reversed(self.cleanup):
+                cleanup()
+
+    def _l2_config(self, name):
+        if name == 'locmem':
+            return {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark'}
+        if name == 'file':
+            directory = tempfile.mkdtemp(prefix='cache-benchmark-')
+            self.cleanup.append(lambda: shutil.rmtree(directory, ignore_errors=True))
+            return {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory}
+        if name == 'db':
+            config = {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': BENCH_TABLE}
+            creator = CreateCacheTable()
+            creator.verbosity = 0
+            creator.create_table(DEFAULT_DB_ALIAS, BENCH_TABLE, dry_run=False)
+            self.cleanup.append(self._drop_table)
+            return config
+        if name == 'redis':
+            if not self.options['redis_url']:
+                self.stdout.write("\nredis: skipped (no --redis-url / REDIS_URL)")
+                return None
+            try:
+                import redis  # noqa: F401
+            except ImportError:
+                self.stdout.write("\nredis: skipped (the redis package is not installed)")
+                return None
+            return {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': self.options['redis_url']}
+        self.stderr.write(f"Unknown backend {name!r}, expected one of {', '.join(BACKENDS)}")
+        return None
+
+    def _drop_table(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {connection.ops.quote_name(BENCH_TABLE)}')
+
+    def _cache(self, config, tiered, role):
+        if not tiered:
+            return build_backend(config)
+        return TieredCache(f'benchmark-{role}', {
+            'OPTIONS': {'L2': config, 'L1_TIMEOUT': self.options['l1_timeout']},
+        })
+
+    def _run(self, name, label, config, tiered):
+        cache = self._cache(config, tiered, f'{name}-parent')
+        cache.clear()
+        iterations = self.options['iterations']
+
+        cache.set('bench:hit', VALUE, None)
+        hit = _time(lambda: cache.get('bench:hit'), iterations)
+        miss = _time(lambda: cache.get('bench:miss'), iterations)
+        write = _time(lambda: cache.set('bench:write', VALUE, None), max(iterations // 10, 1))
+        self.stdout.write(
+            f"  {label:8}  hit {_format(hit)}  miss {_format(miss)}  set {_format(write)}"
+        )
+
+        stale, stale_tag, lost = self._cross_process(name, config, tiered, cache)
+        increments = self.options['increments'] * 2
+        self.stdout.write(
+            f"  {label:8}  other process sees a write after {stale}, a tag invalidation after {stale_tag}; "
+            f"lost increments {lost}/{increments}"
+        )
+
+    def _cross_process(self, name, config, tiered, cache):
+        """(write staleness, tag staleness, lost increments) as seen from a forked process"""
+        timeout = self.options['l1_timeout'] + 2
+        increments = self.options['increments']
+        cache.set('bench:shared', 1, None)
+        set_tagged('bench:tagged', VALUE, ['bench'], None, using=cache)
+        cache.set('bench:counter', 0, None)
+
+        context = multiprocessing.get_context('fork')
+        parent_end, child_end = context.Pipe()
+        # The child opens its own database connection
+        connections.close_all()
+        child = context.Process(
+            target=_child, args=(child_end, self._cache(config, tiered, f'{name}-child'), timeout, increments),
+        )
+        child.start()
+        try:
+            parent_end.recv()  # child has read the value
+            cache.set('bench:shared', 2, None)
+            parent_end.send('written')
+            stale = parent_end.recv()
+
+            parent_end.recv()  # child has read the tagged value
+            invalidate_tags('bench', using=cache)
+            parent_end.send('invalidated')
+            stale_tag = parent_end.recv()
+
+            parent_end.recv()
+            parent_end.send('increment')
+            for _ in range(increments):
+                cache.incr('bench:counter')
+            parent_end.recv()
+            lost = increments * 2 - cache.get('bench:counter')
+        finally:
+            child.join(timeout + 5)
+            if child.is_alive():
+                child.terminate()
+        return stale, stale_tag, lost
+
+
+def _child(pipe, cache, timeout, increments):
+    cache.get('bench:shared')
+    pipe.send('ready')
+    pipe.recv()
+    pipe.send(_wait_for(lambda: cache.get('bench:shared') == 2, timeout))
+
+    get_tagged('bench:tagged', using=cache)
+    pipe.send('ready')
+    pipe.recv()
+    pipe.send(_wait_for(lambda: get_tagged('bench:tagged', using=cache) is None, timeout))
+
+    pipe.send('ready')
+    pipe.recv()
+    for _ in range(increments):
+        cache.incr('bench:counter')
+    pipe.send('done')
+    connections.close_all()
+
+
+def _wait_for(condition, timeout):
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        if condition():
+            return f'{(time.perf_counter() - started) * 1000:.1f}ms'
+        time.sleep(0.001)
+    return f'never (>{timeout:.0f}s)'
+
+
+def _time(operation, iterations):
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        operation()
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.99) - 1]
+
+
+def _format(timing):
+    median, p99 = timing
+    return f'{median * 1e6:8.1f}µs (p99 {p99 * 1e6:8.1f}µs)'
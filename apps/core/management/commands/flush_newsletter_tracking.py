@@ -0,0 +1,42 @@
+"""
+Management command to fold buffered newsletter open/click events into campaign stats
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.core.newsletter_tracking import FLUSH_BATCH_SIZE, flush_tracking_events
+
+
+class Command(BaseCommand):
+    help = 'Apply buffered newsletter open/click tracking events to send logs and campaign totals'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep running and flush periodically (default: flush once and exit, for cron)'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=60,
+            help='Seconds between flushes in --loop mode (default: 60)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=FLUSH_BATCH_SIZE,
+            help=f'Events folded per transaction (default: {FLUSH_BATCH_SIZE})'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                processed = flush_tracking_events(batch_size=options['batch_size'])
+                self.stdout.write(f"Flushed {processed} tracking events")
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping tracking flusher")
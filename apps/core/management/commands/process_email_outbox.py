@@ -0,0 +1,74 @@
+"""
+Management command to deliver queued outbound emails
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.core.email_outbox import (
+    BATCH_SIZE, CONNECTIONS, MAX_ATTEMPTS, RATE_LIMIT, OutboxWorker
+)
+
+
+class Command(BaseCommand):
+    help = 'Send emails waiting in the outbox, retrying failures with backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep running and poll the outbox (default: drain once and exit, for cron)'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=5,
+            help='Seconds to sleep between polls in --loop mode (default: 5)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help=f'Messages claimed per batch (default: {BATCH_SIZE})'
+        )
+        parser.add_argument(
+            '--connections',
+            type=int,
+            default=CONNECTIONS,
+            help=f'SMTP connections kept open in parallel (default: {CONNECTIONS})'
+        )
+        parser.add_argument(
+            '--rate',
+            type=float,
+            default=RATE_LIMIT,
+            help=f'Maximum messages per second, 0 for unlimited (default: {RATE_LIMIT})'
+        )
+        parser.add_argument(
+            '--max-attempts',
+            type=int,
+            default=MAX_ATTEMPTS,
+            help=f'Attempts before a message is marked failed (default: {MAX_ATTEMPTS})'
+        )
+
+    def handle(self, *args, **options):
+        worker = OutboxWorker(
+            batch_size=options['batch_size'],
+            connections=options['connections'],
+            rate_limit=options['rate'],
+            max_attempts=options['max_attempts'],
+        )
+        try:
+            while True:
+                sent, failed = worker.drain()
+                if sent or failed:
+                    self.stdout.write(f"Sent {sent} emails, {failed} failed")
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping email outbox worker")
+        finally:
+            worker.close()
+
+        if not options['loop'] and not (sent or failed):
+            self.stdout.write("No emails to send")
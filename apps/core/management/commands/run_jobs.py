@@ -0,0 +1,74 @@
+"""
+Management command to run queued background jobs.
+
+Run continuously with --loop, or from cron on shared hosting, e.g.
+    * * * * * python manage.py run_jobs --max-time 55
+"""
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.core.job_queue import autodiscover_jobs, run_pending_jobs
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (backups, exports, campaign sends, geocoding, receipt PDFs)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep running and poll for new jobs (default: run due jobs and exit)'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=5,
+            help='Seconds to sleep between polls in --loop mode (default: 5)'
+        )
+        parser.add_argument(
+            '--max-jobs',
+            type=int,
+            help='Stop after running this many jobs'
+        )
+        parser.add_argument(
+            '--max-time',
+            type=int,
+            help='Do not start new jobs after this many seconds (use with cron)'
+        )
+        parser.add_argument(
+            '--type',
+            action='append',
+            dest='job_types',
+            help='Only run jobs of this type (repeatable)'
+        )
+
+    def handle(self, *args, **options):
+        autodiscover_jobs()
+        deadline = None
+        if options['max_time']:
+            deadline = timezone.now() + timedelta(seconds=options['max_time'])
+
+        total = 0
+        try:
+            while True:
+                remaining = None
+                if options['max_jobs'] is not None:
+                    remaining = options['max_jobs'] - total
+                    if remaining <= 0:
+                        break
+                ran = run_pending_jobs(max_jobs=remaining, job_types=options['job_types'], deadline=deadline)
+                total += ran
+                if ran:
+                    self.stdout.write(f"Ran {ran} jobs")
+
+                if not options['loop'] or (deadline and timezone.now() >= deadline):
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping job worker")
+
+        if not total:
+            self.stdout.write("No jobs to run")
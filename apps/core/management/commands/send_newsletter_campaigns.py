@@ -0,0 +1,42 @@
+"""
+Management command to resume newsletter campaigns whose dispatcher stopped
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from apps.core.campaign_dispatch import HEARTBEAT_TIMEOUT, dispatch_campaign
+from apps.core.models import NewsletterCampaign
+
+
+class Command(BaseCommand):
+    help = 'Resume sending newsletter campaigns left in the sending state (e.g. after a restart)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--campaign',
+            type=int,
+            help='Only resume the campaign with this ID'
+        )
+
+    def handle(self, *args, **options):
+        stale = timezone.now() - timedelta(seconds=HEARTBEAT_TIMEOUT)
+        campaigns = NewsletterCampaign.objects.filter(status='sending').filter(
+            Q(dispatch_heartbeat__isnull=True) | Q(dispatch_heartbeat__lt=stale)
+        )
+        if options['campaign']:
+            campaigns = campaigns.filter(pk=options['campaign'])
+
+        resumed = 0
+        for campaign_id in campaigns.values_list('pk', flat=True):
+            result = dispatch_campaign(campaign_id)
+            if result is None:
+                continue
+            sent, failed = result
+            resumed += 1
+            self.stdout.write(f"Campaign {campaign_id}: sent {sent}, failed {failed}")
+
+        if not resumed:
+            self.stdout.write("No campaigns to resume")
@@ -2,9 +2,15 @@
 Additional core middleware for development and production optimizations
 """
 
+import logging
+
 from django.conf import settings
 from django.http import HttpResponse
 
+from .lazy_context import processor_stats
+
+logger = logging.getLogger(__name__)
+
 
 class DevelopmentCacheControlMiddleware:
     """
@@ -42,6 +48,14 @@ class CacheControlMiddleware:
         if request.path.startswith('/admin/') or request.path.startswith('/api/'):
             return response
 
+        # Responses with their own validators (cached PDFs) are revalidated, not re-downloaded
+        if response.has_header('ETag'):
+            return response
+
+        # Views that chose their own policy (the public page cache) keep it
+        if response.has_header('Cache-Control'):
+            return response
+
         # For HTML pages (no extension in path or ends with .html)
         if ('/' in request.path or request.path.endswith('.html')) and not request.path.startswith('/static/'):
             # Prevent browser caching of HTML pages - network-first approach
@@ -59,3 +73,33 @@ class CacheControlMiddleware:
                 response['Cache-Control'] = 'public, max-age=300'  # 5 minutes in dev
 
         return response
+
+
+class ContextProcessorTimingMiddleware:
+    """
+    Report which lazy context processors a response used and what they cost,
+    as Server-Timing entries (visible in browser dev tools) and a debug log line
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'CONTEXT_PROCESSOR_TIMING', settings.DEBUG)
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not self.enabled:
+            return response
+
+        stats = processor_stats(request)
+        if stats:
+            timings = ', '.join(
+                f'cp-{name};dur={duration:.2f};desc="{name} ({queries} queries)"'
+                for name, duration, queries in stats
+            )
+            existing = response.get('Server-Timing')
+            response['Server-Timing'] = f'{existing}, {timings}' if existing else timings
+        logger.debug(
+            f"{request.method} {request.path} used context processors: "
+            + (', '.join(f'{name} {duration:.2f}ms/{queries}q' for name, duration, queries in stats) or 'none')
+        )
+        return response
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-17 03:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0025_emailoutbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='newslettercampaign',
+            name='dispatch_heartbeat',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
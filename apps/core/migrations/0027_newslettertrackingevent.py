@@ -0,0 +1,28 @@
+# Generated by Django 5.1.5 on 2026-10-17 04:00
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0026_newslettercampaign_dispatch_heartbeat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NewsletterTrackingEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('send_log_id', models.PositiveBigIntegerField()),
+                ('event_type', models.CharField(choices=[('open', 'Open'), ('click', 'Click')], max_length=10)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Newsletter Tracking Event',
+                'verbose_name_plural': 'Newsletter Tracking Events',
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -265,6 +265,134 @@ class Currency(models.Model):
         return f"{self.code} - {self.name}"
 
 
+class DocumentSequence(models.Model):
+    """Yearly counters for document numbers that have no dedicated sequence model"""
+    name = models.CharField(max_length=50, help_text="Sequence key, e.g. financial.transaction")
+    year = models.IntegerField()
+    last_number = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ['name', 'year']
+        verbose_name = 'Document Sequence'
+        verbose_name_plural = 'Document Sequences'
+
+    def __str__(self):
+        return f"{self.name} {self.year}: {self.last_number}"
+
+
+class EmailOutbox(models.Model):
+    """Outbound email waiting to be delivered by the process_email_outbox worker"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    subject = models.CharField(max_length=998)
+    body = models.TextField(blank=True)
+    html_body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=254)
+    to = models.JSONField(default=list)
+    attachments = models.JSONField(
+        default=list, blank=True,
+        help_text="Attachment specs resolved at send time, e.g. {'path': ...} or {'quotation_id': ...}"
+    )
+    template_name = models.CharField(max_length=100, blank=True)
+
+    # Delivery state
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claimed_by = models.CharField(max_length=32, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['next_attempt_at', 'id']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+        verbose_name = 'Outbox Email'
+        verbose_name_plural = 'Email Outbox'
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.to)} ({self.get_status_display()})"
+
+
+class BackgroundJob(models.Model):
+    """Long-running task executed by the run_jobs worker instead of a web request"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    job_type = models.CharField(max_length=100, help_text="Registered handler name, e.g. core.system_backup")
+    params = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+
+    # Progress reporting
+    progress = models.PositiveSmallIntegerField(default=0, help_text="Percent complete")
+    progress_message = models.CharField(max_length=255, blank=True)
+
+    # Outcome
+    result = models.JSONField(default=dict, blank=True)
+    result_file = models.CharField(max_length=500, blank=True, help_text="Absolute path of the generated file")
+    result_filename = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+
+    # Scheduling
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=1)
+    run_after = models.DateTimeField(default=timezone.now)
+    claimed_by = models.CharField(max_length=32, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True,
+                                   related_name='background_jobs')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+        ]
+        verbose_name = 'Background Job'
+        verbose_name_plural = 'Background Jobs'
+
+    def __str__(self):
+        return f"{self.job_type} #{self.pk} ({self.get_status_display()})"
+
+    @property
+    def is_finished(self):
+        return self.status in ('completed', 'failed')
+
+    def update_progress(self, progress, message=''):
+        """Report progress from inside a handler; also acts as the worker heartbeat"""
+        self.progress = max(0, min(100, int(progress)))
+        self.progress_message = message[:255]
+        self.heartbeat_at = timezone.now()
+        # Only while this worker still holds the claim (see apps/core/job_queue.py)
+        BackgroundJob.objects.filter(pk=self.pk, claimed_by=self.claimed_by).update(
+            progress=self.progress, progress_message=self.progress_message, heartbeat_at=self.heartbeat_at
+        )
+
+    def set_result_file(self, path, filename=None):
+        """Attach a generated file that users can download once the job completes"""
+        import os
+        self.result_file = str(path)
+        self.result_filename = filename or os.path.basename(str(path))
+        BackgroundJob.objects.filter(pk=self.pk, claimed_by=self.claimed_by).update(
+            result_file=self.result_file, result_filename=self.result_filename
+        )
+
+
 class AuditLog(models.Model):
     """System audit log for tracking important actions"""
     ACTION_CHOICES = [
@@ -576,6 +704,9 @@ class NewsletterCampaign(models.Model):
     opens_count = models.PositiveIntegerField(default=0)
     clicks_count = models.PositiveIntegerField(default=0)
 
+    # Last progress report of the dispatcher sending this campaign
+    dispatch_heartbeat = models.DateTimeField(null=True, blank=True, editable=False)
+
     created_by = models.ForeignKey('accounts.User', on_delete=models.CASCADE,
                                  related_name='newsletter_campaigns')
 
@@ -675,6 +806,27 @@ class NewsletterSendLog(models.Model):
         super().save(*args, **kwargs)
 
 
+class NewsletterTrackingEvent(models.Model):
+    """Append-only open/click hit, folded into NewsletterSendLog by flush_newsletter_tracking"""
+    EVENT_CHOICES = [
+        ('open', 'Open'),
+        ('click', 'Click'),
+    ]
+
+    # Plain id rather than a foreign key: the pixel request only appends a row
+    send_log_id = models.PositiveBigIntegerField()
+    event_type = models.CharField(max_length=10, choices=EVENT_CHOICES)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['id']
+        verbose_name = 'Newsletter Tracking Event'
+        verbose_name_plural = 'Newsletter Tracking Events'
+
+    def __str__(self):
+        return f"{self.get_event_type_display()} of send log {self.send_log_id}"
+
+
 class LegalDocument(models.Model):
     """Base model for legal documents like Privacy Policy and Terms of Service"""
     DOCUMENT_TYPES = [
@@ -1,127 +1,226 @@
 """
 M-Pesa Payment Integration Utilities
 Handles STK Push, payment callbacks, and transaction verification
+
+MPesaAPI is the single Daraja client used across the site (the checkout and
+POS wrapper in apps/ecommerce/mpesa.py delegates to it). One instance per
+configuration is shared through get_mpesa_client(). It keeps a pooled
+requests.Session, so calls reuse HTTPS connections. The OAuth token is held in
+memory and in the shared cache, and only one caller refreshes it at a time
+(single-flight), so a burst of requests or a status sweep costs one token
+request. query_stk_statuses() runs STK status queries on a bounded thread pool
+behind a rate limiter for the pending-payment sweeps.
 """
 
-import requests
 import base64
-import json
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+
+import requests
 from django.conf import settings
 from django.core.cache import cache
 from django.utils import timezone
-import logging
+from requests.adapters import HTTPAdapter
 
 logger = logging.getLogger(__name__)
 
+BASE_URLS = {
+    'production': 'https://api.safaricom.co.ke',
+    'sandbox': 'https://sandbox.safaricom.co.ke',
+}
+TOKEN_CACHE_KEY = 'mpesa:access_token:{}'
+TOKEN_LOCK_KEY = 'mpesa:access_token_lock:{}'
+# Refresh tokens this long before Daraja expires them
+TOKEN_EXPIRY_MARGIN = 300
+
+
 class MPesaAPI:
     """M-Pesa Daraja API Integration"""
-    
-    def __init__(self):
-        self.consumer_key = settings.MPESA_CONSUMER_KEY
-        self.consumer_secret = settings.MPESA_CONSUMER_SECRET
-        self.shortcode = settings.MPESA_SHORTCODE
-        self.passkey = settings.MPESA_PASSKEY
-        self.environment = settings.MPESA_ENVIRONMENT
-        
+
+    def __init__(self, consumer_key=None, consumer_secret=None, shortcode=None, passkey=None,
+                 environment=None, base_url=None, timeout=None, pool_size=None):
+        self.consumer_key = consumer_key if consumer_key is not None else settings.MPESA_CONSUMER_KEY
+        self.consumer_secret = consumer_secret if consumer_secret is not None else settings.MPESA_CONSUMER_SECRET
+        self.shortcode = shortcode or settings.MPESA_SHORTCODE
+        self.passkey = passkey if passkey is not None else settings.MPESA_PASSKEY
+        self.environment = environment or settings.MPESA_ENVIRONMENT
+        self.timeout = timeout or getattr(settings, 'MPESA_TIMEOUT', 30)
+
         # Set API URLs based on environment
-        if self.environment == 'production':
-            self.base_url = 'https://api.safaricom.co.ke'
-        else:
-            self.base_url = 'https://sandbox.safaricom.co.ke'
-    
+        self.base_url = (base_url or getattr(settings, 'MPESA_BASE_URL', '')
+                         or BASE_URLS.get(self.environment, BASE_URLS['sandbox'])).rstrip('/')
+
+        # Connections are kept alive and shared by the status query threads
+        pool_size = pool_size or getattr(settings, 'MPESA_HTTP_POOL_SIZE', 10)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        credentials_id = hashlib.sha256(f'{self.base_url}:{self.consumer_key}'.encode()).hexdigest()[:16]
+        self._token_cache_key = TOKEN_CACHE_KEY.format(credentials_id)
+        self._token_lock_key = TOKEN_LOCK_KEY.format(credentials_id)
+        self._token_lock = threading.Lock()
+        self._token = None
+        self._token_expires_at = 0.0
+
+    @property
+    def is_configured(self):
+        return bool(self.consumer_key and self.consumer_secret)
+
+    # OAuth
+
     def get_access_token(self):
-        """Get OAuth access token from M-Pesa API"""
-        
-        # Check if token exists in cache
-        token = cache.get('mpesa_access_token')
+        """Get OAuth access token from M-Pesa API.
+
+        Served from memory, then the shared cache; only one thread per process,
+        and one process per cache, requests a new token when it expires.
+        """
+        token = self._cached_token()
         if token:
             return token
-        
+        if not self.is_configured:
+            logger.error("M-Pesa credentials are not configured")
+            return None
+
+        with self._token_lock:
+            token = self._cached_token()
+            if token:
+                return token
+
+            # Another process may be refreshing: wait briefly for its token
+            if not cache.add(self._token_lock_key, 1, self.timeout):
+                deadline = time.monotonic() + min(self.timeout, 5)
+                while time.monotonic() < deadline:
+                    time.sleep(0.1)
+                    token = self._cached_token()
+                    if token:
+                        return token
+            try:
+                return self._request_token()
+            finally:
+                cache.delete(self._token_lock_key)
+
+    def _cached_token(self):
+        if self._token and time.monotonic() < self._token_expires_at:
+            return self._token
+        cached = cache.get(self._token_cache_key)
+        if cached:
+            token, expires_at = cached
+            remaining = expires_at - time.time()
+            if remaining > 0:
+                self._token = token
+                self._token_expires_at = time.monotonic() + remaining
+                return token
+        return None
+
+    def _request_token(self):
         try:
             # Prepare credentials
             credentials = f"{self.consumer_key}:{self.consumer_secret}"
             encoded_credentials = base64.b64encode(credentials.encode()).decode()
-            
-            # Request headers
-            headers = {
-                'Authorization': f'Basic {encoded_credentials}',
-                'Content-Type': 'application/json'
-            }
-            
-            # Make request
-            url = f"{self.base_url}/oauth/v1/generate?grant_type=client_credentials"
-            response = requests.get(url, headers=headers, timeout=30)
-            
-            if response.status_code == 200:
-                token_data = response.json()
-                access_token = token_data.get('access_token')
-                expires_in = int(token_data.get('expires_in', 3600))
-                
-                # Cache token (with 5 minute buffer)
-                cache.set('mpesa_access_token', access_token, expires_in - 300)
-                
-                logger.info("M-Pesa access token obtained successfully")
-                return access_token
-            else:
-                logger.error(f"Failed to get M-Pesa access token: {response.text}")
+
+            response = self.session.get(
+                f"{self.base_url}/oauth/v1/generate?grant_type=client_credentials",
+                headers={'Authorization': f'Basic {encoded_credentials}'},
+                timeout=self.timeout,
+            )
+            if response.status_code != 200:
+                logger.error(f"Failed to get M-Pesa access token: HTTP {response.status_code}")
+                return None
+
+            token_data = response.json()
+            access_token = token_data.get('access_token')
+            if not access_token:
+                logger.error("M-Pesa token response did not include an access token")
                 return None
-                
+            lifetime = max(int(token_data.get('expires_in', 3600)) - TOKEN_EXPIRY_MARGIN, 60)
+
+            self._token = access_token
+            self._token_expires_at = time.monotonic() + lifetime
+            cache.set(self._token_cache_key, (access_token, time.time() + lifetime), lifetime)
+            logger.info("M-Pesa access token obtained successfully")
+            return access_token
+
         except Exception as e:
             logger.error(f"Error getting M-Pesa access token: {str(e)}")
             return None
-    
+
+    def invalidate_access_token(self):
+        """Forget the current token, e.g. after Daraja rejected it"""
+        self._token = None
+        self._token_expires_at = 0.0
+        cache.delete(self._token_cache_key)
+
+    def _post(self, path, payload):
+        """POST to Daraja with the bearer token; a rejected token is refreshed once"""
+        for attempt in range(2):
+            access_token = self.get_access_token()
+            if not access_token:
+                return None
+            response = self.session.post(
+                f"{self.base_url}{path}",
+                json=payload,
+                headers={'Authorization': f'Bearer {access_token}'},
+                timeout=self.timeout,
+            )
+            if response.status_code == 401 and attempt == 0:
+                self.invalidate_access_token()
+                continue
+            return response
+
+    # STK Push
+
     def generate_password(self, timestamp=None):
         """Generate password for STK Push"""
         if not timestamp:
             timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-        
+
         password_string = f"{self.shortcode}{self.passkey}{timestamp}"
         password = base64.b64encode(password_string.encode()).decode()
-        
+
         return password, timestamp
-    
+
+    @staticmethod
+    def format_phone_number(phone_number):
+        """Normalise a Kenyan phone number to 254XXXXXXXXX"""
+        phone_number = str(phone_number).strip().replace(' ', '')
+        if phone_number.startswith('0'):
+            phone_number = '254' + phone_number[1:]
+        elif phone_number.startswith('+254'):
+            phone_number = phone_number[1:]
+        elif not phone_number.startswith('254'):
+            phone_number = '254' + phone_number
+        return phone_number
+
     def stk_push(self, phone_number, amount, account_reference, transaction_desc, callback_url=None):
         """
         Initiate STK Push payment request
-        
+
         Args:
             phone_number (str): Customer phone number in format 254XXXXXXXXX
             amount (float): Amount to pay
             account_reference (str): Reference for the transaction (e.g., order number)
             transaction_desc (str): Description of the transaction
             callback_url (str): URL to receive payment callback
-        
+
         Returns:
             dict: Response from M-Pesa API
         """
-        
-        access_token = self.get_access_token()
-        if not access_token:
-            return {'success': False, 'message': 'Failed to get access token'}
-        
         try:
-            # Format phone number
-            if phone_number.startswith('0'):
-                phone_number = '254' + phone_number[1:]
-            elif phone_number.startswith('+254'):
-                phone_number = phone_number[1:]
-            elif not phone_number.startswith('254'):
-                phone_number = '254' + phone_number
-            
+            phone_number = self.format_phone_number(phone_number)
+
             # Generate password and timestamp
             password, timestamp = self.generate_password()
-            
+
             # Default callback URL
             if not callback_url:
                 callback_url = f"{settings.SITE_URL}/api/mpesa/callback/"
-            
-            # Request headers
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
-            }
-            
+
             # Request payload
             payload = {
                 'BusinessShortCode': self.shortcode,
@@ -136,55 +235,51 @@ class MPesaAPI:
                 'AccountReference': account_reference,
                 'TransactionDesc': transaction_desc
             }
-            
+
             # Make STK Push request
-            url = f"{self.base_url}/mpesa/stkpush/v1/processrequest"
-            response = requests.post(url, json=payload, headers=headers, timeout=30)
-            
-            if response.status_code == 200:
-                response_data = response.json()
-                
-                if response_data.get('ResponseCode') == '0':
-                    logger.info(f"STK Push initiated successfully for {phone_number}")
-                    return {
-                        'success': True,
-                        'checkout_request_id': response_data.get('CheckoutRequestID'),
-                        'merchant_request_id': response_data.get('MerchantRequestID'),
-                        'response_code': response_data.get('ResponseCode'),
-                        'response_description': response_data.get('ResponseDescription'),
-                        'customer_message': response_data.get('CustomerMessage')
-                    }
-                else:
-                    logger.error(f"STK Push failed: {response_data}")
-                    return {
-                        'success': False,
-                        'message': response_data.get('ResponseDescription', 'Payment request failed')
-                    }
-            else:
-                logger.error(f"STK Push request failed: {response.text}")
-                return {'success': False, 'message': 'Payment request failed'}
-                
+            response = self._post('/mpesa/stkpush/v1/processrequest', payload)
+            if response is None:
+                return {'success': False, 'message': 'Failed to get access token'}
+
+            response_data = response.json()
+            if response.status_code == 200 and response_data.get('ResponseCode') == '0':
+                logger.info(f"STK Push initiated for {account_reference}")
+                return {
+                    'success': True,
+                    'checkout_request_id': response_data.get('CheckoutRequestID'),
+                    'merchant_request_id': response_data.get('MerchantRequestID'),
+                    'response_code': response_data.get('ResponseCode'),
+                    'response_description': response_data.get('ResponseDescription'),
+                    'customer_message': response_data.get('CustomerMessage')
+                }
+
+            logger.error(f"STK Push failed for {account_reference}: {response_data}")
+            return {
+                'success': False,
+                'message': (response_data.get('ResponseDescription') or response_data.get('errorMessage')
+                            or 'Payment request failed'),
+                'error_code': response_data.get('ResponseCode') or response_data.get('errorCode'),
+            }
+
+        except requests.exceptions.Timeout:
+            logger.error(f"STK Push timed out for {account_reference}")
+            return {'success': False, 'message': 'Network timeout - please check your connection and try again',
+                    'timeout': True}
         except Exception as e:
             logger.error(f"Error initiating STK Push: {str(e)}")
             return {'success': False, 'message': 'Payment request failed'}
-    
+
     def query_stk_status(self, checkout_request_id):
-        """Query STK Push payment status"""
-        
-        access_token = self.get_access_token()
-        if not access_token:
-            return {'success': False, 'message': 'Failed to get access token'}
-        
+        """Query STK Push payment status.
+
+        Returns ``success`` (the query itself worked), the Daraja ``result_code``
+        (int; None while the payment is still being processed), ``result_desc``
+        and the raw response as ``data``.
+        """
         try:
             # Generate password and timestamp
             password, timestamp = self.generate_password()
-            
-            # Request headers
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
-            }
-            
+
             # Request payload
             payload = {
                 'BusinessShortCode': self.shortcode,
@@ -192,37 +287,44 @@ class MPesaAPI:
                 'Timestamp': timestamp,
                 'CheckoutRequestID': checkout_request_id
             }
-            
-            # Make query request
-            url = f"{self.base_url}/mpesa/stkpushquery/v1/query"
-            response = requests.post(url, json=payload, headers=headers, timeout=30)
-            
-            if response.status_code == 200:
-                response_data = response.json()
-                logger.info(f"STK status query successful: {response_data}")
+
+            response = self._post('/mpesa/stkpushquery/v1/query', payload)
+            if response is None:
+                return {'success': False, 'message': 'Failed to get access token'}
+
+            response_data = response.json()
+            if response.status_code == 200 and 'ResultCode' in response_data:
                 return {
                     'success': True,
-                    'data': response_data
+                    'result_code': int(response_data['ResultCode']),
+                    'result_desc': response_data.get('ResultDesc', ''),
+                    'data': response_data,
                 }
-            else:
-                logger.error(f"STK status query failed: {response.text}")
-                return {'success': False, 'message': 'Status query failed'}
-                
+
+            # Daraja answers 500 "The transaction is being processed" until the customer responds
+            return {
+                'success': False,
+                'result_code': None,
+                'message': response_data.get('errorMessage') or response_data.get('ResponseDescription')
+                           or 'Status query failed',
+                'data': response_data,
+            }
+
         except Exception as e:
-            logger.error(f"Error querying STK status: {str(e)}")
-            return {'success': False, 'message': 'Status query failed'}
-    
+            logger.error(f"Error querying STK status for {checkout_request_id}: {str(e)}")
+            return {'success': False, 'result_code': None, 'message': f'Status query failed: {str(e)}'}
+
     def process_callback(self, callback_data):
         """Process M-Pesa callback data"""
         try:
             body = callback_data.get('Body', {})
             stk_callback = body.get('stkCallback', {})
-            
+
             result_code = stk_callback.get('ResultCode')
             result_desc = stk_callback.get('ResultDesc')
             checkout_request_id = stk_callback.get('CheckoutRequestID')
             merchant_request_id = stk_callback.get('MerchantRequestID')
-            
+
             # Initialize response data
             response_data = {
                 'checkout_request_id': checkout_request_id,
@@ -231,16 +333,16 @@ class MPesaAPI:
                 'result_description': result_desc,
                 'success': result_code == 0
             }
-            
+
             if result_code == 0:  # Success
                 # Extract callback metadata
                 callback_metadata = stk_callback.get('CallbackMetadata', {})
                 items = callback_metadata.get('Item', [])
-                
+
                 for item in items:
                     name = item.get('Name')
                     value = item.get('Value')
-                    
+
                     if name == 'Amount':
                         response_data['amount'] = float(value)
                     elif name == 'MpesaReceiptNumber':
@@ -254,13 +356,13 @@ class MPesaAPI:
                             response_data['transaction_date'] = timezone.now()
                     elif name == 'PhoneNumber':
                         response_data['phone_number'] = str(value)
-                
+
                 logger.info(f"M-Pesa payment successful: {response_data}")
             else:
                 logger.warning(f"M-Pesa payment failed: {result_desc}")
-            
+
             return response_data
-            
+
         except Exception as e:
             logger.error(f"Error processing M-Pesa callback: {str(e)}")
             return {
@@ -268,8 +370,62 @@ class MPesaAPI:
                 'error': str(e)
             }
 
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_mpesa_client():
+    """Shared MPesaAPI for the current M-Pesa settings (one session and token per configuration)"""
+    key = (
+        settings.MPESA_CONSUMER_KEY, settings.MPESA_CONSUMER_SECRET, settings.MPESA_SHORTCODE,
+        settings.MPESA_PASSKEY, settings.MPESA_ENVIRONMENT, getattr(settings, 'MPESA_BASE_URL', ''),
+    )
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = MPesaAPI()
+    return client
+
+
+def query_stk_statuses(checkout_request_ids, client=None, concurrency=None, rate_limit=None):
+    """Query many STK pushes concurrently; returns {checkout_request_id: query_stk_status() result}.
+
+    At most ``concurrency`` queries are in flight and no more than
+    ``rate_limit`` start per second (Daraja throttles bursts). Only HTTP runs
+    in the worker threads; callers apply the results on their own connection.
+    """
+    from .email_outbox import RateLimiter
+
+    client = client or get_mpesa_client()
+    concurrency = concurrency or getattr(settings, 'MPESA_QUERY_CONCURRENCY', 8)
+    limiter = RateLimiter(getattr(settings, 'MPESA_QUERY_RATE_LIMIT', 20) if rate_limit is None else rate_limit)
+    checkout_request_ids = list(dict.fromkeys(checkout_request_ids))
+    if not checkout_request_ids:
+        return {}
+
+    # Fetch the token once up front instead of racing for it in every thread
+    client.get_access_token()
+
+    def query(checkout_request_id):
+        limiter.wait()
+        return client.query_stk_status(checkout_request_id)
+
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(checkout_request_ids))) as executor:
+        return dict(zip(checkout_request_ids, executor.map(query, checkout_request_ids)))
+
+
 # Global M-Pesa API instance
-mpesa_api = MPesaAPI()
+class _SharedClient:
+    """Backwards-compatible ``mpesa_api`` that resolves the shared client lazily"""
+
+    def __getattr__(self, name):
+        return getattr(get_mpesa_client(), name)
+
+
+mpesa_api = _SharedClient()
 
 # Helper functions for common operations
 def initiate_payment(phone_number, amount, order_number, description):
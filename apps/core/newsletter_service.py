@@ -22,8 +22,12 @@ class NewsletterService:
     def __init__(self):
         self.email_service = EmailService()
     
-    def send_campaign(self, campaign, user=None):
-        """Send a newsletter campaign to all target subscribers"""
+    def send_campaign(self, campaign, user=None, background=None):
+        """Start sending a newsletter campaign to all target subscribers.
+
+        Send logs are created up front and delivery runs outside the request
+        (see campaign_dispatch); progress is shown on the campaign detail page.
+        """
         try:
             # Validate campaign
             if not campaign.can_send():
@@ -40,35 +44,19 @@ class NewsletterService:
                     'error': 'No active subscribers found for target audience.'
                 }
             
-            # Update campaign status
-            campaign.status = 'sending'
-            campaign.save()
-            
-            # Send to each subscriber
-            sent_count = 0
-            failed_count = 0
-            
-            for subscriber in subscribers:
-                try:
-                    result = self.send_to_subscriber(campaign, subscriber)
-                    if result['success']:
-                        sent_count += 1
-                    else:
-                        failed_count += 1
-                        logger.error(f"Failed to send to {subscriber.email}: {result['error']}")
-                        
-                except Exception as e:
-                    failed_count += 1
-                    logger.error(f"Exception sending to {subscriber.email}: {str(e)}")
-            
-            # Update campaign status and stats
-            campaign.status = 'sent'
-            campaign.sent_at = timezone.now()
-            campaign.total_recipients = subscribers.count()  # Total targeted subscribers
-            campaign.total_sent = sent_count  # Successfully sent count
-            campaign.total_failed = failed_count  # Failed sends
-            campaign.save()
-            
+            from .campaign_dispatch import start_campaign
+            result = start_campaign(campaign, background=background, user=user)
+            campaign.refresh_from_db()
+
+            if result is None:
+                return {
+                    'success': True,
+                    'recipients': campaign.total_recipients,
+                    'failed': 0,
+                    'message': f'Campaign is being sent to {campaign.total_recipients} subscribers'
+                }
+
+            sent_count, failed_count = result
             return {
                 'success': True,
                 'recipients': sent_count,
@@ -77,8 +65,9 @@ class NewsletterService:
             }
             
         except Exception as e:
-            campaign.status = 'draft'  # Reset status on error
-            campaign.save()
+            # Reset status on error unless some subscribers were already reached
+            if not campaign.send_logs.filter(delivery_status='sent').exists():
+                NewsletterCampaign.objects.filter(pk=campaign.pk).update(status='draft')
             logger.error(f"Campaign send failed: {str(e)}")
             return {
                 'success': False,
@@ -190,38 +179,19 @@ class NewsletterService:
         return f"{site_url}{reverse('core:track_click', kwargs={'log_id': send_log.id})}"
     
     def track_email_open(self, log_id):
-        """Track email open"""
-        try:
-            send_log = NewsletterSendLog.objects.get(id=log_id)
-            if not send_log.opened_at:
-                send_log.opened_at = timezone.now()
-                send_log.save()
-                
-                # Update campaign stats
-                campaign = send_log.campaign
-                campaign.opens_count += 1
-                campaign.save()
-                
-            return True
-        except NewsletterSendLog.DoesNotExist:
-            return False
+        """Record an email open; folded into the send log by flush_tracking_events"""
+        from .newsletter_tracking import record_event
+        return record_event(log_id, 'open')
     
     def track_email_click(self, log_id, redirect_url=None):
-        """Track email click"""
-        try:
-            send_log = NewsletterSendLog.objects.get(id=log_id)
-            if not send_log.clicked_at:
-                send_log.clicked_at = timezone.now()
-                send_log.save()
-                
-                # Update campaign stats
-                campaign = send_log.campaign
-                campaign.clicks_count += 1
-                campaign.save()
-            
-            return redirect_url or campaign.call_to_action_url
-        except NewsletterSendLog.DoesNotExist:
-            return None
+        """Record an email click and return the URL to redirect to"""
+        from .newsletter_tracking import record_event
+        record_event(log_id, 'click')
+        if redirect_url:
+            return redirect_url
+        return NewsletterSendLog.objects.filter(pk=log_id).values_list(
+            'campaign__call_to_action_url', flat=True
+        ).first()
     
     def process_unsubscribe(self, subscriber_id, token):
         """Process newsletter unsubscribe"""
@@ -0,0 +1,87 @@
+"""
+Buffered newsletter open/click tracking.
+
+The tracking pixel and click redirect only append a NewsletterTrackingEvent
+row, so concurrent opens of one campaign never contend on the campaign row.
+flush_tracking_events() (run by the flush_newsletter_tracking command) folds the
+events into NewsletterSendLog.opened_at/clicked_at and adds the number of first
+opens/clicks to the campaign counters with one F() update per campaign.
+"""
+
+import logging
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .models import NewsletterCampaign, NewsletterSendLog, NewsletterTrackingEvent
+
+logger = logging.getLogger(__name__)
+
+FLUSH_BATCH_SIZE = getattr(settings, 'NEWSLETTER_TRACKING_FLUSH_BATCH_SIZE', 2000)
+
+COUNTERS = {
+    'open': ('opened_at', 'opens_count'),
+    'click': ('clicked_at', 'clicks_count'),
+}
+
+
+def record_event(log_id, event_type):
+    """Append a tracking hit for an existing send log; returns False for unknown ids"""
+    # The tracking URLs are public, so do not buffer hits for made-up ids
+    if not NewsletterSendLog.objects.filter(pk=log_id).exists():
+        return False
+    NewsletterTrackingEvent.objects.create(send_log_id=log_id, event_type=event_type)
+    return True
+
+
+def _fold(first_seen, event_type):
+    """Set the timestamp on logs seen for the first time and bump campaign counters"""
+    if not first_seen:
+        return 0
+    field, counter = COUNTERS[event_type]
+    logs = list(
+        NewsletterSendLog.objects.select_for_update()
+        .filter(pk__in=first_seen, **{f'{field}__isnull': True})
+        .only('pk', 'campaign_id')
+    )
+    if not logs:
+        return 0
+
+    for log in logs:
+        setattr(log, field, first_seen[log.pk])
+    NewsletterSendLog.objects.bulk_update(logs, [field])
+
+    for campaign_id, count in Counter(log.campaign_id for log in logs).items():
+        NewsletterCampaign.objects.filter(pk=campaign_id).update(**{counter: F(counter) + count})
+    return len(logs)
+
+
+def flush_tracking_events(batch_size=FLUSH_BATCH_SIZE):
+    """Fold buffered events into send logs and campaign totals; returns events processed"""
+    processed = 0
+    while True:
+        with transaction.atomic():
+            events = list(
+                NewsletterTrackingEvent.objects.order_by('pk')
+                .values_list('pk', 'send_log_id', 'event_type', 'created_at')[:batch_size]
+            )
+            if not events:
+                break
+
+            first_seen = {event_type: {} for event_type in COUNTERS}
+            for _, log_id, event_type, created_at in events:
+                seen = first_seen.get(event_type)
+                if seen is not None and (log_id not in seen or created_at < seen[log_id]):
+                    seen[log_id] = created_at
+
+            opens = _fold(first_seen['open'], 'open')
+            clicks = _fold(first_seen['click'], 'click')
+            NewsletterTrackingEvent.objects.filter(pk__in=[event[0] for event in events]).delete()
+
+        processed += len(events)
+        logger.info(f"Flushed {len(events)} tracking events ({opens} new opens, {clicks} new clicks)")
+        if len(events) < batch_size:
+            break
+    return processed
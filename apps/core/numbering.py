@@ -0,0 +1,115 @@
+"""
+Shared document number allocator.
+
+All yearly sequence models (QuotationSequence, OrderSequence, SaleSequence,
+PurchaseOrderSequence, ProjectSequence and core.DocumentSequence) keep a
+``last_number`` counter per year. Numbers are taken with a single atomic
+``UPDATE ... SET last_number = last_number + N`` so concurrent requests never
+read the same value, and busy callers (POS terminals) can reserve a block of
+numbers per process. Unused numbers of a block are simply skipped, so the
+numbering is unique and increasing per process but may contain gaps.
+
+A block is reserved inside the caller's transaction (e.g. a POS checkout),
+so the caller gets the first number straight away and the rest of the block is
+only kept for later calls once that transaction commits. If it rolls back, the
+sequence row is restored and the range may be reserved again elsewhere.
+"""
+
+import threading
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+
+def reserve_numbers(sequence_model, count=1, seed=None, **lookup):
+    """Atomically reserve ``count`` numbers and return the last one reserved.
+
+    ``lookup`` selects the counter row (e.g. ``year=2025``); the row is created
+    on first use, starting from ``seed()`` if given (the highest number
+    already issued) so existing documents are never renumbered.
+    """
+    if count < 1:
+        raise ValueError('count must be at least 1')
+
+    with transaction.atomic():
+        updated = sequence_model.objects.filter(**lookup).update(last_number=F('last_number') + count)
+        if not updated:
+            start = seed() if seed else 0
+            try:
+                with transaction.atomic():
+                    sequence_model.objects.create(last_number=start + count, **lookup)
+                return start + count
+            except IntegrityError:
+                # Another process created the row first; take from it instead
+                sequence_model.objects.filter(**lookup).update(last_number=F('last_number') + count)
+        # The UPDATE holds the row lock until commit, so this read sees our value
+        return sequence_model.objects.filter(**lookup).values_list('last_number', flat=True).get()
+
+
+class NumberAllocator:
+    """Hands out document numbers, optionally from per-process reserved blocks"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._blocks = {}
+
+    def next_number(self, sequence_model, year=None, block_size=1, seed=None, **lookup):
+        """Return the next number for ``sequence_model`` in ``year``"""
+        if year is None:
+            year = timezone.now().year
+        lookup['year'] = year
+
+        if block_size <= 1:
+            return reserve_numbers(sequence_model, seed=seed, **lookup)
+
+        key = (sequence_model._meta.label, tuple(sorted(lookup.items())))
+        with self._lock:
+            block = self._blocks.get(key)
+            if block and block[0] <= block[1]:
+                number = block[0]
+                block[0] += 1
+                return number
+
+        last = reserve_numbers(sequence_model, count=block_size, seed=seed, **lookup)
+        first = last - block_size + 1
+        # Runs immediately outside a transaction; dropped if the caller's transaction rolls back
+        transaction.on_commit(lambda: self._keep_block(key, [first + 1, last]))
+        return first
+
+    def _keep_block(self, key, block):
+        with self._lock:
+            current = self._blocks.get(key)
+            # A block committed meanwhile by another thread is used up first; this one becomes a gap
+            if not current or current[0] > current[1]:
+                self._blocks[key] = block
+
+    def reset(self):
+        """Forget reserved blocks (their remaining numbers become gaps)"""
+        with self._lock:
+            self._blocks.clear()
+
+
+allocator = NumberAllocator()
+
+
+def next_number(sequence_model, year=None, block_size=1, seed=None, **lookup):
+    """Return the next number from the shared process allocator"""
+    return allocator.next_number(sequence_model, year=year, block_size=block_size, seed=seed, **lookup)
+
+
+def next_document_number(name, year=None, seed=None):
+    """Next number of a core.DocumentSequence counter (e.g. 'financial.transaction')"""
+    from .models import DocumentSequence
+    return allocator.next_number(DocumentSequence, year=year, seed=seed, name=name)
+
+
+def max_issued_number(queryset, field, prefix):
+    """Seed helper: highest trailing number among ``field`` values starting with ``prefix``"""
+    last = queryset.filter(**{f'{field}__startswith': prefix}).order_by(f'-{field}').values_list(field, flat=True).first()
+    if not last:
+        return 0
+    try:
+        return int(last.split('-')[-1])
+    except ValueError:
+        return 0
@@ -0,0 +1,176 @@
+"""
+Server-side page and fragment cache for the public marketing pages.
+
+The home, about, services, help, legal, project showcase and blog pages are
+mostly hit by anonymous visitors, and every hit recomputed project aggregates,
+featured products and testimonials. They are now cached in the ``pages`` cache
+(settings.CACHES), a file-based cache by default so that every process on the
+host shares one copy (a database cache works too, see PAGE_CACHE_BACKEND).
+
+Sections and invalidation
+    Cached content depends on named sections: 'site' (company settings, legal
+    documents, holiday offers - everything in the base template) plus
+    'projects', 'products', 'blog' and 'testimonials'. Each section is a tag
+    (tiered_cache.py) with a version token in the pages cache; saving or
+    deleting any model listed in SECTION_MODELS rotates the tokens of its
+    sections (apps/core/signals.py).
+    Tokens are part of every key, so stale entries are never read again and
+    simply expire.
+
+Full pages (@cache_public_page)
+    Only GET/HEAD requests from anonymous visitors without pending flash
+    messages are served from or stored in the cache. The key covers the path,
+    the query string, the cookies in PAGE_CACHE_VARY_COOKIES (cookie consent),
+    the date (for holiday offers and urgency banners) and the page's section
+    tokens. Only the body of 200 responses that set no cookies is stored, with
+    CSRF form tokens replaced by a placeholder that is filled with the
+    visitor's own token when the page is served.
+
+Fragments
+    section_versions() is put in the homepage context as ``page_cache`` for
+    {% cache %} tags, and cached_value() caches computed data (the homepage
+    statistics), so logged-in visitors, who always get a fresh page, still
+    reuse the expensive parts.
+"""
+
+import hashlib
+import re
+from datetime import date
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+
+from .tiered_cache import invalidate_tags, tag_versions
+
+PAGE_CACHE_ALIAS = getattr(settings, 'PAGE_CACHE_ALIAS', 'pages')
+PAGE_CACHE_TIMEOUT = getattr(settings, 'PAGE_CACHE_TIMEOUT', 60 * 10)
+FRAGMENT_CACHE_TIMEOUT = getattr(settings, 'FRAGMENT_CACHE_TIMEOUT', 60 * 60)
+VARY_COOKIES = tuple(getattr(settings, 'PAGE_CACHE_VARY_COOKIES', ('cookie_consent',)))
+
+PAGE_KEY = 'page_cache:page:{digest}'
+VALUE_KEY = 'page_cache:value:{name}:{digest}'
+
+SECTION_MODELS = {
+    'core.CompanySettings': ('site',),
+    'core.LegalDocument': ('site',),
+    'core.KenyanHoliday': ('site',),
+    'core.HolidayOffer': ('site',),
+    'core.VideoTutorial': ('site',),
+    'core.ProjectShowcase': ('projects',),
+    'core.Testimonial': ('testimonials',),
+    'projects.Project': ('projects',),
+    'products.Product': ('products',),
+    'products.ProductCategory': ('products',),
+    'products.ProductImage': ('products',),
+    'products.ProductReview': ('testimonials',),
+    'blog.Post': ('blog',),
+    'blog.Comment': ('blog',),
+    'blog.Category': ('blog',),
+    'blog.Tag': ('blog',),
+    'blog.BlogBanner': ('blog',),
+}
+SECTIONS = ('site', 'projects', 'products', 'blog', 'testimonials')
+
+CSRF_PLACEHOLDER = b'__page_cache_csrf_token__'
+CSRF_INPUT_RE = re.compile(rb'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+
+
+def page_cache():
+    return caches[PAGE_CACHE_ALIAS]
+
+
+def section_versions(sections=SECTIONS):
+    """{section: version token} for ``sections``, creating missing tokens"""
+    return tag_versions(sections, using=page_cache())
+
+
+def invalidate_sections(*sections):
+    """Rotate the version tokens of ``sections`` so their cached pages and fragments are rebuilt"""
+    invalidate_tags(*sections, using=page_cache())
+
+
+def sections_for_model(model):
+    return SECTION_MODELS.get(model._meta.label, ())
+
+
+def _digest(*parts):
+    return hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def cached_value(name, sections, compute, timeout=FRAGMENT_CACHE_TIMEOUT):
+    """compute(), cached until one of ``sections`` changes"""
+    versions = section_versions(sections)
+    key = VALUE_KEY.format(name=name, digest=_digest(*sorted(versions.items())))
+    value = page_cache().get(key)
+    if value is None:
+        value = compute()
+        page_cache().set(key, value, timeout)
+    return value
+
+
+def _cacheable_request(request):
+    return (
+        request.method in ('GET', 'HEAD')
+        and not request.user.is_authenticated
+        # Flash messages are shown once and must not end up in a shared page
+        and not request.COOKIES.get(getattr(settings, 'MESSAGE_COOKIE_NAME', 'messages'))
+    )
+
+
+def page_key(request, sections):
+    versions = section_versions(('site',) + tuple(sections))
+    return PAGE_KEY.format(digest=_digest(
+        request.path,
+        request.META.get('QUERY_STRING', ''),
+        *(request.COOKIES.get(name, '') for name in VARY_COOKIES),
+        date.today().isoformat(),
+        *sorted(versions.items()),
+    ))
+
+
+def _serve(request, entry):
+    content = entry['content'].replace(CSRF_PLACEHOLDER, get_token(request).encode())
+    response = HttpResponse(content, content_type=entry['content_type'])
+    response['X-Page-Cache'] = 'hit'
+    # Revalidate rather than no-store: pages carry the visitor's CSRF token, so private only
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def cache_public_page(*sections, timeout=None, on_hit=None):
+    """
+    View decorator caching the page for anonymous visitors until one of
+    ``sections`` (or 'site') changes. ``on_hit(request, meta)`` is called for
+    pages served from the cache, with the dict the view left in
+    ``response.page_cache_meta`` (e.g. to keep counting blog post views).
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapped(request, *args, **kwargs):
+            if not _cacheable_request(request):
+                return view_func(request, *args, **kwargs)
+
+            key = page_key(request, sections)
+            entry = page_cache().get(key)
+            if entry is not None:
+                if on_hit is not None:
+                    on_hit(request, entry['meta'])
+                return _serve(request, entry)
+
+            response = view_func(request, *args, **kwargs)
+            if hasattr(response, 'render') and callable(response.render):
+                response = response.render()
+            if response.status_code == 200 and not response.streaming and not response.cookies:
+                page_cache().set(key, {
+                    'content': CSRF_INPUT_RE.sub(rb'\1' + CSRF_PLACEHOLDER + rb'\2', response.content),
+                    'content_type': response['Content-Type'],
+                    'meta': getattr(response, 'page_cache_meta', {}),
+                }, PAGE_CACHE_TIMEOUT if timeout is None else timeout)
+                response['X-Page-Cache'] = 'miss'
+                response['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapped
+    return decorator
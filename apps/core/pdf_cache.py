@@ -0,0 +1,104 @@
+"""
+Content-addressed cache for generated PDF documents.
+
+Quotation and receipt PDFs are drawn with ReportLab, which is slow enough to
+matter when a customer re-opens the same quote or an email carries it as an
+attachment. A document is rendered once per distinct set of inputs: the caller
+lists everything the PDF shows (document fields, line items, the company
+branding it prints), the inputs are hashed, and the file is stored under a name
+containing the hash. Unchanged documents are served from disk with an ETag and
+Last-Modified header so browsers can revalidate with a 304; any change to the
+inputs produces a new hash, a fresh render, and removal of the stale file.
+
+    path, digest = get_or_render(cache_dir('quotations'), quotation.quotation_number,
+                                 inputs, lambda target: draw_pdf(target))
+    return pdf_response(request, path, digest, 'quotation.pdf')
+"""
+
+import glob
+import hashlib
+import json
+import logging
+import os
+import uuid
+
+from django.conf import settings
+from django.http import FileResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+logger = logging.getLogger(__name__)
+
+DIGEST_LENGTH = 20
+
+
+def cache_dir(namespace):
+    """Directory for one kind of document under PDF_CACHE_ROOT (outside MEDIA_ROOT)"""
+    root = getattr(settings, 'PDF_CACHE_ROOT', os.path.join(settings.BASE_DIR, 'pdf_cache'))
+    return os.path.join(root, namespace)
+
+
+def field_values(instance, fields):
+    """Values of ``fields`` on ``instance`` for use as fingerprint inputs; None when instance is None"""
+    if instance is None:
+        return None
+    return [getattr(instance, field, None) for field in fields]
+
+
+def fingerprint(inputs):
+    """Stable hash of JSON-like inputs; dates, decimals and files hash by their string form"""
+    encoded = json.dumps(inputs, sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def get_or_render(directory, identifier, inputs, render):
+    """Return ``(path, digest)`` of the document for ``inputs``.
+
+    ``render(path)`` is only called when no file exists for the current inputs.
+    The file is written under a temporary name and moved into place, so
+    concurrent requests never serve a partial PDF.
+    """
+    digest = fingerprint(inputs)
+    path = os.path.join(directory, f'{identifier}-{digest[:DIGEST_LENGTH]}.pdf')
+    if os.path.exists(path):
+        return path, digest
+
+    os.makedirs(directory, exist_ok=True)
+    temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    try:
+        render(temp_path)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    logger.info(f"Rendered PDF {os.path.basename(path)}")
+
+    # Earlier versions of this document are no longer reachable
+    for stale in glob.glob(os.path.join(glob.escape(directory), f'{glob.escape(identifier)}-*.pdf')):
+        if stale != path:
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+    return path, digest
+
+
+def pdf_response(request, path, version, filename, as_attachment=True):
+    """Serve a cached PDF, answering conditional requests with 304 Not Modified.
+
+    ``version`` becomes the ETag: the content digest, or the digest-bearing file name.
+    """
+    etag = quote_etag(version)
+    last_modified = int(os.path.getmtime(path))
+    if request is not None:
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return not_modified
+
+    response = FileResponse(open(path, 'rb'), content_type='application/pdf',
+                            as_attachment=as_attachment, filename=filename)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # Documents can be private: let the browser keep a copy but revalidate every time
+    response['Cache-Control'] = 'private, no-cache'
+    return response
@@ -0,0 +1,117 @@
+"""
+Process-wide cache for the CompanySettings singleton.
+
+CompanySettings.get_settings() issues a get_or_create query on every call and
+is used on every page render (context processor), every POS line item and every
+cart total. The snapshot below is held in process memory and in the shared
+Django cache, keyed by a version token that is rotated whenever the settings row
+is saved or deleted (see apps/core/signals.py).
+"""
+
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+
+VERSION_CACHE_KEY = 'core:company_settings:version'
+DATA_CACHE_KEY = 'core:company_settings:data:{version}'
+
+# How long a process trusts its in-memory snapshot before re-checking the shared
+# version token. Saves in the same process invalidate immediately.
+LOCAL_TTL = getattr(settings, 'COMPANY_SETTINGS_LOCAL_TTL', 30)
+SHARED_TTL = getattr(settings, 'COMPANY_SETTINGS_CACHE_TIMEOUT', 60 * 60 * 24)
+
+
+class CompanySettingsSnapshot:
+    """Read-only view of a CompanySettings row.
+
+    Attribute access is delegated to the underlying model instance so templates
+    keep working (``company.logo.url``, ``company.get_whatsapp_url`` ...), while
+    assignment is refused to stop callers mutating the shared copy.
+    """
+
+    __slots__ = ('_instance', 'version')
+
+    def __init__(self, instance, version):
+        object.__setattr__(self, '_instance', instance)
+        object.__setattr__(self, 'version', version)
+
+    def __getattr__(self, name):
+        return getattr(self._instance, name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('CompanySettingsSnapshot is read-only; edit CompanySettings.get_settings() instead')
+
+    def __str__(self):
+        return str(self._instance)
+
+    def __repr__(self):
+        return f'<CompanySettingsSnapshot version={self.version} name={self._instance.name!r}>'
+
+    @property
+    def vat_rate(self) -> Decimal:
+        """VAT rate percentage as a Decimal (e.g. Decimal('16.00'))"""
+        return Decimal(str(self._instance.vat_rate))
+
+    @property
+    def vat_multiplier(self) -> Decimal:
+        """Multiplier used to strip VAT from VAT-inclusive prices"""
+        return Decimal('1') + (self.vat_rate / Decimal('100'))
+
+    @property
+    def installation_fee(self) -> Decimal:
+        return Decimal(str(self._instance.installation_fee))
+
+
+_lock = threading.Lock()
+_local = {'snapshot': None, 'checked_at': 0.0}
+
+
+def _load_from_db():
+    from .models import CompanySettings
+    return CompanySettings.get_settings()
+
+
+def _current_version():
+    version = cache.get(VERSION_CACHE_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        # add() keeps a token another process may have published meanwhile
+        if not cache.add(VERSION_CACHE_KEY, version, SHARED_TTL):
+            version = cache.get(VERSION_CACHE_KEY) or version
+    return version
+
+
+def get_company_settings() -> CompanySettingsSnapshot:
+    """Return the cached, read-only company settings snapshot"""
+    now = time.monotonic()
+    snapshot = _local['snapshot']
+    if snapshot is not None and now - _local['checked_at'] < LOCAL_TTL:
+        return snapshot
+
+    # No lock is held while loading: get_settings() may create the row, and the
+    # resulting post_save signal calls invalidate_company_settings().
+    version = _current_version()
+    if snapshot is None or snapshot.version != version:
+        data_key = DATA_CACHE_KEY.format(version=version)
+        instance = cache.get(data_key)
+        if instance is None:
+            instance = _load_from_db()
+            cache.set(data_key, instance, SHARED_TTL)
+        snapshot = CompanySettingsSnapshot(instance, version)
+
+    with _lock:
+        _local['snapshot'] = snapshot
+        _local['checked_at'] = now
+    return snapshot
+
+
+def invalidate_company_settings():
+    """Drop the local snapshot and publish a new version token to other processes"""
+    with _lock:
+        _local['snapshot'] = None
+        _local['checked_at'] = 0.0
+    cache.set(VERSION_CACHE_KEY, uuid.uuid4().hex, SHARED_TTL)
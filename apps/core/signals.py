@@ -2,16 +2,51 @@
 Signal handlers for automated email and in-app notifications
 """
 
-from django.db.models.signals import post_save, pre_save
+from django.db import transaction
+from django.db.models.signals import post_save, pre_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth.signals import user_logged_in
 from apps.core.email_utils import EmailService
-from apps.core.models import Notification
+from apps.core.models import Notification, CompanySettings, KenyanHoliday, HolidayOffer
+from apps.core.settings_cache import invalidate_company_settings
+from apps.core.holiday_calendar import invalidate_holiday_calendar
+from apps.core.page_cache import SECTION_MODELS, invalidate_sections, sections_for_model
 from apps.accounts.models import update_employee_id_on_role_change
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Company Settings Cache Invalidation
+@receiver(post_save, sender=CompanySettings)
+@receiver(post_delete, sender=CompanySettings)
+def invalidate_company_settings_cache(sender, instance, **kwargs):
+    """Rotate the cached settings snapshot when the settings row changes"""
+    invalidate_company_settings()
+    # Invalidate again once committed so no process re-caches pre-commit data
+    transaction.on_commit(invalidate_company_settings)
+
+# Holiday Calendar Invalidation
+@receiver(post_save, sender=KenyanHoliday)
+@receiver(post_delete, sender=KenyanHoliday)
+@receiver(post_save, sender=HolidayOffer)
+@receiver(post_delete, sender=HolidayOffer)
+def invalidate_holiday_calendar_cache(sender, instance, **kwargs):
+    """Rebuild the holiday offer calendar when a holiday or offer changes"""
+    invalidate_holiday_calendar()
+    transaction.on_commit(invalidate_holiday_calendar)
+
+# Public Page Cache Invalidation
+def invalidate_public_page_cache(sender, instance, **kwargs):
+    """Rebuild cached marketing pages and fragments that show the saved model"""
+    sections = sections_for_model(sender)
+    invalidate_sections(*sections)
+    transaction.on_commit(lambda: invalidate_sections(*sections))
+
+# Connected per model: a receiver for every sender would disable fast deletes site-wide
+for label in SECTION_MODELS:
+    post_save.connect(invalidate_public_page_cache, sender=label, dispatch_uid=f'page_cache_save_{label}')
+    post_delete.connect(invalidate_public_page_cache, sender=label, dispatch_uid=f'page_cache_delete_{label}')
+
 # User Registration and Authentication Signals
 @receiver(post_save, sender='accounts.User')
 def send_welcome_email(sender, instance, created, **kwargs):
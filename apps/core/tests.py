@@ -1,3 +1,763 @@
-from django.test import TestCase
+import shutil
+import socketserver
+import tempfile
+import threading
+from datetime import date
+from decimal import Decimal
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import caches
+from django.db import OperationalError, connection, connections, transaction
+from django.http import HttpResponse
+from django.template import engines
+from django.test import TestCase, TransactionTestCase, RequestFactory, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import AnonymousUser
+
+from apps.core.context_processors import active_discounts, company_info
+from apps.core.email_outbox import OutboxWorker
+from apps.core.middleware import ContextProcessorTimingMiddleware
+from apps.core.lazy_context import processor_stats, skip_context_processors
+from apps.core.job_queue import (
+    Heartbeat, claim_next_job, enqueue_job, register_job, result_path, run_job, run_pending_jobs,
+)
+from apps.core.email_utils import EmailService
+from apps.core.campaign_dispatch import CampaignDispatcher
+from apps.core.views import HomeView
+from apps.core.holiday_calendar import HolidayCalendar, get_holiday_calendar, invalidate_holiday_calendar
+from apps.core.models import (
+    BackgroundJob, CompanySettings, DocumentSequence, EmailOutbox, HolidayOffer, KenyanHoliday, NewsletterCampaign,
+    NewsletterSendLog, NewsletterSubscriber, NewsletterTrackingEvent, Testimonial
+)
+from apps.core.newsletter_service import NewsletterService
+from apps.core.page_cache import cache_public_page, cached_value
+from apps.core.newsletter_tracking import flush_tracking_events
+from apps.core.numbering import NumberAllocator, next_document_number
+from apps.core.settings_cache import get_company_settings, invalidate_company_settings
+from apps.core.tiered_cache import TieredCache, get_tagged, invalidate_tags, set_tagged, versioned_key
+
+
+class CompanySettingsCacheTest(TestCase):
+    """Tests for the cached company settings snapshot"""
+
+    def setUp(self):
+        invalidate_company_settings()
+
+    def test_snapshot_is_served_without_queries_once_warm(self):
+        get_company_settings()
+        with self.assertNumQueries(0):
+            snapshot = get_company_settings()
+        self.assertEqual(snapshot.name, 'The Olivian Group Limited')
+        self.assertIsInstance(snapshot.vat_rate, Decimal)
+
+    def test_save_invalidates_snapshot(self):
+        first = get_company_settings()
+        settings = CompanySettings.get_settings()
+        settings.vat_rate = Decimal('14.00')
+        settings.save()
+
+        second = get_company_settings()
+        self.assertNotEqual(first.version, second.version)
+        self.assertEqual(second.vat_rate, Decimal('14.00'))
+        self.assertEqual(second.vat_multiplier, Decimal('1.14'))
+
+    def test_snapshot_is_read_only(self):
+        with self.assertRaises(AttributeError):
+            get_company_settings().name = 'Changed'
+
+
+class CompanySettingsQueryBenchmark(TestCase):
+    """Query count per page render for the company_info context processor"""
+
+    def setUp(self):
+        CompanySettings.get_settings()
+        invalidate_company_settings()
+        self.request = RequestFactory().get('/')
+        self.request.user = AnonymousUser()
+
+    def test_context_processor_query_count(self):
+        # Before: every render ran CompanySettings.get_settings()
+        with CaptureQueriesContext(connection) as before:
+            CompanySettings.get_settings()
+
+        company_info.__wrapped__(self.request)  # warm the snapshot
+        with CaptureQueriesContext(connection) as after:
+            for _ in range(10):
+                company_info.__wrapped__(self.request)
+
+        self.assertEqual(len(before), 1)
+        self.assertEqual(len(after), 0)
+
+
+class NumberAllocatorStressTest(TransactionTestCase):
+    """Concurrent document number allocation must never hand out duplicates"""
+
+    threads = 8
+    per_thread = 25
+
+    def _run_threads(self, allocate):
+        results, errors = [], []
+        lock = threading.Lock()
+
+        def allocate_with_retry():
+            # The in-memory SQLite test database reports concurrent writers as
+            # "table is locked" instead of waiting; MySQL blocks on the row lock
+            while True:
+                try:
+                    return allocate()
+                except OperationalError as e:
+                    if 'locked' not in str(e):
+                        raise
+
+        def worker():
+            try:
+                numbers = [allocate_with_retry() for _ in range(self.per_thread)]
+                with lock:
+                    results.extend(numbers)
+            except Exception as e:  # pragma: no cover - reported below
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        workers = [threading.Thread(target=worker) for _ in range(self.threads)]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        self.assertEqual(errors, [])
+        return results
+
+    def test_concurrent_allocation_is_unique(self):
+        numbers = self._run_threads(lambda: next_document_number('test.stress', year=2030))
+        total = self.threads * self.per_thread
+        self.assertEqual(len(set(numbers)), total)
+        self.assertEqual(sorted(numbers), list(range(1, total + 1)))
+
+    def test_block_reservation_is_unique_and_gap_tolerant(self):
+        allocator = NumberAllocator()
+        numbers = self._run_threads(
+            lambda: allocator.next_number(DocumentSequence, year=2030, block_size=10, name='test.blocks')
+        )
+        self.assertEqual(len(set(numbers)), self.threads * self.per_thread)
+
+        # A second process-level allocator continues after the reserved blocks
+        other = NumberAllocator().next_number(DocumentSequence, year=2030, block_size=10, name='test.blocks')
+        self.assertGreater(other, max(numbers))
+
+    def test_block_is_dropped_when_the_reservation_rolls_back(self):
+        allocator = NumberAllocator()
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                self.assertEqual(
+                    allocator.next_number(DocumentSequence, year=2030, block_size=10, name='test.rollback'), 1
+                )
+                raise RuntimeError('checkout failed')
+
+        # The range went back to the sequence, so another process may now own it
+        other = NumberAllocator().next_number(DocumentSequence, year=2030, block_size=10, name='test.rollback')
+        self.assertEqual(other, 1)
+        self.assertEqual(
+            allocator.next_number(DocumentSequence, year=2030, block_size=10, name='test.rollback'), 11
+        )
+
+        with transaction.atomic():
+            allocator.next_number(DocumentSequence, year=2030, block_size=10, name='test.committed')
+        self.assertEqual(
+            allocator.next_number(DocumentSequence, year=2030, block_size=10, name='test.committed'), 2
+        )
+
+    def test_seed_continues_existing_numbering(self):
+        number = next_document_number('test.seeded', year=2030, seed=lambda: 41)
+        self.assertEqual(number, 42)
+
+
+class _StandInSMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP to accept mail; recipients containing 'reject' are refused"""
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost stand-in')
+        while True:
+            line = self.rfile.readline().decode().strip()
+            command = line[:4].upper()
+            if not line or command == 'QUIT':
+                self.reply('221 bye')
+                return
+            if command == 'EHLO':
+                self.reply('250-localhost')
+                self.reply('250 8BITMIME')
+            elif command == 'RCPT' and 'reject' in line:
+                self.reply('550 mailbox unavailable')
+            elif command == 'DATA':
+                self.reply('354 go ahead')
+                data = []
+                while (chunk := self.rfile.readline()) not in (b'.\r\n', b''):
+                    data.append(chunk)
+                self.server.messages.append(b''.join(data))
+                self.reply('250 queued')
+            else:
+                self.reply('250 OK')
+
+
+class StandInSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _StandInSMTPHandler)
+        self.connections = 0
+        self.messages = []
+
+
+class StandInSMTPMixin:
+    """Points the SMTP backend at a local StandInSMTPServer for the test"""
+
+    def start_smtp_server(self):
+        self.server = StandInSMTPServer()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        smtp = override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST='127.0.0.1', EMAIL_PORT=self.server.server_address[1],
+            EMAIL_USE_SSL=False, EMAIL_USE_TLS=False, EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='',
+        )
+        smtp.enable()
+        self.addCleanup(smtp.disable)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+
+class EmailOutboxTest(StandInSMTPMixin, TestCase):
+    """Tests for the queued email path and the outbox worker"""
+
+    def setUp(self):
+        self.start_smtp_server()
+
+    def _queue(self, count, recipient='customer{}@example.com'):
+        for i in range(count):
+            self.assertTrue(EmailService.send_email_notification(
+                'notification', {'title': f'Message {i}', 'message': 'Hello'}, recipient.format(i), f'Message {i}'
+            ))
+
+    def test_service_queues_instead_of_sending(self):
+        self._queue(3)
+        self.assertEqual(EmailOutbox.objects.filter(status='pending').count(), 3)
+        self.assertEqual(self.server.connections, 0)
+
+    @override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+    def test_sync_opt_out_sends_immediately(self):
+        self.assertTrue(EmailService.send_email_notification(
+            'notification', {'title': 'Now', 'message': 'Hi'}, 'staff@example.com', 'Now', sync=True
+        ))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertFalse(EmailOutbox.objects.exists())
+
+    def test_worker_reuses_pooled_connections(self):
+        self._queue(12)
+        worker = OutboxWorker(batch_size=5, connections=2, rate_limit=0)
+        try:
+            sent, failed = worker.drain()
+        finally:
+            worker.close()
+
+        self.assertEqual((sent, failed), (12, 0))
+        self.assertEqual(len(self.server.messages), 12)
+        # Three batches went over the same two connections
+        self.assertEqual(self.server.connections, 2)
+        self.assertEqual(EmailOutbox.objects.filter(status='sent').count(), 12)
+
+    def test_failed_delivery_backs_off_then_gives_up(self):
+        self._queue(1, recipient='reject@example.com')
+        worker = OutboxWorker(connections=1, rate_limit=0, max_attempts=2)
+        try:
+            self.assertEqual(worker.drain(), (0, 1))
+            entry = EmailOutbox.objects.get()
+            self.assertEqual((entry.status, entry.attempts), ('pending', 1))
+            self.assertGreater(entry.next_attempt_at, entry.created_at)
+            self.assertIn('550', entry.last_error)
+
+            # Not due yet, so a second drain does nothing
+            self.assertEqual(worker.drain(), (0, 0))
+
+            EmailOutbox.objects.update(next_attempt_at=entry.created_at)
+            self.assertEqual(worker.drain(), (0, 1))
+        finally:
+            worker.close()
+        entry.refresh_from_db()
+        self.assertEqual((entry.status, entry.attempts), ('failed', 2))
+
+
+class CampaignDispatchTest(StandInSMTPMixin, TestCase):
+    """Tests for the batched newsletter campaign sender"""
+
+    def setUp(self):
+        self.start_smtp_server()
+        user = get_user_model().objects.create_user(username='marketing', password='testpass123', role='manager')
+        self.campaign = NewsletterCampaign.objects.create(
+            title='October', subject='Solar news', created_by=user,
+            content='<p>Hi {{ subscriber.first_name }}, read more.</p>',
+        )
+        NewsletterSubscriber.objects.bulk_create([
+            NewsletterSubscriber(email=f'reader{i}@example.com', first_name=f'Reader{i}', is_active=True)
+            for i in range(30)
+        ])
+
+    def _dispatch(self):
+        dispatcher = CampaignDispatcher(self.campaign, batch_size=10, connections=3)
+        dispatcher.prepare()
+        self.assertTrue(dispatcher.claim())
+        return dispatcher.run()
+
+    def test_campaign_is_sent_in_batches_over_pooled_connections(self):
+        self.assertEqual(self._dispatch(), (30, 0))
+
+        self.assertEqual(len(self.server.messages), 30)
+        self.assertEqual(self.server.connections, 3)
+        self.assertEqual(NewsletterSendLog.objects.filter(delivery_status='sent').count(), 30)
+
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.status, 'sent')
+        self.assertEqual((self.campaign.total_recipients, self.campaign.total_sent), (30, 30))
+
+        # Each copy carries its own name and tracking link
+        log = NewsletterSendLog.objects.get(email_address='reader7@example.com')
+        message = next(m for m in self.server.messages if b'reader7@example.com' in m)
+        self.assertIn(b'Reader7', message)
+        self.assertIn(f'/newsletter/track/open/{log.pk}/'.encode(), message)
+        self.assertNotIn(b'%%olv:', message)
+
+    def test_filtered_subscriber_variables_are_rendered_per_recipient(self):
+        self.campaign.content = (
+            '<p>Hi {{ subscriber.first_name|upper }}{% if subscriber.last_name %} '
+            '{{ subscriber.last_name }}{% endif %}, read more.</p>'
+        )
+        self.campaign.save()
+        NewsletterSubscriber.objects.filter(email='reader3@example.com').update(last_name="O'Neil")
+        self.assertEqual(self._dispatch(), (30, 0))
+
+        message = next(m for m in self.server.messages if b'reader3@example.com' in m)
+        self.assertIn(b'Hi READER3 O&#x27;Neil, read more.', message)
+        self.assertNotIn(b'%%olv:', message.lower())
+        other = next(m for m in self.server.messages if b'reader7@example.com' in m)
+        self.assertIn(b'Hi READER7, read more.', other)
+
+    def test_resume_only_sends_pending_logs(self):
+        dispatcher = CampaignDispatcher(self.campaign, batch_size=10, connections=2)
+        dispatcher.prepare()
+        # Simulate a dispatcher that died after its first batch
+        first_batch = NewsletterSendLog.objects.order_by('pk').values_list('pk', flat=True)[:10]
+        NewsletterSendLog.objects.filter(pk__in=list(first_batch)).update(delivery_status='sent', status='sent')
+
+        self.assertTrue(dispatcher.claim())
+        self.assertFalse(CampaignDispatcher(self.campaign).claim())  # already owned
+        self.assertEqual(dispatcher.run(), (20, 0))
+        self.assertEqual(len(self.server.messages), 20)
+        self.assertEqual(NewsletterSendLog.objects.filter(delivery_status='sent').count(), 30)
+
+
+class NewsletterTrackingTest(TestCase):
+    """Tests for buffered open/click tracking"""
+
+    def setUp(self):
+        user = get_user_model().objects.create_user(username='marketing', password='testpass123', role='manager')
+        self.campaign = NewsletterCampaign.objects.create(
+            title='October', subject='Solar news', content='<p>News</p>', created_by=user,
+            status='sent', total_sent=4, call_to_action_url='https://olivian.co.ke/offers/',
+        )
+        self.logs = [
+            NewsletterSendLog.objects.create(
+                campaign=self.campaign, email_address=f'reader{i}@example.com', delivery_status='sent',
+                subscriber=NewsletterSubscriber.objects.create(email=f'reader{i}@example.com'),
+            )
+            for i in range(4)
+        ]
+        self.service = NewsletterService()
+
+    def test_hits_only_append_events(self):
+        with self.assertNumQueries(2):  # send log lookup + insert
+            self.assertTrue(self.service.track_email_open(self.logs[0].pk))
+        self.assertEqual(
+            self.service.track_email_click(self.logs[0].pk), 'https://olivian.co.ke/offers/'
+        )
+        self.assertEqual(NewsletterTrackingEvent.objects.count(), 2)
+        self.assertIsNone(NewsletterSendLog.objects.get(pk=self.logs[0].pk).opened_at)
+
+    def test_unknown_log_ids_are_not_buffered(self):
+        self.assertFalse(self.service.track_email_open(999999))
+        self.assertIsNone(self.service.track_email_click(999999))
+        self.assertFalse(NewsletterTrackingEvent.objects.exists())
+
+    def test_flush_counts_first_open_and_click_per_log(self):
+        for _ in range(3):
+            self.service.track_email_open(self.logs[0].pk)
+        self.service.track_email_open(self.logs[1].pk)
+        self.service.track_email_click(self.logs[0].pk, 'https://olivian.co.ke/')
+        NewsletterTrackingEvent.objects.create(send_log_id=999999, event_type='open')  # log since deleted
+        first_open = NewsletterTrackingEvent.objects.filter(event_type='open').first().created_at
+
+        self.assertEqual(flush_tracking_events(), 6)
+
+        self.campaign.refresh_from_db()
+        self.assertEqual((self.campaign.opens_count, self.campaign.clicks_count), (2, 1))
+        self.assertEqual(self.campaign.open_rate, 50.0)
+        self.assertEqual(self.campaign.click_rate, 25.0)
+        self.assertEqual(NewsletterSendLog.objects.get(pk=self.logs[0].pk).opened_at, first_open)
+        self.assertFalse(NewsletterTrackingEvent.objects.exists())
+
+        # Repeat opens after the first flush do not count again
+        self.service.track_email_open(self.logs[0].pk)
+        flush_tracking_events()
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.opens_count, 2)
+
+
+@register_job('tests.write_report')
+def _write_report_job(job, rows):
+    job.update_progress(50, 'Writing')
+    path = result_path(f'test_report_{job.pk}.txt')
+    with open(path, 'w') as f:
+        f.write('\n'.join(str(i) for i in range(rows)))
+    job.set_result_file(path)
+    return {'rows': rows}
+
+
+@register_job('tests.always_fails')
+def _failing_job(job):
+    raise RuntimeError('boom')
+
+
+@register_job('tests.reclaimed')
+def _reclaimed_job(job):
+    # Another worker took the job over while this one was still running
+    BackgroundJob.objects.filter(pk=job.pk).update(claimed_by='other-worker', progress=10)
+    job.update_progress(90, 'Stale worker')
+    return {'stale': True}
+
+
+class BackgroundJobQueueTest(TestCase):
+    """Tests for the DB-backed job queue and its status/download views"""
+
+    def setUp(self):
+        jobs_root = override_settings(JOBS_ROOT=tempfile.mkdtemp())
+        jobs_root.enable()
+        self.addCleanup(jobs_root.disable)
+        self.addCleanup(shutil.rmtree, settings.JOBS_ROOT, True)
+        self.admin = get_user_model().objects.create_user(
+            username='sysadmin', password='testpass123', role='super_admin', is_staff=True
+        )
+        self.client.force_login(self.admin)
+
+    def test_job_runs_and_result_can_be_downloaded(self):
+        job = enqueue_job('tests.write_report', {'rows': 3}, user=self.admin)
+        self.assertEqual(run_pending_jobs(), 1)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.progress, job.result), ('completed', 100, {'rows': 3}))
+
+        status = self.client.get(reverse('core:job_status', args=[job.pk])).json()
+        self.assertTrue(status['has_file'])
+        response = self.client.get(status['download_url'])
+        self.assertEqual(b''.join(response.streaming_content), b'0\n1\n2')
+
+        other = get_user_model().objects.create_user(username='other', password='testpass123')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(reverse('core:job_status', args=[job.pk])).status_code, 404)
+
+    def test_failed_job_is_retried_then_marked_failed(self):
+        job = enqueue_job('tests.always_fails', max_attempts=2)
+        run_pending_jobs()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertGreater(job.run_after, timezone.now())
+
+        BackgroundJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        run_pending_jobs()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+        self.assertIn('boom', job.error)
+
+    def test_unique_jobs_and_abandoned_jobs(self):
+        first = enqueue_job('tests.write_report', {'rows': 1}, unique=True)
+        self.assertEqual(enqueue_job('tests.write_report', {'rows': 1}, unique=True), first)
+
+        # A worker claimed the job and then died without reporting progress
+        claimed = claim_next_job()
+        self.assertEqual(claimed, first)
+        self.assertIsNone(claim_next_job())
+        BackgroundJob.objects.filter(pk=first.pk).update(heartbeat_at=timezone.now() - timezone.timedelta(hours=2))
+        self.assertEqual(claim_next_job(), first)
+
+    def test_heartbeat_keeps_a_claimed_job_alive(self):
+        enqueue_job('tests.write_report', {'rows': 1})
+        job = claim_next_job()
+        BackgroundJob.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timezone.timedelta(hours=2))
+
+        self.assertTrue(Heartbeat(job).beat())
+        self.assertIsNone(claim_next_job())
+
+        BackgroundJob.objects.filter(pk=job.pk).update(claimed_by='other-worker')
+        self.assertFalse(Heartbeat(job).beat())
+
+    def test_superseded_run_does_not_overwrite_the_new_run(self):
+        job = enqueue_job('tests.reclaimed')
+        self.assertFalse(run_job(claim_next_job()))
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.progress, job.result), ('running', 10, {}))
+
+    def test_export_all_data_runs_as_job(self):
+        response = self.client.get(reverse('core:export_all_data'))
+        job = BackgroundJob.objects.get(job_type='core.export_all_data')
+        self.assertRedirects(response, reverse('core:job_detail', args=[job.pk]), fetch_redirect_response=False)
+
+        run_pending_jobs()
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'completed', job.error)
+        self.assertTrue(job.result_filename.endswith('.json'))
+
+
+class HolidayCalendarTest(TestCase):
+    """Tests for the precomputed holiday offer calendar"""
+
+    def setUp(self):
+        invalidate_holiday_calendar()
+        self.jamhuri = KenyanHoliday.objects.create(
+            name='Jamhuri Day', fixed_month=12, fixed_day=12, lead_time_days=14, duration_days=1,
+        )
+        self.christmas = KenyanHoliday.objects.create(
+            name='Christmas/New Year', date_type='calculated', lead_time_days=30, duration_days=3,
+        )
+        self.labour = KenyanHoliday.objects.create(
+            name='Labour Day', fixed_month=5, fixed_day=1, lead_time_days=7, duration_days=1,
+        )
+        self.jamhuri_offer = HolidayOffer.objects.create(
+            holiday=self.jamhuri, banner_text='Jamhuri deals', discount_percentage=Decimal('12.00'), priority=2,
+        )
+        self.christmas_offer = HolidayOffer.objects.create(
+            holiday=self.christmas, banner_text='Festive deals', discount_percentage=Decimal('15.00'), priority=1,
+        )
+        # Best Labour Day offer has no discount: shown in the banner but not applied to prices
+        self.labour_banner = HolidayOffer.objects.create(holiday=self.labour, banner_text='Labour Day', priority=1)
+        HolidayOffer.objects.create(
+            holiday=self.labour, banner_text='Labour Day 5%', discount_percentage=Decimal('5.00'), priority=3,
+        )
+
+    def test_resolves_offers_by_date(self):
+        calendar = HolidayCalendar.build(2025)
+        with self.assertNumQueries(0):
+            # 1-12 December: Jamhuri Day comes first for discounts, the banner takes the best priority
+            self.assertEqual(calendar.discount_offer(date(2025, 12, 5)), self.jamhuri_offer)
+            self.assertEqual(calendar.banner_offer(date(2025, 12, 5)), self.christmas_offer)
+            # Christmas period crosses into the next year
+            self.assertEqual(calendar.discount_offer(date(2025, 12, 20)), self.christmas_offer)
+            self.assertEqual(calendar.discount_offer(date(2025, 1, 2)), self.christmas_offer)
+            # The countdown runs to the end of the window the day falls in
+            self.assertEqual(calendar.banner_end_date(date(2025, 1, 2)), date(2025, 1, 3))
+            self.assertEqual(calendar.banner_end_date(date(2025, 12, 5)), date(2026, 1, 3))
+            self.assertEqual(calendar.banner_offer(date(2025, 4, 28)), self.labour_banner)
+            self.assertIsNone(calendar.discount_offer(date(2025, 4, 28)))
+            self.assertIsNone(calendar.banner_offer(date(2025, 3, 1)))
+            self.assertIsNone(calendar.banner_end_date(date(2025, 3, 1)))
+            self.assertEqual(calendar.offers[self.jamhuri_offer.pk].holiday.name, 'Jamhuri Day')
+
+    def test_calendar_is_cached_and_rebuilt_on_changes(self):
+        get_holiday_calendar()
+        with self.assertNumQueries(0):
+            calendar = get_holiday_calendar()
+            active_discounts.resolve(RequestFactory().get('/'))
+
+        self.christmas_offer.discount_percentage = Decimal('20.00')
+        self.christmas_offer.save()
+        rebuilt = get_holiday_calendar()
+        self.assertNotEqual(rebuilt.version, calendar.version)
+        self.assertEqual(rebuilt.discount_offer(date(date.today().year, 12, 20)).discount_percentage, Decimal('20.00'))
+
+        self.christmas.is_active = False
+        self.christmas.save()
+        self.assertIsNone(get_holiday_calendar().banner_offer(date(date.today().year, 12, 20)))
+
+
+class LazyContextProcessorTest(TestCase):
+    """Site-wide context processors only run for the variables a template uses"""
+
+    def setUp(self):
+        invalidate_holiday_calendar()
+        self.user = get_user_model().objects.create_user(username='shopper', password='test123')
+        self.request = RequestFactory().get('/')
+        self.request.user = self.user
+
+    def render(self, source, request=None):
+        return engines['django'].from_string(source).render({}, request or self.request)
+
+    def test_only_used_processors_run_once_per_request(self):
+        self.assertEqual(self.render('{{ cart_count }}|{% if has_cart_items %}yes{% endif %}'), '0|')
+        self.render('{{ cart_count }}')
+        self.assertEqual([name for name, _, _ in processor_stats(self.request)], ['cart_info'])
+        self.assertEqual(processor_stats(self.request)[0][2], 1)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.render('<p>static fragment</p>'), '<p>static fragment</p>')
+
+    def test_company_wrapper_is_reused_across_requests(self):
+        self.assertEqual(self.render('{{ company.name }}'), 'The Olivian Group Limited')
+        other = RequestFactory().get('/')
+        other.user = self.user
+        self.assertIs(company_info.resolve(other)['company'], company_info.resolve(self.request)['company'])
+
+    def test_views_can_skip_processors(self):
+        @skip_context_processors('cart_info')
+        def view(request):
+            return HttpResponse(self.render('[{{ cart_count }}][{{ default_currency }}]', request))
+
+        self.assertEqual(view(self.request).content, b'[][KES]')
+
+    @override_settings(CONTEXT_PROCESSOR_TIMING=True)
+    def test_timing_middleware_reports_used_processors(self):
+        middleware = ContextProcessorTimingMiddleware(lambda request: HttpResponse(self.render('{{ cart_count }}', request)))
+        response = middleware(self.request)
+        self.assertTrue(response['Server-Timing'].startswith('cp-cart_info;dur='))
+        self.assertIn('(1 queries)', response['Server-Timing'])
+
+
+PAGE_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'default'},
+    'pages': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'pages'},
+}
+
+
+@override_settings(CACHES=PAGE_CACHES)
+class PublicPageCacheTest(TestCase):
+    """Anonymous marketing pages are served from the shared page cache"""
+
+    def setUp(self):
+        caches['pages'].clear()
+        self.factory = RequestFactory()
+        self.calls = []
+
+        @cache_public_page('testimonials')
+        def page(request):
+            self.calls.append(request)
+            html = engines['django'].from_string(
+                '<form>{% csrf_token %}</form>{{ request.GET.q }}'
+            ).render({}, request)
+            return HttpResponse(html)
+
+        self.page = page
+
+    def get(self, path='/about/', user=None, **cookies):
+        request = self.factory.get(path)
+        request.user = user or AnonymousUser()
+        request.COOKIES.update(cookies)
+        return self.page(request)
+
+    def test_second_visit_is_a_cache_hit_with_its_own_csrf_token(self):
+        first = self.get()
+        second = self.get()
+        self.assertEqual((first['X-Page-Cache'], second['X-Page-Cache']), ('miss', 'hit'))
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(second['Cache-Control'], 'private, no-cache')
+        self.assertNotIn(b'__page_cache_csrf_token__', second.content)
+        self.assertNotEqual(first.content, second.content)  # a fresh token per visitor
+
+    def test_key_varies_on_query_and_consent_cookie(self):
+        self.get('/about/?q=one')
+        self.assertIn(b'two', self.get('/about/?q=two').content)
+        self.get('/about/', cookie_consent='granted')
+        self.get('/about/', cookie_consent='denied')
+        self.assertEqual(len(self.calls), 4)
+
+    def test_logged_in_visitors_and_flash_messages_bypass_the_cache(self):
+        user = get_user_model().objects.create_user(username='staffer', password='test123')
+        self.get(user=user)
+        self.assertFalse(self.get(user=user).has_header('X-Page-Cache'))
+        self.get(messages='pending')
+        self.assertEqual(len(self.calls), 3)
+
+    def test_saving_a_section_model_invalidates_pages(self):
+        self.get()
+        Testimonial.objects.create(author_name='Achieng', quote='Great install')
+        self.assertEqual(self.get()['X-Page-Cache'], 'miss')
+        self.assertEqual(self.get()['X-Page-Cache'], 'hit')
+
+    def test_home_statistics_are_cached_until_projects_change(self):
+        calls = []
+        compute = lambda: calls.append(1) or {'stats': {}}
+        cached_value('home_stats', ('site', 'projects'), compute)
+        cached_value('home_stats', ('site', 'projects'), compute)
+        self.assertEqual(len(calls), 1)
+
+        CompanySettings.get_settings().save()
+        cached_value('home_stats', ('site', 'projects'), compute)
+        self.assertEqual(len(calls), 2)
+
+    def test_home_view_context_reuses_cached_stats(self):
+        request = self.factory.get('/')
+        request.user = AnonymousUser()
+        view = HomeView()
+        view.setup(request)
+        first = view.get_context_data()
+        with CaptureQueriesContext(connection) as warm:
+            second = view.get_context_data()
+        self.assertEqual(first['stats'], second['stats'])
+        self.assertIn('products', second['page_cache'])
+        self.assertFalse(any('projects_project' in query['sql'] for query in warm.captured_queries))
+
+
+class TieredCacheTest(TestCase):
+    """TieredCache serves hits from process memory in front of a shared cache"""
+
+    def setUp(self):
+        options = {
+            'L2': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tiered-test'},
+            'L1_EXCLUDE_PREFIXES': ['counter:'],
+        }
+        # Two "processes": separate L1 stores over the same L2
+        self.first = TieredCache('first', {'OPTIONS': options})
+        self.second = TieredCache('second', {'OPTIONS': options})
+        self.first.clear()
+        self.second.l1.clear()
+
+    def test_other_processes_see_writes_once_their_l1_copy_expires(self):
+        self.first.set('offer', 'old')
+        self.assertEqual(self.second.get('offer'), 'old')
+        self.first.set('offer', 'new')
+        self.assertEqual(self.first.get('offer'), 'new')
+        self.assertEqual(self.second.get('offer'), 'old')  # L1 copy, at most L1_TIMEOUT old
+        self.second.l1.clear()
+        self.assertEqual(self.second.get_many(['offer', 'missing']), {'offer': 'new'})
+
+        self.first.delete('offer')
+        self.assertIsNone(self.first.get('offer'))
+
+    def test_locks_and_counters_always_use_the_shared_cache(self):
+        self.assertTrue(self.first.add('lock', 1))
+        self.assertFalse(self.second.add('lock', 1))
+
+        self.first.set('hits', 1)
+        self.assertEqual(self.second.get('hits'), 1)
+        self.first.incr('hits')
+        self.assertEqual(self.second.incr('hits'), 3)
+
+        self.first.set('counter:views', 1)
+        self.second.get('counter:views')
+        self.first.set('counter:views', 2)
+        self.assertEqual(self.second.get('counter:views'), 2)
+
+    def test_versioned_keys_and_tags(self):
+        key = versioned_key('catalog', 'summary', using=self.first)
+        self.assertEqual(versioned_key('catalog', 'summary', using=self.first), key)
+
+        set_tagged('price-list', [1, 2], ['catalog', 'offers'], using=self.first)
+        self.assertEqual(get_tagged('price-list', using=self.first), [1, 2])
+        invalidate_tags('offers', using=self.first)
+        self.assertIsNone(get_tagged('price-list', using=self.first))
+        self.assertEqual(versioned_key('catalog', 'summary', using=self.first), key)
+
+        invalidate_tags('catalog', using=self.first)
+        self.assertNotEqual(versioned_key('catalog', 'summary', using=self.first), key)
@@ -0,0 +1,286 @@
+"""
+Two-level cache backend for hosts without Redis, plus versioned keys and tags.
+
+Production used LocMemCache, so under passenger_wsgi every worker process had
+its own copy of the M-Pesa token, the company settings snapshot, the chat
+access lists... and lost it whenever Passenger recycled the worker.
+TieredCache puts a small in-process L1 (LocMemCache) in front of a shared L2,
+any other Django cache:
+
+- file: FileBasedCache in a directory all workers can write (the default)
+- db: DatabaseCache, a MySQL table created with ``manage.py createcachetable``
+- redis: Django's RedisCache, when REDIS_URL is available
+
+settings.CACHES['default'] is a TieredCache over the 'shared' alias; see
+SHARED_CACHE_BACKEND in settings.py.
+
+Consistency
+    Writes and deletes go to L2 first and update this process's L1, so a
+    process always reads its own writes. Other processes keep an L1 copy for
+    at most L1_TIMEOUT seconds (default 5), which bounds how stale a read can
+    be. add(), incr() and decr() always run on L2 (they are how locks and
+    counters stay correct across processes) and drop the L1 copy. Keys
+    starting with one of L1_EXCLUDE_PREFIXES bypass L1 entirely; use this for
+    counters and read-modify-write state such as the blog view buffer and chat
+    typing rosters. incr() is only atomic across processes on Redis: the file
+    and database backends implement it as get + set.
+
+    OPTIONS: L2 (alias of the shared cache, or an inline cache config dict),
+    L1_TIMEOUT, L1_MAX_ENTRIES, L1_EXCLUDE_PREFIXES. LOCATION names the L1
+    store; TieredCache instances with the same LOCATION share it.
+
+Versioned keys and tags
+    versioned_key(namespace, key) embeds the namespace's version token in the
+    key, and set_tagged()/get_tagged() store a value together with the tokens
+    of its tags. invalidate_tags() rotates tokens, so every key and value that
+    depends on them is ignored from then on and simply expires. Tokens are
+    ordinary cache entries, so in other processes an invalidation is seen
+    within L1_TIMEOUT. These helpers work on any cache backend.
+
+manage.py benchmark_cache_backends compares hit latency and cross-process
+consistency of the backends.
+"""
+
+import uuid
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils.module_loading import import_string
+
+L1_TIMEOUT = 5
+L1_MAX_ENTRIES = 1000
+
+TAG_KEY = 'tiered_cache:tag:{tag}'
+
+_MISSING = object()
+
+
+def _raw_key(key, key_prefix, version):
+    # L1 stores keys already made by the L2 backend
+    return key
+
+
+def build_backend(config):
+    """Instantiate a cache backend from a CACHES-style config dict"""
+    config = dict(config)
+    backend = import_string(config.pop('BACKEND'))
+    return backend(config.pop('LOCATION', ''), config)
+
+
+class TieredCache(BaseCache):
+    """Process-local L1 (LocMemCache) in front of a shared L2 cache"""
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._l2_config = options.get('L2', 'shared')
+        self._l2_instance = None
+        self.l1_timeout = options.get('L1_TIMEOUT', L1_TIMEOUT)
+        self.l1_exclude_prefixes = tuple(options.get('L1_EXCLUDE_PREFIXES', ()))
+        self.l1 = LocMemCache(f'tiered:{location or self._l2_config}', {
+            'TIMEOUT': self.l1_timeout,
+            'KEY_FUNCTION': _raw_key,
+            'OPTIONS': {'MAX_ENTRIES': options.get('L1_MAX_ENTRIES', L1_MAX_ENTRIES)},
+        })
+
+    @property
+    def l2(self):
+        if isinstance(self._l2_config, str):
+            # Per-thread connection from the cache handler
+            return caches[self._l2_config]
+        if self._l2_instance is None:
+            self._l2_instance = build_backend(self._l2_config)
+        return self._l2_instance
+
+    # Keys are made and validated by L2 so both levels agree on them
+
+    def make_key(self, key, version=None):
+        return self.l2.make_key(key, version=version)
+
+    def validate_key(self, key):
+        self.l2.validate_key(key)
+
+    def _l1_key(self, key, version):
+        if key.startswith(self.l1_exclude_prefixes):
+            return None
+        return self.l2.make_and_validate_key(key, version=version)
+
+    def _l1_timeout(self, timeout):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.l2.default_timeout
+        if timeout is None:
+            return self.l1_timeout
+        return min(timeout, self.l1_timeout)
+
+    def _l1_set(self, l1_key, value, timeout):
+        if l1_key is None:
+            return
+        l1_timeout = self._l1_timeout(timeout)
+        if l1_timeout > 0:
+            self.l1.set(l1_key, value, l1_timeout)
+        else:
+            self.l1.delete(l1_key)
+
+    def _l1_delete(self, l1_key):
+        if l1_key is not None:
+            self.l1.delete(l1_key)
+
+    # Reads
+
+    def get(self, key, default=None, version=None):
+        l1_key = self._l1_key(key, version)
+        if l1_key is not None:
+            value = self.l1.get(l1_key, _MISSING)
+            if value is not _MISSING:
+                return value
+        value = self.l2.get(key, _MISSING, version=version)
+        if value is _MISSING:
+            return default
+        if l1_key is not None:
+            self.l1.set(l1_key, value, self.l1_timeout)
+        return value
+
+    def get_many(self, keys, version=None):
+        found = {}
+        l1_keys = {}
+        for key in keys:
+            l1_key = self._l1_key(key, version)
+            if l1_key is not None:
+                value = self.l1.get(l1_key, _MISSING)
+                if value is not _MISSING:
+                    found[key] = value
+                    continue
+                l1_keys[key] = l1_key
+            found.setdefault(key, _MISSING)
+
+        missing = [key for key, value in found.items() if value is _MISSING]
+        fetched = self.l2.get_many(missing, version=version) if missing else {}
+        for key in missing:
+            if key in fetched:
+                found[key] = fetched[key]
+                if key in l1_keys:
+                    self.l1.set(l1_keys[key], fetched[key], self.l1_timeout)
+            else:
+                del found[key]
+        return found
+
+    def has_key(self, key, version=None):
+        l1_key = self._l1_key(key, version)
+        if l1_key is not None and self.l1.has_key(l1_key):
+            return True
+        return self.l2.has_key(key, version=version)
+
+    # Writes
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.l2.set(key, value, timeout, version=version)
+        self._l1_set(self._l1_key(key, version), value, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.l2.set_many(data, timeout, version=version)
+        for key, value in data.items():
+            l1_key = self._l1_key(key, version)
+            if key in failed:
+                self._l1_delete(l1_key)
+            else:
+                self._l1_set(l1_key, value, timeout)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        l1_key = self._l1_key(key, version)
+        added = self.l2.add(key, value, timeout, version=version)
+        if added:
+            self._l1_set(l1_key, value, timeout)
+        else:
+            self._l1_delete(l1_key)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self._l1_delete(self._l1_key(key, version))
+        return self.l2.touch(key, timeout, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        self._l1_delete(self._l1_key(key, version))
+        return self.l2.incr(key, delta, version=version)
+
+    def decr(self, key, delta=1, version=None):
+        self._l1_delete(self._l1_key(key, version))
+        return self.l2.decr(key, delta, version=version)
+
+    def delete(self, key, version=None):
+        self._l1_delete(self._l1_key(key, version))
+        return self.l2.delete(key, version=version)
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self._l1_delete(self._l1_key(key, version))
+        self.l2.delete_many(keys, version=version)
+
+    def clear(self):
+        self.l1.clear()
+        self.l2.clear()
+
+    def close(self, **kwargs):
+        if self._l2_instance is not None:
+            self._l2_instance.close(**kwargs)
+
+
+# Versioned keys and tags
+
+def _cache(using):
+    if isinstance(using, BaseCache):
+        return using
+    return caches[using or 'default']
+
+
+def tag_versions(tags, using=None):
+    """{tag: version token} for ``tags``, creating missing tokens"""
+    cache = _cache(using)
+    keys = {TAG_KEY.format(tag=tag): tag for tag in tags}
+    found = cache.get_many(list(keys))
+    versions = {}
+    for key, tag in keys.items():
+        version = found.get(key)
+        if version is None:
+            version = uuid.uuid4().hex[:12]
+            # add() keeps a token another process may have published meanwhile
+            if not cache.add(key, version, None):
+                version = cache.get(key) or version
+        versions[tag] = version
+    return versions
+
+
+def invalidate_tags(*tags, using=None):
+    """Rotate the tokens of ``tags``: keys and values depending on them are no longer read"""
+    _cache(using).set_many({TAG_KEY.format(tag=tag): uuid.uuid4().hex[:12] for tag in tags}, None)
+
+
+def versioned_key(namespace, key, using=None):
+    """``key`` within ``namespace``; invalidate_tags(namespace) retires every such key"""
+    return f'{namespace}:{tag_versions((namespace,), using)[namespace]}:{key}'
+
+
+def set_tagged(key, value, tags, timeout=DEFAULT_TIMEOUT, using=None):
+    """Store ``value`` under ``key`` until ``timeout`` or until one of ``tags`` is invalidated"""
+    _cache(using).set(key, (tag_versions(tags, using), value), timeout)
+
+
+def get_tagged(key, default=None, using=None):
+    """Value stored by set_tagged(), or ``default`` if missing or one of its tags was invalidated"""
+    entry = _cache(using).get(key)
+    if entry is None:
+        return default
+    versions, value = entry
+    if tag_versions(versions, using) != versions:
+        return default
+    return value
+
+
+def get_or_set_tagged(key, compute, tags, timeout=DEFAULT_TIMEOUT, using=None):
+    """get_tagged(), calling ``compute()`` and storing its result on a miss"""
+    value = get_tagged(key, _MISSING, using)
+    if value is _MISSING:
+        value = compute()
+        set_tagged(key, value, tags, timeout, using)
+    return value
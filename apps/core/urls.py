@@ -28,6 +28,7 @@ urlpatterns = [
     path('dashboard/newsletter/campaigns/<int:pk>/', views.NewsletterCampaignDetailView.as_view(), name='newsletter_campaign_detail'),
     path('dashboard/newsletter/campaigns/<int:pk>/edit/', views.NewsletterCampaignUpdateView.as_view(), name='newsletter_campaign_update'),
     path('dashboard/newsletter/campaigns/<int:pk>/send/', views.NewsletterCampaignSendView.as_view(), name='newsletter_campaign_send'),
+    path('dashboard/newsletter/campaigns/<int:pk>/progress/', views.NewsletterCampaignProgressView.as_view(), name='newsletter_campaign_progress'),
     path('dashboard/newsletter/subscribers/', views.NewsletterSubscriberListView.as_view(), name='newsletter_subscriber_list'),
     path('dashboard/newsletter/subscribers/<int:pk>/', views.NewsletterSubscriberDetailView.as_view(), name='newsletter_subscriber_detail'),
     path('dashboard/newsletter/subscribers/<int:pk>/toggle/', views.NewsletterSubscriberToggleView.as_view(), name='newsletter_subscriber_toggle'),
@@ -68,6 +69,11 @@ urlpatterns = [
     path('system/clear-cache/', views.ClearCacheView.as_view(), name='clear_cache'),
     path('system/run-diagnostics/', views.RunDiagnosticsView.as_view(), name='run_diagnostics'),
 
+    # Background Job URLs
+    path('jobs/<int:pk>/', views.BackgroundJobDetailView.as_view(), name='job_detail'),
+    path('jobs/<int:pk>/status/', views.BackgroundJobStatusView.as_view(), name='job_status'),
+    path('jobs/<int:pk>/download/', views.BackgroundJobDownloadView.as_view(), name='job_download'),
+
     # Export URLs
     path('export/all-data/', views.ExportAllDataView.as_view(), name='export_all_data'),
     path('export/user-report/', views.ExportUserReportView.as_view(), name='export_user_report'),
@@ -1,6 +1,6 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth import get_user_model
-from django.http import JsonResponse, HttpResponse, FileResponse, StreamingHttpResponse
+from django.http import JsonResponse, HttpResponse, FileResponse
 from django.views.generic import TemplateView, ListView, DetailView, CreateView, UpdateView, DeleteView
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.contrib.auth.decorators import login_required
@@ -14,10 +14,11 @@ from django.db.models import Q, Sum, Count, Avg, Max, F, ExpressionWrapper, Dura
 from django.db.models.functions import Now
 from django.views import View
 from django.utils import timezone
-from .models import Notification, CompanySettings, ActivityLog, ProjectShowcase, LegalDocument, CookieConsent, CookieCategory, Testimonial, VideoTutorial, ServiceArea, NewsletterCampaign, NewsletterSubscriber
+from .models import Notification, CompanySettings, ActivityLog, ProjectShowcase, LegalDocument, CookieConsent, CookieCategory, Testimonial, VideoTutorial, ServiceArea, NewsletterCampaign, NewsletterSubscriber, BackgroundJob
+from .holiday_calendar import get_holiday_calendar
+from .page_cache import FRAGMENT_CACHE_TIMEOUT, cache_public_page, cached_value, section_versions
 from apps.financial.models import Transaction
 from django.core import serializers
-from django.core.management import call_command
 from django.conf import settings
 from django.contrib import messages
 from django.utils.text import slugify
@@ -42,6 +43,7 @@ User = get_user_model()
 # Initialize logger
 logger = logging.getLogger(__name__)
 
+@method_decorator(cache_public_page('projects', 'products', 'blog', 'testimonials'), name='dispatch')
 class HomeView(TemplateView):
     template_name = 'website/home.html'
 
@@ -75,9 +77,8 @@ class HomeView(TemplateView):
 
         return 0
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-
+    def get_stats(self):
+        """Homepage statistics and recent projects (cached until projects or company settings change)"""
         # Get statistics from projects and project showcases
         try:
             # Import here to avoid circular imports
@@ -152,10 +153,7 @@ class HomeView(TemplateView):
             cities_served_calculated = min(max(1, company_projects // 3), cities_served or company_projects)
 
         # Ensure minimum of 1 if there are projects
-        print(f"DEBUG: cities_served_calculated before max: {cities_served_calculated}, type: {type(cities_served_calculated)}")
-        print(f"DEBUG: cities_served: {cities_served}, type: {type(cities_served)}")
         cities_served_calculated = max(1, cities_served_calculated) if company_projects > 0 else cities_served
-        print(f"DEBUG: cities_served_calculated after max: {cities_served_calculated}, type: {type(cities_served_calculated)}")
 
         # Calculate CO2 saved reasonably based on capacity and realistic usage
         # More conservative estimate: 0.8-1.0 tons CO2 per kW per year
@@ -172,7 +170,7 @@ class HomeView(TemplateView):
         co2_saved_calculated = int(company_capacity * co2_factor) if company_capacity > 0 else int(co2_saved)
 
         if company:
-            context['stats'] = {
+            stats = {
                 'projects_completed': company.projects_completed or total_projects,
                 'total_capacity': self.parse_capacity_value(company.total_capacity) if company.total_capacity else total_capacity,
                 'total_capacity_display': company.total_capacity or capacity_display,
@@ -181,7 +179,7 @@ class HomeView(TemplateView):
             }
         else:
             # Fallback to dynamic calculations if no company settings
-            context['stats'] = {
+            stats = {
                 'projects_completed': total_projects,
                 'total_capacity': total_capacity,
                 'total_capacity_display': capacity_display,
@@ -189,8 +187,16 @@ class HomeView(TemplateView):
                 'co2_saved_tons': co2_saved_calculated,
             }
 
-        # Add recent projects to context
-        context['recent_projects'] = recent_projects
+        return {'stats': stats, 'recent_projects': list(recent_projects)}
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+
+        # Statistics and recent projects are recomputed only after a project or settings change
+        context.update(cached_value('home_stats', ('site', 'projects'), self.get_stats))
+        # Section versions for the {% cache %} fragments in website/home.html
+        context['page_cache'] = section_versions()
+        context['fragment_timeout'] = FRAGMENT_CACHE_TIMEOUT
 
         # Get featured products for homepage showcase
         try:
@@ -249,61 +255,30 @@ class HomeView(TemplateView):
 
         # Get active holiday offer for banner display
         context['active_holiday_offer'] = self.get_active_holiday_offer()
+        context['holiday_banner_end_date'] = self.get_holiday_banner_end_date()
 
         return context
 
     def get_active_holiday_offer(self):
         """Get the current active holiday offer for banner display using chronological prioritization"""
         try:
-            # Import here to avoid circular imports
-            from .models import HolidayOffer, KenyanHoliday
-
-            # Get all currently active holidays
-            all_holidays = KenyanHoliday.objects.filter(is_active=True)
-            active_holidays = []
-            for holiday in all_holidays:
-                if holiday.is_currently_active:
-                    active_holidays.append(holiday)
-
-            if active_holidays:
-                # Special rule: Jamhuri Day gets priority over Christmas from Dec 1-12
-                today = timezone.now().date()
-                is_jamhuri_priority_period = (today.month == 12 and today.day <= 12)
-
-                # Sort by holiday date ascending (earlier holidays first for chronological prioritization)
-                # But apply Jamhuri priority override for Dec 1-12
-                def get_holiday_date(holiday):
-                    """Get comparable holiday date tuple (month, day) for sorting"""
-                    if is_jamhuri_priority_period and holiday.name == 'Jamhuri Day':
-                        return (12, 1)  # Force Jamhuri to sort first during priority period
-                    elif holiday.date_type == 'fixed' and holiday.fixed_month and holiday.fixed_day:
-                        return (holiday.fixed_month, holiday.fixed_day)
-                    elif holiday.name == 'Christmas/New Year':
-                        return (12, 25)  # Christmas date for sorting
-                    else:
-                        # Default fallback
-                        return (holiday.fixed_month or 99, holiday.fixed_day or 99)
-
-                active_holidays.sort(key=get_holiday_date)
-
-                # Get the first (highest priority) holiday offer
-                holiday_offer = HolidayOffer.objects.filter(
-                    holiday__in=active_holidays,
-                    is_active=True
-                ).order_by('priority', 'order').first()
-
-                if holiday_offer:
-                    return holiday_offer
-
+            return get_holiday_calendar().banner_offer()
+        except Exception as e:
+            # If holiday system is not available, return None
             return None
 
+    def get_holiday_banner_end_date(self):
+        """Last day of the banner offer's current window, for the countdown"""
+        try:
+            return get_holiday_calendar().banner_end_date()
         except Exception as e:
-            # If holiday system is not available, return None
             return None
 
+@method_decorator(cache_public_page(), name='dispatch')
 class AboutView(TemplateView):
     template_name = 'website/about.html'
 
+@method_decorator(cache_public_page(), name='dispatch')
 class ServicesView(TemplateView):
     template_name = 'website/services.html'
 
@@ -313,6 +288,7 @@ class ServicesView(TemplateView):
         context['GOOGLE_MAPS_API_KEY'] = settings.GOOGLE_MAPS_API_KEY
         return context
 
+@method_decorator(cache_public_page(), name='dispatch')
 class HelpView(TemplateView):
     """Customer-focused help and support page for public website"""
     template_name = 'website/help.html'
@@ -974,6 +950,7 @@ class NotificationTestView(LoginRequiredMixin, View):
             }, status=500)
 
 
+@method_decorator(cache_public_page(), name='dispatch')
 class LegalDocumentView(TemplateView):
     """Display legal documents like Privacy Policy and Terms of Service"""
     template_name = 'website/legal_document.html'
@@ -999,6 +976,7 @@ class LegalDocumentView(TemplateView):
         return context
 
 
+@method_decorator(cache_public_page(), name='dispatch')
 class PrivacyPolicyView(TemplateView):
     """Dedicated Privacy Policy view"""
     template_name = 'website/legal_document.html'
@@ -1031,6 +1009,7 @@ class PrivacyPolicyView(TemplateView):
         return context
 
 
+@method_decorator(cache_public_page(), name='dispatch')
 class TermsOfServiceView(TemplateView):
     """Dedicated Terms of Service view"""
     template_name = 'website/legal_document.html'
@@ -1063,6 +1042,7 @@ class TermsOfServiceView(TemplateView):
         return context
 
 
+@method_decorator(cache_public_page(), name='dispatch')
 class DataDeletionView(TemplateView):
     """Dedicated Data Deletion view"""
     template_name = 'website/legal_document.html'
@@ -1098,6 +1078,7 @@ class DataDeletionView(TemplateView):
         return context
 
 
+@method_decorator(cache_public_page(), name='dispatch')
 class DisclaimerView(TemplateView):
     """Dedicated Disclaimer view"""
     template_name = 'website/legal_document.html'
@@ -1133,6 +1114,7 @@ class DisclaimerView(TemplateView):
         return context
 
 
+@method_decorator(cache_public_page(), name='dispatch')
 class RefundPolicyView(TemplateView):
     """Dedicated Refund Policy view"""
     template_name = 'website/legal_document.html'
@@ -1364,21 +1346,19 @@ class SystemAdminRequiredMixin(UserPassesTestMixin):
 class SystemBackupView(SystemAdminRequiredMixin, View):
     """Create system backup including database and media files"""
     
-    CHUNK_SIZE = 8192
-    
     def get(self, request):
-        """Handle GET request for backup creation"""
+        """Queue a backup job; the archive is built by the run_jobs worker"""
         try:
-            temp_dir = tempfile.mkdtemp()
-            timestamp = timezone.now().strftime('%Y%m%d_%H%M%S')
-            backup_name = f'olivian_backup_{timestamp}'
-            
-            response = StreamingHttpResponse(
-                self.generate_backup(backup_name),
-                content_type='application/zip'
-            )
-            response['Content-Disposition'] = f'attachment; filename="{backup_name}.zip"'
-            return response
+            from .job_queue import enqueue_job
+            job = enqueue_job('core.system_backup', user=request.user, unique=True)
+
+            if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+                return JsonResponse({
+                    'job_id': job.pk,
+                    'status_url': reverse('core:job_status', args=[job.pk]),
+                })
+            messages.info(request, 'System backup started. You can download it here once it is ready.')
+            return redirect('core:job_detail', pk=job.pk)
             
         except Exception as e:
             logger.error(f'Backup creation failed: {str(e)}', exc_info=True)
@@ -1393,11 +1373,10 @@ class SystemBackupView(SystemAdminRequiredMixin, View):
             'error': f'Method {request.method} not allowed. Use GET to create backup.'
         }, status=405)
 
-    def generate_backup(self, backup_name):
-        """Generator function to stream the backup file"""
+    def build_backup(self, backup_name, job=None):
+        """Write the backup archive to BACKUP_ROOT and return its path"""
         temp_dir = tempfile.mkdtemp()
         temp_sql = None
-        zip_path = None
 
         try:
             # Ensure backup directory exists
@@ -1411,15 +1390,21 @@ class SystemBackupView(SystemAdminRequiredMixin, View):
                 temp_sql = os.path.join(temp_dir, 'database_backup.sql')
 
                 # Backup database to temp file
+                if job:
+                    job.update_progress(10, 'Dumping database')
                 self.backup_database(temp_sql)
 
                 # Add SQL file to zip
                 backup_zip.write(temp_sql, 'database_backup.sql')
 
                 # Backup media files
+                if job:
+                    job.update_progress(40, 'Archiving media files')
                 self.backup_media_files(backup_zip)
 
                 # Backup system configuration
+                if job:
+                    job.update_progress(90, 'Archiving configuration')
                 self.backup_system_config(backup_zip)
 
             # Update last backup timestamp on successful creation
@@ -1432,13 +1417,7 @@ class SystemBackupView(SystemAdminRequiredMixin, View):
                 logger.error(f'Failed to update last backup timestamp: {str(e)}')
                 # Don't fail the backup if timestamp update fails
 
-            # Stream the zip file in chunks
-            with open(zip_path, 'rb') as f:
-                while True:
-                    chunk = f.read(self.CHUNK_SIZE)
-                    if not chunk:
-                        break
-                    yield chunk
+            return zip_path
 
         finally:
             # Clean up temporary files
@@ -2143,40 +2122,62 @@ class ExportAllDataView(SystemAdminRequiredMixin, View):
     
     def get(self, request):
         try:
-            with tempfile.TemporaryDirectory() as temp_dir:
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                filename = f'olivian_data_export_{timestamp}.json'
-                filepath = os.path.join(temp_dir, filename)
-                
-                # Export all data excluding problematic tables
-                with open(filepath, 'w') as f:
-                    call_command('dumpdata', 
-                               exclude=[
-                                   'auth.permission',
-                                   'sessions',
-                                   'admin.logentry',
-                                   'core.bankaccount',  # Exclude non-existent model
-                                   'contenttypes'
-                               ],
-                               natural_foreign=True,
-                               indent=2,
-                               output=filepath)
-                
-                # Send file to user
-                with open(filepath, 'rb') as f:
-                    response = HttpResponse(f.read(), 
-                                         content_type='application/json')
-                    response['Content-Disposition'] = \
-                        f'attachment; filename="{filename}"'
-                
-                logger.info(f'Full data export created by {request.user.username}')
-                return response
+            from .job_queue import enqueue_job
+            job = enqueue_job('core.export_all_data', user=request.user, unique=True)
+            logger.info(f'Full data export queued by {request.user.username}')
+            messages.info(request, 'Data export started. You can download it here once it is ready.')
+            return redirect('core:job_detail', pk=job.pk)
                 
         except Exception as e:
             logger.error(f'Data export failed: {str(e)}', exc_info=True)
             messages.error(request, f'Data export failed: {str(e)}')
             return redirect('core:system_reports')
 
+class BackgroundJobAccessMixin(LoginRequiredMixin):
+    """Jobs are visible to the user who started them and to super admins"""
+
+    def get_job(self, pk):
+        job = get_object_or_404(BackgroundJob, pk=pk)
+        user = self.request.user
+        if job.created_by_id != user.pk and not (user.is_superuser or getattr(user, 'role', '') == 'super_admin'):
+            from django.http import Http404
+            raise Http404('Job not found')
+        return job
+
+
+class BackgroundJobDetailView(BackgroundJobAccessMixin, TemplateView):
+    """Progress page for a background job"""
+    template_name = 'core/job_status.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['job'] = self.get_job(kwargs['pk'])
+        return context
+
+
+class BackgroundJobStatusView(BackgroundJobAccessMixin, View):
+    """JSON status of a background job, polled by the progress page"""
+
+    def get(self, request, pk):
+        from .job_queue import job_status
+        job = self.get_job(pk)
+        data = job_status(job)
+        if data['has_file']:
+            data['download_url'] = reverse('core:job_download', args=[job.pk])
+        return JsonResponse(data)
+
+
+class BackgroundJobDownloadView(BackgroundJobAccessMixin, View):
+    """Download the file produced by a completed job"""
+
+    def get(self, request, pk):
+        job = self.get_job(pk)
+        if job.status != 'completed' or not job.result_file or not os.path.exists(job.result_file):
+            from django.http import Http404
+            raise Http404('Job result is not available')
+        return FileResponse(open(job.result_file, 'rb'), as_attachment=True, filename=job.result_filename)
+
+
 class ExportUserReportView(SystemAdminRequiredMixin, View):
     """Export detailed user report in CSV format"""
     
@@ -2361,25 +2362,16 @@ class ExportFinancialCSVView(SystemAdminRequiredMixin, View):
     
     def get(self, request):
         try:
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f'financial_data_{timestamp}.csv'
-            
-            response = HttpResponse(content_type='text/csv')
-            response['Content-Disposition'] = f'attachment; filename="{filename}"'
-            
-            writer = csv.writer(response)
-            self.write_financial_data(writer)
-            
-            return response
+            from .exports import export_response
+            params = {
+                key: request.GET[key] for key in ('date_from', 'date_to', 'status') if request.GET.get(key)
+            }
+            return export_response(request, 'financial.transactions', 'csv', params)
             
         except Exception as e:
             logger.error(f'Financial data export failed: {str(e)}')
             messages.error(request, 'Financial data export failed. Please try again.')
             return redirect('core:system_reports')
-    
-    def write_financial_data(self, writer):
-        # Implementation for writing financial data
-        pass
 
 class SystemStatusAPIView(LoginRequiredMixin, View):
     """API endpoint for system status metrics"""
@@ -3216,19 +3208,21 @@ class NewsletterCampaignDetailView(ManagementRequiredMixin, DetailView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+
+        # Opens/clicks are the counters folded in by flush_newsletter_tracking
         campaign = self.object
 
         # Get send logs with analytics
         send_logs = campaign.send_logs.all()
         total_sent = send_logs.count()
-        total_opens = send_logs.filter(opened_at__isnull=False).count()
-        total_clicks = send_logs.filter(clicked_at__isnull=False).count()
+        total_opens = campaign.opens_count
+        total_clicks = campaign.clicks_count
         total_bounces = send_logs.filter(delivery_status='bounced').count()
         total_failed = send_logs.filter(delivery_status='failed').count()
 
-        # Calculate rates
-        open_rate = (total_opens / total_sent * 100) if total_sent > 0 else 0
-        click_rate = (total_clicks / total_sent * 100) if total_sent > 0 else 0
+        # Rates come from the aggregated campaign counters
+        open_rate = campaign.open_rate
+        click_rate = campaign.click_rate
         delivery_rate = ((total_sent - total_failed - total_bounces) / total_sent * 100) if total_sent > 0 else 0
 
         context.update({
@@ -3275,6 +3269,24 @@ class NewsletterCampaignSendView(ManagementRequiredMixin, View):
         return redirect('core:newsletter_campaign_detail', pk=pk)
 
 
+class NewsletterCampaignProgressView(ManagementRequiredMixin, View):
+    """Delivery progress of a campaign, polled by the campaign detail page"""
+
+    def get(self, request, pk):
+        campaign = get_object_or_404(NewsletterCampaign, pk=pk)
+        from .campaign_dispatch import CampaignDispatcher
+        totals = CampaignDispatcher(campaign).progress()
+        done = totals['sent'] + totals['failed']
+        return JsonResponse({
+            'status': campaign.status,
+            'total': totals['total'],
+            'sent': totals['sent'],
+            'failed': totals['failed'],
+            'pending': totals['pending'],
+            'percent': round(done / totals['total'] * 100, 1) if totals['total'] else 0,
+        })
+
+
 class NewsletterSubscriberListView(ManagementRequiredMixin, ListView):
     """Manage newsletter subscribers"""
     model = NewsletterSubscriber
@@ -0,0 +1,54 @@
+"""
+CRM export specs (see apps/core/exports.py)
+"""
+
+from django.db.models import Q
+
+from apps.core.exports import Column, ExportSpec, blank_if_none, choice_label, date_format, register_export
+
+from .models import Contact, Lead
+
+
+def contact_name(title, first_name, last_name):
+    """Same output as Contact.get_full_name without loading the row"""
+    titles = dict(Contact.TITLE_CHOICES)
+    name_parts = [titles.get(title, title)] if title else []
+    name_parts.extend([first_name, last_name])
+    return ' '.join(name_parts)
+
+
+@register_export
+class CompanyContactExport(ExportSpec):
+    """Contacts of a company: its primary contact and the contacts on its leads"""
+    name = 'crm.company_contacts'
+    filename = 'company_contacts'
+    sheet_title = 'Contacts'
+    columns = [
+        Column('Name', 'title', 'first_name', 'last_name', format=contact_name),
+        Column('Email', 'email'),
+        Column('Phone', 'phone'),
+        Column('Position', 'position'),
+    ]
+
+    def get_queryset(self, params, user=None):
+        company_id = params['company_id']
+        return (Contact.objects
+                .filter(Q(leads__company_id=company_id) | Q(primary_company__pk=company_id))
+                .distinct()
+                .order_by('first_name', 'last_name', 'pk'))
+
+
+@register_export
+class CompanyLeadExport(ExportSpec):
+    name = 'crm.company_leads'
+    filename = 'company_leads'
+    sheet_title = 'Leads'
+    columns = [
+        Column('Title', 'title'),
+        Column('Status', 'status', format=choice_label(Lead.STATUS_CHOICES)),
+        Column('Value', 'estimated_value', format=blank_if_none),
+        Column('Created', 'created_at', format=date_format()),
+    ]
+
+    def get_queryset(self, params, user=None):
+        return Lead.objects.filter(company_id=params['company_id']).order_by('-created_at')
@@ -333,15 +333,16 @@ class Lead(models.Model):
             subject = self.render_template(template.subject, template_vars)
             body = self.render_template(template.body, template_vars)
 
-            # Send email
-            from django.core.mail import send_mail
-            result = send_mail(
-                subject=subject,
-                message=body,
-                from_email=getattr(settings, 'DEFAULT_FROM_EMAIL', 'noreply@olivian.co.ke'),
-                recipient_list=[self.contact.email],
-                html_message=body if '<' in body else None,
-                fail_silently=True
+            # Queue email (delivered by the process_email_outbox worker)
+            from apps.core.email_outbox import outbox_enabled
+            from apps.core.email_utils import EmailService
+            result = EmailService.queue_email(
+                subject,
+                body,
+                [self.contact.email],
+                getattr(settings, 'DEFAULT_FROM_EMAIL', 'noreply@olivian.co.ke'),
+                html_content=body if '<' in body else '',
+                template_name=f'lead_status_{new_status}'
             )
 
             if result:
@@ -351,7 +352,7 @@ class Lead(models.Model):
                     recipient_name=self.contact.get_full_name(),
                     subject=subject,
                     template=template,
-                    status='sent',
+                    status='queued' if outbox_enabled() else 'sent',
                     sent_at=timezone.now(),
                     contact=self.contact,
                     lead=self,
@@ -647,15 +648,16 @@ class Opportunity(models.Model):
             subject = self.render_template(template.subject, template_vars)
             body = self.render_template(template.body, template_vars)
 
-            # Send email
-            from django.core.mail import send_mail
-            result = send_mail(
-                subject=subject,
-                message=body,
-                from_email=getattr(settings, 'DEFAULT_FROM_EMAIL', 'noreply@olivian.co.ke'),
-                recipient_list=[self.contact.email],
-                html_message=body if '<' in body else None,
-                fail_silently=True
+            # Queue email (delivered by the process_email_outbox worker)
+            from apps.core.email_outbox import outbox_enabled
+            from apps.core.email_utils import EmailService
+            result = EmailService.queue_email(
+                subject,
+                body,
+                [self.contact.email],
+                getattr(settings, 'DEFAULT_FROM_EMAIL', 'noreply@olivian.co.ke'),
+                html_content=body if '<' in body else '',
+                template_name=f'opportunity_stage_{new_stage}'
             )
 
             if result:
@@ -665,7 +667,7 @@ class Opportunity(models.Model):
                     recipient_name=self.contact.get_full_name(),
                     subject=subject,
                     template=template,
-                    status='sent',
+                    status='queued' if outbox_enabled() else 'sent',
                     sent_at=timezone.now(),
                     contact=self.contact,
                     opportunity=self,
@@ -1143,6 +1145,7 @@ class EmailTemplate(models.Model):
 class EmailLog(models.Model):
     """Log of sent emails for tracking and analytics"""
     STATUS_CHOICES = [
+        ('queued', 'Queued'),
         ('sent', 'Sent'),
         ('delivered', 'Delivered'),
         ('opened', 'Opened'),
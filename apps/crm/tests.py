@@ -1,3 +1,62 @@
+from datetime import date
+from io import BytesIO
+
+import openpyxl
+from django.contrib.auth import get_user_model
 from django.test import TestCase
+from django.urls import reverse
+
+from apps.core.models import EmailOutbox
+
+from .models import Company, Contact, EmailLog, EmailTemplate, Lead, Opportunity
+
+User = get_user_model()
+
+
+class CompanyExportTest(TestCase):
+    """Test the streamed company CSV/XLSX export"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='crmuser', password='testpass123', role='sales_manager')
+        self.client.force_login(self.user)
+        primary = Contact.objects.create(title='dr', first_name='Amina', last_name='Otieno', email='amina@example.com')
+        self.company = Company.objects.create(name='Sunrise Farms', primary_contact=primary)
+        for i in range(3):
+            contact = Contact.objects.create(first_name='Lead', last_name=f'Contact {i}', email=f'lead{i}@example.com')
+            Lead.objects.create(title=f'Farm pump {i}', contact=contact, company=self.company, estimated_value=1000 * i)
+
+    def test_csv_export_lists_contacts_and_leads(self):
+        response = self.client.get(reverse('crm:company_export', args=[self.company.pk]), {'format': 'csv'})
+        content = b''.join(response.streaming_content).decode()
+        self.assertIn('Name,Sunrise Farms', content)
+        self.assertIn('Dr. Amina Otieno,amina@example.com', content)
+        self.assertIn('Lead Contact 2,lead2@example.com', content)
+        self.assertIn('Farm pump 1,New,1000', content)
+
+    def test_excel_export_has_one_sheet_per_section(self):
+        response = self.client.get(reverse('crm:company_export', args=[self.company.pk]), {'format': 'excel'})
+        workbook = openpyxl.load_workbook(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(workbook.sheetnames, ['Company Info', 'Contacts', 'Leads'])
+        self.assertEqual(len(list(workbook['Contacts'].values)), 5)
+        self.assertEqual(len(list(workbook['Leads'].values)), 4)
+
+
+class OpportunityStageEmailTest(TestCase):
+    """Stage changes queue the stage's template email in the outbox"""
+
+    def test_stage_change_queues_email(self):
+        contact = Contact.objects.create(first_name='Brian', last_name='Kamau', email='brian@example.com')
+        lead = Lead.objects.create(title='School solar', contact=contact, estimated_value=50000)
+        opportunity = Opportunity.objects.create(
+            name='School solar', lead=lead, contact=contact, value=50000, expected_close_date=date(2026, 12, 1)
+        )
+        template = EmailTemplate.objects.create(
+            name='Proposal', subject='Your proposal', body='Hello {{contact_name}}', template_type='proposal'
+        )
+
+        opportunity.send_stage_change_email('qualification', 'proposal')
 
-# Create your tests here.
+        queued = EmailOutbox.objects.get(template_name='opportunity_stage_proposal')
+        self.assertEqual(queued.subject, 'Your proposal')
+        log = EmailLog.objects.get(opportunity=opportunity)
+        self.assertEqual((log.template, log.status), (template, 'queued'))
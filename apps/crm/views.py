@@ -19,7 +19,6 @@ from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 from decimal import Decimal
 import csv
-import xlsxwriter
 from io import BytesIO
 from reportlab.pdfgen import canvas
 from reportlab.lib import colors
@@ -39,9 +38,8 @@ from .forms import (
     ActivityForm, CampaignForm
 )
 from .reports import ActivityReport, PipelineReport, RevenueReport, CustomerReport
+from apps.core.exports import csv_response, get_export, workbook_response
 from django.contrib.auth import get_user_model
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 from apps.ecommerce.models import Order
 
 User = get_user_model()
@@ -2272,121 +2270,46 @@ class CompanyExportView(LoginRequiredMixin, View):
         else:
             return HttpResponse('Invalid format specified', status=400)
 
+    def company_info_rows(self, company):
+        return [
+            ['Name', company.name],
+            ['Type', company.get_company_type_display()],
+            ['Industry', company.industry],
+            ['Registration Number', company.registration_number],
+            ['Tax Number', company.tax_number],
+            ['Email', company.email],
+            ['Phone', company.phone],
+            ['Website', company.website],
+            ['Address', f"{company.address_line_1} {company.address_line_2}"],
+            ['City', company.city],
+            ['County', company.county],
+            ['Postal Code', company.postal_code],
+            ['Employee Count', company.employee_count],
+            ['Annual Revenue', company.annual_revenue],
+        ]
+
+    def related_sections(self, company):
+        """(title, rows) for the contacts and leads sections, one streamed query each"""
+        params = {'company_id': company.pk}
+        for name in ('crm.company_contacts', 'crm.company_leads'):
+            spec = get_export(name)
+            yield spec.sheet_title, spec.rows(spec.get_queryset(params, self.request.user))
+
     def export_csv(self, company):
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = f'attachment; filename="{company.name}_export.csv"'
-        
-        writer = csv.writer(response)
-        writer.writerow(['Company Information'])
-        writer.writerow(['Name', company.name])
-        writer.writerow(['Type', company.get_company_type_display()])
-        writer.writerow(['Industry', company.industry])
-        writer.writerow(['Registration Number', company.registration_number])
-        writer.writerow(['Tax Number', company.tax_number])
-        writer.writerow(['Email', company.email])
-        writer.writerow(['Phone', company.phone])
-        writer.writerow(['Website', company.website])
-        writer.writerow(['Address', f"{company.address_line_1} {company.address_line_2}"])
-        writer.writerow(['City', company.city])
-        writer.writerow(['County', company.county])
-        writer.writerow(['Postal Code', company.postal_code])
-        writer.writerow(['Employee Count', company.employee_count])
-        writer.writerow(['Annual Revenue', company.annual_revenue])
-        
-        # Add contacts
-        writer.writerow([])
-        writer.writerow(['Contacts'])
-        writer.writerow(['Name', 'Email', 'Phone', 'Position'])
-        for contact in company.contacts.all():
-            writer.writerow([
-                contact.get_full_name(),
-                contact.email,
-                contact.phone,
-                contact.position
-            ])
-        
-        # Add leads
-        writer.writerow([])
-        writer.writerow(['Leads'])
-        writer.writerow(['Title', 'Status', 'Value', 'Created'])
-        for lead in company.leads.all():
-            writer.writerow([
-                lead.title,
-                lead.get_status_display(),
-                lead.estimated_value,
-                lead.created_at.strftime('%Y-%m-%d')
-            ])
-        
-        return response
+        def rows():
+            yield ['Company Information']
+            yield from self.company_info_rows(company)
+            for title, section_rows in self.related_sections(company):
+                yield []
+                yield [title]
+                yield from section_rows
+
+        return csv_response(rows(), f"{company.name}_export.csv")
 
     def export_excel(self, company):
-        output = BytesIO()
-        workbook = xlsxwriter.Workbook(output)
-        
-        # Company Information worksheet
-        ws_info = workbook.add_worksheet('Company Info')
-        bold = workbook.add_format({'bold': True})
-        
-        # Write company information
-        row = 0
-        ws_info.write(row, 0, 'Company Information', bold)
-        row += 1
-        
-        info_rows = [
-            ('Name', company.name),
-            ('Type', company.get_company_type_display()),
-            ('Industry', company.industry),
-            ('Registration Number', company.registration_number),
-            ('Tax Number', company.tax_number),
-            ('Email', company.email),
-            ('Phone', company.phone),
-            ('Website', company.website),
-            ('Address', f"{company.address_line_1} {company.address_line_2}"),
-            ('City', company.city),
-            ('County', company.county),
-            ('Postal Code', company.postal_code),
-            ('Employee Count', company.employee_count),
-            ('Annual Revenue', company.annual_revenue),
-        ]
-        
-        for label, value in info_rows:
-            ws_info.write(row, 0, label, bold)
-            ws_info.write(row, 1, value)
-            row += 1
-        
-        # Contacts worksheet
-        ws_contacts = workbook.add_worksheet('Contacts')
-        headers = ['Name', 'Email', 'Phone', 'Position']
-        for col, header in enumerate(headers):
-            ws_contacts.write(0, col, header, bold)
-        
-        for row, contact in enumerate(company.contacts.all(), start=1):
-            ws_contacts.write(row, 0, contact.get_full_name())
-            ws_contacts.write(row, 1, contact.email)
-            ws_contacts.write(row, 2, contact.phone)
-            ws_contacts.write(row, 3, contact.position)
-        
-        # Leads worksheet
-        ws_leads = workbook.add_worksheet('Leads')
-        headers = ['Title', 'Status', 'Value', 'Created']
-        for col, header in enumerate(headers):
-            ws_leads.write(0, col, header, bold)
-        
-        for row, lead in enumerate(company.leads.all(), start=1):
-            ws_leads.write(row, 0, lead.title)
-            ws_leads.write(row, 1, lead.get_status_display())
-            ws_leads.write(row, 2, float(lead.estimated_value) if lead.estimated_value else 0)
-            ws_leads.write(row, 3, lead.created_at.strftime('%Y-%m-%d'))
-        
-        workbook.close()
-        output.seek(0)
-        
-        response = HttpResponse(
-            output.read(),
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-        response['Content-Disposition'] = f'attachment; filename="{company.name}_export.xlsx"'
-        return response
+        sheets = [('Company Info', [['Company Information']] + self.company_info_rows(company))]
+        sheets.extend(self.related_sections(company))
+        return workbook_response(sheets, f"{company.name}_export.xlsx")
 
     def export_pdf(self, company):
         response = HttpResponse(content_type='application/pdf')
@@ -2431,7 +2354,8 @@ class CompanyExportView(LoginRequiredMixin, View):
         y -= 20
         p.setFont("Helvetica", 10)
         
-        for contact in company.contacts.all():
+        contacts = get_export('crm.company_contacts').get_queryset({'company_id': company.pk})
+        for contact in contacts:
             p.drawString(50, y, f"{contact.get_full_name()} - {contact.email}")
             y -= 15
             if contact.position:
@@ -2732,119 +2656,49 @@ class ExportReportView(ReportView):
         # Add other report types as needed
 
     def _export_excel(self, data, report_type):
-        wb = Workbook()
-        ws = wb.active
-        ws.title = f"{report_type.title()} Report"
-        
-        # Define styles
-        header_font = Font(bold=True, size=12, color='FFFFFF')
-        header_fill = PatternFill(start_color='366092', end_color='366092', fill_type='solid')
-        border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
-        )
-        
-        # Export based on report type
+        sheet_builders = {
+            'activity': self._activity_sheet,
+            'pipeline': self._pipeline_sheet,
+            'revenue': self._revenue_sheet,
+            'customer': self._customer_sheet,
+        }
         if report_type == 'all':
             # Comprehensive report with multiple sheets
-            self._write_activity_sheet(wb, data.get('activity', {}))
-            self._write_pipeline_sheet(wb, data.get('pipeline', {}))
-            self._write_revenue_sheet(wb, data.get('revenue', {}))
-            self._write_customer_sheet(wb, data.get('customer', {}))
+            sheets = [builder(data.get(section, {})) for section, builder in sheet_builders.items()]
+        elif report_type in sheet_builders:
+            sheets = [sheet_builders[report_type](data)]
         else:
-            # Single report type
-            if report_type == 'activity':
-                self._write_activity_sheet(wb, data)
-            elif report_type == 'pipeline':
-                self._write_pipeline_sheet(wb, data)
-            elif report_type == 'revenue':
-                self._write_revenue_sheet(wb, data)
-            elif report_type == 'customer':
-                self._write_customer_sheet(wb, data)
-
-        # Save to buffer
-        output = io.BytesIO()
-        wb.save(output)
-        output.seek(0)
-        
-        filename = f"crm_report_{report_type}_{timezone.now().strftime('%Y%m%d')}.xlsx"
-       
-        response = HttpResponse(
-            output.read(),
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
-        return response
+            sheets = [(f"{report_type.title()} Report", [])]
 
-    def _write_activity_sheet(self, workbook, data):
-        ws = workbook.create_sheet("Activities")
-        headers = ['Type', 'Count', 'Completion Rate']
-        
-        # Write headers
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col, value=header)
-            cell.font = Font(bold=True)
-        
-        # Write data
-        for row, activity in enumerate(data.get('by_type', []), 2):
-            ws.cell(row=row, column=1, value=activity['activity_type'])
-            ws.cell(row=row, column=2, value=activity['count'])
-            ws.cell(row=row, column=3, value=f"{activity['completion_rate']:.1f}%")
-
-    def _write_pipeline_sheet(self, workbook, data):
-        ws = workbook.create_sheet("Pipeline")
-        headers = ['Stage', 'Count', 'Value', 'Weighted Value']
-        
-        # Write headers
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col, value=header)
-            cell.font = Font(bold=True)
-        
-        # Write data
-        for row, stage in enumerate(data.get('by_stage', []), 2):
-            ws.cell(row=row, column=1, value=stage['stage'])
-            ws.cell(row=row, column=2, value=stage['count'])
-            ws.cell(row=row, column=3, value=stage['value'])
-            ws.cell(row=row, column=4, value=stage['weighted_value'])
-
-    def _write_revenue_sheet(self, workbook, data):
-        ws = workbook.create_sheet("Revenue")
-        headers = ['Month', 'Revenue', 'Deals']
-        
-        # Write headers
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col, value=header)
-            cell.font = Font(bold=True)
-        
-        # Write monthly data
-        for row, month in enumerate(data.get('by_month', []), 2):
-            ws.cell(row=row, column=1, value=month['month'])
-            ws.cell(row=row, column=2, value=month['revenue'])
-            ws.cell(row=row, column=3, value=month['deals'])
-
-    def _write_customer_sheet(self, workbook, data):
-        ws = workbook.create_sheet("Customers")
-        
-        # Write summary
-        ws.cell(row=1, column=1, value='Metric')
-        ws.cell(row=1, column=2, value='Value')
-        ws.cell(row=1, column=1).font = Font(bold=True)
-        ws.cell(row=1, column=2).font = Font(bold=True)
-        
-        row = 2
-        metrics = [
-            ('Total Customers', data.get('total_customers', 0)),
-            ('New Customers', data.get('new_customers', 0)),
-            ('Retention Rate', f"{data.get('retention_rate', 0):.1f}%"),
-            ('Average Customer LTV', data.get('customer_lifetime_value', 0))
+        filename = f"crm_report_{report_type}_{timezone.now().strftime('%Y%m%d')}.xlsx"
+        return workbook_response(sheets, filename)
+
+    def _activity_sheet(self, data):
+        rows = [['Type', 'Count', 'Completion Rate']]
+        for activity in data.get('by_type', []):
+            rows.append([activity['activity_type'], activity['count'], f"{activity['completion_rate']:.1f}%"])
+        return 'Activities', rows
+
+    def _pipeline_sheet(self, data):
+        rows = [['Stage', 'Count', 'Value', 'Weighted Value']]
+        for stage in data.get('by_stage', []):
+            rows.append([stage['stage'], stage['count'], stage['value'], stage['weighted_value']])
+        return 'Pipeline', rows
+
+    def _revenue_sheet(self, data):
+        rows = [['Month', 'Revenue', 'Deals']]
+        for month in data.get('by_month', []):
+            rows.append([month['month'], month['revenue'], month['deals']])
+        return 'Revenue', rows
+
+    def _customer_sheet(self, data):
+        return 'Customers', [
+            ['Metric', 'Value'],
+            ['Total Customers', data.get('total_customers', 0)],
+            ['New Customers', data.get('new_customers', 0)],
+            ['Retention Rate', f"{data.get('retention_rate', 0):.1f}%"],
+            ['Average Customer LTV', data.get('customer_lifetime_value', 0)],
         ]
-        
-        for metric, value in metrics:
-            ws.cell(row=row, column=1, value=metric)
-            ws.cell(row=row, column=2, value=value)
-            row += 1
 
     def _export_pdf(self, data, report_type):
         buffer = io.BytesIO()
@@ -7,7 +7,7 @@ import logging
 
 logger = logging.getLogger(__name__)
 
-from .models import Order, OrderItem, OrderStatusHistory, ShoppingCart, CartItem, Payment, Receipt, MPesaTransaction
+from .models import Order, OrderItem, OrderStatusHistory, ShoppingCart, CartItem, Payment, Receipt, MPesaTransaction, MPesaCallbackEvent
 
 class OrderStatusHistoryInline(admin.TabularInline):
     model = OrderStatusHistory
@@ -250,3 +250,10 @@ class MPesaTransactionAdmin(admin.ModelAdmin):
     list_display = ('order', 'phone_number', 'amount', 'status', 'created_at')
     list_filter = ('status', 'created_at')
     readonly_fields = ('order', 'checkout_request_id', 'created_at', 'updated_at')
+
+@admin.register(MPesaCallbackEvent)
+class MPesaCallbackEventAdmin(admin.ModelAdmin):
+    list_display = ('checkout_request_id', 'source', 'result_code', 'mpesa_receipt_number', 'status', 'attempts', 'created_at')
+    list_filter = ('status', 'source', 'created_at')
+    search_fields = ('checkout_request_id', 'mpesa_receipt_number')
+    readonly_fields = ('checkout_request_id', 'mpesa_receipt_number', 'result_code', 'payload', 'created_at', 'processed_at')
@@ -0,0 +1,66 @@
+import json
+from channels.generic.websocket import AsyncWebsocketConsumer
+from channels.db import database_sync_to_async
+from .models import MPesaTransaction
+from .mpesa_status import push_enabled, status_group, status_payload
+
+# Roles that may follow any customer's payment (same as the order management views)
+STAFF_ROLES = ['super_admin', 'manager', 'director', 'sales_manager', 'cashier']
+
+
+class MPesaStatusConsumer(AsyncWebsocketConsumer):
+    """Pushes the outcome of one STK push to the checkout page or POS terminal waiting on it"""
+
+    async def connect(self):
+        """Handle WebSocket connection"""
+        self.checkout_request_id = self.scope['url_route']['kwargs']['checkout_request_id']
+
+        # Check if user is authenticated
+        user = self.scope.get('user')
+        if not user or not user.is_authenticated:
+            await self.close()
+            return
+
+        # Join the group before reading the status, so a result published in between is not missed
+        self.group_name = status_group(self.checkout_request_id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+
+        payload = await self.get_status(user)
+        if payload is None:
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+            del self.group_name
+            await self.close()
+            return
+
+        await self.accept()
+
+        # The callback may have landed before the page subscribed. ``push`` tells the page
+        # whether later results can reach this socket or it should poll instead.
+        await self.send(text_data=json.dumps(dict(payload, push=push_enabled())))
+
+    async def disconnect(self, close_code):
+        """Handle WebSocket disconnection"""
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def mpesa_status(self, event):
+        """Forward a published status update"""
+        await self.send(text_data=json.dumps(event['payload']))
+
+    @database_sync_to_async
+    def get_status(self, user):
+        """Current status payload, or None if the user may not follow this transaction"""
+        transaction = (
+            MPesaTransaction.objects.select_related('order', 'pos_sale')
+            .filter(checkout_request_id=self.checkout_request_id)
+            .first()
+        )
+        if transaction is None:
+            return None
+
+        allowed = user.is_staff or getattr(user, 'role', None) in STAFF_ROLES
+        if transaction.order and transaction.order.user_id == user.id:
+            allowed = True
+        if transaction.pos_sale and transaction.pos_sale.cashier_id == user.id:
+            allowed = True
+        return status_payload(transaction) if allowed else None
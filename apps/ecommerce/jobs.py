@@ -0,0 +1,16 @@
+"""
+Background job handlers for the ecommerce app (see apps/core/job_queue.py)
+"""
+
+from apps.core.job_queue import register_job
+
+
+@register_job('ecommerce.generate_receipt_pdf')
+def generate_receipt_pdf(job, receipt_id):
+    """Render a receipt PDF outside the payment request"""
+    from .models import Receipt
+
+    receipt = Receipt.objects.get(pk=receipt_id)
+    if not receipt.receipt_file:
+        receipt.generate_receipt_pdf()
+    return {'receipt_number': receipt.receipt_number}
@@ -2,6 +2,7 @@ from django.core.management.base import BaseCommand
 from django.utils import timezone
 from datetime import timedelta
 from apps.ecommerce.models import MPesaTransaction
+from apps.ecommerce.mpesa_status import PENDING, UNAVAILABLE, publish_status, sweep_pending
 import logging
 
 logger = logging.getLogger(__name__)
@@ -16,6 +17,11 @@ class Command(BaseCommand):
             default=10,
             help='Hours after which pending transactions are considered timed out (default: 10)'
         )
+        parser.add_argument(
+            '--skip-query',
+            action='store_true',
+            help='Time transactions out without a final status query to Safaricom'
+        )
 
     def handle(self, *args, **options):
         timeout_hours = options['hours']
@@ -27,6 +33,14 @@ class Command(BaseCommand):
             created_at__lt=cutoff_time
         )
 
+        # Payments that went through but whose callback was lost are settled, not timed out
+        if not options['skip_query']:
+            outcomes = sweep_pending(timed_out_transactions.select_related('order', 'pos_sale'))
+            settled = sum(1 for _, outcome in outcomes if outcome not in (PENDING, UNAVAILABLE))
+            if settled:
+                # They are no longer pending, so the queryset below skips them
+                self.stdout.write(f"Settled {settled} transactions from their M-Pesa status")
+
         processed_count = 0
         order_updates = 0
         sale_updates = 0
@@ -42,6 +56,7 @@ class Command(BaseCommand):
             transaction.status = 'timeout'
             transaction.error_message = f'Transaction timed out after {timeout_hours} hours'
             transaction.save()
+            publish_status(transaction)
 
             processed_count += 1
 
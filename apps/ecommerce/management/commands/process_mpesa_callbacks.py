@@ -0,0 +1,47 @@
+"""
+Management command to apply stored M-Pesa callbacks
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.ecommerce.mpesa_callbacks import BATCH_SIZE, CallbackWorker
+
+
+class Command(BaseCommand):
+    help = 'Apply M-Pesa STK callbacks waiting in the callback inbox to their orders and POS sales'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep running and poll the inbox (default: drain once and exit, for cron)'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=1,
+            help='Seconds to sleep between polls in --loop mode (default: 1)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help=f'Callbacks claimed per batch (default: {BATCH_SIZE})'
+        )
+
+    def handle(self, *args, **options):
+        worker = CallbackWorker(batch_size=options['batch_size'])
+        try:
+            while True:
+                applied, failed = worker.drain()
+                if applied or failed:
+                    self.stdout.write(f"Applied {applied} callbacks, {failed} failed")
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping M-Pesa callback worker")
+
+        if not options['loop'] and not (applied or failed):
+            self.stdout.write("No callbacks to apply")
@@ -0,0 +1,41 @@
+# Generated by Django 5.1.5 on 2026-10-17 04:20
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0006_order_shipping_company_alter_order_tracking_number'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MPesaCallbackEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('source', models.CharField(choices=[('shop', 'Online Shop'), ('pos', 'Point of Sale')], max_length=10)),
+                ('checkout_request_id', models.CharField(max_length=100)),
+                ('mpesa_receipt_number', models.CharField(blank=True, max_length=50)),
+                ('result_code', models.IntegerField(blank=True, null=True)),
+                ('payload', models.JSONField(default=dict)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('processed', 'Processed'), ('ignored', 'Ignored'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('claimed_by', models.CharField(blank=True, max_length=32)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'M-Pesa Callback',
+                'verbose_name_plural': 'M-Pesa Callbacks',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='ecommerce_m_status_d104e2_idx')],
+                'constraints': [models.UniqueConstraint(fields=('checkout_request_id', 'mpesa_receipt_number'), name='unique_mpesa_callback')],
+            },
+        ),
+    ]
@@ -2,6 +2,7 @@ from django.db import models
 from django.utils import timezone
 from decimal import Decimal
 from apps.core.models import TimeStampedModel
+from apps.core.numbering import next_number
 
 class ShoppingCart(TimeStampedModel):
     user = models.OneToOneField('accounts.User', on_delete=models.CASCADE)
@@ -22,12 +23,8 @@ class ShoppingCart(TimeStampedModel):
     @property
     def subtotal_ex_vat(self):
         """Returns subtotal excluding VAT"""
-        from apps.core.models import CompanySettings
-        from decimal import Decimal
-        company_settings = CompanySettings.get_settings()
-        vat_rate = company_settings.vat_rate
-        vat_multiplier = 1 + (vat_rate / 100)
-        return self.subtotal / vat_multiplier
+        from apps.core.settings_cache import get_company_settings
+        return self.subtotal / get_company_settings().vat_multiplier
 
     @property
     def total_with_vat(self):
@@ -111,10 +108,8 @@ class OrderSequence(models.Model):
         if year is None:
             year = timezone.now().year
 
-        sequence, created = cls.objects.get_or_create(year=year, defaults={'last_number': 0})
-        sequence.last_number += 1
-        sequence.save()
-        return f"OG-ORD-{year}-{sequence.last_number:04d}"
+        number = next_number(cls, year=year)
+        return f"OG-ORD-{year}-{number:04d}"
 
 class Order(TimeStampedModel):
     STATUS_CHOICES = [
@@ -312,15 +307,16 @@ class Order(TimeStampedModel):
             }
         )
 
-        # Generate PDF if receipt exists but no file
+        # Render the PDF in a background job rather than in the payment request
         if not receipt.receipt_file:
             try:
-                receipt.generate_receipt_pdf()
+                from apps.core.job_queue import enqueue_job
+                enqueue_job('ecommerce.generate_receipt_pdf', {'receipt_id': receipt.pk}, unique=True)
             except Exception as e:
                 # Log error but don't fail the function
                 import logging
                 logger = logging.getLogger(__name__)
-                logger.error(f"Failed to generate PDF for receipt {receipt.receipt_number}: {str(e)}")
+                logger.error(f"Failed to queue PDF for receipt {receipt.receipt_number}: {str(e)}")
 
         return receipt
 
@@ -427,15 +423,14 @@ class Receipt(TimeStampedModel):
         return f"Receipt {self.receipt_number}"
 
     def generate_receipt_pdf(self):
-        """Generate PDF receipt with company logo and details"""
-        from reportlab.pdfgen import canvas
-        from reportlab.lib.pagesizes import letter, A4
-        from reportlab.lib.units import inch
-        from reportlab.lib import colors
-        from reportlab.lib.styles import getSampleStyleSheet
-        from reportlab.platypus import Table, TableStyle
+        """Generate PDF receipt with company logo and details.
+
+        The file name carries a hash of everything the receipt shows, so an
+        unchanged receipt is not drawn again (see apps/core/pdf_cache.py).
+        """
         from django.conf import settings
         from apps.core.models import CompanySettings
+        from apps.core.pdf_cache import get_or_render
         import os
 
         # Get company settings
@@ -443,13 +438,77 @@ class Receipt(TimeStampedModel):
             company = CompanySettings.objects.first()
         except CompanySettings.DoesNotExist:
             company = None
+        bank_accounts = self._payment_bank_accounts()
 
-        # Create the PDF
-        filename = f"receipt_{self.receipt_number}.pdf"
-        filepath = os.path.join(settings.MEDIA_ROOT, 'receipts', filename)
+        filepath, digest = get_or_render(
+            os.path.join(settings.MEDIA_ROOT, 'receipts'),
+            f"receipt_{self.receipt_number}",
+            self.pdf_inputs(company, bank_accounts),
+            lambda target: self._draw_receipt_pdf(target, company, bank_accounts),
+        )
 
-        # Ensure directory exists
-        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        # Update the file field
+        name = f"receipts/{os.path.basename(filepath)}"
+        if self.receipt_file.name != name:
+            self.receipt_file.name = name
+            self.save()
+
+        return filepath
+
+    def _payment_bank_accounts(self):
+        """Bank accounts printed in the payment details section (at most two)"""
+        try:
+            from apps.financial.models import BankAccount
+            bank_accounts = BankAccount.objects.filter(is_active=True, is_default=True).select_related('bank')
+
+            if not bank_accounts.exists():
+                # Fallback to any active account
+                bank_accounts = BankAccount.objects.filter(is_active=True).select_related('bank')
+        except ImportError:
+            # Fallback to legacy core model if financial app not available
+            from apps.core.models import BankAccount
+            bank_accounts = BankAccount.objects.filter(is_active=True)
+        return list(bank_accounts[:2])
+
+    def pdf_inputs(self, company, bank_accounts):
+        """Everything the receipt PDF shows; the file is regenerated when any of it changes"""
+        from apps.core.pdf_cache import field_values
+
+        order = self.order
+        return {
+            'receipt': field_values(self, ['receipt_number', 'issued_date']),
+            'order': field_values(order, [
+                'order_number', 'payment_method', 'mpesa_transaction_id',
+                'subtotal', 'discount_amount', 'tax_amount', 'total_amount',
+            ]),
+            'customer': field_values(order.customer, ['name']),
+            'items': list(order.items.values_list('product_name', 'quantity', 'unit_price', 'total_price')),
+            'company': field_values(company, [
+                'name', 'address', 'phone', 'email', 'website', 'logo',
+                'bank_name', 'bank_account_number', 'bank_branch',
+                'mpesa_business_name', 'mpesa_till_number', 'mpesa_paybill_number',
+                'mpesa_account_number', 'mpesa_phone_number',
+            ]),
+            'bank_accounts': [
+                [getattr(account, 'account_name', None) or getattr(account, 'name', 'N/A'),
+                 getattr(getattr(account, 'bank', None), 'name', None) or getattr(account, 'bank_name', None),
+                 account.account_number,
+                 getattr(account, 'branch', None) or getattr(account, 'branch_name', None),
+                 getattr(account, 'branch_code', None)]
+                for account in bank_accounts
+            ],
+        }
+
+    def _draw_receipt_pdf(self, filepath, company, bank_accounts):
+        """Draw the receipt with reportlab into ``filepath``"""
+        from reportlab.pdfgen import canvas
+        from reportlab.lib.pagesizes import letter, A4
+        from reportlab.lib.units import inch
+        from reportlab.lib import colors
+        from reportlab.lib.styles import getSampleStyleSheet
+        from reportlab.platypus import Table, TableStyle
+        from django.conf import settings
+        import os
 
         c = canvas.Canvas(filepath, pagesize=A4)
         width, height = A4
@@ -578,20 +637,8 @@ class Receipt(TimeStampedModel):
         c.drawString(480, y_position, f"KES {self.order.total_amount:,.2f}")
 
         # Payment Details Section - Bank accounts and M-Pesa
-        try:
-            from apps.financial.models import BankAccount
-            bank_accounts = BankAccount.objects.filter(is_active=True, is_default=True)
-
-            if not bank_accounts.exists():
-                # Fallback to any active account
-                bank_accounts = BankAccount.objects.filter(is_active=True)
-        except ImportError:
-            # Fallback to legacy core model if financial app not available
-            from apps.core.models import BankAccount
-            bank_accounts = BankAccount.objects.filter(is_active=True)
-
         # Check if we have any payment methods to show
-        has_bank_accounts = bank_accounts.exists()
+        has_bank_accounts = bool(bank_accounts)
         has_legacy_bank = company and company.bank_name
         has_mpesa = company and (company.mpesa_till_number or company.mpesa_paybill_number)
 
@@ -609,7 +656,7 @@ class Receipt(TimeStampedModel):
                 c.drawString(50, y_position, "Bank Transfer:")
                 y_position -= 15
 
-                for account in bank_accounts[:2]:  # Show maximum 2 accounts
+                for account in bank_accounts:  # Show maximum 2 accounts
                     c.setFont("Helvetica-Bold", 9)
                     # Handle both financial app BankAccount and legacy core BankAccount
                     account_name = getattr(account, 'account_name', None) or getattr(account, 'name', 'N/A')
@@ -708,12 +755,6 @@ class Receipt(TimeStampedModel):
 
         c.save()
 
-        # Update the file field
-        self.receipt_file.name = f"receipts/{filename}"
-        self.save()
-
-        return filepath
-
 class Wishlist(TimeStampedModel):
     user = models.OneToOneField('accounts.User', on_delete=models.CASCADE)
     products = models.ManyToManyField('products.Product', through='WishlistItem')
@@ -865,3 +906,50 @@ class MPesaTransaction(TimeStampedModel):
         self.status = 'failed'
         self.error_message = error_message
         self.save()
+
+
+class MPesaCallbackEvent(TimeStampedModel):
+    """Raw Daraja STK callback, stored on receipt and applied by the process_mpesa_callbacks worker"""
+    SOURCE_CHOICES = [
+        ('shop', 'Online Shop'),
+        ('pos', 'Point of Sale'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('processed', 'Processed'),
+        ('ignored', 'Ignored'),
+        ('failed', 'Failed'),
+    ]
+
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES)
+    checkout_request_id = models.CharField(max_length=100)
+    # Blank for unsuccessful payments; Safaricom retries repeat the same receipt
+    mpesa_receipt_number = models.CharField(max_length=50, blank=True)
+    result_code = models.IntegerField(null=True, blank=True)
+    payload = models.JSONField(default=dict)
+
+    # Processing state
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claimed_by = models.CharField(max_length=32, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['checkout_request_id', 'mpesa_receipt_number'], name='unique_mpesa_callback'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+        verbose_name = 'M-Pesa Callback'
+        verbose_name_plural = 'M-Pesa Callbacks'
+
+    def __str__(self):
+        return f"Callback {self.checkout_request_id} ({self.get_status_display()})"
@@ -0,0 +1,301 @@
+"""
+Inbox for Daraja STK Push callbacks.
+
+The shop and POS callback views store the raw payload in the
+MPesaCallbackEvent table first. Resent callbacks are dropped by the unique
+(checkout_request_id, receipt number) key. Each event is applied inside a
+transaction that locks the MPesaTransaction row; a transaction that has
+already reached the callback's outcome is left alone, so every state change
+happens exactly once. Applied results are pushed to subscribed checkout pages
+and POS terminals (see publish_status).
+
+By default new events are applied inside the callback request. With
+MPESA_CALLBACK_QUEUE_ENABLED the views only store and acknowledge them, so a
+slow email or a locked row can't make Safaricom time out and resend, and the
+process_mpesa_callbacks command claims stored events in arrival order. That
+command also retries events whose inline processing failed, so schedule it
+either way (README, Deployment Guide).
+"""
+
+import json
+import logging
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction as db_transaction
+from django.db.models import Q
+from django.http import JsonResponse
+from django.utils import timezone
+
+from .models import MPesaCallbackEvent, MPesaTransaction
+from .mpesa import MPesaCallback
+from .mpesa_status import publish_status, record_receipt
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = getattr(settings, 'MPESA_CALLBACK_BATCH_SIZE', 50)
+MAX_ATTEMPTS = getattr(settings, 'MPESA_CALLBACK_MAX_ATTEMPTS', 5)
+# An event stuck in 'processing' longer than this belonged to a worker that died
+CLAIM_TIMEOUT = getattr(settings, 'MPESA_CALLBACK_CLAIM_TIMEOUT', 60 * 5)
+RETRY_DELAY = getattr(settings, 'MPESA_CALLBACK_RETRY_DELAY', 30)  # seconds, doubled per attempt
+# Events due this long ago and still pending mean process_mpesa_callbacks is not running
+BACKLOG_ALERT_AFTER = getattr(settings, 'MPESA_CALLBACK_BACKLOG_ALERT_AFTER', 60 * 10)
+
+# Result codes where the customer or M-Pesa cancelled the request
+CANCELLED_RESULT_CODES = (1, 17, 26)
+
+PROCESSED = 'processed'
+IGNORED = 'ignored'
+
+
+def queue_enabled():
+    """Whether callbacks are applied by the worker (True) or inside the callback request (False)"""
+    return getattr(settings, 'MPESA_CALLBACK_QUEUE_ENABLED', False)
+
+
+def record_callback(payload, source):
+    """Store a callback payload; returns (event, created), event is None for unusable payloads"""
+    stk_callback = (payload.get('Body') or {}).get('stkCallback') or {}
+    checkout_request_id = stk_callback.get('CheckoutRequestID')
+    if not checkout_request_id:
+        return None, False
+
+    parsed = MPesaCallback.parse_callback_data(payload)
+    try:
+        with db_transaction.atomic():
+            return MPesaCallbackEvent.objects.get_or_create(
+                checkout_request_id=checkout_request_id,
+                mpesa_receipt_number=parsed.get('mpesa_receipt_number') or '',
+                defaults={
+                    'source': source,
+                    'result_code': stk_callback.get('ResultCode'),
+                    'payload': payload,
+                },
+            )
+    except IntegrityError:
+        # A concurrent delivery of the same callback won the insert
+        return MPesaCallbackEvent.objects.get(
+            checkout_request_id=checkout_request_id,
+            mpesa_receipt_number=parsed.get('mpesa_receipt_number') or '',
+        ), False
+
+
+def receive_callback(request, source, error_status=200):
+    """Callback view body: persist the payload and acknowledge Safaricom straight away"""
+    try:
+        payload = json.loads(request.body.decode('utf-8'))
+    except (ValueError, UnicodeDecodeError):
+        logger.warning(f"Unreadable M-Pesa {source} callback")
+        return JsonResponse({'ResultCode': 1, 'ResultDesc': 'Invalid callback payload'}, status=error_status)
+
+    event, created = record_callback(payload, source)
+    if event is None:
+        return JsonResponse({'ResultCode': 1, 'ResultDesc': 'Missing checkout request ID'}, status=error_status)
+    if not created:
+        logger.info(f"Duplicate M-Pesa callback for {event.checkout_request_id}")
+    elif not queue_enabled():
+        process_event(event)
+    else:
+        check_backlog()
+
+    return JsonResponse({'ResultCode': 0, 'ResultDesc': 'Accepted'})
+
+
+def check_backlog():
+    """Log an error when stored callbacks have waited longer than BACKLOG_ALERT_AFTER; returns their number"""
+    overdue = MPesaCallbackEvent.objects.filter(
+        status='pending', next_attempt_at__lt=timezone.now() - timedelta(seconds=BACKLOG_ALERT_AFTER),
+    ).count()
+    if overdue:
+        logger.error(
+            f"{overdue} M-Pesa callbacks have waited over {BACKLOG_ALERT_AFTER // 60} minutes: "
+            f"payments stay pending until `manage.py process_mpesa_callbacks` runs"
+        )
+    return overdue
+
+
+def failure_message(result_code, result_description):
+    """Customer-facing message for an unsuccessful STK result code"""
+    if result_code in CANCELLED_RESULT_CODES:  # User cancelled, transaction cancelled, or insufficient balance
+        return "Payment was cancelled by user or failed"
+    elif result_code in [2, 3, 4]:  # Wrong PIN, transaction declined, or wrong expiry date
+        return f"Payment declined: {result_description}"
+    elif result_code == 1032:  # Timeout
+        return "Payment timed out"
+    return f"Payment failed: {result_description}"
+
+
+def apply_callback(event):
+    """Apply one stored callback; returns PROCESSED or IGNORED. Runs inside a transaction."""
+    mpesa_transaction = (
+        MPesaTransaction.objects.select_for_update()
+        .filter(checkout_request_id=event.checkout_request_id)
+        .first()
+    )
+    if mpesa_transaction is None:
+        # Log unknown transaction for security monitoring
+        logger.warning(f"Unknown transaction callback received for CheckoutRequestID {event.checkout_request_id}")
+        return IGNORED
+
+    data = MPesaCallback.parse_callback_data(event.payload)
+    result_code = data.get('result_code')
+
+    if result_code == 0:
+        # A late success still wins over a timeout or failure: the customer has paid
+        if mpesa_transaction.status == 'completed':
+            receipt_number = data.get('mpesa_receipt_number')
+            if mpesa_transaction.mpesa_receipt_number or not receipt_number:
+                return IGNORED
+            # Completed from a status query, which carries no receipt number
+            mpesa_transaction.callback_response = dict(mpesa_transaction.callback_response or {}, **event.payload)
+            record_receipt(mpesa_transaction, receipt_number)
+            publish_status(mpesa_transaction)
+            return PROCESSED
+        mpesa_transaction.callback_response = event.payload
+        _complete(mpesa_transaction, data.get('mpesa_receipt_number'))
+        logger.info(f"M-Pesa payment completed: {mpesa_transaction.mpesa_receipt_number}")
+    else:
+        if mpesa_transaction.status not in ('initiated', 'pending'):
+            return IGNORED
+        error_message = failure_message(result_code, data.get('result_description', 'Unknown result'))
+        mpesa_transaction.callback_response = event.payload
+        mpesa_transaction.mark_failed(error_message)
+        _fail_related(mpesa_transaction, result_code, error_message)
+        logger.info(f"M-Pesa payment failed (Result Code: {result_code}): {error_message}")
+
+    publish_status(mpesa_transaction)
+    return PROCESSED
+
+
+def _complete(mpesa_transaction, receipt_number):
+    now = timezone.now()
+    if mpesa_transaction.order:
+        # Also records the order's M-Pesa Payment
+        mpesa_transaction.mark_completed(receipt_number=receipt_number, transaction_date=now)
+
+        order = mpesa_transaction.order
+        order.payment_status = 'paid'
+        order.status = 'paid'
+        order.mpesa_transaction_id = receipt_number
+        order.save()
+        return
+
+    mpesa_transaction.status = 'completed'
+    mpesa_transaction.mpesa_receipt_number = receipt_number
+    mpesa_transaction.transaction_date = now
+    mpesa_transaction.save()
+
+    sale = mpesa_transaction.pos_sale
+    if sale:
+        from apps.pos.models import Payment as POSPayment
+
+        # Create or update payment record for POS
+        payment, created = POSPayment.objects.get_or_create(
+            sale=sale,
+            payment_type='mpesa',
+            defaults={
+                'amount': mpesa_transaction.amount,
+                'transaction_id': receipt_number,
+                'mpesa_receipt_number': receipt_number,
+                'mpesa_phone_number': mpesa_transaction.phone_number,
+                'status': 'completed'
+            }
+        )
+        if not created:
+            payment.status = 'completed'
+            payment.transaction_id = receipt_number
+            payment.mpesa_receipt_number = receipt_number
+            payment.save()
+
+        # Update sale status to completed
+        sale.status = 'completed'
+        sale.mpesa_transaction_id = receipt_number
+        sale.save()
+
+        # Update customer loyalty points if customer exists
+        if hasattr(sale.customer, 'update_purchase_stats'):
+            sale.customer.update_purchase_stats(sale.grand_total, sale.transaction_time)
+
+
+def _fail_related(mpesa_transaction, result_code, error_message):
+    cancelled = result_code in CANCELLED_RESULT_CODES
+    if mpesa_transaction.pos_sale:
+        sale = mpesa_transaction.pos_sale
+        sale.status = 'cancelled' if cancelled else 'failed'
+        sale.save()
+
+    elif mpesa_transaction.order:
+        order = mpesa_transaction.order
+        if cancelled:  # User cancelled or transaction cancelled
+            order.status = 'cancelled'
+            order.status_notes = f"M-Pesa payment cancelled: {error_message}"
+        else:
+            order.status = 'failed'
+            order.status_notes = f"M-Pesa payment failed: {error_message}"
+        order.save()
+
+
+def process_event(event):
+    """Apply ``event`` and record the outcome; returns True when it was applied or ignored"""
+    try:
+        with db_transaction.atomic():
+            outcome = apply_callback(event)
+            MPesaCallbackEvent.objects.filter(pk=event.pk).update(
+                status=outcome, attempts=event.attempts + 1, last_error='',
+                claimed_by='', claimed_at=None, processed_at=timezone.now(),
+            )
+        event.status = outcome
+        return True
+    except Exception as e:
+        event.attempts += 1
+        event.status = 'failed' if event.attempts >= MAX_ATTEMPTS else 'pending'
+        event.last_error = str(e) or e.__class__.__name__
+        event.next_attempt_at = timezone.now() + timedelta(seconds=RETRY_DELAY * 2 ** (event.attempts - 1))
+        MPesaCallbackEvent.objects.filter(pk=event.pk).update(
+            status=event.status, attempts=event.attempts, last_error=event.last_error,
+            next_attempt_at=event.next_attempt_at, claimed_by='', claimed_at=None,
+        )
+        logger.error(f"Error applying M-Pesa callback {event.pk} (attempt {event.attempts}): {event.last_error}")
+        return False
+
+
+class CallbackWorker:
+    """Drains the MPesaCallbackEvent inbox"""
+
+    def __init__(self, batch_size=BATCH_SIZE):
+        self.batch_size = batch_size
+
+    def claim(self):
+        """Mark the oldest waiting events as ours and return them in arrival order"""
+        now = timezone.now()
+        due = (Q(status='pending', next_attempt_at__lte=now) |
+               Q(status='processing', claimed_at__lt=now - timedelta(seconds=CLAIM_TIMEOUT)))
+        ids = list(MPesaCallbackEvent.objects.filter(due).order_by('pk').values_list('pk', flat=True)[:self.batch_size])
+        if not ids:
+            return []
+
+        token = uuid.uuid4().hex
+        # The status filter is repeated so an event claimed by a concurrent worker is left alone
+        MPesaCallbackEvent.objects.filter(due, pk__in=ids).update(status='processing', claimed_by=token, claimed_at=now)
+        return list(MPesaCallbackEvent.objects.filter(claimed_by=token, status='processing').order_by('pk'))
+
+    def run_once(self):
+        """Apply one batch; returns (applied, failed) counts"""
+        applied = failed = 0
+        for event in self.claim():
+            if process_event(event):
+                applied += 1
+            else:
+                failed += 1
+        return applied, failed
+
+    def drain(self):
+        """Apply batches until the inbox is empty; returns (applied, failed) totals"""
+        applied = failed = 0
+        while True:
+            batch_applied, batch_failed = self.run_once()
+            if not batch_applied and not batch_failed:
+                return applied, failed
+            applied += batch_applied
+            failed += batch_failed
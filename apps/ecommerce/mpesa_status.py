@@ -0,0 +1,262 @@
+"""
+Reconcile pending M-Pesa transactions against the Daraja STK status query.
+
+Used by the update_mpesa_status and handle_mpesa_timeouts commands. The
+queries for a whole batch run concurrently through
+apps.core.mpesa_utils.query_stk_statuses(); the results are then applied one
+transaction at a time on the command's own database connection.
+
+Every settled transaction is also published to the channel-layer group that
+MPesaStatusConsumer (apps/ecommerce/consumers.py) subscribes checkout pages
+and POS terminals to, so they learn the result without polling. Results are
+applied by commands and callback workers in other processes, so this needs a
+shared channel layer (CHANNEL_REDIS_URL); with the in-memory layer the socket
+tells the page to poll instead (push_enabled).
+"""
+
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.utils import timezone
+
+from apps.core.mpesa_utils import query_stk_statuses
+
+from .models import MPesaTransaction, Order, Payment
+
+logger = logging.getLogger(__name__)
+
+# Result codes meaning the customer did not pay (cancelled, timed out, insufficient funds)
+FAILED_RESULT_CODES = (1, 1032, 1037)
+
+COMPLETED = 'completed'
+FAILED = 'failed'
+PENDING = 'pending'
+UNAVAILABLE = 'unavailable'
+# Settled by a callback while the status was being queried
+SETTLED = 'settled'
+
+
+def status_group(checkout_request_id):
+    """Channel-layer group for one STK push"""
+    return f'mpesa_{checkout_request_id}'
+
+
+def push_enabled():
+    """Whether published statuses reach sockets served by other processes"""
+    backend = settings.CHANNEL_LAYERS.get('default', {}).get('BACKEND', '')
+    return bool(backend) and not backend.endswith('InMemoryChannelLayer')
+
+
+def status_payload(transaction):
+    """Status message sent to subscribers, matching the POS status API responses"""
+    if transaction.status == 'completed':
+        return {
+            'status': 'completed',
+            'mpesa_receipt_number': transaction.mpesa_receipt_number,
+            'transaction_date': transaction.transaction_date.isoformat() if transaction.transaction_date else None,
+            'amount': float(transaction.amount),
+        }
+    if transaction.status in ('failed', 'cancelled', 'timeout'):
+        return {'status': 'failed', 'error': transaction.error_message or 'Payment failed'}
+    return {'status': 'pending', 'message': 'Payment is still being processed'}
+
+
+def publish_status(transaction):
+    """Push the transaction's status to its subscribers once the current DB transaction commits"""
+    if not transaction.checkout_request_id:
+        return
+    group = status_group(transaction.checkout_request_id)
+    payload = status_payload(transaction)
+
+    def send():
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            return
+        try:
+            async_to_sync(channel_layer.group_send)(group, {'type': 'mpesa_status', 'payload': payload})
+        except Exception as e:
+            # Subscribers fall back to polling the status API
+            logger.warning(f"Could not publish M-Pesa status for {transaction.checkout_request_id}: {str(e)}")
+
+    db_transaction.on_commit(send)
+
+
+def payment_reference(transaction):
+    """Receipt number, or the checkout request ID until the callback brings the receipt"""
+    return transaction.mpesa_receipt_number or transaction.checkout_request_id
+
+
+def apply_stk_status(transaction, result):
+    """Update ``transaction`` from a query_stk_status() result; returns the outcome
+
+    The row is re-read under a lock: a callback may have settled it while the
+    batch was being queried, and that result wins.
+
+    The query response only carries ResultCode/ResultDesc; the receipt number
+    comes with the callback. A ResultCode of 0 still confirms the payment, so
+    the transaction is completed against its checkout request ID and a late
+    callback fills in the receipt (record_receipt).
+    """
+    if not result.get('success'):
+        return UNAVAILABLE
+
+    result_code = result['result_code']
+    result_desc = result.get('result_desc', '')
+    outcome = PENDING
+
+    with db_transaction.atomic():
+        current = MPesaTransaction.objects.select_for_update().filter(pk=transaction.pk).first()
+        if current is None or current.status != 'pending':
+            return SETTLED
+
+        fields = ['callback_response', 'updated_at']
+        if result_code == 0:  # Success
+            current.status = 'completed'
+            current.transaction_date = timezone.now()
+            fields += ['status', 'transaction_date']
+            outcome = COMPLETED
+            logger.info(f"Transaction {current.id}: paid per status query, receipt number awaits the callback")
+        elif result_code in FAILED_RESULT_CODES:  # Completed but not paid
+            current.status = 'failed'
+            current.error_message = result_desc or 'Payment failed'
+            fields += ['status', 'error_message']
+            outcome = FAILED
+
+        # Store the query response
+        current.callback_response = current.callback_response or {}
+        current.callback_response.update({
+            'status_query': result['data'],
+            'status_query_time': timezone.now().isoformat()
+        })
+        current.save(update_fields=fields)
+
+        if outcome == COMPLETED:
+            # Loads the order or sale fresh, after the lock
+            update_related_records(current)
+        if outcome != PENDING:
+            publish_status(current)
+
+    # The caller's copy reports the result
+    for field in fields:
+        setattr(transaction, field, getattr(current, field))
+    return outcome
+
+
+def sweep_pending(transactions, concurrency=None, rate_limit=None):
+    """Query and apply the Daraja status of ``transactions``; returns [(transaction, outcome)]"""
+    transactions = [t for t in transactions if t.checkout_request_id]
+    results = query_stk_statuses(
+        [t.checkout_request_id for t in transactions], concurrency=concurrency, rate_limit=rate_limit,
+    )
+
+    outcomes = []
+    for transaction in transactions:
+        try:
+            outcome = apply_stk_status(transaction, results[transaction.checkout_request_id])
+        except Exception as e:
+            logger.error(f"Error applying M-Pesa status to transaction {transaction.id}: {str(e)}")
+            outcome = UNAVAILABLE
+        outcomes.append((transaction, outcome))
+    return outcomes
+
+
+def pending_transactions(**filters):
+    return MPesaTransaction.objects.filter(
+        status='pending', checkout_request_id__isnull=False, **filters,
+    ).select_related('order', 'pos_sale')
+
+
+def update_related_records(transaction):
+    """Update related order or POS sale records"""
+    reference = payment_reference(transaction)
+    receipt_number = transaction.mpesa_receipt_number or ''
+    try:
+        if transaction.order:
+            # Update order
+            order = transaction.order
+            if order.payment_status == 'pending':
+                order.payment_status = 'paid'
+                order.mpesa_transaction_id = reference
+                order.save()
+
+                # Create or update payment record
+                payment, created = Payment.objects.get_or_create(
+                    order=order,
+                    payment_method='mpesa',
+                    defaults={
+                        'amount': transaction.amount,
+                        'reference_number': reference,
+                        'mpesa_receipt_number': receipt_number,
+                        'mpesa_phone_number': transaction.phone_number,
+                        'transaction_date': transaction.transaction_date,
+                        'status': 'completed'
+                    }
+                )
+
+                if not created and payment.status != 'completed':
+                    payment.status = 'completed'
+                    payment.mpesa_receipt_number = receipt_number
+                    payment.transaction_date = transaction.transaction_date
+                    payment.save()
+
+            logger.info(f"Updated order {order.order_number} with M-Pesa payment")
+
+        elif transaction.pos_sale:
+            # Update POS sale
+            sale = transaction.pos_sale
+            if sale.status == 'pending_payment':
+                sale.status = 'completed'
+                sale.mpesa_transaction_id = reference
+                sale.save()
+
+                # Create or update POS payment record
+                from apps.pos.models import Payment as POSPayment
+                payment, created = POSPayment.objects.get_or_create(
+                    sale=sale,
+                    payment_type='mpesa',
+                    defaults={
+                        'amount': transaction.amount,
+                        'transaction_id': reference,
+                        'mpesa_receipt_number': receipt_number,
+                        'mpesa_phone_number': transaction.phone_number,
+                        'status': 'completed'
+                    }
+                )
+
+                if not created and payment.status != 'completed':
+                    payment.status = 'completed'
+                    payment.mpesa_receipt_number = receipt_number
+                    payment.save()
+
+            logger.info(f"Completed POS sale {sale.sale_number} with M-Pesa payment")
+
+    except Exception as e:
+        logger.error(f"Error updating related records for transaction {transaction.id}: {str(e)}")
+
+
+def record_receipt(transaction, receipt_number):
+    """Replace the checkout request ID placeholder with the receipt number from a late callback"""
+    from apps.pos.models import Payment as POSPayment, Sale
+
+    placeholder = transaction.checkout_request_id
+    transaction.mpesa_receipt_number = receipt_number
+    transaction.save(update_fields=['mpesa_receipt_number', 'callback_response', 'updated_at'])
+
+    if transaction.order_id:
+        Order.objects.filter(pk=transaction.order_id, mpesa_transaction_id=placeholder).update(
+            mpesa_transaction_id=receipt_number
+        )
+        Payment.objects.filter(order_id=transaction.order_id, reference_number=placeholder).update(
+            reference_number=receipt_number, mpesa_receipt_number=receipt_number
+        )
+    elif transaction.pos_sale_id:
+        Sale.objects.filter(pk=transaction.pos_sale_id, mpesa_transaction_id=placeholder).update(
+            mpesa_transaction_id=receipt_number
+        )
+        POSPayment.objects.filter(sale_id=transaction.pos_sale_id, transaction_id=placeholder).update(
+            transaction_id=receipt_number, mpesa_receipt_number=receipt_number
+        )
+    logger.info(f"Transaction {transaction.id}: recorded receipt {receipt_number}")
@@ -1,3 +1,426 @@
-from django.test import TestCase
+import json
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from apps.core.mpesa_utils import MPesaAPI, query_stk_statuses
+from apps.quotations.models import Customer
+
+from .models import MPesaCallbackEvent, MPesaTransaction, Order, Payment
+from .mpesa import MPesaSTKPush
+from .mpesa_callbacks import record_callback, process_event
+from .mpesa_status import SETTLED, apply_stk_status, pending_transactions, push_enabled
+from .routing import websocket_urlpatterns
+
+
+class _FakeDarajaHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def authorized(self):
+        return self.headers.get('Authorization') == f'Bearer {self.server.token}'
+
+    def do_GET(self):
+        if self.path.startswith('/oauth/v1/generate'):
+            with self.server.lock:
+                self.server.token_requests += 1
+            time.sleep(self.server.latency)
+            return self.reply(200, {'access_token': self.server.token, 'expires_in': '3599'})
+        self.reply(404, {})
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if not self.authorized():
+            return self.reply(401, {'errorCode': '404.001.03', 'errorMessage': 'Invalid Access Token'})
+
+        if self.path == '/mpesa/stkpush/v1/processrequest':
+            self.server.pushes.append(payload)
+            return self.reply(200, {
+                'MerchantRequestID': 'MR-1', 'CheckoutRequestID': f'ws_CO_{len(self.server.pushes)}',
+                'ResponseCode': '0', 'ResponseDescription': 'Success. Request accepted for processing',
+                'CustomerMessage': 'Success. Request accepted for processing',
+            })
+
+        if self.path == '/mpesa/stkpushquery/v1/query':
+            with self.server.lock:
+                self.server.in_flight += 1
+                self.server.max_in_flight = max(self.server.max_in_flight, self.server.in_flight)
+            try:
+                time.sleep(self.server.latency)
+                result = self.server.statuses.get(payload['CheckoutRequestID'])
+                if result is None:
+                    return self.reply(500, {'errorCode': '500.001.1001', 'errorMessage': 'The transaction is being processed'})
+                return self.reply(200, dict(result, ResponseCode='0', CheckoutRequestID=payload['CheckoutRequestID']))
+            finally:
+                with self.server.lock:
+                    self.server.in_flight -= 1
+        self.reply(404, {})
+
+
+class FakeDarajaServer(ThreadingHTTPServer):
+    """Local stand-in for the Safaricom Daraja API (OAuth, STK push and STK query)"""
+    daemon_threads = True
+
+    def __init__(self, latency=0.0):
+        super().__init__(('127.0.0.1', 0), _FakeDarajaHandler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.token = 'fake-token-1'
+        self.token_requests = 0
+        self.pushes = []
+        self.statuses = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+
+class FakeDarajaMixin:
+    """Points the M-Pesa settings at a FakeDarajaServer for the test"""
+
+    def start_daraja_server(self, latency=0.0):
+        self.daraja = FakeDarajaServer(latency)
+        threading.Thread(target=self.daraja.serve_forever, daemon=True).start()
+        mpesa = override_settings(
+            MPESA_BASE_URL=self.daraja.url, MPESA_CONSUMER_KEY='key', MPESA_CONSUMER_SECRET='secret',
+            MPESA_SHORTCODE='174379', MPESA_PASSKEY='passkey', MPESA_QUERY_RATE_LIMIT=0,
+        )
+        mpesa.enable()
+        self.addCleanup(mpesa.disable)
+        self.addCleanup(self.daraja.server_close)
+        self.addCleanup(self.daraja.shutdown)
+
+    def paid(self):
+        # The query response has no CallbackMetadata: only the callback carries the receipt number
+        return {'ResultCode': '0', 'ResultDesc': 'The service request is processed successfully.'}
+
+    def cancelled(self):
+        return {'ResultCode': '1032', 'ResultDesc': 'Request cancelled by user'}
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'mpesa-client-tests'},
+    'pages': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+})
+class MPesaClientTest(FakeDarajaMixin, TestCase):
+    """Tests for the shared Daraja client"""
+
+    def setUp(self):
+        # Access tokens are shared through the default cache
+        cache.clear()
+        self.start_daraja_server(latency=0.05)
+
+    def test_token_fetched_once_for_concurrent_callers(self):
+        client = MPesaAPI()
+        threads = [threading.Thread(target=client.get_access_token) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.daraja.token_requests, 1)
+
+        # A second client for the same credentials reuses the cached token
+        self.assertEqual(MPesaAPI().get_access_token(), 'fake-token-1')
+        self.assertEqual(self.daraja.token_requests, 1)
+
+    def test_rejected_token_is_refreshed(self):
+        client = MPesaAPI()
+        client.get_access_token()
+        self.daraja.token = 'fake-token-2'
+        self.daraja.statuses['ws_CO_1'] = self.cancelled()
+
+        result = client.query_stk_status('ws_CO_1')
+        self.assertTrue(result['success'])
+        self.assertEqual(result['result_code'], 1032)
+        self.assertEqual(self.daraja.token_requests, 2)
+
+    def test_stk_push_routes_pos_callbacks(self):
+        result = MPesaSTKPush().initiate_stk_push('0712345678', '1500.50', 'POS-0001', 'Solar panel sale')
+        self.assertTrue(result['success'])
+        self.assertEqual(result['checkout_request_id'], 'ws_CO_1')
+        push = self.daraja.pushes[0]
+        self.assertEqual(push['PhoneNumber'], '254712345678')
+        self.assertEqual(push['Amount'], 1500)
+        self.assertTrue(push['CallBackURL'].endswith('/pos/api/mpesa/callback/'))
+
+    def test_status_queries_run_concurrently_within_limit(self):
+        ids = [f'ws_CO_{i}' for i in range(40)]
+        for checkout_request_id in ids[:20]:
+            self.daraja.statuses[checkout_request_id] = self.cancelled()
+
+        started = time.monotonic()
+        results = query_stk_statuses(ids, client=MPesaAPI(), concurrency=8)
+        elapsed = time.monotonic() - started
+
+        self.assertEqual(len(results), 40)
+        self.assertEqual(results['ws_CO_0']['result_code'], 1032)
+        self.assertFalse(results['ws_CO_39']['success'])
+        self.assertLessEqual(self.daraja.max_in_flight, 8)
+        self.assertGreater(self.daraja.max_in_flight, 1)
+        # One at a time would take at least 40 x latency
+        self.assertLess(elapsed, 40 * 0.05)
+        self.assertEqual(self.daraja.token_requests, 1)
+
+
+def stk_callback(checkout_request_id, result_code=0, receipt='QKJ1ABC2DE'):
+    callback = {
+        'MerchantRequestID': 'MR-1', 'CheckoutRequestID': checkout_request_id,
+        'ResultCode': result_code, 'ResultDesc': 'Request cancelled by user' if result_code else 'Success',
+    }
+    if result_code == 0:
+        callback['CallbackMetadata'] = {'Item': [
+            {'Name': 'Amount', 'Value': 2500}, {'Name': 'MpesaReceiptNumber', 'Value': receipt},
+            {'Name': 'TransactionDate', 'Value': 20250101120000}, {'Name': 'PhoneNumber', 'Value': 254712345678},
+        ]}
+    return {'Body': {'stkCallback': callback}}
+
+
+class OrderTransactionMixin:
+
+    def create_order_transaction(self, user=None):
+        customer = Customer.objects.create(
+            name='Callback Customer', email='callback@example.com', phone='0712345678',
+            address='Moi Avenue', city='Nairobi'
+        )
+        self.order = Order.objects.create(
+            customer=customer, subtotal=2500, total_amount=2500, billing_address='Nairobi',
+            shipping_address='Nairobi', payment_method='mpesa', payment_status='pending', user=user
+        )
+        self.transaction = MPesaTransaction.objects.create(
+            order=self.order, phone_number='254712345678', amount=2500, account_reference=self.order.order_number,
+            transaction_desc='Order', checkout_request_id='ws_CO_100', status='pending'
+        )
+
+
+class MPesaStatusSweepTest(OrderTransactionMixin, FakeDarajaMixin, TestCase):
+    """Tests for the pending-payment commands"""
+
+    def setUp(self):
+        self.start_daraja_server()
+
+    def _transaction(self, checkout_request_id, **fields):
+        return MPesaTransaction.objects.create(
+            phone_number='254712345678', amount=100, account_reference='ORD-1', transaction_desc='Order',
+            checkout_request_id=checkout_request_id, status='pending', **fields
+        )
+
+    def test_update_mpesa_status_applies_results(self):
+        paid = self._transaction('ws_CO_paid')
+        cancelled = self._transaction('ws_CO_cancelled')
+        processing = self._transaction('ws_CO_processing')
+        self.daraja.statuses.update({'ws_CO_paid': self.paid(), 'ws_CO_cancelled': self.cancelled()})
+
+        call_command('update_mpesa_status', stdout=StringIO())
+
+        paid.refresh_from_db()
+        self.assertEqual(paid.status, 'completed')
+        self.assertIsNone(paid.mpesa_receipt_number)
+        cancelled.refresh_from_db()
+        self.assertEqual(cancelled.status, 'failed')
+        self.assertEqual(cancelled.error_message, 'Request cancelled by user')
+        processing.refresh_from_db()
+        self.assertEqual(processing.status, 'pending')
+
+    def test_timeouts_settle_paid_transactions_first(self):
+        self.create_order_transaction()
+        stale = self._transaction('ws_CO_stale')
+        MPesaTransaction.objects.update(created_at=timezone.now() - timedelta(hours=12))
+        self.daraja.statuses['ws_CO_100'] = self.paid()
+
+        call_command('handle_mpesa_timeouts', stdout=StringIO())
+
+        self.transaction.refresh_from_db()
+        self.assertEqual(self.transaction.status, 'completed')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, 'paid')
+        # Referenced by the checkout request ID until the callback brings the receipt
+        self.assertEqual(self.order.mpesa_transaction_id, 'ws_CO_100')
+        self.assertEqual(Payment.objects.get(order=self.order).reference_number, 'ws_CO_100')
+        stale.refresh_from_db()
+        self.assertEqual(stale.status, 'timeout')
+
+        event, _ = record_callback(stk_callback('ws_CO_100'), 'shop')
+        process_event(event)
+        self.transaction.refresh_from_db()
+        self.assertEqual(self.transaction.mpesa_receipt_number, 'QKJ1ABC2DE')
+        self.assertIn('status_query', self.transaction.callback_response)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.mpesa_transaction_id, 'QKJ1ABC2DE')
+        payment = Payment.objects.get(order=self.order)
+        self.assertEqual((payment.reference_number, payment.mpesa_receipt_number), ('QKJ1ABC2DE', 'QKJ1ABC2DE'))
+
+
+@override_settings(MPESA_CALLBACK_QUEUE_ENABLED=True)
+class MPesaCallbackInboxTest(OrderTransactionMixin, TestCase):
+    """Tests for callback ingestion and the process_mpesa_callbacks worker"""
+
+    def setUp(self):
+        self.create_order_transaction()
+
+    def post_callback(self, payload):
+        return self.client.post(reverse('ecommerce:mpesa_callback'), json.dumps(payload), content_type='application/json')
+
+    def drain(self):
+        call_command('process_mpesa_callbacks', stdout=StringIO())
+
+    def test_callback_is_acknowledged_before_processing(self):
+        response = self.post_callback(stk_callback('ws_CO_100'))
+        self.assertEqual(response.json()['ResultCode'], 0)
+        self.transaction.refresh_from_db()
+        self.assertEqual(self.transaction.status, 'pending')
+        self.assertEqual(MPesaCallbackEvent.objects.get().status, 'pending')
+
+        self.drain()
+        self.transaction.refresh_from_db()
+        self.assertEqual(self.transaction.status, 'completed')
+        self.assertEqual(self.transaction.mpesa_receipt_number, 'QKJ1ABC2DE')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, 'paid')
+        self.assertEqual(MPesaCallbackEvent.objects.get().status, 'processed')
+
+    def test_resent_callbacks_apply_once(self):
+        for _ in range(3):
+            self.assertEqual(self.post_callback(stk_callback('ws_CO_100')).json()['ResultCode'], 0)
+        self.assertEqual(MPesaCallbackEvent.objects.count(), 1)
+        self.drain()
+        self.drain()
+        self.assertEqual(Payment.objects.filter(order=self.order).count(), 1)
+
+        # A resend after processing is acknowledged and dropped
+        self.post_callback(stk_callback('ws_CO_100'))
+        self.assertEqual(MPesaCallbackEvent.objects.count(), 1)
+
+    def test_late_failure_does_not_undo_payment(self):
+        self.post_callback(stk_callback('ws_CO_100'))
+        self.post_callback(stk_callback('ws_CO_100', result_code=1032))
+        self.drain()
+
+        self.transaction.refresh_from_db()
+        self.assertEqual(self.transaction.status, 'completed')
+        self.assertEqual(
+            list(MPesaCallbackEvent.objects.values_list('status', flat=True)), ['processed', 'ignored']
+        )
+
+    def test_cancelled_payment_fails_order(self):
+        self.post_callback(stk_callback('ws_CO_100', result_code=1))
+        self.drain()
+        self.transaction.refresh_from_db()
+        self.assertEqual(self.transaction.status, 'failed')
+        self.assertEqual(self.transaction.error_message, 'Payment was cancelled by user or failed')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'cancelled')
+
+    def test_unknown_transaction_is_ignored(self):
+        self.post_callback(stk_callback('ws_CO_unknown'))
+        self.drain()
+        self.assertEqual(MPesaCallbackEvent.objects.get().status, 'ignored')
+
+    def test_status_sweep_does_not_overwrite_a_callback(self):
+        # The sweep loaded the row, then the callback was applied while it queried Daraja
+        stale = pending_transactions().get()
+        self.post_callback(stk_callback('ws_CO_100'))
+        self.drain()
+
+        result = {'success': True, 'result_code': 1032, 'result_desc': 'Request cancelled by user', 'data': {}}
+        self.assertEqual(apply_stk_status(stale, result), SETTLED)
+        self.transaction.refresh_from_db()
+        self.assertEqual(self.transaction.status, 'completed')
+        self.assertNotIn('status_query', self.transaction.callback_response)
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.status, self.order.payment_status), ('paid', 'paid'))
+
+    @override_settings(MPESA_CALLBACK_QUEUE_ENABLED=False)
+    def test_inline_mode_applies_during_callback(self):
+        self.post_callback(stk_callback('ws_CO_100'))
+        self.transaction.refresh_from_db()
+        self.assertEqual(self.transaction.status, 'completed')
+
+    def test_waiting_callbacks_are_reported(self):
+        self.post_callback(stk_callback('ws_CO_100'))
+        MPesaCallbackEvent.objects.update(next_attempt_at=timezone.now() - timedelta(hours=1))
+        with self.assertLogs('apps.ecommerce.mpesa_callbacks', 'ERROR'):
+            self.post_callback(stk_callback('ws_CO_200'))
+
+
+class MPesaStatusConsumerTest(OrderTransactionMixin, TransactionTestCase):
+    """Tests for the pushed payment status WebSocket"""
+
+    def setUp(self):
+        User = get_user_model()
+        self.customer_user = User.objects.create_user(username='payer', password='testpass123')
+        self.create_order_transaction(user=self.customer_user)
+        self.application = URLRouter(websocket_urlpatterns)
+
+    def apply_callback(self, payload):
+        event, _ = record_callback(payload, 'shop')
+        process_event(event)
+
+    async def connect(self, user):
+        path = '/ws/payments/mpesa/ws_CO_100/'
+        communicator = ApplicationCommunicator(self.application, {
+            'type': 'websocket', 'path': path, 'raw_path': path.encode(), 'query_string': b'',
+            'headers': [], 'subprotocols': [], 'user': user,
+        })
+        await communicator.send_input({'type': 'websocket.connect'})
+        response = await communicator.receive_output(timeout=2)
+        return communicator, response['type'] == 'websocket.accept'
+
+    async def receive_json(self, communicator):
+        message = await communicator.receive_output(timeout=2)
+        return json.loads(message['text'])
+
+    def test_status_is_pushed_when_callback_is_applied(self):
+        async def scenario():
+            communicator, connected = await self.connect(self.customer_user)
+            self.assertTrue(connected)
+            initial = await self.receive_json(communicator)
+            self.assertEqual(initial['status'], 'pending')
+            # Other processes can't reach this socket through the in-memory layer: the page polls too
+            self.assertIs(initial['push'], False)
+
+            await database_sync_to_async(self.apply_callback)(stk_callback('ws_CO_100'))
+            update = await self.receive_json(communicator)
+            self.assertEqual(update['status'], 'completed')
+            self.assertEqual(update['mpesa_receipt_number'], 'QKJ1ABC2DE')
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait(timeout=2)
+
+        async_to_sync(scenario)()
+
+    def test_push_needs_a_shared_channel_layer(self):
+        self.assertFalse(push_enabled())
+        with override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels_redis.core.RedisChannelLayer'}}):
+            self.assertTrue(push_enabled())
+
+    def test_other_customers_cannot_subscribe(self):
+        other = get_user_model().objects.create_user(username='someone', password='testpass123')
+
+        async def scenario():
+            communicator, connected = await self.connect(other)
+            self.assertFalse(connected)
+
+        async_to_sync(scenario)()
@@ -13,7 +13,8 @@ from .models import ShoppingCart, Order, CartItem, Payment, Receipt, MPesaTransa
 from apps.products.models import Product
 from apps.quotations.models import Customer
 from apps.core.models import CompanySettings
-from .mpesa import MPesaSTKPush, MPesaCallback
+from .mpesa import MPesaSTKPush
+from .mpesa_callbacks import receive_callback
 import json
 from decimal import Decimal
 
@@ -25,7 +26,7 @@ class CartView(LoginRequiredMixin, TemplateView):
 
         # Add discount information for cart template
         from apps.core.context_processors import active_discounts
-        discount_context = active_discounts(self.request)
+        discount_context = active_discounts.resolve(self.request)
         context.update(discount_context)
         cart, created = ShoppingCart.objects.get_or_create(user=self.request.user)
         context['cart'] = cart
@@ -128,7 +129,7 @@ class CheckoutView(LoginRequiredMixin, TemplateView):
 
         # Add discount information for checkout template
         from apps.core.context_processors import active_discounts
-        discount_context = active_discounts(self.request)
+        discount_context = active_discounts.resolve(self.request)
         context.update(discount_context)
 
         if self.request.user.is_authenticated:
@@ -279,12 +280,12 @@ class CreateOrderView(LoginRequiredMixin, View):
                 return JsonResponse({'success': False, 'message': 'Cart is empty'})
 
             # Calculate totals
-            from apps.core.models import CompanySettings
-            company_settings = CompanySettings.get_settings()
+            from apps.core.settings_cache import get_company_settings
+            company_settings = get_company_settings()
 
             # Check for active holiday discounts
             from apps.core.context_processors import active_discounts
-            discount_context = active_discounts(request)
+            discount_context = active_discounts.resolve(request)
             discount_percentage = discount_context.get('discount_percentage', 0) if discount_context.get('discount_percentage') else 0
 
             # Calculate cart totals with discounts applied
@@ -493,105 +494,18 @@ class ProcessPaymentView(LoginRequiredMixin, View):
             }
 
 class MPesaCallbackView(View):
-    """Handle M-Pesa STK Push callback"""
+    """Handle M-Pesa STK Push callback
+
+    The payload is stored and acknowledged at once; process_mpesa_callbacks
+    applies it to the order (see apps/ecommerce/mpesa_callbacks.py).
+    """
 
     @method_decorator(csrf_exempt)
     def dispatch(self, *args, **kwargs):
         return super().dispatch(*args, **kwargs)
 
     def post(self, request):
-        try:
-            # Parse callback data
-            callback_data = json.loads(request.body.decode('utf-8'))
-
-            # Parse the callback using our helper
-            transaction_data = MPesaCallback.parse_callback_data(callback_data)
-
-            if not transaction_data.get('success'):
-                # Log failed callback parsing
-                print(f"Failed to parse M-Pesa callback: {transaction_data}")
-                return JsonResponse({'ResultCode': 1, 'ResultDesc': 'Failed to parse callback'})
-
-            # Find the transaction
-            checkout_request_id = transaction_data.get('checkout_request_id')
-            if not checkout_request_id:
-                return JsonResponse({'ResultCode': 1, 'ResultDesc': 'Missing checkout request ID'})
-
-            try:
-                mpesa_transaction = MPesaTransaction.objects.get(
-                    checkout_request_id=checkout_request_id
-                )
-            except MPesaTransaction.DoesNotExist:
-                print(f"M-Pesa transaction not found: {checkout_request_id}")
-                return JsonResponse({'ResultCode': 1, 'ResultDesc': 'Transaction not found'})
-
-            # Store callback response
-            mpesa_transaction.callback_response = callback_data
-
-            # Process the callback based on result code
-            result_code = transaction_data.get('result_code')
-            result_description = transaction_data.get('result_description', 'Unknown result')
-
-            if result_code == 0:
-                # Successful payment
-                mpesa_transaction.mark_completed(
-                    receipt_number=transaction_data.get('mpesa_receipt_number'),
-                    transaction_date=timezone.now()
-                )
-
-                # Update order status
-                order = mpesa_transaction.order
-                order.payment_status = 'paid'
-                order.status = 'paid'
-                order.save()
-
-                print(f"M-Pesa payment completed: {transaction_data.get('mpesa_receipt_number')}")
-                print(f"Order {order.order_number} payment completed")
-
-            else:
-                # Failed/Cancelled payment - handle different error codes
-                error_message = f"Payment failed ({result_code}): {result_description}"
-
-                # Specific handling for common failure/cancellation codes
-                if result_code in [1, 17, 26]:  # User cancelled, transaction cancelled, or insufficient balance
-                    error_message = "Payment was cancelled by user or failed"
-                elif result_code in [2, 3, 4]:  # Wrong PIN, transaction declined, or wrong expiry date
-                    error_message = f"Payment declined: {result_description}"
-                elif result_code == 1032:  # Timeout
-                    error_message = "Payment timed out"
-                elif result_code in [2001, 2018]:  # Insufficient balance or system busy
-                    error_message = f"Payment failed: {result_description}"
-                else:
-                    error_message = f"Payment failed: {result_description}"
-
-                mpesa_transaction.mark_failed(error_message)
-                mpesa_transaction.save()
-
-                # Update order status to cancelled for cancelled transactions
-                if mpesa_transaction.order:
-                    order = mpesa_transaction.order
-                    if result_code in [17, 1, 26]:  # User cancelled or transaction cancelled
-                        order.status = 'cancelled'
-                        order.status_notes = f"M-Pesa payment cancelled: {error_message}"
-                    else:
-                        order.status = 'failed'  # Keep pending for retryable failures
-                        order.status_notes = f"M-Pesa payment failed: {error_message}"
-                    order.save()
-
-                print(f"M-Pesa payment failed (Result Code: {result_code}): {error_message}")
-
-            # Return success response to M-Pesa
-            return JsonResponse({
-                'ResultCode': 0,
-                'ResultDesc': 'Callback processed successfully'
-            })
-
-        except Exception as e:
-            print(f"Error processing M-Pesa callback: {str(e)}")
-            return JsonResponse({
-                'ResultCode': 1,
-                'ResultDesc': f'Error: {str(e)}'
-            })
+        return receive_callback(request, 'shop')
 
 class CheckTransactionStatusView(LoginRequiredMixin, View):
     """Check M-Pesa transaction status"""
@@ -636,53 +550,12 @@ class GenerateReceiptView(LoginRequiredMixin, View):
             defaults={'issued_by': request.user}
         )
 
-        # Generate PDF if not exists or file doesn't exist on disk
-        if not receipt.receipt_file or created:
-            receipt.generate_receipt_pdf()
-
-        # Check if file actually exists
-        if not receipt.receipt_file or not receipt.receipt_file.path:
-            # Generate again if file path is missing
-            receipt.generate_receipt_pdf()
-
-        if not receipt.receipt_file or not receipt.receipt_file.path:
-            from django.http import Http404
-            raise Http404("Receipt file could not be generated")
-
-        # Return the PDF file for download
-        from django.http import FileResponse
+        # Rendered only when the receipt contents changed since the last download
+        from apps.core.pdf_cache import pdf_response
         import os
-        import mimetypes
-
-        file_path = receipt.receipt_file.path
-
-        # Check if file exists on disk
-        if not os.path.exists(file_path):
-            # Regenerate the PDF
-            receipt.generate_receipt_pdf()
-            file_path = receipt.receipt_file.path
-
-            if not os.path.exists(file_path):
-                from django.http import Http404
-                raise Http404("Receipt file could not be generated")
 
-        try:
-            # Open and return the file
-            file = open(file_path, 'rb')
-            response = FileResponse(file, content_type='application/pdf')
-
-            # Set headers for download
-            response['Content-Disposition'] = f'attachment; filename="{receipt.receipt_number}.pdf"'
-            response['Content-Length'] = os.path.getsize(file_path)
-
-            return response
-
-        except Exception as e:
-            # If file reading fails, return error JSON (fallback for debugging)
-            return JsonResponse({
-                'success': False,
-                'error': f'Error serving receipt file: {str(e)}'
-            }, status=500)
+        file_path = receipt.generate_receipt_pdf()
+        return pdf_response(request, file_path, os.path.basename(file_path), f"{receipt.receipt_number}.pdf")
 
 class UpdateOrderStatusView(LoginRequiredMixin, View):
     """Update order status - Management only"""
@@ -788,49 +661,12 @@ class ReceiptDownloadView(View):
                 from django.http import HttpResponseForbidden
                 return HttpResponseForbidden("You don't have permission to access this receipt.")
 
-            # Generate PDF if not exists or file doesn't exist on disk
-            if not receipt.receipt_file or not receipt.receipt_file.path:
-                receipt.generate_receipt_pdf()
-
-            # Check if file actually exists
-            if not receipt.receipt_file or not receipt.receipt_file.path:
-                from django.http import Http404
-                raise Http404("Receipt file could not be generated")
-
+            # Rendered only when the receipt contents changed since the last download
+            from apps.core.pdf_cache import pdf_response
             import os
-            file_path = receipt.receipt_file.path
-
-            # Check if file exists on disk
-            if not os.path.exists(file_path):
-                # Regenerate the PDF
-                receipt.generate_receipt_pdf()
-                file_path = receipt.receipt_file.path
 
-                if not os.path.exists(file_path):
-                    from django.http import Http404
-                    raise Http404("Receipt file could not be generated")
-
-            # Serve the PDF file
-            from django.http import FileResponse
-            import mimetypes
-
-            try:
-                # Open and return the file
-                file = open(file_path, 'rb')
-                response = FileResponse(file, content_type='application/pdf')
-
-                # Set headers for download
-                response['Content-Disposition'] = f'attachment; filename="{receipt.receipt_number}.pdf"'
-                response['Content-Length'] = os.path.getsize(file_path)
-
-                return response
-
-            except Exception as e:
-                # If file reading fails, return error
-                return JsonResponse({
-                    'success': False,
-                    'error': f'Error serving receipt file: {str(e)}'
-                }, status=500)
+            file_path = receipt.generate_receipt_pdf()
+            return pdf_response(request, file_path, os.path.basename(file_path), f"{receipt.receipt_number}.pdf")
 
         except Exception as e:
             from django.http import Http404
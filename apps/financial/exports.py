@@ -0,0 +1,47 @@
+"""
+Financial export specs (see apps/core/exports.py)
+"""
+
+from django.utils import timezone
+
+from apps.core.exports import Column, ExportSpec, choice_label, date_format, register_export
+
+from .models import Transaction
+
+
+@register_export
+class TransactionExport(ExportSpec):
+    """Raw transaction ledger for the system reports CSV download"""
+    name = 'financial.transactions'
+    filename = 'financial_data'
+    sheet_title = 'Transactions'
+    columns = [
+        Column('Transaction ID', 'transaction_id'),
+        Column('Date', 'transaction_date', format=date_format()),
+        Column('Value Date', 'value_date', format=date_format()),
+        Column('Type', 'transaction_type', format=choice_label(Transaction.TRANSACTION_TYPES)),
+        Column('Status', 'status', format=choice_label(Transaction.TRANSACTION_STATUS)),
+        Column('Account', 'bank_account__account_name'),
+        Column('Account Number', 'bank_account__account_number'),
+        Column('Currency', 'currency__code'),
+        Column('Amount', 'amount'),
+        Column('Running Balance', 'running_balance'),
+        Column('Description', 'description'),
+        Column('Reference', 'reference_number'),
+        Column('Counterparty', 'counterparty_name'),
+        Column('Reconciled', 'is_reconciled', format=lambda value: 'Yes' if value else 'No'),
+    ]
+
+    def get_queryset(self, params, user=None):
+        queryset = Transaction.objects.order_by('transaction_date', 'pk')
+        if params.get('date_from'):
+            queryset = queryset.filter(transaction_date__gte=params['date_from'])
+        if params.get('date_to'):
+            queryset = queryset.filter(transaction_date__lte=params['date_to'])
+        if params.get('status'):
+            queryset = queryset.filter(status=params['status'])
+        return queryset
+
+    def get_filename(self, fmt):
+        timestamp = timezone.localtime().strftime('%Y%m%d_%H%M%S')
+        return f'{self.filename}_{timestamp}.{fmt}'
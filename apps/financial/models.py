@@ -8,6 +8,8 @@ from django.urls import reverse
 from decimal import Decimal
 import uuid
 
+from apps.core.numbering import next_document_number, max_issued_number
+
 User = get_user_model()
 
 
@@ -201,16 +203,10 @@ class Transaction(models.Model):
         if not self.transaction_id:
             # Generate transaction ID: TXN-YYYY-XXXXXX
             current_year = timezone.now().year
-            last_txn = Transaction.objects.filter(
-                transaction_id__startswith=f'TXN-{current_year}'
-            ).order_by('-transaction_id').first()
-            
-            if last_txn:
-                last_number = int(last_txn.transaction_id.split('-')[-1])
-                next_number = last_number + 1
-            else:
-                next_number = 1
-            
+            next_number = next_document_number(
+                'financial.transaction', year=current_year,
+                seed=lambda: max_issued_number(Transaction.objects.all(), 'transaction_id', f'TXN-{current_year}-')
+            )
             self.transaction_id = f'TXN-{current_year}-{next_number:06d}'
         
         # Set currency from bank account if not specified
@@ -277,16 +273,10 @@ class BankReconciliation(models.Model):
         if not self.reconciliation_id:
             # Generate reconciliation ID: REC-YYYY-0001
             current_year = timezone.now().year
-            last_rec = BankReconciliation.objects.filter(
-                reconciliation_id__startswith=f'REC-{current_year}'
-            ).order_by('-reconciliation_id').first()
-            
-            if last_rec:
-                last_number = int(last_rec.reconciliation_id.split('-')[-1])
-                next_number = last_number + 1
-            else:
-                next_number = 1
-            
+            next_number = next_document_number(
+                'financial.reconciliation', year=current_year,
+                seed=lambda: max_issued_number(BankReconciliation.objects.all(), 'reconciliation_id', f'REC-{current_year}-')
+            )
             self.reconciliation_id = f'REC-{current_year}-{next_number:04d}'
         
         # Calculate reconciled balance and variance
@@ -380,16 +370,10 @@ class FixedAsset(models.Model):
         if not self.asset_number:
             # Generate asset number: AST-YYYY-0001
             current_year = timezone.now().year
-            last_asset = FixedAsset.objects.filter(
-                asset_number__startswith=f'AST-{current_year}'
-            ).order_by('-asset_number').first()
-            
-            if last_asset:
-                last_number = int(last_asset.asset_number.split('-')[-1])
-                next_number = last_number + 1
-            else:
-                next_number = 1
-            
+            next_number = next_document_number(
+                'financial.fixed_asset', year=current_year,
+                seed=lambda: max_issued_number(FixedAsset.objects.all(), 'asset_number', f'AST-{current_year}-')
+            )
             self.asset_number = f'AST-{current_year}-{next_number:04d}'
         
         # Calculate current book value
@@ -2,6 +2,7 @@ from django.db import models
 from django.utils import timezone
 from decimal import Decimal
 from apps.core.models import TimeStampedModel
+from apps.core.numbering import next_number
 
 class Supplier(TimeStampedModel):
     """Supplier information for inventory management"""
@@ -137,10 +138,8 @@ class PurchaseOrderSequence(models.Model):
         if year is None:
             year = timezone.now().year
         
-        sequence, created = cls.objects.get_or_create(year=year, defaults={'last_number': 0})
-        sequence.last_number += 1
-        sequence.save()
-        return f"OG-PO-{year}-{sequence.last_number:04d}"
+        number = next_number(cls, year=year)
+        return f"OG-PO-{year}-{number:04d}"
 
 class PurchaseOrder(TimeStampedModel):
     STATUS_CHOICES = [
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.db import models
 from django.contrib.auth import get_user_model
 from django.urls import reverse
@@ -6,6 +7,9 @@ from django.core.validators import MinValueValidator
 from decimal import Decimal
 import uuid
 
+from apps.core.numbering import next_number
+from apps.core.settings_cache import get_company_settings
+
 User = get_user_model()
 
 
@@ -164,10 +168,10 @@ class SaleSequence(models.Model):
         if year is None:
             year = timezone.now().year
         
-        sequence, created = cls.objects.get_or_create(year=year, defaults={'last_number': 0})
-        sequence.last_number += 1
-        sequence.save()
-        return f"OG-SALE-{year}-{sequence.last_number:04d}"
+        # POS terminals may reserve numbers in blocks to avoid contending on the row
+        block_size = getattr(settings, 'POS_SALE_NUMBER_BLOCK_SIZE', 1)
+        number = next_number(cls, year=year, block_size=block_size)
+        return f"OG-SALE-{year}-{number:04d}"
 
 
 class Sale(models.Model):
@@ -236,15 +240,13 @@ class Sale(models.Model):
         if not self.sale_number:
             self.sale_number = SaleSequence.get_next_number()
             
-        # Generate receipt number using same sequence but different prefix
+        # Generate receipt number using same sequence number but different prefix
         if not self.receipt_number:
-            year = timezone.now().year
-            # Get the current number from sale sequence for receipt numbering
-            sequence = SaleSequence.objects.filter(year=year).first()
-            if sequence:
-                self.receipt_number = f"OG-RCP-{year}-{sequence.last_number:04d}"
+            if self.sale_number.startswith('OG-SALE-'):
+                self.receipt_number = 'OG-RCP-' + self.sale_number[len('OG-SALE-'):]
             else:
-                self.receipt_number = f"OG-RCP-{year}-0001"
+                year = timezone.now().year
+                self.receipt_number = f"OG-RCP-{year}-{next_number(SaleSequence, year=year):04d}"
         
         # Calculate totals if not already set
         if self.pk is None:  # Only for new sales
@@ -261,10 +263,7 @@ class Sale(models.Model):
             vat_inclusive_total = sum(item.line_total for item in self.items.all())
             
             # Calculate VAT backwards from inclusive prices
-            from apps.core.models import CompanySettings
-            company_settings = CompanySettings.get_settings()
-            vat_rate = Decimal(str(company_settings.vat_rate))
-            vat_multiplier = Decimal('1') + (vat_rate / Decimal('100'))
+            vat_multiplier = get_company_settings().vat_multiplier
             
             # Extract VAT amount and ex-VAT subtotal
             self.subtotal = vat_inclusive_total / vat_multiplier  # Ex-VAT subtotal
@@ -276,10 +275,7 @@ class Sale(models.Model):
                 self.subtotal = Decimal('0.00')
             if not self.tax_amount:
                 # Calculate VAT backwards if subtotal is provided
-                from apps.core.models import CompanySettings
-                company_settings = CompanySettings.get_settings()
-                vat_rate = Decimal(str(company_settings.vat_rate))
-                vat_multiplier = Decimal('1') + (vat_rate / Decimal('100'))
+                vat_multiplier = get_company_settings().vat_multiplier
                 
                 # If subtotal is ex-VAT, we need to calculate inclusive total first
                 vat_inclusive = self.subtotal * vat_multiplier
@@ -325,8 +321,10 @@ class SaleItem(models.Model):
     def __str__(self):
         return f"{self.product_name} x{self.quantity}"
     
-    def save(self, *args, **kwargs):
-        from apps.core.models import CompanySettings
+    def calculate_amounts(self, vat_multiplier=None):
+        """Compute discount, VAT and line total (prices are VAT inclusive)"""
+        if vat_multiplier is None:
+            vat_multiplier = get_company_settings().vat_multiplier
         
         # Calculate discount amount
         self.discount_amount = (self.unit_price * self.quantity * self.discount_percentage / 100)
@@ -334,16 +332,13 @@ class SaleItem(models.Model):
         # VAT-inclusive line total (prices include VAT)
         vat_inclusive_total = (self.unit_price * self.quantity) - self.discount_amount
         
-        # Calculate VAT backwards (prices are VAT inclusive)
-        company_settings = CompanySettings.get_settings()
-        vat_rate = Decimal(str(company_settings.vat_rate))
-        vat_multiplier = Decimal('1') + (vat_rate / Decimal('100'))
-        
         # Extract VAT from the inclusive price
         line_total_ex_vat = vat_inclusive_total / vat_multiplier
         self.tax_amount = vat_inclusive_total - line_total_ex_vat
         self.line_total = vat_inclusive_total  # This is the VAT-inclusive total
-        
+    
+    def save(self, *args, **kwargs):
+        self.calculate_amounts()
         super().save(*args, **kwargs)
 
 
@@ -0,0 +1,159 @@
+"""
+POS checkout pipeline.
+
+Runs a counter sale as a small, fixed number of queries regardless of how many
+lines are in the cart: products are locked and fetched in one query, sale items
+are written with a single bulk_create and stock is moved with one UPDATE.
+"""
+
+from decimal import Decimal
+import logging
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, When
+from django.utils import timezone
+
+from apps.core.settings_cache import get_company_settings
+from apps.products.models import Product
+from .models import Sale, SaleItem, Payment
+
+logger = logging.getLogger(__name__)
+
+
+class CheckoutError(Exception):
+    """Raised when a cart cannot be turned into a sale"""
+
+
+class CheckoutService:
+    """Creates POS sales, reserves stock and settles or cancels them"""
+
+    def __init__(self, session, cashier, customer=None):
+        self.session = session
+        self.cashier = cashier
+        self.customer = customer
+
+    @staticmethod
+    def _cart_product_id(item):
+        # Handle different field names for product ID
+        return item.get('product_id') or item.get('id') or item.get('product')
+
+    def create_sale(self, cart, payment_method, amount_paid):
+        """Create a pending sale with its items and decrement stock atomically"""
+        lines = []
+        for item in cart:
+            product_id = self._cart_product_id(item)
+            if not product_id:
+                raise CheckoutError('Cart item is missing a product')
+            lines.append((int(product_id), item))
+
+        vat_multiplier = get_company_settings().vat_multiplier
+
+        with transaction.atomic():
+            products = Product.objects.select_for_update().in_bulk(
+                {product_id for product_id, _ in lines}
+            )
+            missing = {product_id for product_id, _ in lines} - set(products)
+            if missing:
+                raise CheckoutError(f'Product not found: {", ".join(str(pk) for pk in sorted(missing))}')
+
+            sale_items = []
+            for product_id, item in lines:
+                product = products[product_id]
+                sale_item = SaleItem(
+                    product=product,
+                    product_name=item.get('name', product.name),
+                    product_sku=item.get('sku', product.sku),
+                    quantity=Decimal(str(item['quantity'])),
+                    unit_price=Decimal(str(item['price'])),
+                )
+                sale_item.calculate_amounts(vat_multiplier)
+                sale_items.append(sale_item)
+
+            # Totals are computed once from the priced lines (VAT-inclusive)
+            vat_inclusive_subtotal = sum((i.line_total for i in sale_items), Decimal('0.00'))
+            subtotal = vat_inclusive_subtotal / vat_multiplier
+            grand_total = vat_inclusive_subtotal
+
+            sale = Sale.objects.create(
+                session=self.session,
+                cashier=self.cashier,
+                customer=self.customer,
+                subtotal=subtotal,
+                tax_amount=vat_inclusive_subtotal - subtotal,
+                grand_total=grand_total,
+                payment_method=payment_method,
+                amount_paid=amount_paid,
+                change_amount=max(Decimal('0'), amount_paid - grand_total),
+                status='pending'  # Will be updated based on payment processing
+            )
+
+            for sale_item in sale_items:
+                sale_item.sale = sale
+            # bulk_create skips the per-item post_save signals, so sale totals
+            # are not re-summed once per line
+            SaleItem.objects.bulk_create(sale_items)
+
+            reserved = {}
+            for sale_item in sale_items:
+                if products[sale_item.product_id].track_quantity:
+                    reserved[sale_item.product_id] = reserved.get(sale_item.product_id, Decimal('0')) - sale_item.quantity
+            self._adjust_stock(reserved)
+
+        return sale
+
+    def mark_pending_payment(self, sale):
+        """Keep the sale open until the M-Pesa callback confirms payment"""
+        sale.status = 'pending_payment'
+        Sale.objects.filter(pk=sale.pk).update(status=sale.status, updated_at=timezone.now())
+
+    def complete_sale(self, sale, payment_result, payment_data):
+        """Mark the sale completed and record its payment; returns loyalty points earned"""
+        points_earned = None
+        with transaction.atomic():
+            sale.status = 'completed'
+            Sale.objects.filter(pk=sale.pk).update(status=sale.status, updated_at=timezone.now())
+
+            # Update customer stats and loyalty points once, here, rather than
+            # again from the Sale/Payment post_save signals
+            if self.customer:
+                points_earned = self.customer.update_purchase_stats(sale.grand_total, sale.transaction_time)
+
+            # Sale.amount_paid/change_amount were set at creation, so the
+            # per-payment total signal has nothing left to do
+            Payment.objects.bulk_create([Payment(
+                sale=sale,
+                payment_type=sale.payment_method,
+                amount=sale.amount_paid,
+                status='completed',
+                transaction_id=payment_result.get('transaction_id', ''),
+                mpesa_receipt_number=payment_result.get('mpesa_receipt', ''),
+                mpesa_phone_number=payment_data.get('mpesa_phone', ''),
+                reference_number=payment_result.get('reference_number', '')
+            )])
+        return points_earned
+
+    def cancel_sale(self, sale):
+        """Cancel the sale and put its stock back with a single update"""
+        with transaction.atomic():
+            sale.status = 'cancelled'
+            Sale.objects.filter(pk=sale.pk).update(status=sale.status, updated_at=timezone.now())
+
+            restock = {}
+            items = sale.items.filter(product__track_quantity=True).values_list('product_id', 'quantity')
+            for product_id, quantity in items:
+                restock[product_id] = restock.get(product_id, Decimal('0')) + quantity
+            self._adjust_stock(restock)
+
+    @staticmethod
+    def _adjust_stock(deltas):
+        """Apply {product_id: delta} to Product.quantity_in_stock in one UPDATE"""
+        deltas = {pk: int(delta) for pk, delta in deltas.items() if int(delta)}
+        if not deltas:
+            return 0
+        return Product.objects.filter(pk__in=deltas).update(
+            quantity_in_stock=Case(
+                *[When(pk=pk, then=F('quantity_in_stock') + delta) for pk, delta in deltas.items()],
+                default=F('quantity_in_stock'),
+                output_field=IntegerField(),
+            )
+        )
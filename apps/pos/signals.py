@@ -4,6 +4,7 @@ from django.utils import timezone
 from decimal import Decimal
 from .models import Sale, SaleItem, Payment, CashierSession, SaleSequence
 from apps.inventory.models import InventoryItem, StockMovement
+from apps.core.settings_cache import get_company_settings
 
 
 @receiver(post_save, sender=SaleItem)
@@ -19,10 +20,7 @@ def update_sale_totals_on_item_change(sender, instance, **kwargs):
         vat_inclusive_subtotal = sum(item.line_total for item in items)
         
         # Calculate VAT backwards from inclusive prices
-        from apps.core.models import CompanySettings
-        company_settings = CompanySettings.get_settings()
-        vat_rate = Decimal(str(company_settings.vat_rate))
-        vat_multiplier = Decimal('1') + (vat_rate / Decimal('100'))
+        vat_multiplier = get_company_settings().vat_multiplier
         
         # Extract VAT amount and ex-VAT subtotal
         subtotal_ex_vat = vat_inclusive_subtotal / vat_multiplier
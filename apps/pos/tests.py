@@ -1,3 +1,87 @@
+import json
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from apps.products.models import Product, ProductCategory
+from apps.pos.models import Store, Terminal, CashierSession, Sale, SaleItem, Payment
+
+User = get_user_model()
+
+
+class ProcessPaymentAPITest(TestCase):
+    """Tests for the batched POS checkout pipeline"""
+
+    def setUp(self):
+        self.cashier = User.objects.create_user(username='cashier', password='testpass123', role='cashier')
+        store = Store.objects.create(name='Main Store', code='ST001', address_line_1='Kahawa Sukari',
+                                     city='Nairobi', county='Nairobi')
+        terminal = Terminal.objects.create(name='Till 1', code='TERM001', store=store)
+        self.session = CashierSession.objects.create(cashier=self.cashier, terminal=terminal)
+        category = ProductCategory.objects.create(name='Solar Panels')
+        self.products = [
+            Product.objects.create(
+                name=f'Panel {i}', slug=f'panel-{i}', sku=f'SKU-{i}', product_type='solar_panel',
+                category=category, brand='Olivian', short_description='Panel',
+                cost_price=Decimal('1000.00'), selling_price=Decimal('1160.00'), quantity_in_stock=100,
+            )
+            for i in range(30)
+        ]
+        self.client.force_login(self.cashier)
+
+    def _pay(self, items, amount_paid):
+        return self.client.post(
+            reverse('pos:api_process_payment'),
+            data=json.dumps({'items': items, 'payment_method': 'cash', 'amount_paid': amount_paid}),
+            content_type='application/json',
+        )
+
+    def test_thirty_line_cash_sale_uses_fixed_queries(self):
+        single = [{'product_id': self.products[0].id, 'quantity': 1, 'price': '1160.00'}]
+        self._pay(single, 2000)  # warm up session and settings caches
+        with CaptureQueriesContext(connection) as single_line:
+            self._pay(single, 2000)
+
+        items = [{'product_id': p.id, 'quantity': 2, 'price': '1160.00'} for p in self.products]
+        with CaptureQueriesContext(connection) as thirty_lines:
+            response = self._pay(items, 70000)
+
+        self.assertTrue(response.json()['success'])
+        # Query count does not grow with the number of cart lines
+        self.assertEqual(len(thirty_lines), len(single_line))
+
+        sale = Sale.objects.get(pk=response.json()['sale_id'])
+        self.assertEqual(sale.status, 'completed')
+        self.assertEqual(sale.items.count(), 30)
+        self.assertEqual(sale.grand_total, Decimal('69600.00'))
+        self.assertEqual(Payment.objects.filter(sale=sale).count(), 1)
+        self.assertEqual(
+            set(Product.objects.exclude(pk=self.products[0].pk).values_list('quantity_in_stock', flat=True)), {98}
+        )
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).quantity_in_stock, 96)
+
+    def test_failed_payment_restores_stock(self):
+        items = [{'product_id': p.id, 'quantity': 3, 'price': '1160.00'} for p in self.products[:5]]
+
+        response = self._pay(items, 10)
+
+        self.assertFalse(response.json()['success'])
+        self.assertEqual(Sale.objects.get().status, 'cancelled')
+        self.assertEqual(SaleItem.objects.count(), 5)
+        self.assertEqual(
+            set(Product.objects.values_list('quantity_in_stock', flat=True)), {100}
+        )
+
+    def test_unknown_product_rolls_back(self):
+        items = [{'product_id': self.products[0].id, 'quantity': 1, 'price': '1160.00'},
+                 {'product_id': 999999, 'quantity': 1, 'price': '1160.00'}]
+
+        response = self._pay(items, 5000)
 
-# Create your tests here.
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Sale.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).quantity_in_stock, 100)
@@ -7,17 +7,21 @@ from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMix
 from django.contrib import messages
 from django.urls import reverse_lazy, reverse
 from django.http import JsonResponse, HttpResponse
+from django.db import transaction
 from django.db.models import Q, Sum, Count, Avg, Max
 from django.utils import timezone
 from django.core.paginator import Paginator
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
 from datetime import datetime, timedelta
 from decimal import Decimal
 import json
 
 from .models import (
-    Store, Terminal, CashierSession, Sale, SaleItem, 
-    Payment, Discount, CashMovement, POSSettings
+    Store, Terminal, CashierSession, Sale,
+    Discount, CashMovement, POSSettings
 )
+from .services import CheckoutService, CheckoutError
 from apps.quotations.models import Customer
 from .forms import (
     SessionStartForm, CustomerForm, SaleForm, PaymentForm, 
@@ -26,7 +30,7 @@ from .forms import (
 from apps.products.models import Product
 from apps.inventory.models import InventoryItem
 from apps.ecommerce.models import MPesaTransaction
-from apps.ecommerce.mpesa import MPesaCallback
+from apps.ecommerce.mpesa_callbacks import receive_callback
 from apps.core.models import CompanySettings
 
 
@@ -748,32 +752,6 @@ class ProcessPaymentAPIView(LoginRequiredMixin, View):
                         'error': 'Cart is empty'
                     }, status=400)
             
-            # Calculate totals using VAT-inclusive approach (same as ecommerce)
-            vat_inclusive_subtotal = Decimal('0')
-            for item in cart:
-                # Handle both payload and session cart structures
-                if 'line_total' in item:
-                    line_total = Decimal(str(item['line_total']))
-                else:
-                    # Calculate from quantity and price if line_total not available
-                    quantity = Decimal(str(item.get('quantity', 1)))
-                    price = Decimal(str(item.get('price', 0)))
-                    line_total = quantity * price  # This is VAT-inclusive
-                    item['line_total'] = float(line_total)  # Add for later use
-                    
-                vat_inclusive_subtotal += line_total
-            
-            # Calculate VAT backwards from inclusive prices (same as ecommerce)
-            from apps.core.models import CompanySettings
-            company_settings = CompanySettings.get_settings()
-            vat_rate = Decimal(str(company_settings.vat_rate))
-            vat_multiplier = Decimal('1') + (vat_rate / Decimal('100'))
-            
-            # Extract VAT amount and ex-VAT subtotal
-            subtotal = vat_inclusive_subtotal / vat_multiplier  # Ex-VAT subtotal
-            tax_amount = vat_inclusive_subtotal - subtotal      # VAT amount
-            grand_total = vat_inclusive_subtotal                # Total is VAT-inclusive
-            
             # Get payment details
             payment_method = data.get('payment_method', 'cash')
             amount_paid = Decimal(str(data.get('amount_paid', 0)))
@@ -787,51 +765,22 @@ class ProcessPaymentAPIView(LoginRequiredMixin, View):
                 except Customer.DoesNotExist:
                     pass
             
-            # Create sale
-            sale = Sale.objects.create(
-                session=session,
-                cashier=request.user,
-                customer=customer,
-                subtotal=subtotal,
-                tax_amount=tax_amount,
-                grand_total=grand_total,
-                payment_method=payment_method,
-                amount_paid=amount_paid,
-                change_amount=max(Decimal('0'), amount_paid - grand_total),
-                status='pending'  # Will be updated based on payment processing
-            )
-            
-            # Create sale items
-            for item in cart:
-                # Handle different field names for product ID
-                product_id = item.get('product_id') or item.get('id') or item.get('product')
-                product = Product.objects.get(id=product_id)
-                
-                SaleItem.objects.create(
-                    sale=sale,
-                    product=product,
-                    product_name=item.get('name', product.name),
-                    product_sku=item.get('sku', product.sku),
-                    quantity=Decimal(str(item['quantity'])),
-                    unit_price=Decimal(str(item['price'])),
-                    line_total=Decimal(str(item['line_total']))
-                )
-                
-                # Update inventory if tracking is enabled
-                if product.track_quantity:
-                    product.quantity_in_stock -= Decimal(str(item['quantity']))
-                    product.save()
-            
-            # Process payment based on method
-            payment_result = self.process_payment(sale, payment_method, data)
+            checkout = CheckoutService(session=session, cashier=request.user, customer=customer)
             
-            # Handle M-Pesa payments differently - don't complete sale immediately
+            # Handle M-Pesa payments differently - don't complete sale immediately.
+            # The STK push is an external call, so it runs after the sale is committed.
             if payment_method == 'mpesa':
+                try:
+                    sale = checkout.create_sale(cart, payment_method, amount_paid)
+                except CheckoutError as e:
+                    return JsonResponse({'success': False, 'error': str(e)}, status=400)
+                grand_total = sale.grand_total
+                
+                payment_result = self.process_payment(sale, payment_method, data)
                 if payment_result['success']:
                     # For M-Pesa, return the checkout request ID for polling
                     # Don't complete the sale yet - it will be completed via callback
-                    sale.status = 'pending_payment'  # Keep sale pending until M-Pesa confirms
-                    sale.save()
+                    checkout.mark_pending_payment(sale)
                     
                     # Clear cart since payment is initiated
                     request.session['pos_cart'] = []
@@ -846,61 +795,33 @@ class ProcessPaymentAPIView(LoginRequiredMixin, View):
                         'total': float(grand_total)
                     })
                 else:
-                    # M-Pesa initiation failed
-                    sale.status = 'cancelled'
-                    sale.save()
-                    
-                    # Restore inventory
-                    for item in cart:
-                        product_id = item.get('product_id') or item.get('id') or item.get('product')
-                        product = Product.objects.get(id=product_id)
-                        if product.track_quantity:
-                            product.quantity_in_stock += Decimal(str(item['quantity']))
-                            product.save()
+                    # M-Pesa initiation failed - cancel and restore inventory
+                    checkout.cancel_sale(sale)
                     
                     return JsonResponse({
                         'success': False,
                         'error': payment_result.get('error', 'M-Pesa payment failed')
                     })
             
-            # Handle other payment methods (cash, card, bank transfer) - complete immediately
-            if payment_result['success']:
-                sale.status = 'completed'
-                sale.save()
-                
-                # Update customer stats and loyalty points if customer selected
-                if customer:
-                    # Use the model's method to update purchase stats and loyalty points
-                    points_earned = customer.update_purchase_stats(grand_total, sale.transaction_time)
-                    
-                    # Add points earned info to the response
-                    payment_result['points_earned'] = points_earned
-                
-                # Clear cart
-                request.session['pos_cart'] = []
-                
-                # Create payment record
-                Payment.objects.create(
-                    sale=sale,
-                    payment_type=payment_method,
-                    amount=amount_paid,
-                    status='completed',
-                    transaction_id=payment_result.get('transaction_id', ''),
-                    mpesa_receipt_number=payment_result.get('mpesa_receipt', ''),
-                    mpesa_phone_number=data.get('mpesa_phone', ''),
-                    reference_number=payment_result.get('reference_number', '')
-                )
-            else:
-                sale.status = 'cancelled'
-                sale.save()
-                
-                # Restore inventory
-                for item in cart:
-                    product_id = item.get('product_id') or item.get('id') or item.get('product')
-                    product = Product.objects.get(id=product_id)
-                    if product.track_quantity:
-                        product.quantity_in_stock += Decimal(str(item['quantity']))
-                        product.save()
+            # Handle other payment methods (cash, card, bank transfer) - the sale,
+            # its items, stock and payment are committed in one transaction
+            try:
+                with transaction.atomic():
+                    sale = checkout.create_sale(cart, payment_method, amount_paid)
+                    grand_total = sale.grand_total
+                    payment_result = self.process_payment(sale, payment_method, data)
+                    if payment_result['success']:
+                        points_earned = checkout.complete_sale(sale, payment_result, data)
+                        if points_earned is not None:
+                            # Add points earned info to the response
+                            payment_result['points_earned'] = points_earned
+                        
+                        # Clear cart
+                        request.session['pos_cart'] = []
+                    else:
+                        checkout.cancel_sale(sale)
+            except CheckoutError as e:
+                return JsonResponse({'success': False, 'error': str(e)}, status=400)
             
             return JsonResponse({
                 'success': payment_result['success'],
@@ -1545,158 +1466,20 @@ class POSMPesaStatusAPIView(LoginRequiredMixin, View):
             }, status=400)
 
 
+@method_decorator(csrf_exempt, name='dispatch')
 class POSMPesaCallbackView(View):
-    """Handle M-Pesa payment callbacks for POS transactions"""
+    """Handle M-Pesa payment callbacks for POS transactions
 
-    def post(self, request):
-        import json
+    The payload is stored and acknowledged at once; process_mpesa_callbacks
+    applies it to the sale (see apps/ecommerce/mpesa_callbacks.py).
+    """
 
+    def post(self, request):
         # Validate callback authenticity
         if not self._validate_callback_source(request):
             return JsonResponse({'ResultCode': 1, 'ResultDesc': 'Unauthorized access'}, status=403)
 
-        try:
-            callback_data = json.loads(request.body)
-
-            # Parse callback using same logic as ecommerce
-            transaction_data = MPesaCallback.parse_callback_data(callback_data)
-
-            if transaction_data.get('success'):
-                # Find the transaction by checkout_request_id
-                checkout_request_id = transaction_data.get('checkout_request_id')
-                try:
-                    mpesa_transaction = MPesaTransaction.objects.get(
-                        checkout_request_id=checkout_request_id
-                    )
-
-                    # Process callback based on result code
-                    result_code = transaction_data.get('result_code')
-                    result_description = transaction_data.get('result_description', 'Unknown result')
-
-                    if result_code == 0:
-                        # Successful payment
-                        mpesa_transaction.mark_completed(
-                            receipt_number=transaction_data.get('mpesa_receipt_number'),
-                            transaction_date=timezone.now()
-                        )
-
-                        # Handle both ecommerce orders and POS sales
-                        if mpesa_transaction.pos_sale:
-                            # Handle POS sale
-                            sale = mpesa_transaction.pos_sale
-
-                            # Create or update payment record for POS
-                            payment, created = Payment.objects.get_or_create(
-                                sale=sale,
-                                payment_type='mpesa',
-                                defaults={
-                                    'amount': mpesa_transaction.amount,
-                                    'transaction_id': mpesa_transaction.mpesa_receipt_number,
-                                    'mpesa_receipt_number': mpesa_transaction.mpesa_receipt_number,
-                                    'mpesa_phone_number': mpesa_transaction.phone_number,
-                                    'status': 'completed'
-                                }
-                            )
-
-                            if not created:
-                                payment.status = 'completed'
-                                payment.transaction_id = mpesa_transaction.mpesa_receipt_number
-                                payment.mpesa_receipt_number = mpesa_transaction.mpesa_receipt_number
-                                payment.save()
-
-                            # Update sale status to completed
-                            sale.status = 'completed'
-                            sale.mpesa_transaction_id = mpesa_transaction.mpesa_receipt_number
-                            sale.save()
-
-                            # Update customer loyalty points if customer exists
-                            if hasattr(sale.customer, 'update_purchase_stats'):
-                                sale.customer.update_purchase_stats(sale.grand_total, sale.transaction_time)
-
-                        elif mpesa_transaction.order:
-                            # Handle ecommerce order
-                            order = mpesa_transaction.order
-
-                            # Create or update payment record for ecommerce
-                            from apps.ecommerce.models import Payment as EcommercePayment
-                            payment, created = EcommercePayment.objects.get_or_create(
-                                order=order,
-                                payment_method='mpesa',
-                                defaults={
-                                    'amount': mpesa_transaction.amount,
-                                    'reference_number': mpesa_transaction.mpesa_receipt_number,
-                                    'mpesa_receipt_number': mpesa_transaction.mpesa_receipt_number,
-                                    'mpesa_phone_number': mpesa_transaction.phone_number,
-                                    'transaction_date': mpesa_transaction.transaction_date,
-                                    'status': 'completed'
-                                }
-                            )
-
-                            if not created:
-                                payment.status = 'completed'
-                                payment.mpesa_receipt_number = mpesa_transaction.mpesa_receipt_number
-                                payment.transaction_date = mpesa_transaction.transaction_date
-                                payment.save()
-
-                            # Update order status
-                            order.payment_status = 'paid'
-                            order.status = 'paid'
-                            order.mpesa_transaction_id = mpesa_transaction.mpesa_receipt_number
-                            order.save()
-
-                        print(f"M-Pesa payment completed: {transaction_data.get('mpesa_receipt_number')}")
-
-                    else:
-                        # Failed/Cancelled payment - handle different error codes
-                        error_message = f"Payment failed ({result_code}): {result_description}"
-
-                        # Specific handling for common failure/cancellation codes
-                        if result_code in [1, 17, 26]:  # User cancelled, transaction cancelled, or insufficient balance
-                            error_message = "Payment was cancelled by user or failed"
-                        elif result_code in [2, 3, 4]:  # Wrong PIN, transaction declined, or wrong expiry date
-                            error_message = f"Payment declined: {result_description}"
-                        elif result_code == 1032:  # Timeout
-                            error_message = "Payment timed out"
-                        elif result_code in [2001, 2018]:  # Insufficient balance or system busy
-                            error_message = f"Payment failed: {result_description}"
-                        else:
-                            error_message = f"Payment failed: {result_description}"
-
-                        mpesa_transaction.mark_failed(error_message)
-                        mpesa_transaction.save()
-
-                        # Update related order/sale status for cancelled transactions
-                        if mpesa_transaction.pos_sale:
-                            sale = mpesa_transaction.pos_sale
-                            if result_code in [17, 1, 26]:  # User cancelled or transaction cancelled
-                                sale.status = 'cancelled'
-                                sale.status_notes = f"M-Pesa payment cancelled: {error_message}"
-                            else:
-                                sale.status = 'failed'  # Keep pending for retryable failures
-                                sale.status_notes = f"M-Pesa payment failed: {error_message}"
-                            sale.save()
-
-                        elif mpesa_transaction.order:
-                            order = mpesa_transaction.order
-                            if result_code in [17, 1, 26]:  # User cancelled or transaction cancelled
-                                order.status = 'cancelled'
-                                order.status_notes = f"M-Pesa payment cancelled: {error_message}"
-                            else:
-                                order.status = 'failed'  # Keep pending for retryable failures
-                                order.status_notes = f"M-Pesa payment failed: {error_message}"
-                            order.save()
-
-                        print(f"M-Pesa payment failed (Result Code: {result_code}): {error_message}")
-
-                except MPesaTransaction.DoesNotExist:
-                    # Log unknown transaction for security monitoring
-                    print(f"Warning: Unknown transaction callback received for CheckoutRequestID {checkout_request_id}")
-
-            return JsonResponse({'ResultCode': 0, 'ResultDesc': 'Success'})
-
-        except Exception as e:
-            print(f"M-Pesa callback error: {str(e)}")
-            return JsonResponse({'ResultCode': 1, 'ResultDesc': f'Error: {str(e)}'}, status=400)
+        return receive_callback(request, 'pos', error_status=400)
 
     def _validate_callback_source(self, request):
         """Validate callback source for security"""
@@ -0,0 +1,108 @@
+"""
+Category summary for the catalog page.
+
+ProductListView used to loop over every active ProductCategory and run
+exists(), count() and first() on its products: 3 to 4 queries per category on
+every catalog page. build_category_summary() gets the same cards from two
+queries:
+
+1. active categories annotated with their number of customer-visible products
+   and the id of the newest one
+2. those sample products
+
+The counts then roll up the MPTT tree in memory (a category's card counts its
+own and its active descendants' products, and shows the newest of them) using
+the lft/rght bounds already loaded, so no per-category query is needed. The
+main categories (MAIN_CATEGORIES) get a card each; products in every other
+category are grouped under a single accessories card.
+
+The summary is cached under the 'product_catalog' tag (see
+apps/core/tiered_cache.py), which is invalidated when a product or category
+is saved or deleted (apps/products/signals.py).
+"""
+
+from django.conf import settings
+from django.db.models import Count, OuterRef, Q, Subquery
+
+from apps.core.tiered_cache import get_or_set_tagged, invalidate_tags
+
+from .models import Product, ProductCategory
+
+MAIN_CATEGORIES = ('solar-panels', 'inverters', 'batteries', 'mounting-racking')
+ACCESSORIES_SLUG = 'accessories'
+
+CACHE_KEY = 'products:category_summary'
+CATALOG_TAG = 'product_catalog'
+CACHE_TIMEOUT = getattr(settings, 'PRODUCT_CATEGORY_SUMMARY_TIMEOUT', 60 * 60)
+
+VISIBLE = Q(status='active', show_to_customers=True)
+
+
+def _annotated_categories():
+    newest_product = (
+        Product.objects.filter(VISIBLE, category=OuterRef('pk'))
+        .order_by('-created_at', '-pk')
+        .values('pk')[:1]
+    )
+    return list(
+        ProductCategory.objects.filter(is_active=True)
+        .annotate(
+            product_count=Count('products', filter=Q(products__status='active', products__show_to_customers=True)),
+            sample_product_id=Subquery(newest_product),
+        )
+        .order_by('tree_id', 'lft')
+    )
+
+
+def _newest(products):
+    return max(products, key=lambda product: (product.created_at, product.pk), default=None)
+
+
+def _card(category, members, samples):
+    count = sum(member.product_count for member in members)
+    if not count:
+        return None
+    return {
+        'category': category,
+        'products_count': count,
+        'sample_product': _newest([samples[m.sample_product_id] for m in members if m.sample_product_id in samples]),
+        'has_products': True,
+    }
+
+
+def build_category_summary():
+    """Category cards for the catalog page: [{category, products_count, sample_product, has_products}]"""
+    categories = _annotated_categories()
+    sample_ids = [category.sample_product_id for category in categories if category.sample_product_id]
+    samples = Product.objects.in_bulk(sample_ids) if sample_ids else {}
+
+    main = [category for category in categories if category.slug in MAIN_CATEGORIES]
+    summary = []
+    for category in main:
+        subtree = [other for other in categories if other.is_descendant_of(category, include_self=True)]
+        card = _card(category, subtree, samples)
+        if card:
+            summary.append(card)
+
+    # Everything outside the main categories' subtrees is shown as accessories
+    others = [
+        category for category in categories
+        if not any(category.is_descendant_of(parent, include_self=True) for parent in main)
+    ]
+    accessories = next((category for category in categories if category.slug == ACCESSORIES_SLUG), None)
+    if accessories is None:
+        accessories = next((category for category in categories if category.slug not in MAIN_CATEGORIES), None)
+    if accessories is not None:
+        card = _card(accessories, others, samples)
+        if card:
+            summary.append(card)
+    return summary
+
+
+def get_category_summary():
+    """The cached category summary, rebuilt after products or categories change"""
+    return get_or_set_tagged(CACHE_KEY, build_category_summary, [CATALOG_TAG], CACHE_TIMEOUT)
+
+
+def invalidate_category_summary():
+    invalidate_tags(CATALOG_TAG)
@@ -0,0 +1,16 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .category_summary import invalidate_category_summary
+from .models import Product, ProductCategory
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductCategory)
+@receiver(post_delete, sender=ProductCategory)
+def invalidate_catalog_category_summary(sender, instance, **kwargs):
+    """Rebuild the catalog page's category cards after a product or category changes"""
+    invalidate_category_summary()
+    transaction.on_commit(invalidate_category_summary)
@@ -1,3 +1,87 @@
-from django.test import TestCase
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import caches
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .category_summary import build_category_summary, get_category_summary
+from .models import Product, ProductCategory
+from .views import ProductListView
+
+LOCMEM_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'products-tests'},
+    'pages': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+}
+
+
+def _product(category, name, **fields):
+    defaults = {
+        'slug': name.lower().replace(' ', '-'),
+        'sku': name.upper().replace(' ', '-'),
+        'product_type': 'accessory',
+        'brand': 'Olivian',
+        'short_description': name,
+        'cost_price': Decimal('100.00'),
+        'selling_price': Decimal('150.00'),
+        'track_quantity': False,
+        'show_to_customers': True,
+    }
+    defaults.update(fields)
+    return Product.objects.create(category=category, name=name, **defaults)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CategorySummaryTest(TestCase):
+    """Catalog category cards are built from two queries and cached"""
+
+    def setUp(self):
+        caches['default'].clear()
+        self.batteries = ProductCategory.objects.create(name='Batteries', slug='batteries')
+        self.lithium = ProductCategory.objects.create(name='Lithium', slug='lithium', parent=self.batteries)
+        self.panels = ProductCategory.objects.create(name='Solar Panels', slug='solar-panels')
+        self.accessories = ProductCategory.objects.create(name='Accessories', slug='accessories')
+        self.cables = ProductCategory.objects.create(name='Cables', slug='cables')
+
+        _product(self.batteries, 'Lead Acid 200Ah', product_type='battery')
+        self.newest_battery = _product(self.lithium, 'LiFePO4 5kWh', product_type='battery')
+        _product(self.lithium, 'Draft Battery', status='draft')
+        _product(self.cables, 'DC Cable 6mm')
+        self.newest_accessory = _product(self.accessories, 'MC4 Connector')
+
+    def test_counts_roll_up_the_category_tree(self):
+        with CaptureQueriesContext(connection) as queries:
+            summary = build_category_summary()
+        self.assertEqual(len(queries), 2)
+
+        cards = {card['category'].slug: card for card in summary}
+        self.assertEqual(set(cards), {'batteries', 'accessories'})  # no visible solar panels
+        self.assertEqual(cards['batteries']['products_count'], 2)
+        self.assertEqual(cards['batteries']['sample_product'], self.newest_battery)
+        self.assertEqual(cards['accessories']['products_count'], 2)
+        self.assertEqual(cards['accessories']['sample_product'], self.newest_accessory)
+
+    def test_summary_is_cached_until_a_product_changes(self):
+        get_category_summary()
+        with CaptureQueriesContext(connection) as queries:
+            get_category_summary()
+        self.assertEqual(len(queries), 0)
+
+        _product(self.panels, 'Mono 550W', product_type='solar_panel')
+        slugs = [card['category'].slug for card in get_category_summary()]
+        self.assertIn('solar-panels', slugs)
+
+    def test_catalog_page_and_infinite_scroll(self):
+        view = ProductListView()
+        view.setup(RequestFactory().get(reverse('products:list')))
+        view.object_list = view.get_queryset()
+        self.assertEqual(len(view.get_context_data()['category_specs']), 2)
+
+        with mock.patch('apps.products.views.get_category_summary') as summary:
+            response = self.client.get(reverse('products:list'), HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        summary.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('MC4 Connector', response.json()['html'])
+        self.assertFalse(response.json()['has_next'])
@@ -6,6 +6,7 @@ from django.db import models
 from django.http import JsonResponse
 from django.template.loader import render_to_string
 from django.urls import reverse_lazy
+from .category_summary import get_category_summary
 from .models import Product, ProductCategory
 from . import forms
 import logging
@@ -56,87 +57,31 @@ class ProductListView(ListView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        categories = ProductCategory.objects.filter(is_active=True).prefetch_related('products')
-
-        # Prepare category data with specifications summary
-        # Define main categories - everything else goes to accessories
-        main_categories = ['solar-panels', 'inverters', 'batteries', 'mounting-racking']
-        
-        category_specs = []
-        accessories_products_count = 0
-        accessories_sample_product = None
-
-        for category in categories:
-            products = category.products.filter(status='active', show_to_customers=True)
-
-            if category.slug in main_categories and products.exists():
-                category_specs.append({
-                    'category': category,
-                    'products_count': products.count(),
-                    'sample_product': products.first(),
-                    'has_products': True
-                })
-            elif category.slug not in main_categories and products.exists():
-                # Aggregate ALL non-main categories as accessories
-                accessories_products_count += products.count()
-                if not accessories_sample_product:
-                    accessories_sample_product = products.first()
-        
-        # Add aggregated accessories category if there are products
-        if accessories_products_count > 0:
-            # Get or create the main accessories category
-            accessories_category = categories.filter(slug='accessories').first()
-            if not accessories_category:
-                # Fallback to any non-main category if main accessories doesn't exist
-                accessories_category = categories.exclude(slug__in=main_categories).first()
-            
-            if accessories_category:
-                category_specs.append({
-                    'category': accessories_category,
-                    'products_count': accessories_products_count,
-                    'sample_product': accessories_sample_product,
-                    'has_products': True
-                })
-        
-        context['categories'] = categories
-        context['category_specs'] = category_specs
+        context['categories'] = ProductCategory.objects.filter(is_active=True)
+        # Category cards with product counts and a sample product (cached, see category_summary.py)
+        context['category_specs'] = get_category_summary()
         context['product_types'] = Product.PRODUCT_TYPES
         return context
     
     def get(self, request, *args, **kwargs):
         # Handle AJAX requests for infinite scroll
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-            self.object_list = self.get_queryset()
-            context = self.get_context_data()
-
-            # Render only the product cards with full template context
-            full_context = {
-                'products': context['page_obj'].object_list,
-                'request': request,
-            }
-
-            # Add context processor data for AJAX rendering
-            from django.template import RequestContext
-            from django.template.loader import get_template
+            # Only the next page of product cards: no category summary or other page context
+            paginator, page_obj, products, is_paginated = self.paginate_queryset(
+                self.get_queryset(), self.get_paginate_by(None)
+            )
 
-            # Create a template object and render with request context
             try:
-                template = get_template('website/partials/product_cards.html')
-                request_context = RequestContext(request)
-                request_context.push(full_context)
-
-                products_html = template.render(request_context)
-                request_context.pop()
-
+                products_html = render_to_string(
+                    'website/partials/product_cards.html', {'products': products}, request=request
+                )
                 return JsonResponse({
                     'html': products_html,
-                    'has_next': context['page_obj'].has_next(),
-                    'next_page_number': context['page_obj'].next_page_number() if context['page_obj'].has_next() else None
+                    'has_next': page_obj.has_next(),
+                    'next_page_number': page_obj.next_page_number() if page_obj.has_next() else None
                 })
             except Exception as e:
                 # Log the error and return a proper error response for AJAX
-                import logging
-                logger = logging.getLogger(__name__)
                 logger.error(f"AJAX template rendering error: {e}", exc_info=True)
                 return JsonResponse({
                     'error': 'Error rendering products'
@@ -1,6 +1,7 @@
 from django.db import models
 from django.utils import timezone
 from apps.core.models import TimeStampedModel
+from apps.core.numbering import next_number
 from decimal import Decimal
 import os
 
@@ -24,10 +25,8 @@ class ProjectSequence(models.Model):
         if year is None:
             year = timezone.now().year
         
-        sequence, created = cls.objects.get_or_create(year=year, defaults={'last_number': 0})
-        sequence.last_number += 1
-        sequence.save()
-        return f"OG-PRJ-{year}-{sequence.last_number:04d}"
+        number = next_number(cls, year=year)
+        return f"OG-PRJ-{year}-{number:04d}"
 
 class Project(TimeStampedModel):
     PROJECT_TYPES = [
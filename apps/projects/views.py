@@ -11,6 +11,7 @@ from django.views.decorators.http import require_http_methods
 from django.utils import timezone
 from .models import Project
 from .forms import ProjectCreateForm, ProjectUpdateForm
+from apps.core.page_cache import cache_public_page
 
 
 def complete_project(project):
@@ -372,6 +373,7 @@ class ProjectUpdateView(LoginRequiredMixin, UpdateView):
         
         return context
 
+@method_decorator(cache_public_page('projects'), name='dispatch')
 class ProjectShowcaseView(TemplateView):
     template_name = 'projects/showcase.html'
 
@@ -0,0 +1,59 @@
+"""
+Quotation export specs (see apps/core/exports.py)
+"""
+
+from apps.core.exports import Column, ExportSpec, choice_label, date_format, register_export
+
+from .models import Quotation
+
+
+QUOTATION_COLUMNS = [
+    Column('Quotation Number', 'quotation_number'),
+    Column('Customer Name', 'customer__name'),
+    Column('Customer Email', 'customer__email'),
+    Column('System Type', 'system_type', format=choice_label(Quotation.SYSTEM_TYPES)),
+    Column('Capacity (kW)', 'system_capacity'),
+    Column('Total Amount (KES)', 'total_amount'),
+]
+
+QUOTATION_STATUS_COLUMNS = [
+    Column('Status', 'status', format=choice_label(Quotation.STATUS_CHOICES)),
+    Column('Created Date', 'created_at', format=date_format()),
+    Column('Valid Until', 'valid_until', format=date_format()),
+]
+
+
+@register_export
+class QuotationExport(ExportSpec):
+    name = 'quotations.quotations'
+    filename = 'quotations'
+    sheet_title = 'Quotations'
+    columns = QUOTATION_COLUMNS + QUOTATION_STATUS_COLUMNS
+
+    def get_queryset(self, params, user=None):
+        queryset = Quotation.objects.order_by('-created_at', '-pk')
+
+        if params.get('date_from'):
+            queryset = queryset.filter(created_at__gte=params['date_from'])
+        if params.get('date_to'):
+            queryset = queryset.filter(created_at__lte=params['date_to'])
+        if params.get('status'):
+            queryset = queryset.filter(status=params['status'])
+
+        # Apply role-based filtering
+        role = getattr(user, 'role', None)
+        if role == 'customer':
+            queryset = queryset.filter(customer__email=user.email)
+        elif role in ['sales_person', 'sales_manager']:
+            queryset = queryset.filter(salesperson=user)
+        return queryset
+
+
+@register_export
+class QuotationWorkbookExport(QuotationExport):
+    """The Excel export also carries the savings estimates"""
+    name = 'quotations.quotations_workbook'
+    columns = QUOTATION_COLUMNS + [
+        Column('Monthly Savings (KES)', 'estimated_monthly_savings'),
+        Column('Annual Savings (KES)', 'estimated_annual_savings'),
+    ] + QUOTATION_STATUS_COLUMNS
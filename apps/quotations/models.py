@@ -1,13 +1,19 @@
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 from decimal import Decimal
+from contextlib import contextmanager
 from apps.core.models import TimeStampedModel
+from apps.core.numbering import next_number
 from apps.core.email_utils import EmailService
 import json
 import logging
+import threading
 
 logger = logging.getLogger(__name__)
 
+# Quotation pks whose total recalculation is deferred in the current thread
+_deferred_totals = threading.local()
+
 class QuotationSequence(models.Model):
     """Model to track quotation sequence numbers"""
     year = models.IntegerField(unique=True)
@@ -18,10 +24,8 @@ class QuotationSequence(models.Model):
         if year is None:
             year = timezone.now().year
 
-        sequence, created = cls.objects.get_or_create(year=year, defaults={'last_number': 0})
-        sequence.last_number += 1
-        sequence.save()
-        return f"OG-QUO-{year}-{sequence.last_number:04d}"
+        number = next_number(cls, year=year)
+        return f"OG-QUO-{year}-{number:04d}"
 
 class Customer(TimeStampedModel):
     """Customer model for quotations"""
@@ -230,23 +234,88 @@ class Quotation(TimeStampedModel):
     
     def calculate_totals(self):
         """Calculate quotation totals"""
-        items = self.items.all()
-        self.subtotal = sum(item.total_price for item in items)
-        
+        self.update_totals()
+
+    def update_totals(self):
+        """Recalculate totals from the items with one aggregate query.
+
+        Only the total fields are written, so concurrent edits to other fields
+        are not overwritten and no save signals are fired.
+        """
+        subtotal = self.items.aggregate(total=models.Sum('total_price'))['total'] or Decimal('0')
+        self.subtotal = subtotal
+
         # Apply discount
         if self.discount_percentage > 0:
             self.discount_amount = (self.subtotal * self.discount_percentage) / 100
-        
+
         # Calculate tax (VAT)
         from django.conf import settings
         vat_rate = Decimal(str(getattr(settings, 'VAT_RATE', 16.0)))
         taxable_amount = self.subtotal - self.discount_amount
         self.tax_amount = (taxable_amount * vat_rate) / 100
-        
+
         # Calculate total
         self.total_amount = self.subtotal - self.discount_amount + self.tax_amount
+        self.updated_at = timezone.now()
 
-        self.save()
+        Quotation.objects.filter(pk=self.pk).update(
+            subtotal=self.subtotal,
+            discount_amount=self.discount_amount,
+            tax_amount=self.tax_amount,
+            total_amount=self.total_amount,
+            updated_at=self.updated_at,
+        )
+
+    @staticmethod
+    def totals_deferred(quotation_id):
+        return quotation_id in getattr(_deferred_totals, 'pks', set())
+
+    @contextmanager
+    def deferred_totals(self):
+        """Defer QuotationItem.save() total recalculation until the block exits.
+
+        Usage:
+            with quotation.deferred_totals():
+                item_formset.save()
+        """
+        pks = getattr(_deferred_totals, 'pks', None)
+        if pks is None:
+            pks = _deferred_totals.pks = set()
+        if self.pk in pks:
+            # Nested block: the outermost one recalculates
+            yield self
+            return
+
+        pks.add(self.pk)
+        try:
+            yield self
+        finally:
+            pks.discard(self.pk)
+        self.update_totals()
+
+    def add_items(self, items):
+        """Bulk-add items (QuotationItem instances or dicts of field values)"""
+        new_items = []
+        for item in items:
+            if not isinstance(item, QuotationItem):
+                item = QuotationItem(**item)
+            item.quotation = self
+            item.total_price = item.quantity * item.unit_price
+            new_items.append(item)
+
+        with transaction.atomic():
+            created = QuotationItem.objects.bulk_create(new_items)
+            if not self.totals_deferred(self.pk):
+                self.update_totals()
+        return created
+
+    def set_items(self, items):
+        """Replace all items with ``items`` and recalculate totals once"""
+        with transaction.atomic(), self.deferred_totals():
+            self.items.all().delete()
+            created = self.add_items(items)
+        return created
 
     def is_expired(self):
         return timezone.now().date() > self.valid_until
@@ -314,8 +383,9 @@ class QuotationItem(TimeStampedModel):
     def save(self, *args, **kwargs):
         self.total_price = self.quantity * self.unit_price
         super().save(*args, **kwargs)
-        # Recalculate quotation totals
-        self.quotation.calculate_totals()
+        # Recalculate quotation totals unless a bulk edit is in progress
+        if not Quotation.totals_deferred(self.quotation_id):
+            self.quotation.update_totals()
     
     def __str__(self):
         return f"{self.item_name} - {self.quantity} {self.unit}"
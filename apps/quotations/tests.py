@@ -1,16 +1,37 @@
-from django.test import TestCase, Client
+from django.conf import settings
+from django.test import TestCase, Client, override_settings
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from django.utils import timezone
-from apps.quotations.models import Quotation, Customer
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from apps.quotations.models import Quotation, QuotationItem, Customer
+from apps.quotations.views import QuotationPDFView
+from decimal import Decimal
+from unittest import mock
 import json
+import os
+import shutil
+import tempfile
 
 User = get_user_model()
 
-class CalculatorFeatureTestCase(TestCase):
+
+class TemporaryPDFCacheMixin:
+    """Keep PDFs rendered by the tests out of the project directory"""
+
+    def use_temporary_pdf_cache(self):
+        pdf_cache_root = override_settings(PDF_CACHE_ROOT=tempfile.mkdtemp())
+        pdf_cache_root.enable()
+        self.addCleanup(pdf_cache_root.disable)
+        self.addCleanup(shutil.rmtree, settings.PDF_CACHE_ROOT, True)
+
+
+class CalculatorFeatureTestCase(TemporaryPDFCacheMixin, TestCase):
     """Test new calculator features"""
     
     def setUp(self):
+        self.use_temporary_pdf_cache()
         self.client = Client()
         self.user = User.objects.create_user(
             username='testuser',
@@ -120,10 +141,11 @@ class CalculatorFeatureTestCase(TestCase):
         self.assertTrue(response_data['success'])
         self.assertIn('successfully', response_data['message'])
 
-class QuotationPDFTestCase(TestCase):
+class QuotationPDFTestCase(TemporaryPDFCacheMixin, TestCase):
     """Test PDF generation functionality"""
     
     def setUp(self):
+        self.use_temporary_pdf_cache()
         self.user = User.objects.create_user(
             username='pdftest',
             email='pdf@olivian.co.ke',
@@ -183,3 +205,209 @@ class QuotationPDFTestCase(TestCase):
         
         # Should redirect due to permission check
         self.assertEqual(response.status_code, 302)
+    
+    def test_repeat_download_reuses_cached_pdf(self):
+        """Unchanged quotations are rendered once and revalidated by ETag"""
+        self.client.login(username='pdftest', password='testpass123')
+        url = reverse('quotations:pdf', args=[self.quotation.quotation_number])
+        
+        with mock.patch.object(QuotationPDFView, 'render_quotation_pdf',
+                               autospec=True, side_effect=QuotationPDFView.render_quotation_pdf) as render:
+            first = self.client.get(url)
+            second = self.client.get(url)
+            self.assertEqual(render.call_count, 1)
+        
+        self.assertEqual(b''.join(first.streaming_content), b''.join(second.streaming_content))
+        self.assertTrue(first['ETag'])
+        self.assertEqual(first['ETag'], second['ETag'])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+    
+    def test_pdf_regenerated_when_items_change(self):
+        """Changing an item produces a new PDF and removes the stale one"""
+        first = QuotationPDFView().generate_quotation_pdf(self.quotation, return_response=False)
+        self.quotation.set_items([
+            {'item_name': 'Inverter', 'quantity': Decimal('1'), 'unit_price': Decimal('50000.00')}
+        ])
+        self.quotation.refresh_from_db()
+        second = QuotationPDFView().generate_quotation_pdf(self.quotation, return_response=False)
+        
+        self.assertNotEqual(first, second)
+        cached = os.listdir(os.path.join(settings.PDF_CACHE_ROOT, 'quotations'))
+        self.assertEqual(len(cached), 1)
+        self.assertTrue(cached[0].startswith(self.quotation.quotation_number))
+    
+    def test_pdf_regenerated_when_company_branding_changes(self):
+        """The cache key and the PDF header read the same company settings"""
+        from apps.core.models import CompanySettings
+        
+        view = QuotationPDFView()
+        first = view.generate_quotation_pdf(self.quotation, return_response=False)
+        self.assertEqual(first, view.generate_quotation_pdf(self.quotation, return_response=False))
+        
+        company = CompanySettings.get_settings()
+        company.name = 'Olivian Solar'
+        company.save()
+        self.assertNotEqual(first, view.generate_quotation_pdf(self.quotation, return_response=False))
+
+class QuotationTotalsTestCase(TestCase):
+    """Test bulk item API and deferred total recalculation"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='totals',
+            email='totals@olivian.co.ke',
+            password='testpass123',
+            role='sales_person'
+        )
+        self.customer = Customer.objects.create(
+            name='Totals Customer',
+            email='totals@customer.com',
+            phone='+254700000004',
+            address='Totals Address',
+            city='Nairobi',
+            monthly_consumption=300.00,
+            average_monthly_bill=5000.00,
+            roof_area=100.00
+        )
+        self.quotation = Quotation.objects.create(
+            customer=self.customer,
+            quotation_type='custom_solution',
+            system_type='grid_tied',
+            system_capacity=5.0,
+            estimated_generation=600.00,
+            estimated_monthly_savings=3000.00,
+            estimated_annual_savings=36000.00,
+            payback_period_months=120,
+            roi_percentage=15.00,
+            valid_until=timezone.now().date() + timezone.timedelta(days=30),
+            salesperson=self.user
+        )
+
+    def _items(self, count):
+        return [
+            {'item_name': f'Item {i}', 'quantity': Decimal('2'), 'unit_price': Decimal('100.00')}
+            for i in range(count)
+        ]
+
+    def test_set_items_computes_totals(self):
+        self.quotation.set_items(self._items(3))
+        self.quotation.refresh_from_db()
+        self.assertEqual(self.quotation.subtotal, Decimal('600.00'))
+        self.assertEqual(self.quotation.tax_amount, Decimal('96.00'))
+        self.assertEqual(self.quotation.total_amount, Decimal('696.00'))
+
+    def test_hundred_item_quotation_query_count(self):
+        """Regression benchmark: query count must not grow with item count"""
+        with CaptureQueriesContext(connection) as ten:
+            self.quotation.set_items(self._items(10))
+        with CaptureQueriesContext(connection) as hundred:
+            self.quotation.set_items(self._items(100))
+        # bulk_create may split into batches on SQLite's variable limit
+        self.assertLessEqual(len(hundred), len(ten) + 1)
+        self.quotation.refresh_from_db()
+        self.assertEqual(self.quotation.subtotal, Decimal('20000.00'))
+
+        # Per-item saves inside deferred_totals() recalculate only once
+        with CaptureQueriesContext(connection) as deferred:
+            with self.quotation.deferred_totals():
+                for i in range(100):
+                    QuotationItem.objects.create(
+                        quotation=self.quotation, item_name=f'Extra {i}',
+                        quantity=Decimal('1'), unit_price=Decimal('10.00')
+                    )
+        self.assertLessEqual(len(deferred), 100 + 2)
+        self.quotation.refresh_from_db()
+        self.assertEqual(self.quotation.subtotal, Decimal('21000.00'))
+
+
+class QuotationExportTestCase(TestCase):
+    """Test the streaming CSV/XLSX quotation export"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='exporter',
+            email='exporter@olivian.co.ke',
+            password='testpass123',
+            role='sales_person'
+        )
+        self.client.force_login(self.user)
+
+    def _create_quotations(self, count):
+        for i in range(count):
+            customer = Customer.objects.create(
+                name=f'Export Customer {i}',
+                email=f'export{i}@customer.com',
+                phone='+254700000005',
+                address='Export Address',
+                city='Nairobi',
+                monthly_consumption=300.00,
+                average_monthly_bill=5000.00,
+                roof_area=100.00
+            )
+            Quotation.objects.create(
+                customer=customer,
+                quotation_type='custom_solution',
+                system_type='hybrid',
+                system_capacity=5.0,
+                estimated_generation=600.00,
+                estimated_monthly_savings=3000.00,
+                estimated_annual_savings=36000.00,
+                payback_period_months=120,
+                roi_percentage=15.00,
+                valid_until=timezone.now().date() + timezone.timedelta(days=30),
+                salesperson=self.user
+            )
+
+    def _export(self, export_format):
+        response = self.client.get(reverse('quotations:export'), {'format': export_format})
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_csv_export_streams_with_constant_queries(self):
+        self._create_quotations(2)
+        with CaptureQueriesContext(connection) as few:
+            self._export('csv')
+        self._create_quotations(10)
+        with CaptureQueriesContext(connection) as many:
+            content = self._export('csv').decode()
+        self.assertEqual(len(many), len(few))
+
+        lines = content.strip().splitlines()
+        self.assertEqual(len(lines), 13)
+        self.assertTrue(lines[0].startswith('Quotation Number,Customer Name,Customer Email,System Type'))
+        self.assertIn('Hybrid System', lines[1])
+        self.assertIn('@customer.com', lines[1])
+
+    def test_excel_export_uses_workbook_columns(self):
+        from io import BytesIO
+        import openpyxl
+
+        self._create_quotations(3)
+        worksheet = openpyxl.load_workbook(BytesIO(self._export('excel'))).active
+        rows = list(worksheet.values)
+        self.assertEqual(worksheet.title, 'Quotations')
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[0][6], 'Monthly Savings (KES)')
+        self.assertEqual(rows[1][6], 3000)
+
+    def test_large_export_is_handed_to_background_job(self):
+        from apps.core import exports
+        from apps.core.job_queue import run_pending_jobs
+        from apps.core.models import BackgroundJob
+
+        jobs_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, jobs_root, True)
+        self._create_quotations(3)
+
+        with mock.patch.object(exports, 'BACKGROUND_THRESHOLD', 2), override_settings(JOBS_ROOT=jobs_root):
+            response = self.client.get(reverse('quotations:export'), {'format': 'csv', 'status': 'draft'})
+            job = BackgroundJob.objects.get(job_type='core.export')
+            self.assertRedirects(response, reverse('core:job_detail', args=[job.pk]), fetch_redirect_response=False)
+            self.assertEqual(job.params['params'], {'status': 'draft'})
+
+            run_pending_jobs()
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'completed', job.error)
+        self.assertEqual(job.result['rows'], 3)
+        with open(job.result_file) as result:
+            self.assertEqual(len(result.read().strip().splitlines()), 4)
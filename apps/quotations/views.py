@@ -13,7 +13,8 @@ from django.utils import timezone
 from .models import Quotation, Customer, QuotationFollowUp, QuotationRequest
 from .forms import CustomerRequirementsWizard, QuotationCreateForm, QuotationItemFormSet, QuotationCreateFromRequestForm
 from apps.core.email_utils import EmailService
-from django.db.models import Count, Q, Subquery, OuterRef
+from apps.core.exports import export_response, get_export
+from django.db.models import Count, Q, Subquery, OuterRef, Sum
 from django.core.serializers.json import DjangoJSONEncoder
 from apps.products.models import Product, ProductCategory, ProductImage
 import json
@@ -380,11 +381,10 @@ class QuotationCreateFromRequestView(LoginRequiredMixin, View):
                 quotation.save()  # This will also update totals via item saves
 
                 # Save items
-                # Use formset.save() to save the items (sets quotation automatically)
-                item_formset.save()
-
-                # Update totals after all items are saved
-                quotation.update_totals()
+                # Use formset.save() to save the items (sets quotation automatically);
+                # totals are recalculated once when the block exits
+                with quotation.deferred_totals():
+                    item_formset.save()
 
                 # For final quotations, send email with PDF attachment
                 if not is_draft:
@@ -2024,11 +2024,49 @@ class QuotationPDFView(LoginRequiredMixin, View):
             return redirect('quotations:list')
         
         # Generate PDF
-        pdf_response = self.generate_quotation_pdf(quotation)
+        pdf_response = self.generate_quotation_pdf(quotation, request=request)
         return pdf_response
     
-    def generate_quotation_pdf(self, quotation, return_response=True):
-        """Generate PDF for quotation using reportlab"""
+    def generate_quotation_pdf(self, quotation, return_response=True, request=None):
+        """Quotation PDF, rendered only when the quotation, its items or the company branding changed"""
+        from apps.core.pdf_cache import cache_dir, get_or_render, pdf_response
+        from apps.core.settings_cache import get_company_settings
+        
+        company = get_company_settings()
+        path, digest = get_or_render(
+            cache_dir('quotations'),
+            quotation.quotation_number,
+            self.pdf_inputs(quotation, company),
+            lambda target: self.render_quotation_pdf(quotation, company, target),
+        )
+        
+        if return_response:
+            # Return PDF response for direct download
+            return pdf_response(request, path, digest, f"quotation_{quotation.quotation_number}.pdf")
+        else:
+            # Return raw PDF content for email attachment
+            with open(path, 'rb') as pdf_file:
+                return pdf_file.read()
+    
+    def pdf_inputs(self, quotation, company):
+        """Everything the quotation PDF shows; the cached file is reused while these are unchanged"""
+        from apps.core.pdf_cache import field_values
+        
+        return {
+            'quotation': field_values(quotation, [
+                'quotation_number', 'created_at', 'valid_until', 'quotation_type', 'system_type',
+                'system_capacity', 'subtotal', 'discount_percentage', 'discount_amount', 'tax_amount',
+                'total_amount',
+            ]),
+            'customer': field_values(quotation.customer, ['name', 'email', 'phone']),
+            'items': list(quotation.items.values_list(
+                'item_name', 'description', 'quantity', 'unit', 'unit_price', 'total_price'
+            )),
+            'company': field_values(company, ['name', 'phone', 'email', 'website', 'primary_color', 'logo']),
+        }
+    
+    def render_quotation_pdf(self, quotation, company, target):
+        """Draw the quotation with reportlab into ``target`` (a path or file object)"""
         try:
             from reportlab.pdfgen import canvas
             from reportlab.lib.pagesizes import letter, A4
@@ -2037,8 +2075,6 @@ class QuotationPDFView(LoginRequiredMixin, View):
             from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
             from reportlab.platypus import Table, TableStyle, Paragraph
             from django.conf import settings
-            from apps.core.models import CompanySettings
-            from io import BytesIO
             import os
             import logging
             
@@ -2049,15 +2085,7 @@ class QuotationPDFView(LoginRequiredMixin, View):
             logger.error(f"Failed to import PDF libraries: {e}")
             raise Exception(f"PDF generation libraries not available: {e}")
         
-        # Get company settings
-        try:
-            company = CompanySettings.objects.first()
-        except CompanySettings.DoesNotExist:
-            company = None
-        
-        # Create PDF buffer
-        buffer = BytesIO()
-        c = canvas.Canvas(buffer, pagesize=A4)
+        c = canvas.Canvas(target, pagesize=A4)
         width, height = A4
         
         # Company branding
@@ -2252,23 +2280,13 @@ class QuotationPDFView(LoginRequiredMixin, View):
         # Footer
         c.setFont("Helvetica", 8)
         c.setFillColor(colors.gray)
-        c.drawString(50, 50, f"Generated on {timezone.now().strftime('%B %d, %Y at %I:%M %p')}")
+        # No render timestamp: the file is cached and served for as long as pdf_inputs() are unchanged
         c.drawString(50, 35, f"Contact us: {company_phone} | {company_email} | {company_website}")
         
         # Professional disclaimer
         c.drawString(50, 20, "This quotation is based on preliminary calculations. Final system design requires professional site assessment.")
         
         c.save()
-        buffer.seek(0)
-        
-        if return_response:
-            # Return PDF response for direct download
-            response = HttpResponse(buffer.read(), content_type='application/pdf')
-            response['Content-Disposition'] = f'attachment; filename="quotation_{quotation.quotation_number}.pdf"'
-            return response
-        else:
-            # Return raw PDF content for email attachment
-            return buffer.getvalue()
 
 
 @method_decorator(csrf_exempt, name='dispatch')
@@ -2373,6 +2391,8 @@ class GenerateQuotationFromCalculatorView(View):
             system_capacity = Decimal(str(calculator_data.get('capacity', 0)))
             components_data = calculator_data.get('components', {})
             
+            items = []
+            
             # Solar Panels
             panels_data = components_data.get('panels', {})
             if system_capacity > 0:
@@ -2380,45 +2400,39 @@ class GenerateQuotationFromCalculatorView(View):
                 panel_price = Decimal('15000')  # Default panel price
                 panel_name = panels_data.get('name', f'Solar Panels ({system_capacity}kW System)')
                 
-                QuotationItem.objects.create(
-                    quotation=quotation,
+                items.append(QuotationItem(
                     item_name=panel_name,
                     description=f'High-efficiency monocrystalline solar panels for {system_capacity}kW system',
                     quantity=Decimal(str(panel_qty)),
                     unit='pcs',
-                    unit_price=panel_price,
-                    total_price=Decimal(str(panel_qty)) * panel_price
-                )
+                    unit_price=panel_price
+                ))
             
             # Inverter
             if system_capacity > 0:
                 inverter_price = system_capacity * Decimal('35000')  # Estimate KES 35k per kW
                 inverter_name = f'{system_capacity}kW Solar Inverter'
                 
-                QuotationItem.objects.create(
-                    quotation=quotation,
+                items.append(QuotationItem(
                     item_name=inverter_name,
                     description=f'High-efficiency string inverter for {system_capacity}kW system',
                     quantity=Decimal('1'),
                     unit='unit',
-                    unit_price=inverter_price,
-                    total_price=inverter_price
-                )
+                    unit_price=inverter_price
+                ))
             
             # Installation & Components
             installation_price = system_capacity * Decimal('25000')  # Estimate KES 25k per kW
-            QuotationItem.objects.create(
-                quotation=quotation,
+            items.append(QuotationItem(
                 item_name='Professional Installation',
                 description='Professional installation including mounting, wiring, commissioning, and KPLC approvals',
                 quantity=Decimal('1'),
                 unit='system',
-                unit_price=installation_price,
-                total_price=installation_price
-            )
+                unit_price=installation_price
+            ))
             
-            # Calculate proper totals based on items
-            quotation.calculate_totals()
+            # Save all items and calculate proper totals once
+            quotation.set_items(items)
             
             # Update status to 'sent' to trigger email via signal (single email)
             quotation.status = 'sent'
@@ -2472,7 +2486,7 @@ class CustomerQuotationPDFView(View):
         
         # Use the same PDF generation logic but without login requirement
         pdf_view = QuotationPDFView()
-        pdf_response = pdf_view.generate_quotation_pdf(quotation)
+        pdf_response = pdf_view.generate_quotation_pdf(quotation, request=request)
         return pdf_response
 
 
@@ -2482,110 +2496,21 @@ class QuotationExportView(LoginRequiredMixin, View):
     
     def get(self, request):
         format_type = request.GET.get('format', 'csv')
-        date_from = request.GET.get('date_from')
-        date_to = request.GET.get('date_to')
-        status = request.GET.get('status')
-        
-        # Build queryset
-        queryset = Quotation.objects.all()
+        params = {
+            key: request.GET[key] for key in ('date_from', 'date_to', 'status') if request.GET.get(key)
+        }
         
-        if date_from:
-            queryset = queryset.filter(created_at__gte=date_from)
-        if date_to:
-            queryset = queryset.filter(created_at__lte=date_to)
-        if status:
-            queryset = queryset.filter(status=status)
-            
-        # Apply role-based filtering
-        if request.user.role == 'customer':
-            queryset = queryset.filter(customer__email=request.user.email)
-        elif request.user.role in ['sales_person', 'sales_manager']:
-            queryset = queryset.filter(salesperson=request.user)
-            
+        # Rows are streamed by the shared export engine (apps/quotations/exports.py)
         if format_type == 'csv':
-            return self.export_csv(queryset)
+            return export_response(request, 'quotations.quotations', 'csv', params)
         elif format_type == 'excel':
-            return self.export_excel(queryset)
+            return export_response(request, 'quotations.quotations_workbook', 'excel', params)
         elif format_type == 'pdf':
-            return self.export_pdf_report(queryset)
+            queryset = get_export('quotations.quotations').get_queryset(params, request.user)
+            return self.export_pdf_report(queryset.select_related('customer'))
         else:
             return JsonResponse({'error': 'Invalid format'}, status=400)
     
-    def export_csv(self, queryset):
-        import csv
-        from django.http import HttpResponse
-        
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="quotations.csv"'
-        
-        writer = csv.writer(response)
-        writer.writerow([
-            'Quotation Number', 'Customer Name', 'Customer Email', 
-            'System Type', 'Capacity (kW)', 'Total Amount (KES)', 
-            'Status', 'Created Date', 'Valid Until'
-        ])
-        
-        for quotation in queryset:
-            writer.writerow([
-                quotation.quotation_number,
-                quotation.customer.name,
-                quotation.customer.email,
-                quotation.get_system_type_display(),
-                quotation.system_capacity,
-                quotation.total_amount,
-                quotation.get_status_display(),
-                quotation.created_at.strftime('%Y-%m-%d'),
-                quotation.valid_until.strftime('%Y-%m-%d') if quotation.valid_until else ''
-            ])
-        
-        return response
-    
-    def export_excel(self, queryset):
-        import openpyxl
-        from django.http import HttpResponse
-        from io import BytesIO
-        
-        workbook = openpyxl.Workbook()
-        worksheet = workbook.active
-        worksheet.title = 'Quotations'
-        
-        # Headers
-        headers = [
-            'Quotation Number', 'Customer Name', 'Customer Email', 
-            'System Type', 'Capacity (kW)', 'Total Amount (KES)', 
-            'Monthly Savings (KES)', 'Annual Savings (KES)',
-            'Status', 'Created Date', 'Valid Until'
-        ]
-        
-        for col, header in enumerate(headers, 1):
-            worksheet.cell(row=1, column=col, value=header)
-        
-        # Data
-        for row, quotation in enumerate(queryset, 2):
-            worksheet.cell(row=row, column=1, value=quotation.quotation_number)
-            worksheet.cell(row=row, column=2, value=quotation.customer.name)
-            worksheet.cell(row=row, column=3, value=quotation.customer.email)
-            worksheet.cell(row=row, column=4, value=quotation.get_system_type_display())
-            worksheet.cell(row=row, column=5, value=float(quotation.system_capacity))
-            worksheet.cell(row=row, column=6, value=float(quotation.total_amount))
-            worksheet.cell(row=row, column=7, value=float(quotation.estimated_monthly_savings))
-            worksheet.cell(row=row, column=8, value=float(quotation.estimated_annual_savings))
-            worksheet.cell(row=row, column=9, value=quotation.get_status_display())
-            worksheet.cell(row=row, column=10, value=quotation.created_at.strftime('%Y-%m-%d'))
-            worksheet.cell(row=row, column=11, value=quotation.valid_until.strftime('%Y-%m-%d') if quotation.valid_until else '')
-        
-        # Save to BytesIO
-        output = BytesIO()
-        workbook.save(output)
-        output.seek(0)
-        
-        response = HttpResponse(
-            output.getvalue(),
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-        response['Content-Disposition'] = 'attachment; filename="quotations.xlsx"'
-        return response
-    
     def export_pdf_report(self, queryset):
         from django.template.loader import render_to_string
         from django.http import HttpResponse
@@ -2595,7 +2520,7 @@ class QuotationExportView(LoginRequiredMixin, View):
             'quotations': queryset,
             'export_date': timezone.now(),
             'total_count': queryset.count(),
-            'total_value': sum(q.total_amount for q in queryset),
+            'total_value': queryset.aggregate(total=Sum('total_amount'))['total'] or 0,
         }
         
         html_string = render_to_string('quotations/export_report.html', context)
@@ -28,6 +28,7 @@ if not apps.ready:
 django_asgi_app = get_asgi_application()
 
 import apps.chat.routing
+import apps.ecommerce.routing
 
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
@@ -35,6 +36,7 @@ application = ProtocolTypeRouter({
         AuthMiddlewareStack(
             URLRouter(
                 apps.chat.routing.websocket_urlpatterns
+                + apps.ecommerce.routing.websocket_urlpatterns
             )
         )
     ),
@@ -5,6 +5,7 @@ Django settings for Olivian Group project.
 from pathlib import Path
 from decouple import config
 import os
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -68,16 +69,59 @@ if DEBUG:
     CACHES = {
         'default': {
             'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
-        }
+        },
+        'pages': {
+            'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+        },
     }
 else:
-    # Production cache configuration
+    # Production cache configuration: a per-process L1 in front of a cache shared by every
+    # Passenger worker (apps/core/tiered_cache.py). SHARED_CACHE_BACKEND is 'file', 'db'
+    # (run createcachetable) or 'redis' (the default when REDIS_URL is set).
+    REDIS_URL = config('REDIS_URL', default='')
+    SHARED_CACHE_BACKEND = config('SHARED_CACHE_BACKEND', default='redis' if REDIS_URL else 'file')
+    SHARED_CACHES = {
+        'file': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': config('SHARED_CACHE_LOCATION', default=os.path.join(tempfile.gettempdir(), 'olivian_cache')),
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        },
+        'db': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': config('SHARED_CACHE_TABLE', default='olivian_cache'),
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        },
+        'redis': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        },
+    }
     CACHES = {
         'default': {
-            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        }
+            'BACKEND': 'apps.core.tiered_cache.TieredCache',
+            'OPTIONS': {
+                'L2': 'shared',
+                'L1_TIMEOUT': config('CACHE_L1_TIMEOUT', default=5, cast=int),
+                # Counters and read-modify-write state must always be read from the shared cache
+                'L1_EXCLUDE_PREFIXES': ['blog:post_views:', 'chat:typing:', 'chat:presence:'],
+            },
+        },
+        'shared': SHARED_CACHES[SHARED_CACHE_BACKEND],
+        # Public page and fragment cache (apps/core/page_cache.py), shared by every process on
+        # the host. For a database cache set PAGE_CACHE_BACKEND to
+        # django.core.cache.backends.db.DatabaseCache, PAGE_CACHE_LOCATION to a table name and
+        # run createcachetable.
+        'pages': {
+            'BACKEND': config('PAGE_CACHE_BACKEND', default='django.core.cache.backends.filebased.FileBasedCache'),
+            'LOCATION': config('PAGE_CACHE_LOCATION', default=os.path.join(tempfile.gettempdir(), 'olivian_page_cache')),
+            'TIMEOUT': 60 * 10,
+            'OPTIONS': {'MAX_ENTRIES': 5000},
+        },
     }
 
+# Cookies that change how public pages render (page cache keys vary on them)
+PAGE_CACHE_VARY_COOKIES = ['cookie_consent']
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'csp.middleware.CSPMiddleware',
@@ -93,8 +137,12 @@ MIDDLEWARE = [
     'apps.accounts.middleware.PasswordChangeMiddleware',
     'apps.core.middleware.DevelopmentCacheControlMiddleware',
     'apps.core.middleware.CacheControlMiddleware',  # Added for better cache control
+    'apps.core.middleware.ContextProcessorTimingMiddleware',
 ]
 
+# Server-Timing header and debug log of the lazy context processors each page used
+CONTEXT_PROCESSOR_TIMING = config('CONTEXT_PROCESSOR_TIMING', default=DEBUG, cast=bool)
+
 # Removed aggressive page caching - let service worker handle offline caching
 # CACHE_MIDDLEWARE_SECONDS, UpdateCacheMiddleware, and FetchFromCacheMiddleware have been removed
 
@@ -126,6 +174,24 @@ TEMPLATES = [
 WSGI_APPLICATION = 'olivian_solar.wsgi.application'
 ASGI_APPLICATION = 'olivian_solar.asgi.application'
 
+# Channel layer for WebSocket groups (chat, M-Pesa payment status). The in-memory layer only
+# reaches sockets served by the same process; set CHANNEL_REDIS_URL (requires channels-redis)
+# so that callbacks applied by process_mpesa_callbacks reach the ASGI server.
+CHANNEL_REDIS_URL = config('CHANNEL_REDIS_URL', default='')
+if CHANNEL_REDIS_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [CHANNEL_REDIS_URL]},
+        }
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        }
+    }
+
 # Database
 # Use SQLite for development (MySQL can be configured via environment variables in production)
 DATABASES = {
@@ -287,6 +353,21 @@ DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL', default='noreply@olivian.co.ke
 EMAIL_SUBJECT_PREFIX = config('EMAIL_SUBJECT_PREFIX', default='[Olivian Solar] ')
 SERVER_EMAIL = config('SERVER_EMAIL', default='server@olivian.co.ke')
 
+# Outbound Email Queue
+# EmailService stores mail in the EmailOutbox table; run `manage.py process_email_outbox --loop`
+# (or from cron without --loop) to deliver it. Set EMAIL_OUTBOX_ENABLED=False to send inline.
+EMAIL_OUTBOX_ENABLED = config('EMAIL_OUTBOX_ENABLED', default=True, cast=bool)
+EMAIL_OUTBOX_BATCH_SIZE = config('EMAIL_OUTBOX_BATCH_SIZE', default=100, cast=int)
+EMAIL_OUTBOX_CONNECTIONS = config('EMAIL_OUTBOX_CONNECTIONS', default=2, cast=int)
+EMAIL_OUTBOX_RATE_LIMIT = config('EMAIL_OUTBOX_RATE_LIMIT', default=5, cast=float)  # messages per second
+EMAIL_OUTBOX_MAX_ATTEMPTS = config('EMAIL_OUTBOX_MAX_ATTEMPTS', default=6, cast=int)
+
+# Newsletter campaign dispatch (see apps/core/campaign_dispatch.py); campaigns stuck
+# in "sending" after a restart are resumed by `manage.py send_newsletter_campaigns`
+NEWSLETTER_DISPATCH_BATCH_SIZE = config('NEWSLETTER_DISPATCH_BATCH_SIZE', default=200, cast=int)
+NEWSLETTER_DISPATCH_CONNECTIONS = config('NEWSLETTER_DISPATCH_CONNECTIONS', default=4, cast=int)
+NEWSLETTER_DISPATCH_RATE_LIMIT = config('NEWSLETTER_DISPATCH_RATE_LIMIT', default=0, cast=float)
+
 # Email Templates Directory
 EMAIL_TEMPLATES_DIR = BASE_DIR / 'templates' / 'emails'
 
@@ -346,6 +427,17 @@ MPESA_CONSUMER_SECRET = config('MPESA_CONSUMER_SECRET', default='')
 MPESA_SHORTCODE = config('MPESA_SHORTCODE', default='174379')
 MPESA_PASSKEY = config('MPESA_PASSKEY', default='')
 MPESA_ENVIRONMENT = config('MPESA_ENVIRONMENT', default='sandbox')
+MPESA_BASE_URL = config('MPESA_BASE_URL', default='')  # Overrides the Daraja host picked by MPESA_ENVIRONMENT
+MPESA_TIMEOUT = config('MPESA_TIMEOUT', default=30, cast=int)  # Seconds per Daraja request
+MPESA_HTTP_POOL_SIZE = config('MPESA_HTTP_POOL_SIZE', default=10, cast=int)  # Kept-alive connections to Daraja
+# Pending payment sweeps (update_mpesa_status, handle_mpesa_timeouts) query Daraja in parallel
+MPESA_QUERY_CONCURRENCY = config('MPESA_QUERY_CONCURRENCY', default=8, cast=int)
+MPESA_QUERY_RATE_LIMIT = config('MPESA_QUERY_RATE_LIMIT', default=20, cast=float)  # Status queries per second
+# STK callbacks are stored in the MPesaCallbackEvent inbox (duplicates are dropped) and applied
+# inside the callback request. Set MPESA_CALLBACK_QUEUE_ENABLED=True to leave them to
+# `manage.py process_mpesa_callbacks`, which must then run as a worker or cron job (see README).
+MPESA_CALLBACK_QUEUE_ENABLED = config('MPESA_CALLBACK_QUEUE_ENABLED', default=False, cast=bool)
+MPESA_CALLBACK_MAX_ATTEMPTS = config('MPESA_CALLBACK_MAX_ATTEMPTS', default=5, cast=int)
 
 # Social Media Configuration
 FACEBOOK_APP_ID = config('FACEBOOK_APP_ID', default='544914051459824')
@@ -476,3 +568,19 @@ CONTENT_SECURITY_POLICY = {
 BACKUP_ROOT = BASE_DIR / 'backups'
 BACKUP_RETENTION_DAYS = 30  # Keep backups for 30 days
 MAX_BACKUP_SIZE = 100 * 1024 * 1024  # 100MB size limit for backup files
+
+# Background Jobs (apps/core/job_queue.py)
+# Run the worker with `manage.py run_jobs --loop`, or from cron: `manage.py run_jobs --max-time 55`
+JOBS_ROOT = BASE_DIR / 'job_results'  # Generated exports; served only through the job download view
+JOBS_STALE_TIMEOUT = 60 * 30  # Re-run jobs whose worker stopped sending heartbeats
+JOBS_HEARTBEAT_INTERVAL = 60  # Seconds between heartbeats of a running job
+
+# Generated quotation PDFs, reused until their contents change (apps/core/pdf_cache.py)
+PDF_CACHE_ROOT = BASE_DIR / 'pdf_cache'
+
+# Streaming CSV/XLSX exports (apps/core/exports.py)
+EXPORT_CHUNK_SIZE = config('EXPORT_CHUNK_SIZE', default=2000, cast=int)  # Rows fetched per database round trip
+EXPORT_BACKGROUND_THRESHOLD = config('EXPORT_BACKGROUND_THRESHOLD', default=20000, cast=int)  # Larger exports run as background jobs; 0 = always stream
+
+# Document numbering (apps/core/numbering.py)
+POS_SALE_NUMBER_BLOCK_SIZE = config('POS_SALE_NUMBER_BLOCK_SIZE', default=1, cast=int)  # Sale numbers reserved per process at a time; >1 leaves gaps
@@ -0,0 +1,72 @@
+/**
+ * M-Pesa payment status over WebSocket, with polling as the fallback.
+ *
+ * The server pushes the transaction status as soon as the Safaricom callback is
+ * applied (ws/payments/mpesa/<checkout_request_id>/). If WebSockets are not
+ * available, the socket drops before a final status arrives, or the server says
+ * it cannot push results (`push: false` without a shared channel layer),
+ * `fallback` is called once so the page can resume polling its status API.
+ */
+
+const MPESA_FINAL_STATUSES = ['completed', 'failed'];
+
+function watchMpesaStatus(checkoutRequestId, options) {
+    const { onStatus, fallback, timeout, onTimeout } = options;
+    let finished = false;
+    let fellBack = false;
+    let socket = null;
+    let timer = null;
+
+    function stop() {
+        finished = true;
+        if (timer) clearTimeout(timer);
+        if (socket && socket.readyState <= WebSocket.OPEN) socket.close();
+    }
+
+    function fallBack() {
+        if (finished || fellBack) return;
+        fellBack = true;
+        stop();
+        fallback();
+    }
+
+    if (typeof WebSocket === 'undefined') {
+        fallBack();
+        return { close: stop };
+    }
+
+    const scheme = window.location.protocol === 'https:' ? 'wss' : 'ws';
+    try {
+        socket = new WebSocket(
+            `${scheme}://${window.location.host}/ws/payments/mpesa/${encodeURIComponent(checkoutRequestId)}/`
+        );
+    } catch (error) {
+        console.warn('M-Pesa status socket unavailable, polling instead:', error);
+        fallBack();
+        return { close: stop };
+    }
+
+    socket.onmessage = (event) => {
+        const data = JSON.parse(event.data);
+        const final = MPESA_FINAL_STATUSES.includes(data.status);
+        if (final) {
+            stop();
+        }
+        onStatus(data);
+        if (!final && data.push === false) {
+            fallBack();
+        }
+    };
+    socket.onerror = fallBack;
+    socket.onclose = fallBack;
+
+    if (timeout) {
+        timer = setTimeout(() => {
+            if (finished) return;
+            stop();
+            if (onTimeout) onTimeout();
+        }, timeout);
+    }
+
+    return { close: stop };
+}